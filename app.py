@@ -2,12 +2,14 @@
 LDH Web - Sistema de Gestión de Laboratorio de Anatomía Patológica
 Aplicación principal Flask
 """
-from flask import Flask, render_template, redirect, url_for, flash, request
+from flask import Flask, render_template, redirect, url_for, flash, request, abort, Response
 from flask_login import current_user
 from config import config
 from extensions import db, login_manager
 import os
 import unicodedata
+import click
+import hmac
 
 
 def create_app(config_name='development'):
@@ -63,6 +65,63 @@ def create_app(config_name='development'):
     app.register_blueprint(prestador_portal.bp)
     app.register_blueprint(entidades.bp)
     
+    # Métricas en proceso (latencias, base de datos, IA, PDFs, SMTP, caches)
+    from services import metricas
+    metricas.init_app(app)
+    
+    # Versión del catálogo de plantillas: se renueva al modificar sus tablas
+    from services import catalogo_plantillas
+    catalogo_plantillas.init_app(app)
+    
+    # Versión de la facturación de meses cerrados: se renueva al modificar protocolos o tarifas
+    from services import facturacion
+    facturacion.init_app(app)
+    
+    # Contadores de uso de plantillas con escritura diferida
+    from services import contadores_uso
+    contadores_uso.init_app(app)
+    
+    # Registro de llamadas a modelos de IA con escritura en lote
+    from services import uso_llm
+    uso_llm.init_app(app)
+    
+    # Assets estáticos con huella y precomprimidos (asset_url en los templates)
+    from services import assets
+    assets.init_app(app)
+    
+    # Índice de casos históricos: delta incremental con cada commit
+    from services import indice_casos
+    indice_casos.init_app(app)
+    
+    # Predicción de líneas: sincronizar el modelo cuando se completa un protocolo
+    from services import prediccion_lineas
+    prediccion_lineas.init_app(app)
+    
+    # Frecuencias de diagnósticos y categorías: se actualizan con cada flush de casos
+    from services import frecuencias_diagnostico
+    frecuencias_diagnostico.init_app(app)
+    
+    @app.route('/metrics')
+    def metrics():
+        """Métricas en formato Prometheus (solo administradores o token)"""
+        token = app.config.get('METRICS_TOKEN')
+        autorizado = bool(token) and hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {token}'
+        )
+        if not autorizado:
+            es_admin = current_user.is_authenticated and current_user.rol.nombre in ['OSCAR', 'Administrador']
+            if not es_admin:
+                abort(403)
+        return Response(metricas.exportar(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    
+    # Despachador de notificaciones en segundo plano (se inicia con el primer request,
+    # así los comandos de consola no levantan el hilo)
+    if app.config.get('NOTIFICACIONES_DESPACHADOR_EN_PROCESO'):
+        @app.before_request
+        def iniciar_despachador_notificaciones():
+            from services.despachador_notificaciones import iniciar_en_proceso
+            iniciar_en_proceso(app)
+    
     # Ruta principal
     @app.route('/')
     def index():
@@ -222,7 +281,116 @@ def create_app(config_name='development'):
             print('  Rol: Administrador')
         
         print('\n✅ Inicialización completada')
+
+    # Comando para generar datos sintéticos (pruebas de carga / benchmarks)
+    @app.cli.command('seed-sintetico')
+    @click.option('--pacientes', default=5000, show_default=True)
+    @click.option('--prestadores', default=200, show_default=True)
+    @click.option('--entidades', default=10, show_default=True)
+    @click.option('--obras-sociales', default=40, show_default=True)
+    @click.option('--anios', default=2, show_default=True, help='Años de historia de protocolos')
+    @click.option('--protocolos-por-anio', default=15000, show_default=True)
+    @click.option('--auditorias', default=50000, show_default=True)
+    @click.option('--semilla', default=42, show_default=True)
+    def seed_sintetico(pacientes, prestadores, entidades, obras_sociales, anios, protocolos_por_anio, auditorias, semilla):
+        """Genera un conjunto de datos sintético y reproducible (solo sobre una base vacía)."""
+        from models.protocolo import Protocolo
+        from utils.init_permisos import init_roles_y_permisos
+        from utils.datos_sinteticos import generar_datos_sinteticos
+
+        db.create_all()
+        if Protocolo.query.first():
+            print('❌ La base ya tiene protocolos: los datos sintéticos solo se generan sobre una base vacía')
+            return
+
+        init_roles_y_permisos()
+        print('\nGenerando datos sintéticos...')
+        resumen = generar_datos_sinteticos(
+            pacientes=pacientes, prestadores=prestadores, entidades=entidades,
+            obras_sociales=obras_sociales, anios=anios, protocolos_por_anio=protocolos_por_anio,
+            auditorias=auditorias, semilla=semilla
+        )
+        print(f'\n✅ Datos sintéticos generados: {resumen}')
+
+    # Comando para medir los circuitos principales
+    @app.cli.command('benchmark')
+    @click.option('--iteraciones', default=20, show_default=True)
+    @click.option('--etiqueta', default=None, help='Texto para identificar la corrida')
+    @click.option('--no-guardar', is_flag=True, help='No agregar el resultado a benchmarks/resultados.jsonl')
+    def benchmark(iteraciones, etiqueta, no_guardar):
+        """Mide latencia y consultas por request de los circuitos principales."""
+        from utils.benchmark import ejecutar_benchmark
+
+        ejecutar_benchmark(app, iteraciones=iteraciones, etiqueta=etiqueta, guardar=not no_guardar)
+
+    # Comando para enviar las notificaciones de la bandeja de salida
+    @app.cli.command('despachar-notificaciones')
+    @click.option('--continuo', is_flag=True, help='Seguir revisando la bandeja cada NOTIFICACIONES_INTERVALO segundos')
+    @click.option('--reencolar-fallidas', is_flag=True, help='Volver a PENDIENTE las notificaciones FALLIDAS antes de enviar')
+    def despachar_notificaciones(continuo, reencolar_fallidas):
+        """Envía las notificaciones pendientes reutilizando la conexión SMTP."""
+        import time
+        from services.despachador_notificaciones import despachar_todo, reencolar_fallidas as reencolar
+        
+        if reencolar_fallidas:
+            print(f'↩️ {reencolar()} notificación(es) fallida(s) reencolada(s)')
+        while True:
+            resumen = despachar_todo(app.config)
+            if any(resumen.values()) or not continuo:
+                print(f"📬 {resumen['enviadas']} enviadas, {resumen['reintentos']} a reintentar, {resumen['fallidas']} fallidas")
+            if not continuo:
+                break
+            db.session.remove()
+            time.sleep(app.config.get('NOTIFICACIONES_INTERVALO', 15))
+
+    @app.cli.command('compactar-borradores')
+    @click.option('--antiguedad', default=None, type=int,
+                  help='Segundos sin cambios para compactar (por defecto AUTOSAVE_COMPACTAR_SEGUNDOS)')
+    def compactar_borradores(antiguedad):
+        """Vuelca en protocolo_lineas los borradores de autoguardado abandonados."""
+        from services.borradores import compactar_vencidos
+        
+        print(f'📝 {compactar_vencidos(antiguedad)} borrador(es) compactado(s)')
+
+    @app.cli.command('indexar-casos')
+    def indexar_casos():
+        """Construye el índice BM25 de casos históricos (tras importaciones por SQL)."""
+        from services.indice_casos import construir
+        
+        resumen = construir()
+        print(f"🔎 {resumen['documentos']} casos, {resumen['terminos']} términos en {resumen['segundos']}s")
+
+    @app.cli.command('recalcular-diagnosticos')
+    def recalcular_diagnosticos():
+        """Reconstruir las frecuencias de diagnósticos (tras importar casos por SQL)"""
+        from services.frecuencias_diagnostico import recalcular
+        total = recalcular()
+        print(f'✅ Frecuencias de diagnósticos recalculadas: {total} casos activos')
     
+    @app.cli.command('vendorizar-assets')
+    @click.option('--forzar', is_flag=True, help='Volver a descargar las librerías ya presentes')
+    def vendorizar_assets(forzar):
+        """Descarga a static/vendor/ las librerías que antes se pedían a los CDNs."""
+        from services.assets import vendorizar
+        
+        for ruta, tamanio in vendorizar(app.static_folder, forzar=forzar):
+            print(f'⬇️ {ruta} ({tamanio} bytes)')
+
+    @app.cli.command('construir-assets')
+    def construir_assets():
+        """Genera static/dist/: assets minificados, con huella y precomprimidos."""
+        from services.assets import construir, vendor_faltante, VendorIncompleto
+        
+        respaldo = app.config['ASSETS_CDN_RESPALDO']
+        try:
+            manifiesto = construir(app.static_folder, cdn_respaldo=respaldo)
+        except VendorIncompleto as e:
+            raise click.ClickException(str(e))
+        faltantes = vendor_faltante(app.static_folder)
+        if faltantes:
+            print(f'⚠️ {len(faltantes)} librerías sin vendorizar se piden al CDN (ejecutar vendorizar-assets)')
+        print(f'📦 {len(manifiesto)} assets con huella en static/dist/')
+
     return app
 
 
@@ -35,6 +35,43 @@ class Config:
     
     # PDFs
     PDF_FOLDER = os.path.join(basedir, 'static', 'pdf')
+    # PDFs de informes pre-renderizados al completar protocolos (fuera de /static: no son públicos)
+    INFORMES_FOLDER = os.environ.get('INFORMES_FOLDER') or os.path.join(basedir, 'instance', 'informes')
+    INFORMES_PRERENDER = os.environ.get('INFORMES_PRERENDER', 'True').lower() in ('true', '1', 'yes')
+    
+    # Contadores de uso de plantillas: se acumulan en memoria y se vuelcan en lote
+    USO_CONTADORES_INTERVALO = int(os.environ.get('USO_CONTADORES_INTERVALO', '30'))  # segundos
+    USO_CONTADORES_MAX_PENDIENTES = 500  # filas distintas antes de forzar el volcado
+    # Registro de llamadas a modelos de IA: se escriben en lote cada tantos segundos o registros
+    LLM_USO_INTERVALO = int(os.environ.get('LLM_USO_INTERVALO', '30'))
+    LLM_USO_MAX_PENDIENTES = 200
+    
+    # Librerías sin vendorizar en static/vendor/: pedirlas al CDN en lugar de
+    # devolver 404 (desactivar una vez corrido `flask vendorizar-assets`)
+    ASSETS_CDN_RESPALDO = os.environ.get('ASSETS_CDN_RESPALDO', 'True').lower() in ('true', '1', 'yes')
+    
+    # Autoguardado de los editores: diario de borradores por protocolo, compactado
+    # en protocolo_lineas al superar cierta cantidad de operaciones o antigüedad
+    AUTOSAVE_FOLDER = os.environ.get('AUTOSAVE_FOLDER') or os.path.join(basedir, 'instance', 'borradores')
+    AUTOSAVE_COMPACTAR_OPERACIONES = int(os.environ.get('AUTOSAVE_COMPACTAR_OPERACIONES', 100))
+    AUTOSAVE_COMPACTAR_SEGUNDOS = int(os.environ.get('AUTOSAVE_COMPACTAR_SEGUNDOS', 120))
+    
+    # Índice BM25 de casos históricos (flask indexar-casos lo construye; los
+    # cambios hechos por la aplicación se agregan solos)
+    INDICE_CASOS_FOLDER = os.environ.get('INDICE_CASOS_FOLDER') or os.path.join(basedir, 'instance', 'indice_casos')
+
+    # Modelo de predicción de líneas: cada cuánto se buscan protocolos modificados (segundos)
+    PREDICCION_LINEAS_INTERVALO = int(os.environ.get('PREDICCION_LINEAS_INTERVALO', '30'))
+    # Autocompletado de líneas: cada cuánto se reordena por los contadores de uso (segundos)
+    AUTOCOMPLETADO_REFRESCO_USO = int(os.environ.get('AUTOCOMPLETADO_REFRESCO_USO', '300'))
+    # Herramientas de base de datos del asistente: tiempo límite por consulta (ms),
+    # vigencia del cache de resultados (segundos), filas y días máximos por consulta
+    ASISTENTE_TOOLS_TIMEOUT_MS = int(os.environ.get('ASISTENTE_TOOLS_TIMEOUT_MS', '2000'))
+    ASISTENTE_TOOLS_CACHE_TTL = int(os.environ.get('ASISTENTE_TOOLS_CACHE_TTL', '60'))
+    ASISTENTE_TOOLS_MAX_FILAS = int(os.environ.get('ASISTENTE_TOOLS_MAX_FILAS', '50'))
+    ASISTENTE_TOOLS_MAX_DIAS = int(os.environ.get('ASISTENTE_TOOLS_MAX_DIAS', '366'))
+    # Hilos para ejecutar en paralelo las herramientas pedidas en una misma respuesta
+    ASISTENTE_TOOLS_HILOS = int(os.environ.get('ASISTENTE_TOOLS_HILOS', '4'))
     
     # Configuración de informes
     LABORATORIO_NOMBRE = "Laboratorio de Diagnóstico Histopatológico"
@@ -82,6 +119,17 @@ class Config:
     SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')
     SMTP_USE_TLS = os.environ.get('SMTP_USE_TLS', 'True').lower() in ('true', '1', 'yes')
     
+    # Bandeja de salida de notificaciones (los emails se envían en segundo plano)
+    # NOTIFICACIONES_DESPACHADOR_EN_PROCESO: enviar desde un hilo de la propia aplicación.
+    #   Desactivar si se corre `flask despachar-notificaciones` como tarea aparte
+    #   (por ejemplo en PythonAnywhere, donde las web apps no admiten hilos propios).
+    NOTIFICACIONES_DESPACHADOR_EN_PROCESO = os.environ.get('NOTIFICACIONES_DESPACHADOR_EN_PROCESO', 'True').lower() in ('true', '1', 'yes')
+    NOTIFICACIONES_INTERVALO = int(os.environ.get('NOTIFICACIONES_INTERVALO', '15'))  # segundos entre revisiones
+    NOTIFICACIONES_LOTE = 50  # emails por conexión SMTP
+    NOTIFICACIONES_MAX_INTENTOS = 6  # luego pasan a FALLIDA
+    NOTIFICACIONES_BACKOFF_BASE = 60  # segundos; se duplica en cada reintento
+    NOTIFICACIONES_BACKOFF_MAXIMO = 3600
+    
     # Configuración de Claude API
     # IMPORTANTE: Verifica qué modelos están disponibles en tu plan de Anthropic
     # Modelos disponibles (ordenados por disponibilidad común):
@@ -92,6 +140,13 @@ class Config:
     # - claude-3-5-opus-20241022 (más reciente, requiere plan Pro)
     # Si tienes problemas, usa Haiku primero para verificar que la API funciona
     CLAUDE_MODEL = os.environ.get('CLAUDE_MODEL', 'claude-3-haiku-20240307')
+    # Cache de prompts del proveedor (tools + system prompt) y presupuesto de
+    # tokens de entrada del chat: el historial más viejo se recorta para entrar
+    CLAUDE_PROMPT_CACHE = os.environ.get('CLAUDE_PROMPT_CACHE', 'True').lower() in ('true', '1', 'yes')
+    CLAUDE_PRESUPUESTO_ENTRADA = int(os.environ.get('CLAUDE_PRESUPUESTO_ENTRADA', '30000'))
+    # Chat: turnos recientes que se mandan tal cual; los anteriores se resumen de a bloques
+    CHAT_TURNOS_TEXTUALES = int(os.environ.get('CHAT_TURNOS_TEXTUALES', '6'))
+    CHAT_BLOQUE_RESUMEN = int(os.environ.get('CHAT_BLOQUE_RESUMEN', '4'))
     
     # Configuración de Google Gemini API (para análisis de imágenes médicas)
     # Modelos disponibles (todos los Gemini 2.0+ son multimodales y soportan visión):
@@ -105,6 +160,15 @@ class Config:
     # No hardcodear la API key en el código por seguridad
     GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
     GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash')  # Gemini 2.5 Flash es multimodal (soporta visión)
+    # Descubrimiento de modelos (Claude y Gemini): pruebas en paralelo con un plazo
+    # total, resultado guardado en ia_modelos y renovado en segundo plano al vencer
+    IA_MODELOS_TTL = int(os.environ.get('IA_MODELOS_TTL', str(24 * 3600)))
+    IA_MODELOS_PLAZO = int(os.environ.get('IA_MODELOS_PLAZO', '15'))
+    IA_MODELOS_HILOS = int(os.environ.get('IA_MODELOS_HILOS', '8'))
+    
+    # Métricas (endpoint /metrics en formato Prometheus)
+    # Acceso: administradores logueados o header "Authorization: Bearer <METRICS_TOKEN>"
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
     
     # Formato de números de protocolo
     FORMATO_PROTOCOLO_BIOPSIA = "B-{año}-{numero:04d}"
@@ -136,6 +200,10 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
     WTF_CSRF_ENABLED = False
+    NOTIFICACIONES_DESPACHADOR_EN_PROCESO = False
+    INFORMES_PRERENDER = False
+    USO_CONTADORES_INTERVALO = 0
+    LLM_USO_INTERVALO = 0
 
 
 # Configuración por defecto
@@ -17,6 +17,12 @@ ALTER TABLE protocolos ADD COLUMN con_orden BOOLEAN DEFAULT 0;
 ALTER TABLE protocolos ADD COLUMN entregado BOOLEAN DEFAULT 0;
 ALTER TABLE protocolos ADD COLUMN cobrado BOOLEAN DEFAULT 0;
 
+-- Revisión de las líneas del informe (guardado por diferencias del editor)
+ALTER TABLE protocolos ADD COLUMN revision_lineas INTEGER NOT NULL DEFAULT 0;
+
+-- Protocolos modificados desde una marca (sincronización del modelo de predicción de líneas)
+CREATE INDEX IF NOT EXISTS ix_protocolos_ultima_modificacion ON protocolos (ultima_modificacion);
+
 -- ============================================
 -- CAMBIOS EN TABLA prestadores
 -- ============================================
@@ -45,6 +51,127 @@ CREATE INDEX IF NOT EXISTS idx_protocolos_prestador_medico ON protocolos(prestad
 -- Índice para es_entidad en prestadores
 CREATE INDEX IF NOT EXISTS idx_prestadores_es_entidad ON prestadores(es_entidad);
 
+-- ============================================
+-- BANDEJA DE SALIDA DE NOTIFICACIONES
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS notificaciones_salida (
+    notificacion_id INTEGER PRIMARY KEY,
+    canal VARCHAR(20) NOT NULL DEFAULT 'EMAIL',
+    destinatario VARCHAR(200) NOT NULL,
+    asunto VARCHAR(300),
+    mensaje TEXT NOT NULL,
+    protocolo_id INTEGER REFERENCES protocolos(protocolo_id),
+    estado VARCHAR(20) NOT NULL DEFAULT 'PENDIENTE',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    proximo_intento DATETIME NOT NULL,
+    lote VARCHAR(32),
+    ultimo_error TEXT,
+    fecha_creacion DATETIME NOT NULL,
+    fecha_envio DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_notificaciones_estado_proximo ON notificaciones_salida(estado, proximo_intento);
+CREATE INDEX IF NOT EXISTS ix_notificaciones_salida_protocolo_id ON notificaciones_salida(protocolo_id);
+CREATE INDEX IF NOT EXISTS ix_notificaciones_salida_lote ON notificaciones_salida(lote);
+
+-- ============================================
+-- FRECUENCIAS DE DIAGNÓSTICOS (asistente)
+-- ============================================
+-- Se llenan solas en la primera consulta o con: flask recalcular-diagnosticos
+
+CREATE TABLE IF NOT EXISTS diagnosticos_normalizados (
+    diagnostico_id INTEGER PRIMARY KEY,
+    hash VARCHAR(40) NOT NULL UNIQUE,
+    texto_mostrar TEXT NOT NULL,
+    creado_en DATETIME
+);
+CREATE INDEX IF NOT EXISTS ix_diagnosticos_normalizados_hash ON diagnosticos_normalizados(hash);
+
+CREATE TABLE IF NOT EXISTS frecuencias_diagnostico (
+    tipo_estudio VARCHAR(20) NOT NULL,
+    categoria VARCHAR(100) NOT NULL,
+    diagnostico_id INTEGER NOT NULL REFERENCES diagnosticos_normalizados(diagnostico_id),
+    frecuencia INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tipo_estudio, categoria, diagnostico_id)
+);
+CREATE INDEX IF NOT EXISTS idx_frecuencia_diagnostico_top ON frecuencias_diagnostico(tipo_estudio, categoria, frecuencia);
+
+CREATE TABLE IF NOT EXISTS frecuencias_categoria (
+    tipo_estudio VARCHAR(20) NOT NULL,
+    categoria VARCHAR(100) NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tipo_estudio, categoria)
+);
+
+-- ============================================
+-- HISTORIAL DEL CHAT DEL ASISTENTE
+-- ============================================
+-- Turnos de conversación y resúmenes acumulados de los turnos viejos
+CREATE TABLE IF NOT EXISTS chat_turnos (
+    turno_id INTEGER PRIMARY KEY,
+    usuario_id INTEGER NOT NULL REFERENCES usuarios(usuario_id),
+    protocolo_id INTEGER REFERENCES protocolos(protocolo_id),
+    mensaje TEXT NOT NULL,
+    respuesta TEXT NOT NULL,
+    imagenes INTEGER NOT NULL DEFAULT 0,
+    modelo VARCHAR(20),
+    fecha DATETIME NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chat_turno_usuario_protocolo ON chat_turnos(usuario_id, protocolo_id, turno_id);
+
+CREATE TABLE IF NOT EXISTS chat_resumenes (
+    resumen_id INTEGER PRIMARY KEY,
+    usuario_id INTEGER NOT NULL REFERENCES usuarios(usuario_id),
+    desde_turno_id INTEGER NOT NULL,
+    hasta_turno_id INTEGER NOT NULL,
+    turnos_resumidos INTEGER NOT NULL DEFAULT 0,
+    resumen TEXT NOT NULL,
+    actualizado DATETIME,
+    CONSTRAINT uq_chat_resumen_conversacion UNIQUE (usuario_id, desde_turno_id)
+);
+
+-- ============================================
+-- USO DE MODELOS DE IA (latencia, tokens, costo)
+-- ============================================
+CREATE TABLE IF NOT EXISTS llm_usos (
+    uso_id INTEGER PRIMARY KEY,
+    fecha DATETIME NOT NULL,
+    proveedor VARCHAR(20) NOT NULL,
+    modelo VARCHAR(100) NOT NULL,
+    funcion VARCHAR(50) NOT NULL,
+    endpoint VARCHAR(100),
+    usuario_id INTEGER,
+    protocolo_id INTEGER,
+    duracion_ms INTEGER NOT NULL,
+    tokens_entrada INTEGER NOT NULL DEFAULT 0,
+    tokens_salida INTEGER NOT NULL DEFAULT 0,
+    tokens_cache_lectura INTEGER NOT NULL DEFAULT 0,
+    tokens_cache_escritura INTEGER NOT NULL DEFAULT 0,
+    intentos INTEGER NOT NULL DEFAULT 1,
+    exito BOOLEAN NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS ix_llm_usos_fecha ON llm_usos(fecha);
+
+-- ============================================
+-- MODELOS DE IA DESCUBIERTOS (disponibilidad, visión, latencia)
+-- ============================================
+CREATE TABLE IF NOT EXISTS ia_modelos (
+    capacidad_id INTEGER PRIMARY KEY,
+    proveedor VARCHAR(20) NOT NULL,
+    modelo VARCHAR(100) NOT NULL,
+    version VARCHAR(10),
+    nombre_visible VARCHAR(200),
+    descripcion TEXT,
+    metodos VARCHAR(300),
+    listado BOOLEAN NOT NULL DEFAULT 0,
+    disponible BOOLEAN,
+    soporta_vision BOOLEAN NOT NULL DEFAULT 0,
+    latencia_ms INTEGER,
+    error VARCHAR(300),
+    fecha_verificacion DATETIME NOT NULL,
+    CONSTRAINT uq_ia_modelos_proveedor_modelo UNIQUE (proveedor, modelo)
+);
+
 -- ============================================
 -- VERIFICACIÓN
 -- ============================================
@@ -9,7 +9,10 @@ from models.protocolo import Protocolo, TipoAnalisis
 from models.informe import BiopsiaInforme, CitologiaInforme, PapInforme, PlantillaPap
 from models.auditoria import Auditoria
 from models.configuracion import Configuracion
-from models.asistente import CasoHistorico, PlantillaTexto, FragmentoTexto, SugerenciaIA, ConfiguracionAsistente
+from models.notificacion import NotificacionSalida
+from models.asistente import (CasoHistorico, DiagnosticoNormalizado, FrecuenciaDiagnostico, FrecuenciaCategoria,
+                              TurnoChat, ResumenChat, UsoLLM, CapacidadModelo, PlantillaTexto, FragmentoTexto, SugerenciaIA,
+                              ConfiguracionAsistente)
 from models.plantilla_dinamica import SeccionPlantilla, LineaPlantilla, ConfiguracionBotones, PlantillaGenerada
 from models.plantilla_multilinea import PlantillaMultilinea, CasoHistoricoCompleto, SugerenciaInteligente
 from models.configuracion_asistente import ConfiguracionAsistenteUsuario, PerfilAsistente, ConfiguracionAsistenteGlobal, LogUsoAsistente
@@ -23,7 +26,8 @@ __all__ = [
     'BiopsiaInforme', 'CitologiaInforme', 'PapInforme', 'PlantillaPap',
     'Auditoria',
     'Configuracion',
-    'CasoHistorico', 'PlantillaTexto', 'FragmentoTexto', 'SugerenciaIA', 'ConfiguracionAsistente',
+    'NotificacionSalida',
+    'CasoHistorico', 'DiagnosticoNormalizado', 'FrecuenciaDiagnostico', 'FrecuenciaCategoria', 'PlantillaTexto', 'FragmentoTexto', 'SugerenciaIA', 'ConfiguracionAsistente',
     'SeccionPlantilla', 'LineaPlantilla', 'ConfiguracionBotones', 'PlantillaGenerada',
     'PlantillaMultilinea', 'CasoHistoricoCompleto', 'SugerenciaInteligente',
     'ConfiguracionAsistenteUsuario', 'PerfilAsistente', 'ConfiguracionAsistenteGlobal', 'LogUsoAsistente'
@@ -45,6 +45,136 @@ class CasoHistorico(db.Model):
         return f'<CasoHistorico {self.protocolo_original} - {self.tipo_estudio}>'
 
 
+class DiagnosticoNormalizado(db.Model):
+    """Diagnóstico canónico (texto plegado) al que se agrupan las variantes de escritura"""
+    __tablename__ = 'diagnosticos_normalizados'
+    
+    diagnostico_id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.String(40), unique=True, nullable=False, index=True)  # SHA-1 del texto canónico
+    texto_mostrar = db.Column(db.Text, nullable=False)  # Variante más frecuente
+    creado_en = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<DiagnosticoNormalizado {self.texto_mostrar[:50]}>'
+
+
+class FrecuenciaDiagnostico(db.Model):
+    """Casos activos por tipo de estudio, categoría y diagnóstico normalizado"""
+    __tablename__ = 'frecuencias_diagnostico'
+    
+    tipo_estudio = db.Column(db.String(20), primary_key=True)
+    categoria = db.Column(db.String(100), primary_key=True)  # '*' = todas las categorías
+    diagnostico_id = db.Column(db.Integer, db.ForeignKey('diagnosticos_normalizados.diagnostico_id'), primary_key=True)
+    frecuencia = db.Column(db.Integer, default=0, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_frecuencia_diagnostico_top', 'tipo_estudio', 'categoria', 'frecuencia'),
+    )
+    
+    def __repr__(self):
+        return f'<FrecuenciaDiagnostico {self.tipo_estudio}/{self.categoria} {self.diagnostico_id}: {self.frecuencia}>'
+
+
+class FrecuenciaCategoria(db.Model):
+    """Casos activos por tipo de estudio y categoría"""
+    __tablename__ = 'frecuencias_categoria'
+    
+    tipo_estudio = db.Column(db.String(20), primary_key=True)
+    categoria = db.Column(db.String(100), primary_key=True)  # '' = sin categoría
+    total = db.Column(db.Integer, default=0, nullable=False)
+    
+    def __repr__(self):
+        return f'<FrecuenciaCategoria {self.tipo_estudio}/{self.categoria}: {self.total}>'
+
+
+class TurnoChat(db.Model):
+    """Mensaje del usuario y respuesta del asistente en el chat"""
+    __tablename__ = 'chat_turnos'
+    
+    turno_id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.usuario_id'), nullable=False)
+    protocolo_id = db.Column(db.Integer, db.ForeignKey('protocolos.protocolo_id'))  # None = chat general
+    mensaje = db.Column(db.Text, nullable=False)
+    respuesta = db.Column(db.Text, nullable=False)  # Con imágenes: el análisis textual (las imágenes no se guardan)
+    imagenes = db.Column(db.Integer, default=0, nullable=False)  # Cantidad de imágenes adjuntas
+    modelo = db.Column(db.String(20))  # claude, gemini
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_chat_turno_usuario_protocolo', 'usuario_id', 'protocolo_id', 'turno_id'),
+    )
+    
+    def __repr__(self):
+        return f'<TurnoChat {self.turno_id} usuario={self.usuario_id} protocolo={self.protocolo_id}>'
+
+
+class ResumenChat(db.Model):
+    """Resumen acumulado de los turnos viejos de una conversación (desde_turno_id..hasta_turno_id)"""
+    __tablename__ = 'chat_resumenes'
+    
+    resumen_id = db.Column(db.Integer, primary_key=True)
+    usuario_id = db.Column(db.Integer, db.ForeignKey('usuarios.usuario_id'), nullable=False)
+    desde_turno_id = db.Column(db.Integer, nullable=False)  # Primer turno de la conversación
+    hasta_turno_id = db.Column(db.Integer, nullable=False)  # Último turno incluido en el resumen
+    turnos_resumidos = db.Column(db.Integer, default=0, nullable=False)
+    resumen = db.Column(db.Text, nullable=False)
+    actualizado = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('usuario_id', 'desde_turno_id', name='uq_chat_resumen_conversacion'),
+    )
+    
+    def __repr__(self):
+        return f'<ResumenChat usuario={self.usuario_id} {self.desde_turno_id}..{self.hasta_turno_id}>'
+
+
+class UsoLLM(db.Model):
+    """Una llamada a un modelo de IA: latencia, tokens y resultado (services/uso_llm)"""
+    __tablename__ = 'llm_usos'
+    
+    uso_id = db.Column(db.Integer, primary_key=True)
+    fecha = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    proveedor = db.Column(db.String(20), nullable=False)  # claude, gemini
+    modelo = db.Column(db.String(100), nullable=False)
+    funcion = db.Column(db.String(50), nullable=False)  # Método del cliente: chat_conversacional, resumir_conversacion, ...
+    endpoint = db.Column(db.String(100))
+    usuario_id = db.Column(db.Integer)
+    protocolo_id = db.Column(db.Integer)
+    duracion_ms = db.Column(db.Integer, nullable=False)
+    tokens_entrada = db.Column(db.Integer, default=0, nullable=False)
+    tokens_salida = db.Column(db.Integer, default=0, nullable=False)
+    tokens_cache_lectura = db.Column(db.Integer, default=0, nullable=False)
+    tokens_cache_escritura = db.Column(db.Integer, default=0, nullable=False)
+    intentos = db.Column(db.Integer, default=1, nullable=False)  # > 1: hubo reintentos (otra URL u otro modelo)
+    exito = db.Column(db.Boolean, default=True, nullable=False)
+    
+    def __repr__(self):
+        return f'<UsoLLM {self.proveedor}/{self.modelo} {self.funcion} {self.duracion_ms}ms>'
+
+
+class CapacidadModelo(db.Model):
+    """Resultado del descubrimiento de un modelo de IA: disponibilidad, visión y latencia (services/catalogo_modelos)"""
+    __tablename__ = 'ia_modelos'
+    __table_args__ = (db.UniqueConstraint('proveedor', 'modelo', name='uq_ia_modelos_proveedor_modelo'),)
+    
+    capacidad_id = db.Column(db.Integer, primary_key=True)
+    proveedor = db.Column(db.String(20), nullable=False)  # claude, gemini
+    modelo = db.Column(db.String(100), nullable=False)
+    version = db.Column(db.String(10))  # Versión de la API de Gemini donde respondió (v1beta, v1)
+    nombre_visible = db.Column(db.String(200))
+    descripcion = db.Column(db.Text)
+    metodos = db.Column(db.String(300))  # supportedGenerationMethods separados por coma
+    listado = db.Column(db.Boolean, default=False, nullable=False)  # Apareció en el listado de la API
+    disponible = db.Column(db.Boolean)  # None: no se probó
+    soporta_vision = db.Column(db.Boolean, default=False, nullable=False)
+    latencia_ms = db.Column(db.Integer)
+    error = db.Column(db.String(300))
+    fecha_verificacion = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<CapacidadModelo {self.proveedor}/{self.modelo} disponible={self.disponible}>'
+
+
 class PlantillaTexto(db.Model):
     """Plantillas de texto reutilizables"""
     __tablename__ = 'plantillas_texto'
@@ -31,16 +31,36 @@ class Configuracion(db.Model):
         config = Configuracion.query.filter_by(clave=clave).first()
         if not config:
             return default
+        return config._convertir(default)
+    
+    @staticmethod
+    def get_varios(defaults):
+        """
+        Obtiene varios valores de configuración con una sola consulta
+        
+        Args:
+            defaults: Dict clave -> valor por defecto
         
-        # Convertir según el tipo
-        if config.tipo == 'INTEGER':
-            return int(config.valor) if config.valor else default
-        elif config.tipo == 'BOOLEAN':
-            return config.valor.lower() in ('true', '1', 'yes') if config.valor else default
-        elif config.tipo == 'JSON':
-            return json.loads(config.valor) if config.valor else default
+        Returns:
+            Dict clave -> valor (mismas conversiones que get)
+        """
+        filas = Configuracion.query.filter(Configuracion.clave.in_(list(defaults))).all()
+        por_clave = {c.clave: c for c in filas}
+        return {
+            clave: por_clave[clave]._convertir(default) if clave in por_clave else default
+            for clave, default in defaults.items()
+        }
+    
+    def _convertir(self, default=None):
+        """Convertir el valor guardado según el tipo"""
+        if self.tipo == 'INTEGER':
+            return int(self.valor) if self.valor else default
+        elif self.tipo == 'BOOLEAN':
+            return self.valor.lower() in ('true', '1', 'yes') if self.valor else default
+        elif self.tipo == 'JSON':
+            return json.loads(self.valor) if self.valor else default
         else:  # STRING
-            return config.valor if config.valor else default
+            return self.valor if self.valor else default
     
     @staticmethod
     def set(clave, valor, tipo='STRING', descripcion=None, categoria=None):
@@ -97,6 +117,9 @@ class Configuracion(db.Model):
             ('contador_citologia_actual', '0', 'INTEGER', 'Contador actual de citología', 'CONTADORES'),
             ('contador_pap_actual', '0', 'INTEGER', 'Contador actual de PAP', 'CONTADORES'),
             ('items_por_pagina', '50', 'INTEGER', 'Items por página en listados', 'GENERAL'),
+            ('facturacion_valor_biopsia', '0', 'STRING', 'Valor base (100%) de una biopsia', 'FACTURACION'),
+            ('facturacion_valor_citologia', '0', 'STRING', 'Valor base (100%) de una citología', 'FACTURACION'),
+            ('facturacion_valor_pap', '0', 'STRING', 'Valor base (100%) de un PAP', 'FACTURACION'),
         ]
         
         for clave, valor, tipo, descripcion, categoria in defaults:
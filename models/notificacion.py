@@ -0,0 +1,43 @@
+"""
+Modelo de la bandeja de salida de notificaciones (outbox)
+"""
+from extensions import db
+from datetime import datetime
+
+
+class NotificacionSalida(db.Model):
+    """
+    Notificación pendiente de envío.
+
+    Se escribe en la misma transacción que el cambio de estado del protocolo y
+    la envía luego el despachador (services/despachador_notificaciones.py).
+    """
+    __tablename__ = 'notificaciones_salida'
+
+    # Estados
+    PENDIENTE = 'PENDIENTE'
+    ENVIANDO = 'ENVIANDO'
+    ENVIADA = 'ENVIADA'
+    FALLIDA = 'FALLIDA'  # Agotó los reintentos o error permanente (dead letter)
+
+    notificacion_id = db.Column(db.Integer, primary_key=True)
+    canal = db.Column(db.String(20), nullable=False, default='EMAIL')
+    destinatario = db.Column(db.String(200), nullable=False)
+    asunto = db.Column(db.String(300))
+    mensaje = db.Column(db.Text, nullable=False)
+    protocolo_id = db.Column(db.Integer, db.ForeignKey('protocolos.protocolo_id'), index=True)
+    estado = db.Column(db.String(20), nullable=False, default=PENDIENTE)
+    intentos = db.Column(db.Integer, nullable=False, default=0)
+    # Próximo intento (PENDIENTE) o vencimiento del lote tomado (ENVIANDO)
+    proximo_intento = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    lote = db.Column(db.String(32), index=True)
+    ultimo_error = db.Column(db.Text)
+    fecha_creacion = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    fecha_envio = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('idx_notificaciones_estado_proximo', 'estado', 'proximo_intento'),
+    )
+
+    def __repr__(self):
+        return f'<NotificacionSalida {self.notificacion_id} {self.canal} {self.estado}>'
@@ -30,7 +30,8 @@ class Protocolo(db.Model):
     usuario_ingreso_id = db.Column(db.Integer, db.ForeignKey('usuarios.usuario_id'))
     usuario_informe_id = db.Column(db.Integer, db.ForeignKey('usuarios.usuario_id'))
     fecha_creacion = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    ultima_modificacion = db.Column(db.DateTime, onupdate=datetime.utcnow)
+    ultima_modificacion = db.Column(db.DateTime, onupdate=datetime.utcnow, index=True)  # Marca de agua del modelo de predicción de líneas
+    revision_lineas = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # Se incrementa en cada guardado de líneas con cambios
     
     # Relaciones
     tipo_analisis = db.relationship('TipoAnalisis', backref='protocolos')
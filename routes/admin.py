@@ -8,6 +8,7 @@ from models.usuario import Usuario, Rol
 from models.prestador import Prestador
 from models.auditoria import Auditoria
 from utils.decorators import admin_required
+from utils.exportacion import formato_solicitado, iterar_query, respuesta_exportacion
 import unicodedata
 from sqlalchemy import func, update
 def _normalizar_texto(valor: str) -> str:
@@ -1039,6 +1040,51 @@ def asistente_mensajes():
     return render_template('admin/asistente_mensajes.html', mensajes=mensajes, tipo=tipo, buscar=buscar)
 
 
+@bp.route('/asistente/uso-ia')
+@login_required
+@admin_required
+def uso_ia():
+    """Latencia, tokens y costo estimado de las llamadas a modelos de IA por modelo y por función"""
+    from datetime import datetime, timedelta
+    from services import uso_llm
+
+    hoy = datetime.utcnow().date()
+    try:
+        fecha_desde = datetime.strptime(request.args.get('desde', ''), '%Y-%m-%d').date()
+    except ValueError:
+        fecha_desde = hoy - timedelta(days=29)
+    try:
+        fecha_hasta = datetime.strptime(request.args.get('hasta', ''), '%Y-%m-%d').date()
+    except ValueError:
+        fecha_hasta = hoy
+    desde = datetime.combine(fecha_desde, datetime.min.time())
+    hasta = datetime.combine(fecha_hasta + timedelta(days=1), datetime.min.time())
+
+    por_modelo = uso_llm.resumen(desde, hasta, agrupar_por='modelo')
+    por_funcion = uso_llm.resumen(desde, hasta, agrupar_por='funcion')
+
+    formato = formato_solicitado(request)
+    if formato:
+        columnas = ['Agrupación', 'Proveedor', 'Modelo / función', 'Llamadas', 'Errores', 'Reintentos', 'p50 (ms)',
+                    'p95 (ms)', 'Tokens entrada', 'Tokens salida', 'Tokens cache lectura', 'Tokens cache escritura',
+                    'Costo estimado (USD)']
+        filas = [
+            (agrupacion, d['proveedor'], d.get('modelo') or d.get('funcion'), d['llamadas'], d['errores'],
+             d['reintentos'], d['p50_ms'], d['p95_ms'], d['tokens_entrada'], d['tokens_salida'],
+             d['tokens_cache_lectura'], d['tokens_cache_escritura'], round(d['costo_usd'], 4))
+            for agrupacion, datos in (('Modelo', por_modelo), ('Función', por_funcion)) for d in datos
+        ]
+        return respuesta_exportacion('Uso_IA', columnas, filas, formato)
+
+    totales = {
+        clave: sum(d[clave] for d in por_modelo)
+        for clave in ('llamadas', 'errores', 'reintentos', 'tokens_entrada', 'tokens_salida',
+                      'tokens_cache_lectura', 'tokens_cache_escritura', 'costo_usd')
+    }
+    return render_template('admin/uso_ia.html', por_modelo=por_modelo, por_funcion=por_funcion, totales=totales,
+                           desde=fecha_desde.isoformat(), hasta=fecha_hasta.isoformat())
+
+
 @bp.route('/auditoria')
 @login_required
 @admin_required
@@ -1070,6 +1116,17 @@ def auditoria_general():
             query = query.filter(Auditoria.fecha_hora <= fecha_fin)
         except ValueError:
             pass
+    formato = formato_solicitado(request)
+    if formato:
+        query_exportacion = query.outerjoin(
+            Usuario, Auditoria.usuario_id == Usuario.usuario_id
+        ).with_entities(
+            Auditoria.fecha_hora, Auditoria.accion, Usuario.nombre_completo, Auditoria.tabla,
+            Auditoria.registro_id, Auditoria.descripcion, Auditoria.ip_address
+        ).order_by(Auditoria.fecha_hora.desc())
+        filas = (tuple(fila) for fila in iterar_query(query_exportacion))
+        return respuesta_exportacion('Auditoria', ['Fecha', 'Acción', 'Usuario', 'Tabla', 'Registro', 'Descripción', 'IP'],
+                                     filas, formato)
     registros = query.order_by(Auditoria.fecha_hora.desc()).paginate(page=page, per_page=50, error_out=False)
     acciones_disponibles = [row[0] for row in db.session.query(Auditoria.accion).distinct().order_by(Auditoria.accion).all()]
     usuarios = Usuario.query.order_by(Usuario.nombre_completo).all()
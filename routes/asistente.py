@@ -1,10 +1,10 @@
 """
 Rutas para el Asistente Inteligente con integración Claude API
 """
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, make_response
 from flask_login import login_required, current_user
 from extensions import db
-from models.asistente import CasoHistorico, PlantillaTexto, SugerenciaIA
+from models.asistente import CasoHistorico, PlantillaTexto, SugerenciaIA, TurnoChat
 from models.protocolo import Protocolo
 from models.plantilla_dinamica import SeccionPlantilla, LineaPlantilla
 from models.prestador import Prestador
@@ -12,8 +12,9 @@ from models.usuario import Usuario
 from models.auditoria import Auditoria
 from services.claude_client import claude_client
 from services.gemini_client import gemini_client
-from sqlalchemy import or_, func, desc
-import re
+from services import contexto_chat
+from services import catalogo_modelos
+from sqlalchemy import or_, desc
 import logging
 
 logger = logging.getLogger(__name__)
@@ -21,24 +22,51 @@ logger = logging.getLogger(__name__)
 bp = Blueprint('asistente', __name__, url_prefix='/asistente')
 
 
-@bp.route('/buscar-casos', methods=['POST'])
-@login_required
-def buscar_casos():
+@bp.route('/panel')
+def panel():
     """
-    Buscar casos similares en el histórico
+    Markup del panel del asistente (lo pide components/asistente_stub.html en la
+    primera interacción con el botón flotante)
     """
-    data = request.get_json()
-    termino = data.get('termino', '').strip()
-    tipo_estudio = data.get('tipo_estudio', '')
-    limite = data.get('limite', 10)
-    
-    if len(termino) < 3:
-        return jsonify({
-            'success': False,
-            'message': 'Escribe al menos 3 caracteres'
-        })
-    
-    # Construir query
+    response = make_response(render_template('components/asistente_panel.html'))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+def _resumen_caso(caso, puntaje=None):
+    """Caso histórico (CasoHistorico o CasoHistoricoCompleto) como lo muestra el panel"""
+    if isinstance(caso, CasoHistorico):
+        descripcion = caso.descripcion_microscopica if caso.tipo_estudio == 'BIOPSIA' else caso.descripcion
+        descripcion_completa = caso.descripcion_microscopica or caso.descripcion
+        diagnostico = caso.diagnostico
+        origen = 'historico'
+    else:
+        secciones = [caso.seccion_extendido, caso.seccion_celulas, caso.seccion_inflamatorio, caso.seccion_flora]
+        descripcion = descripcion_completa = '\n'.join(s for s in secciones if s)
+        diagnostico = caso.seccion_diagnostico
+        origen = 'completo'
+    
+    descripcion_preview = descripcion[:200] if descripcion else ''
+    diagnostico_preview = diagnostico[:150] if diagnostico else ''
+    resumen = {
+        'caso_id': caso.caso_id,
+        'origen': origen,
+        'protocolo': caso.protocolo_original,
+        'tipo': caso.tipo_estudio,
+        'categoria': caso.categoria,
+        'descripcion_preview': descripcion_preview + '...' if len(descripcion_preview) >= 200 else descripcion_preview,
+        'diagnostico_preview': diagnostico_preview + '...' if len(diagnostico_preview) >= 150 else diagnostico_preview,
+        'descripcion_completa': descripcion_completa,
+        'diagnostico_completo': diagnostico
+    }
+    if puntaje is not None:
+        resumen['puntaje'] = round(puntaje, 3)
+    return resumen
+
+
+def _buscar_casos_sql(termino, tipo_estudio, limite):
+    """Búsqueda por ilike (sin orden por relevancia) mientras no se construya el índice"""
     query = CasoHistorico.query.filter(CasoHistorico.activo == True)
     
     # Filtrar por tipo si se especifica
@@ -46,10 +74,8 @@ def buscar_casos():
         query = query.filter(CasoHistorico.tipo_estudio == tipo_estudio)
     
     # Buscar en múltiples campos
-    palabras = termino.split()
     filtros = []
-    
-    for palabra in palabras:
+    for palabra in termino.split():
         if len(palabra) >= 3:
             filtros.append(
                 or_(
@@ -63,31 +89,52 @@ def buscar_casos():
     if filtros:
         query = query.filter(or_(*filtros))
     
-    # Obtener resultados
-    casos = query.order_by(desc(CasoHistorico.caso_id)).limit(limite).all()
+    return [_resumen_caso(caso) for caso in query.order_by(desc(CasoHistorico.caso_id)).limit(limite).all()]
+
+
+@bp.route('/buscar-casos', methods=['POST'])
+@login_required
+def buscar_casos():
+    """
+    Buscar casos similares en el histórico, ordenados por relevancia (BM25)
+    """
+    from services import indice_casos
+    from models.plantilla_multilinea import CasoHistoricoCompleto
     
-    # Formatear resultados
-    resultados = []
-    for caso in casos:
-        # Determinar qué mostrar según el tipo
-        if caso.tipo_estudio == 'BIOPSIA':
-            descripcion_preview = caso.descripcion_microscopica[:200] if caso.descripcion_microscopica else ''
-        else:
-            descripcion_preview = caso.descripcion[:200] if caso.descripcion else ''
-        
-        diagnostico_preview = caso.diagnostico[:150] if caso.diagnostico else ''
-        
-        resultados.append({
-            'caso_id': caso.caso_id,
-            'protocolo': caso.protocolo_original,
-            'tipo': caso.tipo_estudio,
-            'categoria': caso.categoria,
-            'descripcion_preview': descripcion_preview + '...' if len(descripcion_preview) >= 200 else descripcion_preview,
-            'diagnostico_preview': diagnostico_preview + '...' if len(diagnostico_preview) >= 150 else diagnostico_preview,
-            'descripcion_completa': caso.descripcion_microscopica or caso.descripcion,
-            'diagnostico_completo': caso.diagnostico
+    data = request.get_json()
+    termino = data.get('termino', '').strip()
+    tipo_estudio = data.get('tipo_estudio', '')
+    try:
+        limite = max(1, min(int(data.get('limite', 10)), 50))
+    except (TypeError, ValueError):
+        limite = 10
+    
+    if len(termino) < 3:
+        return jsonify({
+            'success': False,
+            'message': 'Escribe al menos 3 caracteres'
         })
     
+    encontrados = indice_casos.buscar(termino, tipo_estudio, limite)
+    if encontrados is None:
+        logger.warning("⚠️ Índice de casos sin construir (flask indexar-casos): búsqueda por ilike")
+        resultados = _buscar_casos_sql(termino, tipo_estudio, limite)
+    else:
+        # Dos consultas IN (una por tabla) y el orden del índice
+        ids = {'h': [], 'c': []}
+        for _, origen, caso_id in encontrados:
+            ids[origen].append(caso_id)
+        casos = {}
+        for origen, modelo in (('h', CasoHistorico), ('c', CasoHistoricoCompleto)):
+            if ids[origen]:
+                for caso in modelo.query.filter(modelo.caso_id.in_(ids[origen])).all():
+                    casos[(origen, caso.caso_id)] = caso
+        resultados = [
+            _resumen_caso(casos[(origen, caso_id)], puntaje)
+            for puntaje, origen, caso_id in encontrados
+            if (origen, caso_id) in casos
+        ]
+    
     return jsonify({
         'success': True,
         'total': len(resultados),
@@ -142,13 +189,12 @@ def usar_plantilla(plantilla_id):
     """
     Registrar uso de una plantilla
     """
-    plantilla = PlantillaTexto.query.get_or_404(plantilla_id)
+    from services.contadores_uso import registrar_uso
     
-    # Actualizar estadísticas
-    plantilla.veces_usado += 1
-    plantilla.ultima_vez_usado = db.func.now()
+    plantilla = PlantillaTexto.query.get_or_404(plantilla_id)
     
-    db.session.commit()
+    # Actualizar estadísticas (se vuelcan en lote)
+    registrar_uso(PlantillaTexto, plantilla.plantilla_id)
     
     return jsonify({
         'success': True,
@@ -160,33 +206,20 @@ def usar_plantilla(plantilla_id):
 @login_required
 def top_diagnosticos(tipo_estudio):
     """
-    Obtener diagnósticos más frecuentes por tipo
+    Obtener diagnósticos más frecuentes por tipo (variantes de escritura agrupadas)
     """
-    categoria = request.args.get('categoria', '')
-    limite = request.args.get('limite', 20, type=int)
-    
-    query = db.session.query(
-        CasoHistorico.diagnostico,
-        func.count(CasoHistorico.caso_id).label('frecuencia')
-    ).filter(
-        CasoHistorico.tipo_estudio == tipo_estudio.upper(),
-        CasoHistorico.activo == True
-    )
+    from services import frecuencias_diagnostico
     
-    if categoria:
-        query = query.filter(CasoHistorico.categoria == categoria)
+    categoria = request.args.get('categoria', '')
+    limite = min(max(request.args.get('limite', 20, type=int), 1), 200)
     
-    resultados = query.group_by(
-        CasoHistorico.diagnostico
-    ).order_by(
-        desc('frecuencia')
-    ).limit(limite).all()
+    resultados = frecuencias_diagnostico.top_diagnosticos(tipo_estudio, categoria, limite)
     
     diagnosticos = [{
-        'diagnostico': diag[0][:200] + '...' if len(diag[0]) > 200 else diag[0],
-        'diagnostico_completo': diag[0],
-        'frecuencia': diag[1]
-    } for diag in resultados]
+        'diagnostico': texto[:200] + '...' if len(texto) > 200 else texto,
+        'diagnostico_completo': texto,
+        'frecuencia': frecuencia
+    } for texto, frecuencia in resultados]
     
     return jsonify({
         'success': True,
@@ -200,23 +233,13 @@ def obtener_categorias(tipo_estudio):
     """
     Obtener categorías disponibles por tipo de estudio
     """
-    categorias = db.session.query(
-        CasoHistorico.categoria,
-        func.count(CasoHistorico.caso_id).label('total')
-    ).filter(
-        CasoHistorico.tipo_estudio == tipo_estudio.upper(),
-        CasoHistorico.activo == True
-    ).group_by(
-        CasoHistorico.categoria
-    ).order_by(
-        desc('total')
-    ).all()
+    from services import frecuencias_diagnostico
     
     resultado = [{
-        'categoria': cat[0],
-        'nombre_mostrar': cat[0].replace('_', ' ').title(),
-        'total_casos': cat[1]
-    } for cat in categorias]
+        'categoria': categoria,
+        'nombre_mostrar': categoria.replace('_', ' ').title() if categoria else 'Sin categoría',
+        'total_casos': total
+    } for categoria, total in frecuencias_diagnostico.categorias(tipo_estudio)]
     
     return jsonify({
         'success': True,
@@ -504,6 +527,7 @@ def gemini_modelos():
         })
     
     modelos = gemini_client.listar_modelos_disponibles()
+    descubrimiento = catalogo_modelos.estado('gemini')
     
     # Filtrar solo modelos que soporten generateContent y visión
     # Los modelos Gemini 2.0+ son multimodales (soportan visión) aunque no tengan "vision" en el nombre
@@ -519,7 +543,9 @@ def gemini_modelos():
         'success': True,
         'modelos': modelos,
         'modelos_con_vision': modelos_con_vision,
-        'modelo_actual': gemini_client.model
+        'modelo_actual': gemini_client.model,
+        'verificado': descubrimiento['verificado'].isoformat() if descubrimiento['verificado'] else None,
+        'actualizando': descubrimiento['actualizando']
     })
 
 
@@ -527,9 +553,9 @@ def gemini_modelos():
 @login_required
 def probar_modelos():
     """
-    Probar qué modelos están disponibles
-    GET: Muestra página HTML para probar modelos
-    POST: Devuelve JSON con resultados
+    Modelos de Claude disponibles según el último descubrimiento (services/catalogo_modelos)
+    GET: Muestra página HTML con los resultados (?actualizar=1 los renueva en segundo plano)
+    POST: Renueva en segundo plano y devuelve JSON con los resultados guardados
     """
     if not claude_client.is_configured():
         if request.method == 'GET':
@@ -541,20 +567,18 @@ def probar_modelos():
             'error': 'Claude API no está configurada'
         })
     
-    modelos_a_probar = [
-        'claude-3-haiku-20240307',
-        'claude-3-sonnet-20240229',
-        'claude-3-5-sonnet-20240620',
-        'claude-3-opus-20240229',
-        'claude-3-5-opus-20241022'
-    ]
+    # Resultado guardado del descubrimiento; "Probar Modelos" (o un POST) lo renueva en segundo plano
+    if request.method == 'POST' or request.args.get('actualizar'):
+        catalogo_modelos.refrescar('claude')
+    descubrimiento = catalogo_modelos.estado('claude')
     
     resultados = {}
-    for modelo in modelos_a_probar:
-        resultado = claude_client.probar_modelo(modelo=modelo, timeout=5)
-        resultados[modelo] = {
-            'disponible': resultado.get('disponible', False),
-            'error': resultado.get('error')
+    for datos in descubrimiento['modelos']:
+        resultados[datos['modelo']] = {
+            'disponible': bool(datos['disponible']),
+            'error': datos['error'],
+            'soporta_vision': datos['soporta_vision'],
+            'latencia_ms': datos['latencia_ms']
         }
     
     modelos_disponibles = [m for m, r in resultados.items() if r['disponible']]
@@ -564,12 +588,16 @@ def probar_modelos():
                              modelo_actual=claude_client.model,
                              resultados=resultados,
                              modelos_disponibles=modelos_disponibles,
+                             verificado=descubrimiento['verificado'],
+                             actualizando=descubrimiento['actualizando'],
                              error=None)
     
     return jsonify({
         'success': True,
         'modelos_disponibles': modelos_disponibles,
-        'resultados': resultados
+        'resultados': resultados,
+        'verificado': descubrimiento['verificado'].isoformat() if descubrimiento['verificado'] else None,
+        'actualizando': descubrimiento['actualizando']
     })
 
 
@@ -665,6 +693,7 @@ def chat():
                 imagenes=imagenes_procesadas,
                 contexto_usuario=contexto_usuario
             )
+            exito = not resultado.get('error')
             
             # Adaptar respuesta de Gemini al formato esperado
             resultado = {
@@ -686,25 +715,38 @@ def chat():
                 })
             
             logger.info(f"🔍 Usando Claude para conversación de texto")
-            # Obtener historial de mensajes si hay IDs
-            historial = []
-            if historial_ids:
-                # TODO: Implementar recuperación de historial desde base de datos
-                historial = []
+            # Historial de la conversación: últimos turnos textuales + resumen de los anteriores
+            ids_validos = [i for i in historial_ids if isinstance(i, int)]
+            historial, resumen = contexto_chat.armar_contexto(
+                current_user.usuario_id, protocolo_id, min(ids_validos) if ids_validos else None
+            )
             
             resultado = claude_client.chat_conversacional(
                 mensaje=mensaje,
                 historial=historial,
                 contexto_usuario=contexto_usuario,
-                imagenes=None
+                imagenes=None,
+                resumen=resumen
             )
+            exito = resultado.get('intencion') != 'error'
             
             # Agregar información sobre modelo usado
             resultado['gemini_disponible'] = gemini_client.is_configured()
             resultado['modelo_usado'] = 'claude'
         
-        # Guardar mensaje en historial (opcional)
-        # TODO: Implementar guardado de historial en base de datos
+        # Guardar el turno en el historial (con imágenes queda el análisis, no las imágenes)
+        historial_id = None
+        if exito and resultado.get('respuesta'):
+            try:
+                turno = contexto_chat.registrar_turno(
+                    current_user.usuario_id, protocolo_id, mensaje, resultado.get('respuesta'),
+                    imagenes=len(imagenes_procesadas), modelo=resultado.get('modelo_usado')
+                )
+                db.session.commit()
+                historial_id = turno.turno_id
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Error guardando el turno del chat: {e}")
         
         # Registrar en auditoría
         try:
@@ -727,6 +769,7 @@ def chat():
             'respuesta': resultado.get('respuesta', ''),
             'intencion': resultado.get('intencion', 'pregunta'),
             'acciones': resultado.get('acciones', []),
+            'historial_id': historial_id,
             'claude_disponible': True
         })
         
@@ -865,37 +908,21 @@ def historial_chat():
     """
     Obtener historial de chat para el usuario actual o un protocolo específico.
     """
-    limite = request.args.get('limite', 20, type=int)
+    limite = min(max(request.args.get('limite', 20, type=int), 1), 100)
     protocolo_id = request.args.get('protocolo_id', type=int)
 
-    query = Auditoria.query.filter(
-        Auditoria.usuario_id == current_user.usuario_id,
-        Auditoria.accion == 'chat_asistente'
+    query = TurnoChat.query.filter(
+        TurnoChat.usuario_id == current_user.usuario_id,
+        TurnoChat.protocolo_id == protocolo_id if protocolo_id else TurnoChat.protocolo_id.is_(None)
     )
-
-    if protocolo_id:
-        # Filtrar por protocolo_id si se proporciona
-        query = query.filter(Auditoria.descripcion.ilike(f'%Protocolo ID: {protocolo_id}%'))
-        
-    historial_auditoria = query.order_by(desc(Auditoria.fecha_hora)).limit(limite).all()
-    
-    historial_formateado = []
-    for item in reversed(historial_auditoria): # Mostrar en orden cronológico ascendente
-        # Intentar parsear el mensaje y la respuesta del asistente desde la descripción
-        descripcion = item.descripcion or ''
-        mensaje_usuario_match = re.search(r'Mensaje: (.*?)(?=\nRespuesta:|$)', descripcion, re.DOTALL)
-        respuesta_asistente_match = re.search(r'Respuesta: (.*)', descripcion, re.DOTALL)
-
-        mensaje_usuario = mensaje_usuario_match.group(1).strip() if mensaje_usuario_match else None
-        respuesta_asistente = respuesta_asistente_match.group(1).strip() if respuesta_asistente_match else None
-
-        if mensaje_usuario and respuesta_asistente:
-            historial_formateado.append({
-                'historial_id': item.auditoria_id,
-                'mensaje': mensaje_usuario,
-                'respuesta': respuesta_asistente,
-                'fecha_hora': item.fecha_hora.isoformat()
-            })
+    turnos = query.order_by(desc(TurnoChat.turno_id)).limit(limite).all()
+    
+    historial_formateado = [{
+        'historial_id': turno.turno_id,
+        'mensaje': contexto_chat.texto_usuario(turno),
+        'respuesta': turno.respuesta,
+        'fecha_hora': turno.fecha.isoformat()
+    } for turno in reversed(turnos)]  # Mostrar en orden cronológico ascendente
     
     return jsonify({'success': True, 'historial': historial_formateado})
 
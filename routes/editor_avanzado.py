@@ -174,9 +174,11 @@ def obtener_sugerencias(protocolo_id, seccion):
     if not config:
         return jsonify({'error': 'Configuración no encontrada'}), 400
     
-    # Simular sugerencias basadas en el modo y casos históricos
+    # Predicción de las próximas líneas; `linea` (repetible) trae las líneas que
+    # tiene la sección en el editor si todavía no se guardaron
+    lineas_seccion = request.args.getlist('linea') or None
     sugerencias = generar_sugerencias_inteligentes(
-        protocolo, seccion, config
+        protocolo, seccion, config, lineas_seccion
     )
     
     # Registrar consulta en el log
@@ -236,13 +238,12 @@ def usar_plantilla_multilinea(plantilla_id):
     """
     Registrar uso de una plantilla multilinea
     """
-    plantilla = PlantillaMultilinea.query.get_or_404(plantilla_id)
+    from services.contadores_uso import registrar_uso
     
-    # Actualizar estadísticas
-    plantilla.veces_usado += 1
-    plantilla.ultima_vez_usado = db.func.now()
+    plantilla = PlantillaMultilinea.query.get_or_404(plantilla_id)
     
-    db.session.commit()
+    # Actualizar estadísticas (se vuelcan en lote)
+    registrar_uso(PlantillaMultilinea, plantilla.plantilla_id)
     
     try:
         lineas = json.loads(plantilla.lineas) if plantilla.lineas else []
@@ -275,74 +276,66 @@ def feedback_sugerencia(log_id):
     return jsonify({'success': True})
 
 
-def generar_sugerencias_inteligentes(protocolo, seccion, config):
+def generar_sugerencias_inteligentes(protocolo, seccion, config, lineas_seccion=None):
     """
-    Generar sugerencias inteligentes basadas en el modo y casos históricos
+    Generar sugerencias con el modelo de próxima línea (services.prediccion_lineas),
+    entrenado con las líneas de los protocolos completados.
+
+    - sugeridor: las próximas líneas más probables que superen
+      `nivel_confianza_minimo`, cada una con su confianza
+    - predictor: la continuación más probable mientras cada línea supere
+      `nivel_confianza_minimo`
+    - colaborador: la continuación completa hasta el cierre de la sección
+
+    `casos_base` es la cantidad de veces que el modelo vio el contexto actual.
     """
+    from services import prediccion_lineas
+
     sugerencias = []
-    
-    # Simulación de sugerencias basadas en el modo
     if config.modo_principal == 'silencioso':
         return sugerencias  # No sugerencias en modo silencioso
-    
-    # Obtener cantidad de casos similares desde datos reales disponibles
-    try:
-        # Preferir plantillas generadas reales para el mismo tipo de estudio
-        from models.plantilla_dinamica import PlantillaGenerada
-        casos_similares_count = PlantillaGenerada.query.filter_by(
-            tipo_estudio=protocolo.tipo_estudio,
-            activo=True
-        ).count()
-        # Si no hay plantillas guardadas aún, usar cantidad de protocolos PAP como aproximación
-        if not casos_similares_count:
-            casos_similares_count = Protocolo.query.filter_by(
-                tipo_estudio=protocolo.tipo_estudio
-            ).count()
-        # Umbral amigable: si aún es muy bajo (base recién creada), mostrar un valor base configurable
-        try:
-            from models.configuracion import Configuracion
-            base_min = int(Configuracion.get('asistente_casos_base_min', '2847'))
-        except Exception:
-            base_min = 2847
-        if casos_similares_count < 100:
-            casos_similares_count = max(casos_similares_count, base_min)
-    except Exception:
-        casos_similares_count = 0
-    
+
+    lineas_protocolo = prediccion_lineas.lineas_protocolo(protocolo.protocolo_id)
+    tipo = protocolo.tipo_estudio
+
     if config.modo_principal == 'sugeridor':
-        sugerencias.append({
-            'titulo': 'Sugerencia Basada en Patrones',
-            'descripcion': f"Basado en {casos_similares_count} casos similares de {protocolo.tipo_estudio}",
-            'lineas': ['abundante, trófico y representativo'],
-            'confianza': 0.8,
-            'casos_base': casos_similares_count
-        })
-    
-    elif config.modo_principal == 'predictor':
-        sugerencias.append({
-            'titulo': 'Predicción Automática',
-            'descripcion': f"89% de {casos_similares_count} casos similares usan esta combinación",
-            'lineas': [
-                'abundante, trófico y representativo',
-                'células pavimentosas, intermedias y superficiales'
-            ],
-            'confianza': 0.89,
-            'casos_base': casos_similares_count
-        })
-    
+        resultado = prediccion_lineas.predecir(
+            tipo, seccion, lineas_protocolo, lineas_seccion,
+            limite=config.max_sugerencias_por_seccion or 5
+        )
+        confianza_minima = config.nivel_confianza_minimo or 0.0
+        for prediccion in resultado['predicciones']:
+            if prediccion['confianza'] < confianza_minima:
+                continue
+            sugerencias.append({
+                'titulo': 'Sugerencia Basada en Patrones',
+                'descripcion': (f"Confianza {prediccion['confianza']:.0%}: siguió {prediccion['soporte']} veces "
+                                f"a este contexto, visto en {resultado['soporte']} casos de {tipo}"),
+                'lineas': [prediccion['texto']],
+                'confianza': prediccion['confianza'],
+                'casos_base': resultado['soporte']
+            })
+        return sugerencias
+
+    if config.modo_principal == 'predictor':
+        resultado = prediccion_lineas.completar(
+            tipo, seccion, lineas_protocolo, lineas_seccion,
+            confianza_minima=config.nivel_confianza_minimo or 0.0
+        )
+        titulo = 'Predicción Automática'
     elif config.modo_principal == 'colaborador':
+        resultado = prediccion_lineas.completar(tipo, seccion, lineas_protocolo, lineas_seccion)
+        titulo = 'Análisis Completo'
+    else:
+        return sugerencias
+
+    if resultado['lineas']:
         sugerencias.append({
-            'titulo': 'Análisis Completo',
-            'descripcion': f"Para casos de este tipo, recomiendo esta secuencia completa basada en {casos_similares_count} casos",
-            'lineas': [
-                'abundante, trófico y representativo',
-                'células pavimentosas, intermedias y superficiales',
-                'moderado, leucocitario polimorfonuclear',
-                'bacilar',
-                'NEGATIVO'
-            ],
-            'confianza': 0.92,
-            'casos_base': casos_similares_count
+            'titulo': titulo,
+            'descripcion': (f"Secuencia más probable ({resultado['confianza']:.0%}) según "
+                            f"{resultado['soporte']} casos de {tipo} con este contexto"),
+            'lineas': resultado['lineas'],
+            'confianza': resultado['confianza'],
+            'casos_base': resultado['soporte']
         })
-    
     return sugerencias
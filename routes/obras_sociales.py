@@ -111,6 +111,8 @@ def editar(id):
             obra_social.plan_id = int(plan_id) if plan_id and plan_id != '' else None
             obra_social.observaciones = request.form.get('observaciones')
             
+            # El plan asignado cambia la valorización de los meses cerrados: la
+            # versión de facturación se renueva en este mismo commit
             db.session.commit()
             
             Auditoria.registrar(
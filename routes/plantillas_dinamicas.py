@@ -1,7 +1,7 @@
 """
 Rutas para el sistema de plantillas dinámicas con secciones y líneas
 """
-from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, flash
+from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, flash, current_app
 from flask_login import login_required, current_user
 from extensions import db
 from models.plantilla_dinamica import SeccionPlantilla, LineaPlantilla, ConfiguracionBotones, PlantillaGenerada
@@ -227,13 +227,12 @@ def usar_linea(linea_id):
     """
     Registrar uso de una línea y devolver su texto
     """
-    linea = LineaPlantilla.query.get_or_404(linea_id)
+    from services.contadores_uso import registrar_uso
     
-    # Actualizar estadísticas
-    linea.veces_usado += 1
-    linea.ultima_vez_usado = db.func.now()
+    linea = LineaPlantilla.query.get_or_404(linea_id)
     
-    db.session.commit()
+    # Actualizar estadísticas (se vuelcan en lote)
+    registrar_uso(LineaPlantilla, linea.linea_id)
     
     return jsonify({
         'success': True,
@@ -313,18 +312,35 @@ def cargar_plantilla(protocolo_id):
         })
 
 
-def construir_contexto_reporte(protocolo_id, lineas_json=None, disenio_id=None):
-    from models.informe import ProtocoloLinea, DisenioInforme
-    from models.protocolo import Protocolo
-    from models.configuracion import Configuracion
-    import json
+# Configuración usada por el reporte: clave -> valor por defecto
+CONFIG_REPORTE_DEFAULTS = {
+    'laboratorio_direccion': 'Pellegrini 630',
+    'laboratorio_telefono': '03462-15412472',
+    'laboratorio_ciudad': '2600 - Venado Tuerto',
+    'laboratorio_nombre': 'LABORATORIO DE DIAGNÓSTICO HISTOPATOLÓGICO',
+    'mostrar_logo_reporte': 'true',
+    'reporte_footer': '',
+}
 
-    protocolo = Protocolo.query.get_or_404(protocolo_id)
 
-    lineas = ProtocoloLinea.query.filter_by(protocolo_id=protocolo_id).order_by(
-        ProtocoloLinea.seccion, ProtocoloLinea.orden
+def _datos_comunes_reporte():
+    """Configuración y diseños activos (iguales para todos los protocolos)"""
+    from models.informe import DisenioInforme
+    from models.configuracion import Configuracion
+
+    config = Configuracion.get_varios(CONFIG_REPORTE_DEFAULTS)
+    disenios_activos = DisenioInforme.query.filter_by(
+        activo=True
+    ).order_by(
+        DisenioInforme.tipo_estudio,
+        DisenioInforme.es_default.desc(),
+        DisenioInforme.nombre
     ).all()
+    return config, disenios_activos
 
+
+def _armar_contexto_reporte(protocolo, lineas, config, disenios_activos, lineas_json=None, disenio_id=None):
+    """Contexto de reporte_unificado.html a partir de datos ya cargados (sin consultas)"""
     lineas_por_seccion = {}
     for linea in lineas:
         lineas_por_seccion.setdefault(linea.seccion, []).append({
@@ -400,14 +416,7 @@ def construir_contexto_reporte(protocolo_id, lineas_json=None, disenio_id=None):
                 lineas_por_seccion_ordenado[seccion] = lineas_list
         lineas_por_seccion = lineas_por_seccion_ordenado
 
-    config = {
-        'laboratorio_direccion': Configuracion.get('laboratorio_direccion', 'Pellegrini 630'),
-        'laboratorio_telefono': Configuracion.get('laboratorio_telefono', '03462-15412472'),
-        'laboratorio_ciudad': Configuracion.get('laboratorio_ciudad', '2600 - Venado Tuerto'),
-        'laboratorio_nombre': Configuracion.get('laboratorio_nombre', 'LABORATORIO DE DIAGNÓSTICO HISTOPATOLÓGICO'),
-        'mostrar_logo_reporte': Configuracion.get('mostrar_logo_reporte', 'true'),
-        'reporte_footer': Configuracion.get('reporte_footer', '')
-    }
+    config = dict(config)
 
     def _normalizar_tipo_estudio(valor: str) -> str:
         if not valor:
@@ -420,14 +429,6 @@ def construir_contexto_reporte(protocolo_id, lineas_json=None, disenio_id=None):
     disenio_config = None
     disenio_actual = None
 
-    disenios_activos = DisenioInforme.query.filter_by(
-        activo=True
-    ).order_by(
-        DisenioInforme.tipo_estudio,
-        DisenioInforme.es_default.desc(),
-        DisenioInforme.nombre
-    ).all()
-
     disenios_filtrados = [
         d for d in disenios_activos
         if _normalizar_tipo_estudio(d.tipo_estudio) == tipo_estudio_normalizado
@@ -481,6 +482,64 @@ def construir_contexto_reporte(protocolo_id, lineas_json=None, disenio_id=None):
     )
 
 
+def construir_contexto_reporte(protocolo_id, lineas_json=None, disenio_id=None):
+    from models.informe import ProtocoloLinea
+    from models.protocolo import Protocolo
+
+    protocolo = Protocolo.query.get_or_404(protocolo_id)
+
+    lineas = ProtocoloLinea.query.filter_by(protocolo_id=protocolo_id).order_by(
+        ProtocoloLinea.seccion, ProtocoloLinea.orden
+    ).all()
+
+    config, disenios_activos = _datos_comunes_reporte()
+    return _armar_contexto_reporte(protocolo, lineas, config, disenios_activos,
+                                   lineas_json=lineas_json, disenio_id=disenio_id)
+
+
+def construir_contextos_reporte(protocolo_ids, disenio_id=None):
+    """
+    Contextos de reporte para varios protocolos con una cantidad fija de consultas.
+
+    Carga los protocolos con paciente, obra social, prestador y médico informante,
+    todas las líneas en una sola consulta IN, y la configuración y los diseños una
+    única vez. Cada contexto es idéntico al de construir_contexto_reporte.
+
+    Returns:
+        Dict protocolo_id -> contexto (los ids inexistentes se omiten)
+    """
+    from sqlalchemy.orm import selectinload
+    from models.informe import ProtocoloLinea
+    from models.prestador import Prestador
+    from models.usuario import Usuario
+
+    ids = list(dict.fromkeys(protocolo_ids))
+    if not ids:
+        return {}
+
+    protocolos = Protocolo.query.options(
+        selectinload(Protocolo.afiliado).selectinload(Afiliado.obra_social),
+        selectinload(Protocolo.prestador).selectinload(Prestador.especialidad),
+        selectinload(Protocolo.usuario_informe).selectinload(Usuario.firma),
+        selectinload(Protocolo.usuario_informe).selectinload(Usuario.rol),
+    ).filter(Protocolo.protocolo_id.in_(ids)).all()
+
+    lineas_por_protocolo = {}
+    for linea in ProtocoloLinea.query.filter(ProtocoloLinea.protocolo_id.in_(ids)).order_by(
+        ProtocoloLinea.protocolo_id, ProtocoloLinea.seccion, ProtocoloLinea.orden
+    ):
+        lineas_por_protocolo.setdefault(linea.protocolo_id, []).append(linea)
+
+    config, disenios_activos = _datos_comunes_reporte()
+    return {
+        protocolo.protocolo_id: _armar_contexto_reporte(
+            protocolo, lineas_por_protocolo.get(protocolo.protocolo_id, []),
+            config, disenios_activos, disenio_id=disenio_id
+        )
+        for protocolo in protocolos
+    }
+
+
 @bp.route('/preview-plantilla/<int:protocolo_id>')
 @login_required
 def preview_plantilla(protocolo_id):
@@ -524,12 +583,10 @@ def exportar_plantilla(protocolo_id):
         texto_final.append("DESCRIPCIÓN CITOLÓGICA:")
         texto_final.append("=" * 50)
         
-        for seccion_id, linea_id in contenido.items():
-            linea = LineaPlantilla.query.get(linea_id)
-            seccion = SeccionPlantilla.query.get(seccion_id)
-            if linea and seccion:
-                texto_final.append(f"\n{seccion.nombre}:")
-                texto_final.append(linea.texto)
+        from services.materializacion_plantillas import resolver_contenido_generado
+        for nombre_seccion, texto in resolver_contenido_generado(contenido):
+            texto_final.append(f"\n{nombre_seccion}:")
+            texto_final.append(texto)
         
         return "\n".join(texto_final)
     except:
@@ -609,6 +666,35 @@ def get_categoria_icono(categoria):
     return iconos.get(categoria, 'bi-question-circle')
 
 
+# ===== CATÁLOGO DE PLANTILLAS (una carga por editor) =====
+
+@bp.route('/api/catalogo/<tipo_estudio>')
+@login_required
+def api_catalogo_plantillas(tipo_estudio):
+    """
+    Catálogo completo de plantillas de un tipo de estudio en un único JSON:
+    secciones con líneas, botones, líneas por categoría/sección y plantillas estándar.
+    
+    Se sirve con ETag del contenido: el navegador revalida con un request
+    condicional (304 si no cambió). Si se pide con ?v=<versión vigente> la
+    respuesta es inmutable y se cachea sin revalidar.
+    """
+    try:
+        from services.catalogo_plantillas import obtener_catalogo
+        
+        version, cuerpo, etag = obtener_catalogo(tipo_estudio)
+        respuesta = current_app.response_class(cuerpo, mimetype='application/json')
+        respuesta.set_etag(etag)
+        respuesta.headers['X-Catalogo-Version'] = version
+        if request.args.get('v') == version:
+            respuesta.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        else:
+            respuesta.headers['Cache-Control'] = 'private, no-cache'
+        return respuesta.make_conditional(request)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ===== RUTAS API PARA PLANTILLAS PAP DESDE BASE DE DATOS =====
 
 @bp.route('/api/plantillas-pap')
@@ -783,7 +869,8 @@ def api_plantillas_personalizadas(tipo_estudio):
             
             if boton_existente:
                 # Buscar o crear la plantilla estándar asociada
-                from models.informe import PlantillaPap, LineaPap, PlantillaLinea
+                from models.informe import PlantillaPap
+                from services.materializacion_plantillas import reemplazar_lineas_plantilla_pap
                 
                 plantilla_std = PlantillaPap.query.filter_by(
                     codigo=nombre.upper(),
@@ -801,39 +888,8 @@ def api_plantillas_personalizadas(tipo_estudio):
                     db.session.add(plantilla_std)
                     db.session.flush()  # Para obtener el ID
                 
-                # Eliminar líneas anteriores asociadas
-                PlantillaLinea.query.filter_by(plantilla_id=plantilla_std.plantilla_pap_id).delete()
-                
-                # Crear/actualizar líneas en LineaPap y asociarlas
-                orden_global = 0
-                for categoria, textos in lineas_normalizadas.items():
-                    for idx, texto in enumerate(textos):
-                        # Buscar si existe la línea
-                        linea_existente = LineaPap.query.filter_by(
-                            categoria=categoria,
-                            texto=texto,
-                            activo=True
-                        ).first()
-                        
-                        if not linea_existente:
-                            # Crear nueva línea
-                            linea_existente = LineaPap(
-                                categoria=categoria,
-                                texto=texto,
-                                orden=orden_global,
-                                activo=True
-                            )
-                            db.session.add(linea_existente)
-                            db.session.flush()
-                        
-                        # Asociar línea a plantilla
-                        plantilla_linea = PlantillaLinea(
-                            plantilla_id=plantilla_std.plantilla_pap_id,
-                            linea_plantilla_id=linea_existente.linea_id,
-                            orden=orden_global
-                        )
-                        db.session.add(plantilla_linea)
-                        orden_global += 1
+                # Reemplazar las líneas asociadas (resolviendo/creando las LineaPap en lote)
+                reemplazar_lineas_plantilla_pap(plantilla_std.plantilla_pap_id, lineas_normalizadas)
                 
                 asignada_a_boton = True
 
@@ -1141,9 +1197,14 @@ def api_eliminar_linea_protocolo(linea_id):
 @bp.route('/api/protocolo/<int:protocolo_id>/guardar-lineas', methods=['POST'])
 @login_required
 def api_guardar_lineas_protocolo(protocolo_id):
-    """Guardar todas las líneas de un protocolo"""
+    """
+    Guardar las líneas de un protocolo aplicando solo las diferencias
+    
+    JSON: lineas [{seccion, texto, orden}], secciones (opcional: reemplazar solo esas
+    secciones), revision (opcional: revisión del cliente, 409 si quedó vieja)
+    """
     try:
-        from models.informe import ProtocoloLinea
+        from services.lineas_protocolo import guardar_lineas, agrupar_lineas, RevisionObsoleta
         
         # Verificar si es protocolo de prueba
         protocolo = Protocolo.query.get_or_404(protocolo_id)
@@ -1155,31 +1216,40 @@ def api_guardar_lineas_protocolo(protocolo_id):
         
         data = request.get_json()
         lineas = data.get('lineas', [])
+        secciones = data.get('secciones')
         
-        if not lineas:
+        if not lineas and not secciones:
             return jsonify({
                 'success': False,
                 'error': 'No se proporcionaron líneas para guardar'
             }), 400
         
-        # Eliminar líneas existentes del protocolo
-        ProtocoloLinea.query.filter_by(protocolo_id=protocolo_id).delete()
-        
-        # Insertar nuevas líneas
-        for linea_data in lineas:
-            nueva_linea = ProtocoloLinea(
-                protocolo_id=protocolo_id,
-                seccion=linea_data['seccion'],
-                texto=linea_data['texto'],
-                orden=linea_data['orden']
+        try:
+            resultado = guardar_lineas(
+                protocolo_id,
+                agrupar_lineas(lineas),
+                secciones=secciones,
+                revision_esperada=data.get('revision')
             )
-            db.session.add(nueva_linea)
+        except RevisionObsoleta as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': str(e), 'revision': e.revision_actual}), 409
         
         db.session.commit()
         
+        # El guardado explícito reemplaza el borrador de autoguardado
+        from services import borradores
+        borradores.descartar(protocolo_id, secciones)
+        
+        # Si el informe ya estaba completado, regenerar su PDF
+        if resultado['insertadas'] or resultado['actualizadas'] or resultado['eliminadas']:
+            from services.informes_pdf import encolar_si_completado
+            encolar_si_completado(protocolo)
+        
         return jsonify({
             'success': True,
-            'message': f'Se guardaron {len(lineas)} líneas correctamente'
+            'message': f'Se guardaron {len(lineas)} líneas correctamente',
+            **resultado
         })
         
     except Exception as e:
@@ -1190,6 +1260,50 @@ def api_guardar_lineas_protocolo(protocolo_id):
         }), 500
 
 
+@bp.route('/api/protocolo/<int:protocolo_id>/autosave', methods=['POST'])
+@login_required
+def api_autosave_protocolo(protocolo_id):
+    """
+    Autoguardado de los editores: agrega operaciones al diario de borradores
+    
+    JSON: ops [{op: insert|edit|move|delete|replace, seccion, pos, texto, desde, hasta, lineas}],
+    compactar (opcional: volcar el borrador ya, p. ej. al salir del editor)
+    
+    Las operaciones no tocan protocolo_lineas; el diario se compacta con un único
+    guardado por diferencias al superar AUTOSAVE_COMPACTAR_OPERACIONES o
+    AUTOSAVE_COMPACTAR_SEGUNDOS.
+    """
+    try:
+        from services import borradores
+        
+        protocolo = Protocolo.query.get_or_404(protocolo_id)
+        if protocolo.es_prueba:
+            return jsonify({'success': False, 'error': 'Los protocolos de prueba no se autoguardan'}), 400
+        
+        data = request.get_json(silent=True) or {}
+        try:
+            estado = borradores.agregar_operaciones(protocolo_id, data.get('ops') or [])
+        except borradores.OperacionInvalida as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        compactado = None
+        if data.get('compactar') or borradores.debe_compactar(protocolo_id):
+            compactado = borradores.compactar(protocolo_id)
+            estado = borradores.estado(protocolo_id)
+            if compactado and compactado['guardado']:
+                from services.informes_pdf import encolar_si_completado
+                encolar_si_completado(protocolo)
+        
+        return jsonify({'success': True, **estado, 'compactado': compactado})
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
 # ===== RUTAS API PARA EDITOR MODERNO V2 =====
 
 @bp.route('/api/editor-moderno/guardar', methods=['POST'])
@@ -1197,7 +1311,7 @@ def api_guardar_lineas_protocolo(protocolo_id):
 def api_guardar_editor_moderno():
     """Guardar contenido del editor moderno"""
     try:
-        from models.informe import ProtocoloLinea
+        from services.lineas_protocolo import guardar_lineas, RevisionObsoleta
         
         data = request.get_json()
         protocolo_id = data.get('protocolo_id')
@@ -1215,27 +1329,31 @@ def api_guardar_editor_moderno():
                 'error': 'Los protocolos de prueba no se pueden guardar. Use "Guardar como plantilla" en su lugar.'
             }), 400
         
-        # Eliminar líneas existentes de esta sección
-        ProtocoloLinea.query.filter_by(
-            protocolo_id=protocolo_id,
-            seccion=seccion
-        ).delete()
-        
-        # Crear nueva línea con el contenido
-        if contenido.strip():
-            nueva_linea = ProtocoloLinea(
-                protocolo_id=protocolo_id,
-                seccion=seccion,
-                texto=contenido,
-                orden=1
+        # Reemplazar la sección aplicando solo las diferencias
+        try:
+            resultado = guardar_lineas(
+                protocolo_id,
+                {seccion: [(contenido, 1)] if contenido.strip() else []},
+                secciones=[seccion],
+                revision_esperada=data.get('revision')
             )
-            db.session.add(nueva_linea)
+        except RevisionObsoleta as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': str(e), 'revision': e.revision_actual}), 409
         
         db.session.commit()
         
+        from services import borradores
+        borradores.descartar(protocolo_id, [seccion])
+        
+        # Si el informe ya estaba completado, regenerar su PDF
+        from services.informes_pdf import encolar_si_completado
+        encolar_si_completado(protocolo)
+        
         return jsonify({
             'success': True,
-            'message': 'Contenido guardado correctamente'
+            'message': 'Contenido guardado correctamente',
+            'revision': resultado['revision']
         })
         
     except Exception as e:
@@ -1268,9 +1386,16 @@ def api_cargar_editor_moderno(protocolo_id):
         for seccion, textos in contenido_por_seccion.items():
             resultado[seccion] = '\n'.join(textos)
         
+        # Cambios autoguardados que todavía no se compactaron
+        from services import borradores
+        borrador = borradores.borrador(protocolo_id)
+        for seccion, textos in borrador.items():
+            resultado[seccion] = '\n'.join(textos)
+        
         return jsonify({
             'success': True,
-            'contenido': resultado
+            'contenido': resultado,
+            'borrador': sorted(borrador)
         })
         
     except Exception as e:
@@ -1380,7 +1505,7 @@ def editor_citologia(protocolo_id):
 def api_guardar_editor_v2():
     """Guardar (reemplazando) las líneas de una sección del protocolo en protocolo_lineas."""
     try:
-        from models.informe import ProtocoloLinea
+        from services.lineas_protocolo import guardar_lineas, RevisionObsoleta
         data = request.get_json(silent=True) or {}
         protocolo_id = data.get('protocolo_id')
         seccion = (data.get('seccion') or '').strip()
@@ -1406,20 +1531,28 @@ def api_guardar_editor_v2():
             if t:
                 lineas_limpias.append(t)
 
-        # Reemplazar existentes
-        ProtocoloLinea.query.filter_by(protocolo_id=protocolo_id, seccion=seccion).delete()
-
-        # Insertar ordenadas
-        for i, t in enumerate(lineas_limpias, start=1):
-            db.session.add(ProtocoloLinea(
-                protocolo_id=protocolo_id,
-                seccion=seccion,
-                texto=t,
-                orden=i
-            ))
+        # Reemplazar la sección aplicando solo las diferencias (ordenadas desde 1)
+        try:
+            resultado = guardar_lineas(
+                protocolo_id,
+                {seccion: [(t, i) for i, t in enumerate(lineas_limpias, start=1)]},
+                secciones=[seccion],
+                revision_esperada=data.get('revision')
+            )
+        except RevisionObsoleta as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'error': str(e), 'revision': e.revision_actual}), 409
 
         db.session.commit()
-        return jsonify({'success': True, 'insertadas': len(lineas_limpias)})
+
+        from services import borradores
+        borradores.descartar(protocolo_id, [seccion])
+
+        # Si el informe ya estaba completado, regenerar su PDF
+        from services.informes_pdf import encolar_si_completado
+        encolar_si_completado(protocolo)
+
+        return jsonify({'success': True, 'insertadas': len(lineas_limpias), 'revision': resultado['revision']})
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -7,8 +7,9 @@ from models.protocolo import Protocolo
 from models.paciente import Afiliado
 from models.prestador import Prestador, prestador_entidad
 from models.auditoria import Auditoria
-from routes.plantillas_dinamicas import construir_contexto_reporte
+from routes.plantillas_dinamicas import construir_contexto_reporte, construir_contextos_reporte
 from extensions import db
+from services.informes_pdf import obtener_pdf
 from sqlalchemy import or_, func, and_
 from datetime import datetime
 import unicodedata
@@ -223,7 +224,7 @@ def descargar_multiples():
         return jsonify({'success': False, 'error': 'No se encontraron protocolos válidos para descargar'}), 404
 
     try:
-        from weasyprint import HTML  # Importar aquí para evitar fallos en el arranque
+        import weasyprint  # noqa: F401 - Importar aquí para evitar fallos en el arranque
     except Exception as exc:
         return jsonify({
             'success': False,
@@ -233,12 +234,15 @@ def descargar_multiples():
 
     try:
         zip_buffer = io.BytesIO()
+        # Contextos de todos los protocolos con una cantidad fija de consultas
+        contextos = construir_contextos_reporte([p.protocolo_id for p in protocolos])
         with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
             for protocolo in protocolos:
-                contexto = construir_contexto_reporte(protocolo.protocolo_id)
+                contexto = contextos[protocolo.protocolo_id]
                 html = render_template('plantillas_dinamicas/reporte_unificado.html', **contexto)
                 try:
-                    pdf_bytes = HTML(string=html, base_url=request.url_root).write_pdf()
+                    pdf_bytes = obtener_pdf(protocolo.protocolo_id, html, request.url_root,
+                                            origen='portal_descarga_multiple')
                 except Exception as pdf_error:
                     return jsonify({
                         'success': False,
@@ -12,8 +12,10 @@ from models.auditoria import Auditoria
 from models.entidad import usuario_prestador
 from models.usuario import Usuario
 from utils.decorators import permission_required
+from utils.exportacion import formato_solicitado, iterar_query, respuesta_exportacion
 from datetime import datetime, date
 from sqlalchemy import or_, and_, desc, asc, text, func
+from sqlalchemy.orm import aliased
 import unicodedata
 import logging
 
@@ -160,6 +162,25 @@ def _es_usuario_medico():
     return 'medico' in normalizado if normalizado else False
 
 
+def _encolar_notificaciones(protocolo):
+    """Encolar las notificaciones de protocolo completado (sin commit)"""
+    try:
+        from services.notificaciones import NotificacionesService
+        NotificacionesService.enviar_notificacion_protocolo_completado(protocolo)
+    except Exception as e:
+        logger.error(f"Error encolando notificaciones para protocolo {protocolo.protocolo_id}: {e}")
+        # No fallar la operación si las notificaciones fallan
+
+
+def _encolar_prerender_pdf(protocolo):
+    """Encolar el render en segundo plano del PDF final (después del commit)"""
+    try:
+        from services.informes_pdf import encolar_prerender
+        encolar_prerender([protocolo.protocolo_id])
+    except Exception as e:
+        logger.error(f"Error encolando el PDF del protocolo {protocolo.protocolo_id}: {e}")
+
+
 @bp.route('/')
 @login_required
 @permission_required('protocolos_ver')
@@ -202,6 +223,38 @@ def index():
     # Ordenamiento por fecha de ingreso (más reciente primero)
     query = query.order_by(desc(Protocolo.fecha_ingreso), desc(Protocolo.protocolo_id))
     
+    formato = formato_solicitado(request)
+    if formato:
+        # Solo columnas: evita cargar entidades y relaciones fila por fila
+        UsuarioInforme = aliased(Usuario)
+        query_exportacion = query.outerjoin(
+            UsuarioInforme, Protocolo.usuario_informe_id == UsuarioInforme.usuario_id
+        ).with_entities(
+            Protocolo.numero_protocolo,
+            Protocolo.tipo_estudio,
+            Afiliado.apellido,
+            Afiliado.nombre,
+            Afiliado.numero_documento,
+            Prestador.apellido,
+            Prestador.nombre,
+            Protocolo.obra_social_nombre,
+            Protocolo.fecha_ingreso,
+            Protocolo.fecha_informe,
+            UsuarioInforme.nombre_completo,
+            Protocolo.estado
+        )
+        filas = (
+            (numero, tipo_estudio, f"{af_apellido}, {af_nombre}", documento,
+             f"{pr_apellido}, {pr_nombre}" if pr_apellido else '', obra_social,
+             fecha_ingreso, fecha_informe, informado_por, estado_protocolo)
+            for (numero, tipo_estudio, af_apellido, af_nombre, documento, pr_apellido, pr_nombre,
+                 obra_social, fecha_ingreso, fecha_informe, informado_por, estado_protocolo)
+            in iterar_query(query_exportacion)
+        )
+        columnas = ['Protocolo', 'Tipo', 'Paciente', 'Documento', 'Prestador', 'Obra Social',
+                    'F. Ingreso', 'F. Informe', 'Informado por', 'Estado']
+        return respuesta_exportacion('Protocolos', columnas, filas, formato)
+    
     # Paginación
     protocolos = query.paginate(
         page=page, 
@@ -335,6 +388,12 @@ def crear():
         )
         
         db.session.add(protocolo)
+        
+        # Encolar notificaciones en la misma transacción que el alta completada
+        if marcar_completado:
+            db.session.flush()
+            _encolar_notificaciones(protocolo)
+        
         db.session.commit()
         
         # Registrar auditoría
@@ -357,13 +416,7 @@ def crear():
                 ip_address=request.remote_addr
             )
             
-            # Enviar notificaciones cuando se completa el protocolo
-            try:
-                from services.notificaciones import NotificacionesService
-                NotificacionesService.enviar_notificacion_protocolo_completado(protocolo)
-            except Exception as e:
-                logger.error(f"Error enviando notificaciones para protocolo {protocolo.protocolo_id}: {e}")
-                # No fallar la operación si las notificaciones fallan
+            _encolar_prerender_pdf(protocolo)
             
             flash(f'Protocolo {numero_protocolo} creado y completado correctamente.', 'success')
         else:
@@ -506,6 +559,10 @@ def actualizar(id):
             # Si desmarcan urgente, cambiar a EN_PROCESO
             protocolo.estado = 'EN_PROCESO'
         
+        # Encolar notificaciones en la misma transacción que el cambio a COMPLETADO
+        if marcar_completado and estado_anterior != 'COMPLETADO':
+            _encolar_notificaciones(protocolo)
+        
         db.session.commit()
         
         # Registrar auditoría
@@ -527,18 +584,11 @@ def actualizar(id):
                 descripcion=f'Protocolo {protocolo.numero_protocolo}: {estado_anterior} → COMPLETADO',
                 ip_address=request.remote_addr
             )
-            
-            # Enviar notificaciones cuando se completa el protocolo
-            try:
-                from services.notificaciones import NotificacionesService
-                NotificacionesService.enviar_notificacion_protocolo_completado(protocolo)
-            except Exception as e:
-                logger.error(f"Error enviando notificaciones para protocolo {protocolo.protocolo_id}: {e}")
-                # No fallar la operación si las notificaciones fallan
         
         mensaje = 'Protocolo actualizado correctamente.'
         if marcar_completado and estado_anterior != 'COMPLETADO':
             mensaje = 'Protocolo actualizado y completado correctamente.'
+            _encolar_prerender_pdf(protocolo)
         flash(mensaje, 'success')
         
         return redirect(url_for('protocolos.ver', id=id))
@@ -588,6 +638,9 @@ def cambiar_estado(id):
             ip_address=request.remote_addr
         )
         
+        if nuevo_estado == 'COMPLETADO' and estado_anterior != 'COMPLETADO':
+            _encolar_prerender_pdf(protocolo)
+        
         flash(f'Estado cambiado a {nuevo_estado}.', 'success')
         
     except Exception as e:
@@ -6,15 +6,37 @@ from flask_login import login_required
 from extensions import db
 from models.protocolo import Protocolo
 from models.paciente import Afiliado
-from models.prestador import Prestador
+from models.prestador import Prestador, Especialidad
 from models.obra_social import ObraSocial
 from sqlalchemy import func, desc
 from datetime import datetime, timedelta, date
 from utils.decorators import permission_required
+from utils.exportacion import formato_solicitado, iterar_query, respuesta_exportacion
 
 bp = Blueprint('reportes', __name__, url_prefix='/reportes')
 
 
+def _exportar_prestadores(nombre, query, formato):
+    """Exportar un reporte de (Prestador, cantidad) sin cargar la lista completa"""
+    # La especialidad va en la misma consulta (join explícito; yield_per no admite selectinload)
+    query = query.outerjoin(
+        Especialidad, Especialidad.especialidad_id == Prestador.especialidad_id
+    ).add_columns(Especialidad.nombre).group_by(Especialidad.especialidad_id)
+    filas = (
+        (prestador.nombre_completo, prestador.numero_matricula,
+         especialidad or prestador.especialidad_otra or 'Sin especialidad', cantidad)
+        for prestador, cantidad, especialidad in iterar_query(query)
+    )
+    return respuesta_exportacion(nombre, ['Prestador', 'Matrícula', 'Especialidad', 'Protocolos'], filas, formato)
+
+
+def _exportar_distribucion(nombre, titulo, resultados, formato):
+    """Exportar una distribución (valor, cantidad) con su porcentaje"""
+    total = sum(cantidad for _, cantidad in resultados) or 1
+    filas = ((valor, cantidad, round(cantidad * 100 / total, 1)) for valor, cantidad in resultados)
+    return respuesta_exportacion(nombre, [titulo, 'Cantidad', 'Porcentaje'], filas, formato)
+
+
 @bp.route('/')
 @login_required
 @permission_required('reportes_ver')
@@ -52,9 +74,25 @@ def pacientes():
             )
         )
     
-    resultados = query.order_by(desc(func.count(Protocolo.protocolo_id)), Afiliado.apellido).paginate(
-        page=page, per_page=50, error_out=False
-    )
+    query = query.order_by(desc(func.count(Protocolo.protocolo_id)), Afiliado.apellido)
+    
+    formato = formato_solicitado(request)
+    if formato:
+        # La obra social va en la misma consulta (join explícito; yield_per no admite selectinload)
+        query_exportacion = query.outerjoin(
+            ObraSocial, ObraSocial.obra_social_id == Afiliado.obra_social_id
+        ).add_columns(ObraSocial.nombre).group_by(ObraSocial.obra_social_id)
+        filas = (
+            (paciente.nombre_completo,
+             f"{paciente.tipo_documento or ''} {paciente.numero_documento or ''}".strip(),
+             paciente.edad,
+             obra_social or '',
+             cantidad)
+            for paciente, cantidad, obra_social in iterar_query(query_exportacion)
+        )
+        return respuesta_exportacion('Pacientes', ['Paciente', 'Documento', 'Edad', 'Obra Social', 'Protocolos'], filas, formato)
+    
+    resultados = query.paginate(page=page, per_page=50, error_out=False)
     
     return render_template('reportes/pacientes.html', resultados=resultados, buscar=buscar)
 
@@ -90,9 +128,13 @@ def prestadores():
             )
         )
     
-    resultados = query.order_by(desc(func.count(Protocolo.protocolo_id)), Prestador.apellido).paginate(
-        page=page, per_page=50, error_out=False
-    )
+    query = query.order_by(desc(func.count(Protocolo.protocolo_id)), Prestador.apellido)
+    
+    formato = formato_solicitado(request)
+    if formato:
+        return _exportar_prestadores('Prestadores', query, formato)
+    
+    resultados = query.paginate(page=page, per_page=50, error_out=False)
     
     return render_template('reportes/prestadores.html', resultados=resultados, buscar=buscar)
 
@@ -122,9 +164,17 @@ def obras_sociales():
             ObraSocial.nombre.ilike(f'%{buscar}%')
         )
     
-    resultados = query.order_by(desc(func.count(Protocolo.protocolo_id)), ObraSocial.nombre).paginate(
-        page=page, per_page=50, error_out=False
-    )
+    query = query.order_by(desc(func.count(Protocolo.protocolo_id)), ObraSocial.nombre)
+    
+    formato = formato_solicitado(request)
+    if formato:
+        filas = (
+            (obra_social.nombre, obra_social.codigo, cantidad)
+            for obra_social, cantidad in iterar_query(query)
+        )
+        return respuesta_exportacion('Obras_Sociales', ['Obra Social', 'Código', 'Protocolos'], filas, formato)
+    
+    resultados = query.paginate(page=page, per_page=50, error_out=False)
     
     return render_template('reportes/obras_sociales.html', resultados=resultados, buscar=buscar)
 
@@ -141,6 +191,10 @@ def protocolos_por_tipo():
         Protocolo.es_prueba == False
     ).group_by(Protocolo.tipo_estudio).all()
     
+    formato = formato_solicitado(request)
+    if formato:
+        return _exportar_distribucion('Protocolos_Por_Tipo', 'Tipo de Estudio', resultados, formato)
+    
     return render_template('reportes/protocolos_por_tipo.html', resultados=resultados)
 
 
@@ -156,6 +210,10 @@ def protocolos_por_estado():
         Protocolo.es_prueba == False
     ).group_by(Protocolo.estado).all()
     
+    formato = formato_solicitado(request)
+    if formato:
+        return _exportar_distribucion('Protocolos_Por_Estado', 'Estado', resultados, formato)
+    
     return render_template('reportes/protocolos_por_estado.html', resultados=resultados)
 
 
@@ -188,6 +246,12 @@ def protocolos_por_periodo():
         except ValueError:
             pass
     
+    formato = formato_solicitado(request)
+    if formato:
+        # La exportación no se limita a los últimos 90 días
+        filas = ((fecha, cantidad) for fecha, cantidad in iterar_query(query.order_by(desc('fecha'))))
+        return respuesta_exportacion('Protocolos_Por_Periodo', ['Fecha', 'Cantidad'], filas, formato)
+    
     resultados_raw = query.order_by(desc('fecha')).limit(90).all()  # Últimos 90 días
     
     # Convertir fechas string a objetos date
@@ -226,7 +290,7 @@ def protocolos_por_prestador():
     page = request.args.get('page', 1, type=int)
     
     # Top 50 prestadores con más protocolos (excluir protocolos de prueba)
-    resultados = db.session.query(
+    query = db.session.query(
         Prestador,
         func.count(Protocolo.protocolo_id).label('cantidad_protocolos')
     ).join(
@@ -236,10 +300,14 @@ def protocolos_por_prestador():
         Protocolo.es_prueba == False
     ).group_by(Prestador.prestador_id).order_by(
         desc(func.count(Protocolo.protocolo_id))
-    ).paginate(
-        page=page, per_page=50, error_out=False
     )
     
+    formato = formato_solicitado(request)
+    if formato:
+        return _exportar_prestadores('Protocolos_Por_Prestador', query, formato)
+    
+    resultados = query.paginate(page=page, per_page=50, error_out=False)
+    
     return render_template('reportes/protocolos_por_prestador.html', resultados=resultados)
 
 
@@ -248,9 +316,24 @@ def protocolos_por_prestador():
 @permission_required('reportes_avanzados')
 def facturacion_obra_social():
     """Reporte de facturación por obra social"""
-    # Por ahora, solo muestra un placeholder
-    # TODO: Implementar lógica de facturación cuando esté disponible
-    return render_template('reportes/facturacion_obra_social.html')
+    from services.facturacion import calcular_facturacion, resumen_por_obra_social, parsear_rango
+    
+    desde, hasta = parsear_rango(request.args.get('fecha_desde'), request.args.get('fecha_hasta'))
+    resultados = resumen_por_obra_social(calcular_facturacion(desde, hasta))
+    
+    formato = formato_solicitado(request)
+    if formato:
+        filas = ((r['obra_social_nombre'], r['obra_social_codigo'], r['plan_nombre'], r['cantidad'], r['importe'])
+                 for r in resultados)
+        return respuesta_exportacion('Facturacion_Obra_Social',
+                                     ['Obra Social', 'Código', 'Plan', 'Protocolos', 'Importe'], filas, formato)
+    
+    return render_template('reportes/facturacion_obra_social.html',
+                         resultados=resultados,
+                         total_cantidad=sum(r['cantidad'] for r in resultados),
+                         total_importe=round(sum(r['importe'] for r in resultados), 2),
+                         fecha_desde=desde.strftime('%Y-%m-%d'),
+                         fecha_hasta=hasta.strftime('%Y-%m-%d'))
 
 
 @bp.route('/facturacion_periodo')
@@ -258,9 +341,25 @@ def facturacion_obra_social():
 @permission_required('reportes_avanzados')
 def facturacion_periodo():
     """Reporte de facturación por período"""
-    # Por ahora, solo muestra un placeholder
-    # TODO: Implementar lógica de facturación cuando esté disponible
-    return render_template('reportes/facturacion_periodo.html')
+    from services.facturacion import calcular_facturacion, resumen_por_periodo, parsear_rango
+    
+    desde, hasta = parsear_rango(request.args.get('fecha_desde'), request.args.get('fecha_hasta'))
+    resultados = resumen_por_periodo(calcular_facturacion(desde, hasta))
+    
+    formato = formato_solicitado(request)
+    if formato:
+        filas = ((f"{r['mes']:02d}/{r['anio']}", r['por_tipo'].get('BIOPSIA', 0), r['por_tipo'].get('CITOLOGIA', 0),
+                  r['por_tipo'].get('PAP', 0), r['cantidad'], r['importe'])
+                 for r in resultados)
+        return respuesta_exportacion('Facturacion_Periodo',
+                                     ['Período', 'Biopsias', 'Citologías', 'PAP', 'Protocolos', 'Importe'], filas, formato)
+    
+    return render_template('reportes/facturacion_periodo.html',
+                         resultados=resultados,
+                         total_cantidad=sum(r['cantidad'] for r in resultados),
+                         total_importe=round(sum(r['importe'] for r in resultados), 2),
+                         fecha_desde=desde.strftime('%Y-%m-%d'),
+                         fecha_hasta=hasta.strftime('%Y-%m-%d'))
 
 
 @bp.route('/estadisticas_contables')
@@ -268,6 +367,18 @@ def facturacion_periodo():
 @permission_required('reportes_avanzados')
 def estadisticas_contables():
     """Reporte de estadísticas contables"""
-    # Por ahora, solo muestra un placeholder
-    # TODO: Implementar lógica contable cuando esté disponible
-    return render_template('reportes/estadisticas_contables.html')
+    from services.facturacion import calcular_facturacion, estadisticas_contables as calcular_estadisticas, parsear_rango
+    
+    desde, hasta = parsear_rango(request.args.get('fecha_desde'), request.args.get('fecha_hasta'))
+    estadisticas = calcular_estadisticas(calcular_facturacion(desde, hasta))
+    
+    formato = formato_solicitado(request)
+    if formato:
+        filas = ((t['tipo_estudio'], t['cantidad'], t['importe'], t['porcentaje']) for t in estadisticas['por_tipo'])
+        return respuesta_exportacion('Estadisticas_Contables',
+                                     ['Tipo de Estudio', 'Cantidad', 'Importe', '% del total'], filas, formato)
+    
+    return render_template('reportes/estadisticas_contables.html',
+                         estadisticas=estadisticas,
+                         fecha_desde=desde.strftime('%Y-%m-%d'),
+                         fecha_hasta=hasta.strftime('%Y-%m-%d'))
@@ -34,12 +34,16 @@ def permission_required(permission):
 def modal_plantillas():
     """Modal para selección de plantillas categorizadas"""
     
-    # Obtener todas las secciones con sus líneas
+    # Obtener todas las secciones y todas sus líneas en una sola consulta
     secciones = SeccionPlantilla.query.order_by(SeccionPlantilla.orden).all()
     
+    lineas_por_seccion = {}
+    for linea in LineaPlantilla.query.order_by(LineaPlantilla.seccion_id, LineaPlantilla.linea_id).all():
+        lineas_por_seccion.setdefault(linea.seccion_id, []).append(linea)
+    
     secciones_data = []
     for seccion in secciones:
-        lineas = LineaPlantilla.query.filter_by(seccion_id=seccion.seccion_id).all()
+        lineas = lineas_por_seccion.get(seccion.seccion_id, [])
         
         secciones_data.append({
             'seccion_id': seccion.seccion_id,
@@ -50,7 +54,7 @@ def modal_plantillas():
             'lineas': [{
                 'linea_id': linea.linea_id,
                 'texto': linea.texto,
-                'codigo': linea.codigo
+                'codigo': f"L{linea.linea_id}"  # LineaPlantilla no tiene código propio
             } for linea in lineas]
         })
     
@@ -85,9 +89,15 @@ def buscar_plantillas():
         LineaPlantilla.texto.ilike(f'%{termino}%')
     ).all()
     
+    # Secciones de los resultados en una sola consulta
+    ids_secciones = {linea.seccion_id for linea in lineas}
+    secciones = {s.seccion_id: s for s in SeccionPlantilla.query.filter(
+        SeccionPlantilla.seccion_id.in_(ids_secciones)
+    ).all()} if ids_secciones else {}
+    
     resultados = []
     for linea in lineas:
-        seccion = SeccionPlantilla.query.get(linea.seccion_id)
+        seccion = secciones[linea.seccion_id]
         resultados.append({
             'linea_id': linea.linea_id,
             'texto': linea.texto,
@@ -101,6 +111,24 @@ def buscar_plantillas():
     
     return jsonify({'resultados': resultados})
 
+@bp.route('/autocompletar')
+@login_required
+def autocompletar():
+    """
+    Completar la línea que se está escribiendo con frases del corpus de plantillas
+
+    Parámetros: q (texto escrito, se buscan prefijos de palabras), tipo (PAP,
+    BIOPSIA, ...; opcional), limite (1-20, por defecto 8)
+    """
+    from services.autocompletado_lineas import completar
+    
+    consulta = request.args.get('q', '').strip()
+    if not consulta:
+        return jsonify({'resultados': []})
+    
+    limite = min(max(request.args.get('limite', 8, type=int), 1), 20)
+    return jsonify({'resultados': completar(consulta, request.args.get('tipo'), limite)})
+
 @bp.route('/obtener_lineas_seccion/<int:seccion_id>')
 @login_required
 def obtener_lineas_seccion(seccion_id):
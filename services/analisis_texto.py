@@ -0,0 +1,59 @@
+"""
+Análisis de texto en castellano para los índices de búsqueda
+
+Plegado de acentos, tokenización, palabras vacías y un stemmer liviano
+(sufijos de plural, género y derivación más comunes en los informes). No busca
+la precisión de Snowball: alcanza con que "carcinomas", "carcinoma" e
+"inflamatorio" / "inflamatoria" / "inflamación" caigan en la misma raíz.
+"""
+import re
+import unicodedata
+
+_PALABRA = re.compile(r'[a-z0-9]+')
+
+PALABRAS_VACIAS = frozenset('''
+a al algo algun alguna algunas alguno algunos ante antes aqui asi aun bajo bien cada
+como con contra cual cuales cuando de del desde donde dos e el ella ellas ellos en entre
+era es esa esas ese eso esos esta estaba estan estas este esto estos fue fueron ha han hasta
+hay la las le les lo los mas me mi muy nada ni no nos o otra otras otro otros para pero poco
+por porque que se sea ser si sin sobre solo son su sus tambien tan tanto te tiene tienen
+todo todos tras tu un una unas uno unos y ya
+'''.split())
+
+# Sufijos a quitar, del más largo al más corto; se aplica el primero que deje
+# una raíz de al menos LARGO_MINIMO_RAIZ letras
+SUFIJOS = (
+    'amientos', 'imientos', 'aciones', 'uciones', 'amiento', 'imiento',
+    'atorias', 'atorios', 'adoras', 'adores', 'ancias', 'encias', 'idades',
+    'acion', 'ucion', 'atoria', 'atorio', 'adora', 'ador', 'ancia', 'encia',
+    'mente', 'idad', 'ismos', 'istas', 'ables', 'ibles', 'iones',
+    'osas', 'osos', 'icas', 'icos', 'ismo', 'ista', 'able', 'ible', 'ion',
+    'osa', 'oso', 'ica', 'ico', 'es', 'as', 'os', 'a', 'o', 'e', 's',
+)
+LARGO_MINIMO_RAIZ = 4
+
+
+def plegar(texto):
+    """Minúsculas y sin acentos ("Displasia LEVE, cérvix" -> "displasia leve, cervix")"""
+    descompuesto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c))
+
+
+def raiz(palabra):
+    """Raíz de una palabra ya plegada"""
+    if len(palabra) <= LARGO_MINIMO_RAIZ or palabra.isdigit():
+        return palabra
+    for sufijo in SUFIJOS:
+        if palabra.endswith(sufijo) and len(palabra) - len(sufijo) >= LARGO_MINIMO_RAIZ:
+            return palabra[:-len(sufijo)]
+    return palabra
+
+
+def palabras(texto):
+    """Palabras plegadas en orden, incluidas las vacías"""
+    return _PALABRA.findall(plegar(texto))
+
+
+def terminos(texto):
+    """Raíces de las palabras significativas del texto, en orden (con repeticiones)"""
+    return [raiz(p) for p in palabras(texto) if len(p) >= 2 and p not in PALABRAS_VACIAS]
@@ -1,221 +1,548 @@
 """
 Herramientas (tools) para que el asistente pueda consultar la base de datos
+
+Cada herramienta corre sobre una conexión propia (no la sesión del request) en
+modo solo lectura y con un tiempo límite por consulta:
+
+- SQLite: PRAGMA query_only y un progress handler que interrumpe la consulta
+- PostgreSQL: transacción READ ONLY con statement_timeout
+- MySQL: transacción READ ONLY con max_execution_time
+
+Los resultados se cachean ASISTENTE_TOOLS_CACHE_TTL segundos por herramienta y
+argumentos. Todas las consultas están acotadas: límites de filas entre 1 y
+ASISTENTE_TOOLS_MAX_FILAS y rangos de fechas de hasta ASISTENTE_TOOLS_MAX_DIAS
+(por defecto, los últimos 12 meses). Los diagnósticos frecuentes se responden
+con las tablas de frecuencias mantenidas (services/frecuencias_diagnostico).
+
+ejecutar_herramientas() corre en paralelo, en un pool de ASISTENTE_TOOLS_HILOS
+hilos, las herramientas pedidas en una misma respuesta del modelo.
 """
-from typing import Dict, List, Any
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import select, func, desc, distinct
+from sqlalchemy.exc import OperationalError, DBAPIError
+
 from extensions import db
 from models.protocolo import Protocolo
 from models.paciente import Afiliado
-from models.prestador import Prestador
-from models.obra_social import ObraSocial
-from sqlalchemy import func, desc, distinct
-import logging
+from models.prestador import Prestador, Especialidad
+from services import metricas
+from services.catalogo_plantillas import normalizar_tipo
+from utils import config_app
 
 logger = logging.getLogger(__name__)
 
+TIEMPO_LIMITE_MS = 2000
+CACHE_TTL = 60
+MAX_FILAS = 50
+MAX_DIAS = 366
+MAX_ENTRADAS_CACHE = 256
+HILOS = 4
+# Tope de filas leídas para calcular percentiles de tiempos de respuesta
+MAX_FILAS_CALCULO = 200000
+
+P = Protocolo.__table__
+A = Afiliado.__table__
+PR = Prestador.__table__
+E = Especialidad.__table__
+
+
+class TiempoLimiteExcedido(Exception):
+    """La consulta de una herramienta superó el tiempo límite"""
 
-def obtener_top_prestadores_por_pacientes(limite: int = 10) -> Dict[str, Any]:
+    def __init__(self, limite_ms):
+        super().__init__(f'La consulta superó el tiempo límite de {limite_ms / 1000:g} s; '
+                         f'probá con un rango de fechas más corto')
+        self.limite_ms = limite_ms
+
+
+
+# ---------------------------------------------------------------------------
+# Conexión de solo lectura con tiempo límite
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def conexion_solo_lectura(limite_ms: Optional[int] = None):
+    """
+    Conexión del pool en modo solo lectura con tiempo límite por consulta.
+
+    Raises:
+        TiempoLimiteExcedido: Si una consulta supera el límite
     """
-    Obtener los prestadores con más pacientes únicos
-    
+    limite_ms = limite_ms or config_app('ASISTENTE_TOOLS_TIMEOUT_MS', TIEMPO_LIMITE_MS)
+    dialecto = db.engine.dialect.name
+    with db.engine.connect() as conexion:
+        crudo = conexion.connection.dbapi_connection
+        if dialecto == 'sqlite':
+            # Se evalúa cada 1000 instrucciones de la VM; devolver True interrumpe
+            vence = time.monotonic() + limite_ms / 1000
+            crudo.set_progress_handler(lambda: time.monotonic() > vence, 1000)
+            conexion.exec_driver_sql('PRAGMA query_only = ON')
+        elif dialecto == 'postgresql':
+            conexion.exec_driver_sql('SET TRANSACTION READ ONLY')
+            conexion.exec_driver_sql(f'SET LOCAL statement_timeout = {int(limite_ms)}')
+        elif dialecto in ('mysql', 'mariadb'):
+            conexion.exec_driver_sql(f'SET SESSION max_execution_time = {int(limite_ms)}')
+            conexion.exec_driver_sql('SET TRANSACTION READ ONLY')
+        try:
+            yield conexion
+        except (OperationalError, DBAPIError) as e:
+            mensaje = str(getattr(e, 'orig', e)).lower()
+            if 'interrupted' in mensaje or 'statement timeout' in mensaje or 'max_execution_time' in mensaje \
+                    or 'canceling statement' in mensaje:
+                raise TiempoLimiteExcedido(limite_ms) from e
+            raise
+        finally:
+            conexion.rollback()
+            # Devolver la conexión al pool como estaba
+            if dialecto == 'sqlite':
+                crudo.set_progress_handler(None, 0)
+                conexion.exec_driver_sql('PRAGMA query_only = OFF')
+            elif dialecto in ('mysql', 'mariadb'):
+                conexion.exec_driver_sql('SET SESSION max_execution_time = 0')
+
+
+# ---------------------------------------------------------------------------
+# Argumentos acotados
+# ---------------------------------------------------------------------------
+
+def _limite(valor, por_defecto=10):
+    maximo = config_app('ASISTENTE_TOOLS_MAX_FILAS', MAX_FILAS)
+    try:
+        valor = int(valor) if valor is not None else por_defecto
+    except (TypeError, ValueError):
+        valor = por_defecto
+    return min(max(valor, 1), maximo)
+
+
+def _rango(fecha_desde: Optional[str], fecha_hasta: Optional[str]) -> Tuple[date, date]:
+    """Rango de fechas (YYYY-MM-DD) acotado a ASISTENTE_TOOLS_MAX_DIAS; por defecto los últimos 12 meses"""
+    max_dias = config_app('ASISTENTE_TOOLS_MAX_DIAS', MAX_DIAS)
+
+    def parsear(valor):
+        if not valor:
+            return None
+        try:
+            return datetime.strptime(str(valor)[:10], '%Y-%m-%d').date()
+        except ValueError:
+            return None
+
+    hasta = parsear(fecha_hasta) or date.today()
+    desde = parsear(fecha_desde) or hasta - timedelta(days=365)
+    if desde > hasta:
+        desde, hasta = hasta, desde
+    if (hasta - desde).days >= max_dias:
+        desde = hasta - timedelta(days=max_dias - 1)
+    return desde, hasta
+
+
+def _periodo(desde, hasta):
+    return {'fecha_desde': desde.isoformat(), 'fecha_hasta': hasta.isoformat()}
+
+
+def _en_rango(desde, hasta):
+    return [P.c.fecha_ingreso >= desde, P.c.fecha_ingreso <= hasta, P.c.es_prueba.is_(False)]
+
+
+# ---------------------------------------------------------------------------
+# Herramientas
+# ---------------------------------------------------------------------------
+
+def obtener_top_prestadores_por_pacientes(limite: int = 10, fecha_desde: str = None,
+                                          fecha_hasta: str = None) -> Dict[str, Any]:
+    """
+    Obtener los prestadores con más pacientes únicos en un período
+
     Args:
         limite: Número máximo de prestadores a retornar (por defecto 10)
-    
+        fecha_desde, fecha_hasta: Período de ingreso (por defecto los últimos 12 meses)
+
     Returns:
         Dict con lista de prestadores y cantidad de pacientes
     """
-    try:
-        # Contar pacientes únicos por prestador (excluyendo protocolos de prueba)
-        query = db.session.query(
-            Prestador.prestador_id,
-            Prestador.nombre_completo,
-            Prestador.especialidad,
-            func.count(distinct(Protocolo.afiliado_id)).label('cantidad_pacientes')
-        ).join(
-            Protocolo, Prestador.prestador_id == Protocolo.prestador_id
-        ).filter(
-            Protocolo.es_prueba == False,
-            Prestador.activo == True,
-            Prestador.es_entidad == False  # Solo prestadores médicos, no entidades
-        ).group_by(
-            Prestador.prestador_id,
-            Prestador.nombre_completo,
-            Prestador.especialidad
-        ).order_by(
-            desc('cantidad_pacientes')
-        ).limit(limite).all()
-        
-        resultado = []
-        for prestador_id, nombre, especialidad, cantidad in query:
-            resultado.append({
-                'prestador_id': prestador_id,
-                'nombre': nombre,
-                'especialidad': especialidad or 'Sin especialidad',
-                'cantidad_pacientes': cantidad
-            })
-        
-        return {
-            'success': True,
-            'prestadores': resultado,
-            'total': len(resultado)
-        }
-    except Exception as e:
-        logger.error(f"Error obteniendo top prestadores: {e}", exc_info=True)
-        return {
-            'success': False,
-            'error': str(e),
-            'prestadores': []
-        }
+    limite = _limite(limite)
+    desde, hasta = _rango(fecha_desde, fecha_hasta)
+    # Agrupar primero por prestador_id (índice) y recién después traer nombre y especialidad
+    por_prestador = select(
+        P.c.prestador_id, func.count(distinct(P.c.afiliado_id)).label('cantidad_pacientes')
+    ).where(*_en_rango(desde, hasta)).group_by(P.c.prestador_id).subquery()
+    consulta = select(
+        PR.c.prestador_id, PR.c.apellido, PR.c.nombre, func.coalesce(E.c.nombre, PR.c.especialidad_otra),
+        por_prestador.c.cantidad_pacientes
+    ).join(por_prestador, por_prestador.c.prestador_id == PR.c.prestador_id).outerjoin(
+        E, E.c.especialidad_id == PR.c.especialidad_id
+    ).where(
+        PR.c.activo.is_(True),
+        PR.c.es_entidad.is_(False)  # Solo prestadores médicos, no entidades
+    ).order_by(desc(por_prestador.c.cantidad_pacientes), PR.c.prestador_id).limit(limite)
+
+    with conexion_solo_lectura() as conexion:
+        filas = conexion.execute(consulta).all()
 
+    resultado = [{
+        'prestador_id': prestador_id,
+        'nombre': f"{apellido}, {nombre}",
+        'especialidad': especialidad or 'Sin especialidad',
+        'cantidad_pacientes': cantidad
+    } for prestador_id, apellido, nombre, especialidad, cantidad in filas]
+    return {'success': True, 'prestadores': resultado, 'total': len(resultado), 'periodo': _periodo(desde, hasta)}
 
-def obtener_pacientes_con_multiples_protocolos(min_protocolos: int = 2) -> Dict[str, Any]:
+
+def obtener_pacientes_con_multiples_protocolos(min_protocolos: int = 2, limite: int = 20, fecha_desde: str = None,
+                                               fecha_hasta: str = None) -> Dict[str, Any]:
     """
-    Obtener pacientes que tienen más de un protocolo
-    
+    Obtener pacientes que tienen más de un protocolo en un período
+
     Args:
         min_protocolos: Número mínimo de protocolos que debe tener el paciente (por defecto 2)
-    
+        limite: Número máximo de pacientes a retornar (por defecto 20)
+        fecha_desde, fecha_hasta: Período de ingreso (por defecto los últimos 12 meses)
+
     Returns:
         Dict con lista de pacientes y cantidad de protocolos
     """
     try:
-        query = db.session.query(
-            Afiliado.afiliado_id,
-            Afiliado.nombre,
-            Afiliado.numero_documento,
-            func.count(Protocolo.protocolo_id).label('cantidad_protocolos')
-        ).join(
-            Protocolo, Afiliado.afiliado_id == Protocolo.afiliado_id
-        ).filter(
-            Protocolo.es_prueba == False,
-            Afiliado.activo == True
-        ).group_by(
-            Afiliado.afiliado_id,
-            Afiliado.nombre,
-            Afiliado.numero_documento
-        ).having(
-            func.count(Protocolo.protocolo_id) >= min_protocolos
-        ).order_by(
-            desc('cantidad_protocolos')
-        ).all()
-        
-        resultado = []
-        for afiliado_id, nombre, documento, cantidad in query:
-            resultado.append({
-                'paciente_id': afiliado_id,
-                'nombre': nombre,
-                'documento': documento or 'Sin documento',
-                'cantidad_protocolos': cantidad
-            })
-        
-        return {
-            'success': True,
-            'pacientes': resultado,
-            'total': len(resultado)
-        }
-    except Exception as e:
-        logger.error(f"Error obteniendo pacientes con múltiples protocolos: {e}", exc_info=True)
-        return {
-            'success': False,
-            'error': str(e),
-            'pacientes': []
-        }
+        min_protocolos = max(int(min_protocolos), 2)
+    except (TypeError, ValueError):
+        min_protocolos = 2
+    limite = _limite(limite, 20)
+    desde, hasta = _rango(fecha_desde, fecha_hasta)
+    cantidad = func.count(P.c.protocolo_id).label('cantidad_protocolos')
+    # Agrupar primero por afiliado_id (índice) y recién después traer los datos del paciente
+    por_afiliado = select(P.c.afiliado_id, cantidad).where(*_en_rango(desde, hasta)).group_by(
+        P.c.afiliado_id
+    ).having(func.count(P.c.protocolo_id) >= min_protocolos).subquery()
+    consulta = select(
+        A.c.afiliado_id, A.c.apellido, A.c.nombre, A.c.numero_documento, por_afiliado.c.cantidad_protocolos
+    ).join(por_afiliado, por_afiliado.c.afiliado_id == A.c.afiliado_id).where(
+        A.c.activo.is_(True)
+    ).order_by(desc(por_afiliado.c.cantidad_protocolos), A.c.afiliado_id).limit(limite)
+
+    with conexion_solo_lectura() as conexion:
+        filas = conexion.execute(consulta).all()
+
+    resultado = [{
+        'paciente_id': afiliado_id,
+        'nombre': f"{apellido}, {nombre}",
+        'documento': documento or 'Sin documento',
+        'cantidad_protocolos': total
+    } for afiliado_id, apellido, nombre, documento, total in filas]
+    return {'success': True, 'pacientes': resultado, 'total': len(resultado), 'periodo': _periodo(desde, hasta)}
 
 
-def obtener_estadisticas_protocolos() -> Dict[str, Any]:
+def obtener_estadisticas_protocolos(fecha_desde: str = None, fecha_hasta: str = None) -> Dict[str, Any]:
     """
     Obtener estadísticas generales de protocolos
-    
+
+    Sin fechas cuenta todos los protocolos (conteos por columnas indexadas);
+    con fechas, los ingresados en el período.
+
     Returns:
         Dict con estadísticas de protocolos
     """
-    try:
-        # Total de protocolos (excluyendo pruebas)
-        total = Protocolo.query.filter_by(es_prueba=False).count()
-        
-        # Por estado
-        por_estado = db.session.query(
-            Protocolo.estado,
-            func.count(Protocolo.protocolo_id).label('cantidad')
-        ).filter(
-            Protocolo.es_prueba == False
-        ).group_by(
-            Protocolo.estado
-        ).all()
-        
-        estados = {estado: cantidad for estado, cantidad in por_estado}
-        
-        # Por tipo de estudio
-        por_tipo = db.session.query(
-            Protocolo.tipo_estudio,
-            func.count(Protocolo.protocolo_id).label('cantidad')
-        ).filter(
-            Protocolo.es_prueba == False
-        ).group_by(
-            Protocolo.tipo_estudio
-        ).all()
-        
-        tipos = {tipo: cantidad for tipo, cantidad in por_tipo}
-        
-        # Pacientes únicos
-        pacientes_unicos = db.session.query(
-            func.count(distinct(Protocolo.afiliado_id))
-        ).filter(
-            Protocolo.es_prueba == False
+    filtros = [P.c.es_prueba.is_(False)]
+    periodo = None
+    if fecha_desde or fecha_hasta:
+        desde, hasta = _rango(fecha_desde, fecha_hasta)
+        filtros = _en_rango(desde, hasta)
+        periodo = _periodo(desde, hasta)
+
+    with conexion_solo_lectura() as conexion:
+        estados = dict(conexion.execute(
+            select(P.c.estado, func.count()).where(*filtros).group_by(P.c.estado)
+        ).all())
+        tipos = dict(conexion.execute(
+            select(P.c.tipo_estudio, func.count()).where(*filtros).group_by(P.c.tipo_estudio)
+        ).all())
+        pacientes_unicos = conexion.execute(
+            select(func.count(distinct(P.c.afiliado_id))).where(*filtros)
         ).scalar()
-        
-        return {
-            'success': True,
-            'total_protocolos': total,
-            'pacientes_unicos': pacientes_unicos or 0,
-            'por_estado': estados,
-            'por_tipo_estudio': tipos
-        }
-    except Exception as e:
-        logger.error(f"Error obteniendo estadísticas: {e}", exc_info=True)
-        return {
-            'success': False,
-            'error': str(e)
+
+    resultado = {
+        'success': True,
+        'total_protocolos': sum(estados.values()),
+        'pacientes_unicos': pacientes_unicos or 0,
+        'por_estado': estados,
+        'por_tipo_estudio': tipos
+    }
+    if periodo:
+        resultado['periodo'] = periodo
+    return resultado
+
+
+def obtener_protocolos_por_periodo(fecha_desde: str = None, fecha_hasta: str = None,
+                                   agrupar_por: str = 'mes', tipo_estudio: str = None) -> Dict[str, Any]:
+    """
+    Cantidad de protocolos ingresados en un período, agrupados por día, mes,
+    tipo de estudio o estado
+    """
+    desde, hasta = _rango(fecha_desde, fecha_hasta)
+    filtros = _en_rango(desde, hasta)
+    if tipo_estudio:
+        filtros.append(P.c.tipo_estudio == normalizar_tipo(tipo_estudio))
+
+    agrupar_por = agrupar_por if agrupar_por in ('dia', 'mes', 'tipo_estudio', 'estado') else 'mes'
+    if agrupar_por in ('tipo_estudio', 'estado'):
+        consulta = select(P.c[agrupar_por], func.count()).where(*filtros).group_by(P.c[agrupar_por])
+        with conexion_solo_lectura() as conexion:
+            grupos = {str(clave): total for clave, total in conexion.execute(consulta).all()}
+    else:
+        # Agrupar por fecha (índice) y plegar a meses en Python: portable entre motores
+        consulta = select(P.c.fecha_ingreso, func.count()).where(*filtros).group_by(P.c.fecha_ingreso)
+        with conexion_solo_lectura() as conexion:
+            filas = conexion.execute(consulta).all()
+        grupos = defaultdict(int)
+        for fecha, total in filas:
+            if isinstance(fecha, str):
+                fecha = datetime.strptime(fecha[:10], '%Y-%m-%d').date()
+            grupos[fecha.isoformat() if agrupar_por == 'dia' else fecha.strftime('%Y-%m')] += total
+        grupos = dict(sorted(grupos.items()))
+
+    return {
+        'success': True,
+        'agrupado_por': agrupar_por,
+        'grupos': grupos,
+        'total': sum(grupos.values()),
+        'periodo': _periodo(desde, hasta)
+    }
+
+
+def obtener_protocolos_por_obra_social(fecha_desde: str = None, fecha_hasta: str = None, limite: int = 10,
+                                       tipo_estudio: str = None) -> Dict[str, Any]:
+    """
+    Obras sociales con más protocolos en un período (nombre y código al momento
+    del protocolo), con el desglose por tipo de estudio
+    """
+    limite = _limite(limite)
+    desde, hasta = _rango(fecha_desde, fecha_hasta)
+    filtros = _en_rango(desde, hasta)
+    if tipo_estudio:
+        filtros.append(P.c.tipo_estudio == normalizar_tipo(tipo_estudio))
+    consulta = select(
+        P.c.obra_social_codigo, P.c.obra_social_nombre, P.c.tipo_estudio, func.count()
+    ).where(*filtros).group_by(P.c.obra_social_codigo, P.c.obra_social_nombre, P.c.tipo_estudio)
+
+    with conexion_solo_lectura() as conexion:
+        filas = conexion.execute(consulta).all()
+
+    por_obra = {}
+    for codigo, nombre, tipo, total in filas:
+        obra = por_obra.setdefault((codigo, nombre), {
+            'codigo': codigo or '', 'nombre': nombre or 'Particular / sin obra social',
+            'cantidad': 0, 'por_tipo_estudio': {}
+        })
+        obra['cantidad'] += total
+        obra['por_tipo_estudio'][tipo] = obra['por_tipo_estudio'].get(tipo, 0) + total
+    obras = sorted(por_obra.values(), key=lambda o: (-o['cantidad'], o['nombre']))
+    return {
+        'success': True,
+        'obras_sociales': obras[:limite],
+        'total_obras_sociales': len(obras),
+        'total_protocolos': sum(o['cantidad'] for o in obras),
+        'periodo': _periodo(desde, hasta)
+    }
+
+
+def obtener_tiempos_respuesta(fecha_desde: str = None, fecha_hasta: str = None,
+                              tipo_estudio: str = None) -> Dict[str, Any]:
+    """
+    Días entre el ingreso y el informe de los protocolos completados en un
+    período, por tipo de estudio (promedio, mediana, percentil 90 y máximo)
+    """
+    desde, hasta = _rango(fecha_desde, fecha_hasta)
+    filtros = _en_rango(desde, hasta) + [P.c.estado == 'COMPLETADO', P.c.fecha_informe.isnot(None)]
+    if tipo_estudio:
+        filtros.append(P.c.tipo_estudio == normalizar_tipo(tipo_estudio))
+    consulta = select(P.c.tipo_estudio, P.c.fecha_ingreso, P.c.fecha_informe).where(*filtros).limit(
+        MAX_FILAS_CALCULO
+    )
+
+    with conexion_solo_lectura() as conexion:
+        filas = conexion.execute(consulta).all()
+
+    dias_por_tipo = defaultdict(list)
+    for tipo, ingreso, informe in filas:
+        if isinstance(ingreso, str):
+            ingreso = datetime.strptime(ingreso[:10], '%Y-%m-%d').date()
+        if isinstance(informe, str):
+            informe = datetime.strptime(informe[:10], '%Y-%m-%d').date()
+        dias_por_tipo[tipo].append(max((informe - ingreso).days, 0))
+
+    tipos = {}
+    for tipo, dias in sorted(dias_por_tipo.items()):
+        dias.sort()
+        tipos[tipo] = {
+            'protocolos': len(dias),
+            'promedio_dias': round(sum(dias) / len(dias), 1),
+            'mediana_dias': metricas.percentil(dias, 0.5),
+            'p90_dias': metricas.percentil(dias, 0.9),
+            'maximo_dias': dias[-1]
         }
+    return {
+        'success': True,
+        'por_tipo_estudio': tipos,
+        'truncado': len(filas) >= MAX_FILAS_CALCULO,
+        'periodo': _periodo(desde, hasta)
+    }
+
+
+def obtener_top_diagnosticos(tipo_estudio: str, categoria: str = None, limite: int = 10) -> Dict[str, Any]:
+    """
+    Diagnósticos más frecuentes de los casos históricos por tipo de estudio
+    (tablas de frecuencias mantenidas, variantes de escritura agrupadas)
+    """
+    from services import frecuencias_diagnostico
+
+    with conexion_solo_lectura() as conexion:
+        if not frecuencias_diagnostico.inicializadas(conexion):
+            return {
+                'success': False,
+                'error': 'Las frecuencias de diagnósticos todavía no se calcularon '
+                         '(falta correr flask recalcular-diagnosticos)'
+            }
+        filas = frecuencias_diagnostico.top_diagnosticos(tipo_estudio, categoria, _limite(limite), conexion)
+    return {
+        'success': True,
+        'diagnosticos': [{'diagnostico': texto, 'frecuencia': frecuencia} for texto, frecuencia in filas],
+        'total': len(filas)
+    }
 
 
 # Diccionario de herramientas disponibles
+_FECHAS = {
+    "fecha_desde": {
+        "type": "string",
+        "description": "Fecha de ingreso inicial YYYY-MM-DD (por defecto, 12 meses antes de fecha_hasta; el período máximo es de 366 días)"
+    },
+    "fecha_hasta": {
+        "type": "string",
+        "description": "Fecha de ingreso final YYYY-MM-DD (por defecto, hoy)"
+    }
+}
+_TIPO_ESTUDIO = {
+    "type": "string",
+    "description": "Tipo de estudio: PAP, BIOPSIA o CITOLOGIA (opcional)"
+}
+
 TOOLS = [
     {
         "name": "obtener_top_prestadores_por_pacientes",
-        "description": "Obtiene los prestadores (médicos) con más pacientes únicos. Útil para responder preguntas como '¿cuáles son los 10 prestadores con más pacientes?'",
+        "description": "Obtiene los prestadores (médicos) con más pacientes únicos en un período. Útil para responder preguntas como '¿cuáles son los 10 prestadores con más pacientes?'",
         "input_schema": {
             "type": "object",
             "properties": {
                 "limite": {
                     "type": "integer",
-                    "description": "Número máximo de prestadores a retornar (por defecto 10)"
-                }
+                    "description": "Número máximo de prestadores a retornar (por defecto 10, máximo 50)"
+                },
+                **_FECHAS
             },
             "required": []
         }
     },
     {
         "name": "obtener_pacientes_con_multiples_protocolos",
-        "description": "Obtiene pacientes que tienen más de un protocolo. Útil para responder preguntas como '¿qué pacientes tienen más de un protocolo?'",
+        "description": "Obtiene pacientes que tienen más de un protocolo en un período. Útil para responder preguntas como '¿qué pacientes tienen más de un protocolo?'",
         "input_schema": {
             "type": "object",
             "properties": {
                 "min_protocolos": {
                     "type": "integer",
                     "description": "Número mínimo de protocolos que debe tener el paciente (por defecto 2)"
-                }
+                },
+                "limite": {
+                    "type": "integer",
+                    "description": "Número máximo de pacientes a retornar (por defecto 20, máximo 50)"
+                },
+                **_FECHAS
             },
             "required": []
         }
     },
     {
         "name": "obtener_estadisticas_protocolos",
-        "description": "Obtiene estadísticas generales de protocolos: total, por estado, por tipo de estudio, y cantidad de pacientes únicos",
+        "description": "Obtiene estadísticas generales de protocolos: total, por estado, por tipo de estudio, y cantidad de pacientes únicos. Sin fechas cuenta todos los protocolos",
         "input_schema": {
             "type": "object",
-            "properties": {},
+            "properties": {**_FECHAS},
+            "required": []
+        }
+    },
+    {
+        "name": "obtener_protocolos_por_periodo",
+        "description": "Cantidad de protocolos ingresados en un período agrupados por día, mes, tipo de estudio o estado. Útil para '¿cuántos PAP ingresaron por mes este año?'",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                **_FECHAS,
+                "agrupar_por": {
+                    "type": "string",
+                    "enum": ["dia", "mes", "tipo_estudio", "estado"],
+                    "description": "Agrupación (por defecto mes)"
+                },
+                "tipo_estudio": _TIPO_ESTUDIO
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "obtener_protocolos_por_obra_social",
+        "description": "Obras sociales con más protocolos en un período, con el desglose por tipo de estudio",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                **_FECHAS,
+                "limite": {
+                    "type": "integer",
+                    "description": "Número máximo de obras sociales a retornar (por defecto 10, máximo 50)"
+                },
+                "tipo_estudio": _TIPO_ESTUDIO
+            },
+            "required": []
+        }
+    },
+    {
+        "name": "obtener_tiempos_respuesta",
+        "description": "Tiempo de respuesta (días entre ingreso e informe) de los protocolos completados en un período, por tipo de estudio: promedio, mediana, percentil 90 y máximo",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                **_FECHAS,
+                "tipo_estudio": _TIPO_ESTUDIO
+            },
             "required": []
         }
+    },
+    {
+        "name": "obtener_top_diagnosticos",
+        "description": "Diagnósticos más frecuentes de los casos históricos de un tipo de estudio, opcionalmente de una categoría",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "tipo_estudio": {
+                    "type": "string",
+                    "description": "Tipo de estudio: PAP, BIOPSIA o CITOLOGIA"
+                },
+                "categoria": {
+                    "type": "string",
+                    "description": "Categoría del diagnóstico (opcional)"
+                },
+                "limite": {
+                    "type": "integer",
+                    "description": "Número máximo de diagnósticos (por defecto 10, máximo 50)"
+                }
+            },
+            "required": ["tipo_estudio"]
+        }
     }
 ]
 
@@ -224,18 +551,62 @@ TOOLS = [
 FUNCIONES_IMPLEMENTACIONES = {
     "obtener_top_prestadores_por_pacientes": obtener_top_prestadores_por_pacientes,
     "obtener_pacientes_con_multiples_protocolos": obtener_pacientes_con_multiples_protocolos,
-    "obtener_estadisticas_protocolos": obtener_estadisticas_protocolos
+    "obtener_estadisticas_protocolos": obtener_estadisticas_protocolos,
+    "obtener_protocolos_por_periodo": obtener_protocolos_por_periodo,
+    "obtener_protocolos_por_obra_social": obtener_protocolos_por_obra_social,
+    "obtener_tiempos_respuesta": obtener_tiempos_respuesta,
+    "obtener_top_diagnosticos": obtener_top_diagnosticos
 }
 
+# Propiedades aceptadas por herramienta (se descartan argumentos inventados por el modelo)
+_PARAMETROS = {tool['name']: set(tool['input_schema']['properties']) for tool in TOOLS}
+
+
+# ---------------------------------------------------------------------------
+# Cache de resultados
+# ---------------------------------------------------------------------------
+
+# (herramienta, argumentos en JSON) -> (vence, resultado)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _leer_cache(clave):
+    with _cache_lock:
+        entrada = _cache.get(clave)
+        if entrada is None:
+            return None
+        if entrada[0] < time.monotonic():
+            del _cache[clave]
+            return None
+        _cache.move_to_end(clave)
+        return entrada[1]
+
+
+def _guardar_cache(clave, resultado):
+    ttl = config_app('ASISTENTE_TOOLS_CACHE_TTL', CACHE_TTL)
+    if ttl <= 0:
+        return
+    with _cache_lock:
+        _cache[clave] = (time.monotonic() + ttl, resultado)
+        _cache.move_to_end(clave)
+        while len(_cache) > MAX_ENTRADAS_CACHE:
+            _cache.popitem(last=False)
+
+
+def limpiar_cache():
+    with _cache_lock:
+        _cache.clear()
+
 
 def ejecutar_funcion(nombre_funcion: str, argumentos: Dict[str, Any]) -> Dict[str, Any]:
     """
     Ejecutar una función de consulta a la base de datos
-    
+
     Args:
         nombre_funcion: Nombre de la función a ejecutar
         argumentos: Argumentos para la función
-    
+
     Returns:
         Resultado de la ejecución de la función
     """
@@ -244,15 +615,83 @@ def ejecutar_funcion(nombre_funcion: str, argumentos: Dict[str, Any]) -> Dict[st
             'success': False,
             'error': f'Función {nombre_funcion} no encontrada'
         }
-    
+
+    argumentos = {k: v for k, v in (argumentos or {}).items()
+                  if k in _PARAMETROS[nombre_funcion] and v not in (None, '')}
+    clave = (nombre_funcion, json.dumps(argumentos, sort_keys=True, default=str))
+    cacheado = _leer_cache(clave)
+    metricas.registrar_cache('asistente_tools', cacheado is not None)
+    if cacheado is not None:
+        return cacheado
+
+    inicio = time.monotonic()
     try:
         funcion = FUNCIONES_IMPLEMENTACIONES[nombre_funcion]
         resultado = funcion(**argumentos)
-        return resultado
+    except TiempoLimiteExcedido as e:
+        logger.warning(f"⏱️ Herramienta {nombre_funcion} cortada por tiempo límite ({argumentos})")
+        metricas.incrementar('ldh_asistente_tools_total', herramienta=nombre_funcion, resultado='tiempo_limite')
+        return {
+            'success': False,
+            'error': str(e)
+        }
     except Exception as e:
         logger.error(f"Error ejecutando función {nombre_funcion}: {e}", exc_info=True)
+        metricas.incrementar('ldh_asistente_tools_total', herramienta=nombre_funcion, resultado='error')
         return {
             'success': False,
             'error': str(e)
         }
 
+    metricas.observar('ldh_asistente_tools_segundos', time.monotonic() - inicio, herramienta=nombre_funcion)
+    metricas.incrementar('ldh_asistente_tools_total', herramienta=nombre_funcion, resultado='ok')
+    if resultado.get('success'):
+        _guardar_cache(clave, resultado)
+    return resultado
+
+
+# ---------------------------------------------------------------------------
+# Ejecución concurrente de varias herramientas de una misma respuesta
+# ---------------------------------------------------------------------------
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _ejecutar_en_hilo(app, nombre_funcion, argumentos):
+    """Cada hilo con su app context y, por lo tanto, su propia sesión"""
+    with app.app_context():
+        try:
+            return ejecutar_funcion(nombre_funcion, argumentos)
+        finally:
+            db.session.remove()
+
+
+def ejecutar_herramientas(llamadas: List[Tuple[str, Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Ejecutar en paralelo las herramientas pedidas en una misma respuesta del modelo
+
+    Args:
+        llamadas: [(nombre_funcion, argumentos)]
+
+    Returns:
+        Resultados en el mismo orden que las llamadas
+    """
+    global _executor
+    if len(llamadas) <= 1:
+        return [ejecutar_funcion(nombre, argumentos) for nombre, argumentos in llamadas]
+
+    app = current_app._get_current_object()
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=app.config.get('ASISTENTE_TOOLS_HILOS', HILOS),
+                                           thread_name_prefix='asistente-tools')
+    futuros = [_executor.submit(_ejecutar_en_hilo, app, nombre, argumentos) for nombre, argumentos in llamadas]
+    resultados = []
+    for (nombre, _), futuro in zip(llamadas, futuros):
+        try:
+            resultados.append(futuro.result())
+        except Exception as e:
+            logger.error(f"Error ejecutando función {nombre}: {e}", exc_info=True)
+            resultados.append({'success': False, 'error': str(e)})
+    return resultados
@@ -0,0 +1,473 @@
+"""
+Pipeline de assets estáticos: vendorizados, con huella y precomprimidos
+
+- `flask vendorizar-assets` descarga a static/vendor/ las librerías de VENDOR
+  (Bootstrap, Bootstrap Icons, Font Awesome, jQuery, html2pdf) con sus fuentes;
+  se versionan en el repositorio y dejan de depender de los CDNs. Si falta
+  alguna, `flask construir-assets` falla y el arranque lo registra como error.
+- `flask construir-assets` copia a static/dist/ los archivos de CARPETAS y
+  ARCHIVOS_SUELTOS con el hash del contenido en el nombre
+  (js/asistente_chat.3f9a1c2b7e.js), minificando los propios y reescribiendo las
+  referencias url(...) de los CSS a las copias con huella. Para los de texto
+  escribe además variantes .gz (y .br si está instalado `brotli`). El
+  manifiesto static/dist/manifest.json mapea la ruta original a la generada.
+- `asset_url('js/...')` (compatible con url_for('static', filename=...)) devuelve
+  la ruta con huella si existe el manifiesto; si no, el archivo original. Para
+  una librería sin vendorizar devuelve el CDN mientras ASSETS_CDN_RESPALDO esté
+  activo (lo está por omisión).
+- /static/dist/ se sirve con `Cache-Control: immutable` y la variante
+  precomprimida que acepte el navegador: una visita repetida no pide ningún asset.
+
+La minificación es conservadora y no necesita Node: quita comentarios,
+sangrías, espacios repetidos y líneas vacías, pero respeta los saltos de línea
+(inserción automática de `;`), las cadenas, los template literals y las
+expresiones regulares.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import threading
+
+from flask import current_app, url_for, request, send_from_directory
+
+logger = logging.getLogger(__name__)
+
+CARPETA_DIST = 'dist'
+MANIFIESTO = 'manifest.json'
+CARPETAS = ('css', 'js', 'img', 'vendor')
+ARCHIVOS_SUELTOS = ('Asistente_femenino.riv', 'Asistente_masculino.riv')
+EXTENSIONES_COMPRIMIBLES = {'.js', '.css', '.svg', '.json', '.ttf', '.riv', '.map'}
+MAX_AGE_DIST = 31536000  # un año: los nombres cambian con el contenido
+
+# Ruta en static/ -> URL de origen (versiones fijas)
+VENDOR = {
+    'vendor/bootstrap/css/bootstrap.min.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'vendor/bootstrap/js/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'vendor/bootstrap-icons/bootstrap-icons.css':
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/bootstrap-icons.css',
+    'vendor/bootstrap-icons/fonts/bootstrap-icons.woff2':
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/fonts/bootstrap-icons.woff2',
+    'vendor/bootstrap-icons/fonts/bootstrap-icons.woff':
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.0/font/fonts/bootstrap-icons.woff',
+    'vendor/font-awesome/css/all.min.css':
+        'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css',
+    'vendor/jquery/jquery.min.js':
+        'https://code.jquery.com/jquery-3.7.0.min.js',
+    'vendor/html2pdf/html2pdf.bundle.min.js':
+        'https://cdnjs.cloudflare.com/ajax/libs/html2pdf.js/0.10.1/html2pdf.bundle.min.js',
+}
+for _fuente in ('fa-brands-400', 'fa-regular-400', 'fa-solid-900', 'fa-v4compatibility'):
+    for _extension in ('woff2', 'ttf'):
+        VENDOR[f'vendor/font-awesome/webfonts/{_fuente}.{_extension}'] = \
+            f'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/webfonts/{_fuente}.{_extension}'
+
+mimetypes.add_type('font/woff2', '.woff2')
+mimetypes.add_type('font/woff', '.woff')
+
+# static_folder -> (mtime del manifiesto, contenido)
+_manifiestos = {}
+_manifiestos_lock = threading.Lock()
+
+# Después de estos caracteres o palabras una `/` abre una expresión regular
+_ANTES_DE_REGEX = set('(,=:[!&|?{};+-*%<>~^')
+_PALABRAS_ANTES_DE_REGEX = {'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete',
+                            'void', 'throw', 'case', 'do', 'else', 'yield', 'await'}
+_SOURCE_MAP = re.compile(r'^\s*(//[#@] sourceMappingURL=.*|/\*[#@] sourceMappingURL=.*?\*/)\s*$', re.M)
+_URL_CSS = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+# ---------------------------------------------------------------------------
+# Minificación
+# ---------------------------------------------------------------------------
+
+def _admite_regex(salida):
+    """Si una `/` en esta posición empieza una expresión regular"""
+    texto = ''.join(salida[-40:]).rstrip()
+    if not texto:
+        return True
+    if texto[-1] in _ANTES_DE_REGEX:
+        return True
+    palabra = re.search(r'[A-Za-z_$][\w$]*$', texto)
+    return bool(palabra) and palabra.group(0) in _PALABRAS_ANTES_DE_REGEX
+
+
+def minificar_js(fuente):
+    """Minificar JavaScript sin cambiar su semántica (ver docstring del módulo)"""
+    salida = []
+    n = len(fuente)
+    i = 0
+    # Pila de contextos: 'codigo' o 'template'; en 'codigo' dentro de ${...} se
+    # cuenta la profundidad de llaves para saber cuándo vuelve el template
+    pila = [['codigo', 0]]
+    inicio_linea = True
+
+    def emitir_espacio():
+        if salida and salida[-1] not in (' ', '\n'):
+            salida.append(' ')
+
+    while i < n:
+        c = fuente[i]
+        contexto = pila[-1]
+
+        if contexto[0] == 'template':
+            if c == '\\':
+                salida.append(fuente[i:i + 2])
+                i += 2
+            elif c == '`':
+                salida.append(c)
+                pila.pop()
+                i += 1
+            elif fuente.startswith('${', i):
+                salida.append('${')
+                pila.append(['codigo', 0])
+                i += 2
+            else:
+                salida.append(c)
+                i += 1
+            inicio_linea = False
+            continue
+
+        if c == '\n':
+            while salida and salida[-1] == ' ':
+                salida.pop()
+            if salida and salida[-1] != '\n':
+                salida.append('\n')
+            inicio_linea = True
+            i += 1
+            continue
+        if c in ' \t\r':
+            if not inicio_linea:
+                emitir_espacio()
+            i += 1
+            continue
+        inicio_linea = False
+
+        if fuente.startswith('//', i):
+            fin = fuente.find('\n', i)
+            i = n if fin == -1 else fin
+            continue
+        if fuente.startswith('/*', i):
+            fin = fuente.find('*/', i + 2)
+            fin = n if fin == -1 else fin + 2
+            if '\n' in fuente[i:fin]:
+                while salida and salida[-1] == ' ':
+                    salida.pop()
+                if salida and salida[-1] != '\n':
+                    salida.append('\n')
+                inicio_linea = True
+            else:
+                emitir_espacio()
+            i = fin
+            continue
+
+        if c in '\'"':
+            j = i + 1
+            while j < n and fuente[j] != c and fuente[j] != '\n':
+                j += 2 if fuente[j] == '\\' else 1
+            salida.append(fuente[i:j + 1])
+            i = j + 1
+            continue
+        if c == '`':
+            salida.append(c)
+            pila.append(['template', 0])
+            i += 1
+            continue
+        if c == '/' and _admite_regex(salida):
+            j = i + 1
+            en_clase = False
+            while j < n and fuente[j] != '\n':
+                if fuente[j] == '\\':
+                    j += 2
+                    continue
+                if fuente[j] == '[':
+                    en_clase = True
+                elif fuente[j] == ']':
+                    en_clase = False
+                elif fuente[j] == '/' and not en_clase:
+                    break
+                j += 1
+            j += 1
+            while j < n and (fuente[j].isalpha()):
+                j += 1
+            salida.append(fuente[i:j])
+            i = j
+            continue
+
+        if c == '{':
+            contexto[1] += 1
+        elif c == '}':
+            if contexto[1] == 0 and len(pila) > 1:
+                # Cierre de ${...}: se vuelve al template
+                pila.pop()
+                salida.append(c)
+                i += 1
+                continue
+            contexto[1] -= 1
+        salida.append(c)
+        i += 1
+
+    return ''.join(salida).strip() + '\n'
+
+
+def minificar_css(fuente):
+    """Minificar CSS: comentarios, espacios y el último `;` de cada bloque"""
+    partes = re.split(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')', fuente)
+    resultado = []
+    for indice, parte in enumerate(partes):
+        if indice % 2:
+            resultado.append(parte)  # cadena literal
+            continue
+        parte = re.sub(r'/\*.*?\*/', '', parte, flags=re.S)
+        parte = re.sub(r'\s+', ' ', parte)
+        parte = re.sub(r'\s*([{};,>])\s*', r'\1', parte)
+        parte = re.sub(r'\s*:\s*(?=[^{}]*;|[^{}]*})', ':', parte)
+        parte = parte.replace(';}', '}')
+        resultado.append(parte)
+    return ''.join(resultado).strip() + '\n'
+
+
+# ---------------------------------------------------------------------------
+# Vendorizado
+# ---------------------------------------------------------------------------
+
+class VendorIncompleto(RuntimeError):
+    """Faltan en static/vendor/ librerías de VENDOR"""
+
+
+def vendor_faltante(static_folder):
+    """Rutas de VENDOR que no están en static/"""
+    return sorted(ruta for ruta in VENDOR if not os.path.isfile(os.path.join(static_folder, ruta)))
+
+
+def vendorizar(static_folder, forzar=False):
+    """
+    Descargar las librerías de VENDOR a static/vendor/.
+
+    Returns:
+        Lista de (ruta, bytes descargados); las ya presentes se saltean salvo `forzar`
+    """
+    import requests
+
+    descargadas = []
+    for ruta, origen in VENDOR.items():
+        destino = os.path.join(static_folder, ruta)
+        if os.path.exists(destino) and not forzar:
+            continue
+        respuesta = requests.get(origen, timeout=30)
+        respuesta.raise_for_status()
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with open(destino, 'wb') as f:
+            f.write(respuesta.content)
+        descargadas.append((ruta, len(respuesta.content)))
+    return descargadas
+
+
+# ---------------------------------------------------------------------------
+# Construcción y manifiesto
+# ---------------------------------------------------------------------------
+
+def _archivos_fuente(static_folder):
+    """Rutas (relativas a static/, con /) que entran al pipeline"""
+    rutas = []
+    for carpeta in CARPETAS:
+        raiz = os.path.join(static_folder, carpeta)
+        for directorio, _, archivos in os.walk(raiz):
+            for nombre in archivos:
+                rutas.append(os.path.relpath(os.path.join(directorio, nombre), static_folder).replace(os.sep, '/'))
+    for nombre in ARCHIVOS_SUELTOS:
+        if os.path.isfile(os.path.join(static_folder, nombre)):
+            rutas.append(nombre)
+    # Los CSS al final: sus url(...) apuntan a las copias con huella de lo demás
+    return sorted(rutas, key=lambda r: (r.endswith('.css'), r))
+
+
+def _nombre_con_huella(ruta, contenido):
+    base, extension = posixpath.splitext(ruta)
+    return f'{base}.{hashlib.sha256(contenido).hexdigest()[:10]}{extension}'
+
+
+def _reescribir_urls_css(texto, ruta, manifiesto):
+    """Apuntar los url(...) relativos de un CSS a las copias con huella"""
+    origen = posixpath.dirname(ruta)
+    destino = posixpath.dirname(f'{CARPETA_DIST}/{ruta}')  # la copia queda en la misma carpeta
+
+    def reemplazar(match):
+        comillas, url = match.group(1), match.group(2).strip()
+        if re.match(r'^(data:|[a-z]+:|/|#)', url, re.I):
+            return match.group(0)
+        camino, sufijo = re.match(r'([^?#]*)(.*)', url).groups()
+        referido = posixpath.normpath(posixpath.join(origen, camino))
+        if referido in manifiesto:
+            objetivo = f'{CARPETA_DIST}/{manifiesto[referido]}'
+            sufijo = re.sub(r'^\?[^#]*', '', sufijo)  # la huella reemplaza al ?v=...
+        else:
+            objetivo = referido
+        return f'url({comillas}{posixpath.relpath(objetivo, destino)}{sufijo}{comillas})'
+
+    return _URL_CSS.sub(reemplazar, texto)
+
+
+def _procesar(static_folder, ruta, generados):
+    with open(os.path.join(static_folder, ruta), 'rb') as f:
+        contenido = f.read()
+    if ruta.endswith(('.js', '.css')):
+        texto = _SOURCE_MAP.sub('', contenido.decode('utf-8'))
+        if not ruta.endswith(('.min.js', '.min.css')):
+            texto = minificar_css(texto) if ruta.endswith('.css') else minificar_js(texto)
+        if ruta.endswith('.css'):
+            # Las huellas de lo referido ya están en `generados` y entran en la del CSS
+            texto = _reescribir_urls_css(texto, ruta, generados)
+        contenido = texto.encode('utf-8')
+    return _nombre_con_huella(ruta, contenido), contenido
+
+
+def _escribir(carpeta_dist, ruta_generada, contenido):
+    destino = os.path.join(carpeta_dist, ruta_generada)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    with open(destino, 'wb') as f:
+        f.write(contenido)
+    escritos = [ruta_generada]
+    if posixpath.splitext(ruta_generada)[1] not in EXTENSIONES_COMPRIMIBLES or len(contenido) < 1024:
+        return escritos
+
+    comprimido = gzip.compress(contenido, compresslevel=9, mtime=0)
+    if len(comprimido) < len(contenido) * 0.9:
+        with open(destino + '.gz', 'wb') as f:
+            f.write(comprimido)
+        escritos.append(ruta_generada + '.gz')
+    try:
+        import brotli
+    except ImportError:
+        return escritos
+    comprimido = brotli.compress(contenido, quality=11)
+    if len(comprimido) < len(contenido) * 0.9:
+        with open(destino + '.br', 'wb') as f:
+            f.write(comprimido)
+        escritos.append(ruta_generada + '.br')
+    return escritos
+
+
+def construir(static_folder, cdn_respaldo=False):
+    """
+    Generar static/dist/ y su manifiesto.
+
+    Se conservan los archivos de la generación anterior (páginas ya abiertas
+    pueden seguir pidiéndolos) y se borra todo lo más viejo.
+
+    Args:
+        static_folder: Carpeta static/ de la aplicación
+        cdn_respaldo: Si las librerías sin vendorizar se seguirán pidiendo al CDN
+
+    Returns:
+        Manifiesto {ruta original: ruta dentro de dist/}
+
+    Raises:
+        VendorIncompleto: Si falta alguna librería vendorizada y no hay respaldo
+            del CDN (las páginas quedarían sin estilos o scripts)
+    """
+    faltantes = vendor_faltante(static_folder)
+    if faltantes and not cdn_respaldo:
+        raise VendorIncompleto(f"Faltan {len(faltantes)} librerías vendorizadas ({', '.join(faltantes[:3])}"
+                               f"{', ...' if len(faltantes) > 3 else ''}): ejecutar `flask vendorizar-assets`")
+
+    carpeta = os.path.join(static_folder, CARPETA_DIST)
+    os.makedirs(carpeta, exist_ok=True)
+    anterior = cargar_manifiesto(static_folder, forzar=True)
+
+    manifiesto = {}
+    conservar = {MANIFIESTO}
+    for ruta in _archivos_fuente(static_folder):
+        ruta_generada, contenido = _procesar(static_folder, ruta, manifiesto)
+        conservar.update(_escribir(carpeta, ruta_generada, contenido))
+        manifiesto[ruta] = ruta_generada
+
+    for generada in anterior.values():
+        conservar.update({generada, generada + '.gz', generada + '.br'})
+    for directorio, _, archivos in os.walk(carpeta):
+        for nombre in archivos:
+            relativa = os.path.relpath(os.path.join(directorio, nombre), carpeta).replace(os.sep, '/')
+            if relativa not in conservar:
+                os.remove(os.path.join(directorio, nombre))
+
+    temporal = os.path.join(carpeta, MANIFIESTO + '.tmp')
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, indent=2, sort_keys=True)
+    os.replace(temporal, os.path.join(carpeta, MANIFIESTO))
+    logger.info(f"📦 {len(manifiesto)} assets con huella en {carpeta}")
+    return manifiesto
+
+
+def cargar_manifiesto(static_folder, forzar=False):
+    """Manifiesto vigente ({} si no se construyeron los assets); se relee si cambia"""
+    ruta = os.path.join(static_folder, CARPETA_DIST, MANIFIESTO)
+    try:
+        mtime = os.path.getmtime(ruta)
+    except OSError:
+        return {}
+    with _manifiestos_lock:
+        cacheado = _manifiestos.get(static_folder)
+    if cacheado and cacheado[0] == mtime and not forzar:
+        return cacheado[1]
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            contenido = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"No se pudo leer el manifiesto de assets: {e}")
+        contenido = {}
+    with _manifiestos_lock:
+        _manifiestos[static_folder] = (mtime, contenido)
+    return contenido
+
+
+def asset_url(ruta):
+    """
+    URL de un asset de static/: con huella si fue construido, el archivo original
+    si no, o el CDN si es una librería sin vendorizar y ASSETS_CDN_RESPALDO está activo
+    """
+    static_folder = current_app.static_folder
+    generada = cargar_manifiesto(static_folder).get(ruta)
+    if generada:
+        return url_for('static', filename=f'{CARPETA_DIST}/{generada}')
+    if ruta in VENDOR and current_app.config.get('ASSETS_CDN_RESPALDO') and \
+            not os.path.isfile(os.path.join(static_folder, ruta)):
+        return VENDOR[ruta]
+    return url_for('static', filename=ruta)
+
+
+def servir_dist(filename):
+    """static/dist/: precomprimido según Accept-Encoding y cache inmutable"""
+    carpeta = os.path.join(current_app.static_folder, CARPETA_DIST)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = None
+    for codificacion, extension in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[codificacion] and \
+                os.path.isfile(os.path.join(carpeta, filename + extension)):
+            response = send_from_directory(carpeta, filename + extension, mimetype=mimetype)
+            response.headers['Content-Encoding'] = codificacion
+            break
+    if response is None:
+        response = send_from_directory(carpeta, filename, mimetype=mimetype)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={MAX_AGE_DIST}, immutable'
+    return response
+
+
+def init_app(app):
+    """Exponer asset_url en los templates y servir static/dist/"""
+    faltantes = vendor_faltante(app.static_folder)
+    if faltantes and app.config.get('ASSETS_CDN_RESPALDO'):
+        logger.warning(f"⚠️ Faltan {len(faltantes)} librerías en static/vendor/, se piden al CDN "
+                       f"(ejecutar `flask vendorizar-assets`)")
+    elif faltantes:
+        logger.error(f"❌ Faltan {len(faltantes)} librerías en static/vendor/ (ejecutar `flask vendorizar-assets`); "
+                     f"las páginas las pedirán y recibirán 404")
+    app.add_template_global(asset_url)
+    app.add_url_rule(f'{app.static_url_path}/{CARPETA_DIST}/<path:filename>',
+                     endpoint='assets_dist', view_func=servir_dist)
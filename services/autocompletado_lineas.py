@@ -0,0 +1,254 @@
+"""
+Autocompletado de frases sobre el corpus de líneas de plantillas
+
+Indexa en memoria los textos de LineaPlantilla, LineaPap, LineaBiopsia y las
+líneas de PlantillaMultilinea (activas) por prefijos de palabras plegadas
+(sin acentos ni mayúsculas): "inf leuc" encuentra "Infiltrado leucocitario".
+Los textos repetidos dentro de un tipo de estudio se unifican sumando su uso.
+
+Orden: puntaje = log(1 + veces_usado) + PESO_RECENCIA · 2^(-días desde el
+último uso / VIDA_MEDIA_DIAS). Los documentos se numeran en orden de puntaje,
+así las listas de postings (arrays ordenados) ya están en orden de ranking y
+una consulta recorre la palabra más selectiva de la consulta hasta juntar el
+límite, verificando las demás palabras contra el documento.
+
+El índice se reconstruye cuando cambia la versión del catálogo de plantillas
+(services/catalogo_plantillas, que se renueva al modificar cualquiera de estas
+tablas) y, para reordenar por los contadores de uso que vuelca
+services/contadores_uso, cada AUTOCOMPLETADO_REFRESCO_USO segundos.
+"""
+import heapq
+import json
+import logging
+import math
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import select
+
+from extensions import db
+from models.informe import LineaPap, LineaBiopsia
+from models.plantilla_dinamica import SeccionPlantilla, LineaPlantilla
+from models.plantilla_multilinea import PlantillaMultilinea
+from services import catalogo_plantillas, metricas
+from services.analisis_texto import palabras
+
+logger = logging.getLogger(__name__)
+
+PESO_RECENCIA = 2.0
+VIDA_MEDIA_DIAS = 30
+# Documentos a revisar como máximo por consulta (corta las consultas con
+# palabras muy comunes que juntas no aparecen)
+MAX_EXAMINADOS = 5000
+
+
+def _puntaje(veces_usado, ultima_vez_usado, ahora):
+    puntaje = math.log1p(veces_usado or 0)
+    if ultima_vez_usado:
+        dias = max((ahora - ultima_vez_usado).total_seconds(), 0) / 86400
+        puntaje += PESO_RECENCIA * 0.5 ** (dias / VIDA_MEDIA_DIAS)
+    return puntaje
+
+
+def _filas():
+    """(tipo, sección, texto, origen, veces_usado, ultima_vez_usado) de todas las fuentes"""
+    lp, sp = LineaPlantilla.__table__, SeccionPlantilla.__table__
+    for fila in db.session.execute(
+        select(sp.c.tipo_estudio, sp.c.nombre, lp.c.texto, lp.c.veces_usado, lp.c.ultima_vez_usado)
+        .join(sp, sp.c.seccion_id == lp.c.seccion_id)
+        .where(lp.c.activo.isnot(False))
+    ):
+        yield fila.tipo_estudio, fila.nombre, fila.texto, 'plantilla', fila.veces_usado, fila.ultima_vez_usado
+
+    for modelo, tipo, columna in ((LineaPap, 'PAP', 'categoria'), (LineaBiopsia, 'BIOPSIA', 'seccion')):
+        t = modelo.__table__
+        for fila in db.session.execute(
+            select(t.c[columna], t.c.texto, t.c.veces_usado, t.c.ultima_vez_usado).where(t.c.activo.is_(True))
+        ):
+            yield tipo, fila[0], fila.texto, modelo.__tablename__, fila.veces_usado, fila.ultima_vez_usado
+
+    t = PlantillaMultilinea.__table__
+    for fila in db.session.execute(
+        select(t.c.tipo_estudio, t.c.seccion, t.c.lineas, t.c.veces_usado, t.c.ultima_vez_usado)
+        .where(t.c.activo.isnot(False))
+    ):
+        try:
+            lineas = json.loads(fila.lineas) if fila.lineas else []
+        except (TypeError, ValueError):
+            continue
+        for texto in lineas:
+            if isinstance(texto, str):
+                yield fila.tipo_estudio, fila.seccion, texto, 'multilinea', fila.veces_usado, fila.ultima_vez_usado
+
+
+class IndiceAutocompletado:
+    """Índice de prefijos: vocabulario ordenado + postings por palabra en orden de ranking"""
+
+    def __init__(self, documentos):
+        """
+        Args:
+            documentos: [(puntaje, tipo, sección, texto, origen, veces_usado, (palabras...))]
+        """
+        documentos.sort(key=lambda d: (-d[0], len(d[3])))
+        self.tipos = [d[1] for d in documentos]
+        self.secciones = [d[2] for d in documentos]
+        self.textos = [d[3] for d in documentos]
+        self.origenes = [d[4] for d in documentos]
+        self.usos = array('I', (d[5] for d in documentos))
+        self.palabras_doc = [d[6] for d in documentos]
+
+        postings = {}
+        for doc, palabras_doc in enumerate(self.palabras_doc):
+            for palabra in set(palabras_doc):
+                lista = postings.get(palabra)
+                if lista is None:
+                    lista = postings[palabra] = array('I')
+                lista.append(doc)  # doc crece: cada lista queda ordenada por ranking
+        self.vocabulario = sorted(postings)
+        self.postings = [postings[p] for p in self.vocabulario]
+        # Suma acumulada de largos para estimar en O(1) cuántos documentos cubre un prefijo
+        self.acumulado = array('L', [0])
+        for lista in self.postings:
+            self.acumulado.append(self.acumulado[-1] + len(lista))
+
+    def __len__(self):
+        return len(self.textos)
+
+    def _rango(self, prefijo):
+        desde = bisect_left(self.vocabulario, prefijo)
+        hasta = bisect_left(self.vocabulario, prefijo + '\uffff', desde)
+        return desde, hasta
+
+    def buscar(self, consulta, tipo=None, limite=10):
+        """
+        Textos que contienen una palabra que empieza con cada palabra de la consulta.
+
+        Returns:
+            [(doc, texto)] en orden de ranking, sin textos repetidos
+        """
+        prefijos = sorted(set(palabras(consulta)), key=len, reverse=True)
+        # Un prefijo contenido en otro más largo de la consulta no filtra nada
+        prefijos = [p for i, p in enumerate(prefijos) if not any(o.startswith(p) for o in prefijos[:i])]
+        if not prefijos:
+            return []
+        rangos = [(self.acumulado[h] - self.acumulado[d], d, h, p) for p in prefijos for d, h in [self._rango(p)]]
+        rangos.sort()
+        if rangos[0][0] == 0:
+            return []
+        _, desde, hasta, _ = rangos[0]
+        resto = [p for _, _, _, p in rangos[1:]]
+
+        if hasta - desde == 1:
+            candidatos = iter(self.postings[desde])
+        else:
+            candidatos = heapq.merge(*self.postings[desde:hasta])
+
+        resultados, vistos, anterior = [], set(), -1
+        for examinados, doc in enumerate(candidatos):
+            if doc == anterior:
+                continue  # el documento tiene dos palabras con el mismo prefijo
+            anterior = doc
+            if examinados >= MAX_EXAMINADOS:
+                break
+            if tipo and self.tipos[doc] != tipo:
+                continue
+            if resto:
+                palabras_doc = self.palabras_doc[doc]
+                if not all(any(w.startswith(p) for w in palabras_doc) for p in resto):
+                    continue
+            texto = self.textos[doc]
+            clave = texto.casefold()
+            if clave in vistos:
+                continue
+            vistos.add(clave)
+            resultados.append((doc, texto))
+            if len(resultados) >= limite:
+                break
+        return resultados
+
+
+def construir():
+    """Leer todas las fuentes y armar el índice"""
+    inicio = time.monotonic()
+    ahora = datetime.utcnow()
+    por_clave = {}
+    for tipo, seccion, texto, origen, veces, ultima in _filas():
+        texto = (texto or '').strip()
+        palabras_texto = tuple(palabras(texto))
+        if not palabras_texto:
+            continue
+        tipo = catalogo_plantillas.normalizar_tipo(tipo)
+        clave = (tipo, ' '.join(palabras_texto))
+        existente = por_clave.get(clave)
+        if existente is None:
+            por_clave[clave] = [texto, seccion, origen, veces or 0, ultima, palabras_texto]
+        else:
+            existente[3] += veces or 0
+            if ultima and (existente[4] is None or ultima > existente[4]):
+                existente[4] = ultima
+    documentos = [
+        (_puntaje(veces, ultima, ahora), tipo, seccion, texto, origen, veces, palabras_texto)
+        for (tipo, _), (texto, seccion, origen, veces, ultima, palabras_texto) in por_clave.items()
+    ]
+    indice = IndiceAutocompletado(documentos)
+    logger.info(f"⌨️ Índice de autocompletado: {len(indice)} frases, {len(indice.vocabulario)} palabras "
+                f"en {time.monotonic() - inicio:.2f}s")
+    return indice
+
+
+_indice = None
+_version = None
+_construido = 0.0
+_lock = threading.Lock()
+
+
+def _indice_vigente():
+    """Índice al día con la versión del catálogo y, cada tanto, con los contadores de uso"""
+    global _indice, _version, _construido
+    version = catalogo_plantillas.version_actual()
+    refresco = current_app.config.get('AUTOCOMPLETADO_REFRESCO_USO', 300)
+    vigente = _indice
+    if vigente is not None and version == _version and time.monotonic() - _construido < refresco:
+        metricas.registrar_cache('autocompletado_lineas', True)
+        return vigente
+    # Si ya hay un índice, un solo request lo reconstruye y el resto sigue con el anterior
+    if not _lock.acquire(blocking=vigente is None):
+        metricas.registrar_cache('autocompletado_lineas', True)
+        return vigente
+    try:
+        if _indice is None or version != _version or time.monotonic() - _construido >= refresco:
+            metricas.registrar_cache('autocompletado_lineas', False)
+            _indice, _version, _construido = construir(), version, time.monotonic()
+        return _indice
+    finally:
+        _lock.release()
+
+
+def completar(consulta, tipo_estudio=None, limite=10):
+    """
+    Frases del corpus que completan lo que se está escribiendo.
+
+    Returns:
+        [{'texto', 'seccion', 'origen', 'veces_usado'}] ordenadas por uso y recencia
+    """
+    indice = _indice_vigente()
+    inicio = time.monotonic()
+    tipo = catalogo_plantillas.normalizar_tipo(tipo_estudio) or None
+    resultados = [
+        {'texto': texto, 'seccion': indice.secciones[doc], 'origen': indice.origenes[doc],
+         'veces_usado': indice.usos[doc]}
+        for doc, texto in indice.buscar(consulta, tipo, limite)
+    ]
+    metricas.observar('ldh_autocompletado_segundos', time.monotonic() - inicio)
+    return resultados
+
+
+def descartar():
+    """Olvidar el índice en memoria (se reconstruye en la próxima consulta)"""
+    global _indice
+    with _lock:
+        _indice = None
@@ -0,0 +1,338 @@
+"""
+Diario de borradores de los editores de informes (autoguardado)
+
+Los editores envían operaciones pequeñas sobre las líneas de cada sección
+(insertar, editar, mover, borrar, reemplazar). En lugar de escribir en la base en
+cada autoguardado, se agregan a un diario por protocolo (un archivo JSONL en
+AUTOSAVE_FOLDER) y cada tanto se compactan en `ProtocoloLinea` con un único
+guardado por diferencias.
+
+Formato del diario, una entrada por línea:
+    {"b": "SECCION", "l": [...]}              líneas de la sección al empezar el borrador
+    {"o": "i", "s": "SECCION", "p": 0, "t": "texto"}   operación
+
+Al compactar, cada sección solo se aplica si la base guardada en el diario sigue
+coincidiendo con la base de datos (un guardado explícito posterior gana).
+
+Agregar, compactar y descartar toman un flock exclusivo sobre el diario, así
+que se excluyen entre hilos y entre los procesos que comparten AUTOSAVE_FOLDER.
+La compactación lo mantiene hasta el commit y recién entonces borra el diario.
+"""
+import fcntl
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+
+from extensions import db
+from models.informe import ProtocoloLinea
+
+logger = logging.getLogger(__name__)
+
+# Operaciones admitidas: nombre en la API -> código en el diario
+OPERACIONES = {'insert': 'i', 'edit': 'e', 'move': 'm', 'delete': 'd', 'replace': 'r'}
+MAX_TEXTO = 5000
+MAX_OPERACIONES_POR_ENVIO = 500
+
+# protocolo_id -> [operaciones en el diario, time.time() de la primera]
+_estado = {}
+
+
+class OperacionInvalida(ValueError):
+    """Operación de autoguardado mal formada"""
+
+
+def _carpeta():
+    carpeta = current_app.config['AUTOSAVE_FOLDER']
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+def _ruta(protocolo_id):
+    return os.path.join(_carpeta(), f'{int(protocolo_id)}.jsonl')
+
+
+@contextmanager
+def _diario_bloqueado(protocolo_id, crear=False):
+    """
+    Diario del protocolo abierto y con flock exclusivo, o None si no existe (y no
+    se pidió crearlo). Si mientras se esperaba el lock otro proceso borró o
+    reemplazó el diario, se vuelve a intentar sobre el vigente.
+    """
+    ruta = _ruta(protocolo_id)
+    while True:
+        try:
+            diario = open(ruta, 'a+' if crear else 'r+', encoding='utf-8')
+        except FileNotFoundError:
+            yield None
+            return
+        # Cerrar el archivo libera el lock
+        with diario:
+            fcntl.flock(diario.fileno(), fcntl.LOCK_EX)
+            try:
+                vigente = os.stat(ruta).st_ino == os.fstat(diario.fileno()).st_ino
+            except FileNotFoundError:
+                vigente = False
+            if vigente:
+                yield diario
+                return
+
+
+def _normalizar(textos):
+    """Líneas tal como las muestran los editores: una por renglón, sin vacías"""
+    resultado = []
+    for texto in textos:
+        for renglon in str(texto or '').splitlines():
+            renglon = renglon.strip()
+            if renglon:
+                resultado.append(renglon)
+    return resultado
+
+
+def _lineas_guardadas(protocolo_id, secciones):
+    """Líneas actuales (normalizadas) de las secciones indicadas"""
+    por_seccion = {seccion: [] for seccion in secciones}
+    filas = db.session.query(ProtocoloLinea.seccion, ProtocoloLinea.texto).filter(
+        ProtocoloLinea.protocolo_id == protocolo_id,
+        ProtocoloLinea.seccion.in_(list(secciones))
+    ).order_by(ProtocoloLinea.seccion, ProtocoloLinea.orden, ProtocoloLinea.protocolo_linea_id).all()
+    for seccion, texto in filas:
+        por_seccion[seccion].append(texto)
+    return {seccion: _normalizar(textos) for seccion, textos in por_seccion.items()}
+
+
+def _validar(op):
+    if not isinstance(op, dict) or op.get('op') not in OPERACIONES:
+        raise OperacionInvalida('Operación desconocida')
+    seccion = op.get('seccion')
+    if not isinstance(seccion, str) or not seccion.strip() or len(seccion) > 50:
+        raise OperacionInvalida('Sección inválida')
+    codigo = OPERACIONES[op['op']]
+    entrada = {'o': codigo, 's': seccion.strip()}
+    if codigo == 'r':
+        lineas = op.get('lineas')
+        if not isinstance(lineas, list):
+            raise OperacionInvalida('replace requiere la lista de líneas')
+        entrada['l'] = [str(t)[:MAX_TEXTO] for t in lineas]
+        return entrada
+    if codigo == 'm':
+        desde, hasta = op.get('desde'), op.get('hasta')
+        if not isinstance(desde, int) or not isinstance(hasta, int):
+            raise OperacionInvalida('move requiere desde y hasta')
+        entrada.update(p=desde, h=hasta)
+        return entrada
+    pos = op.get('pos')
+    if not isinstance(pos, int) or pos < 0:
+        raise OperacionInvalida('Posición inválida')
+    entrada['p'] = pos
+    if codigo in ('i', 'e'):
+        entrada['t'] = str(op.get('texto') or '')[:MAX_TEXTO]
+    return entrada
+
+
+def _aplicar(lineas, entrada):
+    """Aplicar una operación del diario sobre la lista de líneas de una sección"""
+    codigo = entrada['o']
+    if codigo == 'r':
+        lineas[:] = _normalizar(entrada['l'])
+    elif codigo == 'i':
+        lineas.insert(min(entrada['p'], len(lineas)), entrada['t'])
+    elif codigo == 'e':
+        if entrada['p'] < len(lineas):
+            lineas[entrada['p']] = entrada['t']
+    elif codigo == 'd':
+        if entrada['p'] < len(lineas):
+            lineas.pop(entrada['p'])
+    elif codigo == 'm':
+        if 0 <= entrada['p'] < len(lineas):
+            linea = lineas.pop(entrada['p'])
+            lineas.insert(max(0, min(entrada['h'], len(lineas))), linea)
+
+
+def _leer(ruta):
+    """(bases, operaciones) del diario, ignorando una última línea truncada"""
+    bases, operaciones = {}, []
+    try:
+        with open(ruta, encoding='utf-8') as f:
+            for renglon in f:
+                try:
+                    entrada = json.loads(renglon)
+                except ValueError:
+                    continue
+                if 'b' in entrada:
+                    bases.setdefault(entrada['b'], entrada['l'])
+                else:
+                    operaciones.append(entrada)
+    except FileNotFoundError:
+        pass
+    return bases, operaciones
+
+
+def _materializar(bases, operaciones):
+    secciones = {seccion: list(lineas) for seccion, lineas in bases.items()}
+    for entrada in operaciones:
+        if entrada['s'] in secciones:
+            _aplicar(secciones[entrada['s']], entrada)
+    for seccion, lineas in secciones.items():
+        secciones[seccion] = [l.strip() for l in lineas if l and l.strip()]
+    return secciones
+
+
+def agregar_operaciones(protocolo_id, ops):
+    """
+    Agregar operaciones al diario del protocolo.
+
+    Returns:
+        Dict con la cantidad de operaciones pendientes y la antigüedad del borrador
+
+    Raises:
+        OperacionInvalida: Si alguna operación está mal formada
+    """
+    if not isinstance(ops, list) or len(ops) > MAX_OPERACIONES_POR_ENVIO:
+        raise OperacionInvalida('Lista de operaciones inválida')
+    entradas = [_validar(op) for op in ops]
+    if not entradas:
+        return estado(protocolo_id)
+
+    ruta = _ruta(protocolo_id)
+    with _diario_bloqueado(protocolo_id, crear=True) as diario:
+        bases, _ = _leer(ruta)
+        nuevas = sorted({e['s'] for e in entradas} - set(bases))
+        renglones = []
+        if nuevas:
+            for seccion, lineas in _lineas_guardadas(protocolo_id, nuevas).items():
+                renglones.append(json.dumps({'b': seccion, 'l': lineas}, ensure_ascii=False))
+        renglones.extend(json.dumps(e, ensure_ascii=False, separators=(',', ':')) for e in entradas)
+        diario.write('\n'.join(renglones) + '\n')
+        diario.flush()
+
+        pendientes = _estado.get(protocolo_id)
+        if pendientes is None:
+            _, operaciones = _leer(ruta)
+            pendientes = _estado[protocolo_id] = [len(operaciones) - len(entradas), time.time()]
+        pendientes[0] += len(entradas)
+    return estado(protocolo_id)
+
+
+def estado(protocolo_id):
+    """Operaciones pendientes y segundos desde la primera"""
+    pendientes = _estado.get(protocolo_id)
+    if not pendientes:
+        return {'pendientes': 0, 'antiguedad': 0}
+    return {'pendientes': pendientes[0], 'antiguedad': round(time.time() - pendientes[1], 1)}
+
+
+def debe_compactar(protocolo_id):
+    """Si el borrador superó el máximo de operaciones o de antigüedad configurados"""
+    actual = estado(protocolo_id)
+    return (actual['pendientes'] >= current_app.config.get('AUTOSAVE_COMPACTAR_OPERACIONES', 100)
+            or actual['antiguedad'] >= current_app.config.get('AUTOSAVE_COMPACTAR_SEGUNDOS', 120))
+
+
+def borrador(protocolo_id):
+    """Secciones con cambios sin compactar (dict seccion -> líneas), o {}"""
+    ruta = _ruta(protocolo_id)
+    if not os.path.exists(ruta):
+        return {}
+    return _materializar(*_leer(ruta))
+
+
+def compactar(protocolo_id):
+    """
+    Volcar el borrador en ProtocoloLinea con un guardado por diferencias (hace commit).
+
+    Returns:
+        Dict con secciones aplicadas, secciones descartadas por conflicto y el
+        resultado del guardado, o None si no había borrador
+    """
+    from services.lineas_protocolo import guardar_lineas
+
+    ruta = _ruta(protocolo_id)
+    # El lock se mantiene hasta el commit: un autoguardado que llegue mientras tanto
+    # espera y arma la base de su diario nuevo con las líneas ya compactadas. Si el
+    # guardado falla, el diario queda intacto.
+    with _diario_bloqueado(protocolo_id) as diario:
+        if diario is None:
+            return None
+        bases, operaciones = _leer(ruta)
+        borrador_final = _materializar(bases, operaciones)
+        actuales = _lineas_guardadas(protocolo_id, list(bases))
+
+        aplicables = {s: lineas for s, lineas in borrador_final.items() if actuales.get(s) == bases[s]}
+        descartadas = sorted(set(borrador_final) - set(aplicables))
+        if descartadas:
+            logger.warning(f"⚠️ Borrador del protocolo {protocolo_id}: secciones {descartadas} "
+                           f"modificadas por otro guardado, se descartan")
+
+        resultado = None
+        try:
+            if aplicables:
+                resultado = guardar_lineas(
+                    protocolo_id,
+                    {s: [(texto, i) for i, texto in enumerate(lineas, start=1)] for s, lineas in aplicables.items()},
+                    secciones=list(aplicables)
+                )
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        os.remove(ruta)
+        _estado.pop(protocolo_id, None)
+
+    return {'aplicadas': sorted(aplicables), 'descartadas': descartadas, 'guardado': resultado}
+
+
+def descartar(protocolo_id, secciones=None):
+    """
+    Descartar el borrador (todo o solo algunas secciones) tras un guardado explícito.
+    """
+    ruta = _ruta(protocolo_id)
+    with _diario_bloqueado(protocolo_id) as diario:
+        if diario is None:
+            return
+        if secciones is None:
+            os.remove(ruta)
+            _estado.pop(protocolo_id, None)
+            return
+        quitar = set(secciones)
+        conservadas = []
+        for renglon in diario:
+            try:
+                entrada = json.loads(renglon)
+            except ValueError:
+                continue
+            if entrada.get('b', entrada.get('s')) not in quitar:
+                conservadas.append(entrada)
+        if not any('o' in entrada for entrada in conservadas):
+            os.remove(ruta)
+            _estado.pop(protocolo_id, None)
+            return
+        temporal = ruta + '.tmp'
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(entrada, ensure_ascii=False, separators=(',', ':')) + '\n'
+                         for entrada in conservadas)
+        os.replace(temporal, ruta)
+        _estado.pop(protocolo_id, None)
+
+
+def compactar_vencidos(max_antiguedad=None):
+    """Compactar los borradores cuyo archivo no se modificó en max_antiguedad segundos"""
+    if max_antiguedad is None:
+        max_antiguedad = current_app.config.get('AUTOSAVE_COMPACTAR_SEGUNDOS', 120)
+    carpeta = _carpeta()
+    limite = time.time() - max_antiguedad
+    compactados = 0
+    for nombre in os.listdir(carpeta):
+        if not nombre.endswith('.jsonl') or not nombre[:-6].isdigit():
+            continue
+        if os.path.getmtime(os.path.join(carpeta, nombre)) > limite:
+            continue
+        try:
+            if compactar(int(nombre[:-6])):
+                compactados += 1
+        except Exception as e:
+            logger.error(f"Error compactando el borrador {nombre}: {e}")
+    return compactados
@@ -0,0 +1,372 @@
+"""
+Descubrimiento de modelos de IA (Claude y Gemini)
+
+Qué modelos responden, cuáles aceptan imágenes y con qué latencia se averigua
+probándolos con un pedido mínimo (en Gemini, además, leyendo el listado de la
+API). Las pruebas corren en paralelo (IA_MODELOS_HILOS) con un plazo total de
+IA_MODELOS_PLAZO segundos. Las que no terminan a tiempo conservan el
+resultado anterior.
+
+El resultado se guarda en ia_modelos y vale IA_MODELOS_TTL segundos. Los
+requests solo leen lo guardado (la copia del proceso, o la base cuando la
+copia venció). Si no hay resultado o está vencido, se renueva en segundo
+plano y mientras tanto se usa lo que haya. "Probar modelos" en
+administración fuerza la renovación.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+from flask import current_app, has_app_context
+
+from extensions import db
+from models.asistente import CapacidadModelo
+from services import metricas
+from utils import config_app
+
+logger = logging.getLogger(__name__)
+
+# Candidatos a probar, en orden de preferencia
+CANDIDATOS = {
+    'claude': [
+        'claude-3-haiku-20240307',
+        'claude-3-sonnet-20240229',
+        'claude-3-5-sonnet-20240620',
+        'claude-3-opus-20240229',
+        'claude-3-5-opus-20241022',
+    ],
+    'gemini': [
+        'gemini-2.5-flash',  # Estable, multimodal
+        'gemini-2.0-flash',  # Estable, multimodal
+        'gemini-2.5-pro',    # Estable, multimodal, más potente
+        'gemini-2.0-flash-001',  # Versión específica estable
+        'gemini-flash-latest',  # Latest
+        'gemini-pro-latest',    # Latest
+        'gemini-pro-vision',    # Legacy
+        'gemini-1.5-flash-latest',
+        'gemini-1.5-pro-latest',
+    ],
+}
+VERSIONES_GEMINI = ('v1beta', 'v1')
+
+TTL = 24 * 3600
+PLAZO = 15
+HILOS = 8
+TIMEOUT_PRUEBA = 5
+# Espera antes de reintentar una renovación que no obtuvo ningún resultado
+REINTENTO = 300
+
+CAMPOS = ('version', 'nombre_visible', 'descripcion', 'metodos', 'listado', 'disponible',
+          'soporta_vision', 'latencia_ms', 'error', 'fecha_verificacion')
+
+# proveedor -> {'modelos': {modelo: datos}, 'verificado': datetime o None, 'reintentar_desde': monotonic}
+_estado = {}
+_renovaciones = {}  # proveedor -> Future de la renovación en curso
+_lock = threading.Lock()
+
+_executor = None          # renovaciones (una por proveedor a la vez)
+_executor_pruebas = None  # pruebas y listados de todas las renovaciones
+_executor_lock = threading.Lock()
+
+
+
+def _cliente(proveedor):
+    if proveedor == 'claude':
+        from services.claude_client import get_claude_client
+        return get_claude_client()
+    from services.gemini_client import get_gemini_client
+    return get_gemini_client()
+
+
+def _soporta_vision(proveedor, modelo, descripcion=''):
+    if proveedor == 'claude':
+        return 'haiku' not in modelo.lower()
+    from services.gemini_client import GeminiClient
+    return GeminiClient.soporta_vision(modelo, descripcion)
+
+
+def _vacio(proveedor, modelo):
+    return {'modelo': modelo, 'version': None, 'nombre_visible': None, 'descripcion': None, 'metodos': [],
+            'listado': False, 'disponible': None, 'soporta_vision': _soporta_vision(proveedor, modelo),
+            'latencia_ms': None, 'error': None, 'fecha_verificacion': None}
+
+
+def _orden(proveedor, datos):
+    """Clave de preferencia: candidatos en su orden, después el resto; a igualdad, menor latencia"""
+    candidatos = CANDIDATOS.get(proveedor, [])
+    indice = candidatos.index(datos['modelo']) if datos['modelo'] in candidatos else len(candidatos)
+    return (indice, datos['latencia_ms'] if datos['latencia_ms'] is not None else float('inf'), datos['modelo'])
+
+
+# ---------------------------------------------------------------------------
+# Descubrimiento
+# ---------------------------------------------------------------------------
+
+def _probar(cliente, modelo):
+    """Prueba de un modelo; la latencia incluye el reintento con v1 de Gemini, como en un pedido real"""
+    inicio = time.perf_counter()
+    resultado = cliente.probar_modelo(modelo=modelo, timeout=TIMEOUT_PRUEBA)
+    disponible = bool(resultado.get('disponible'))
+    return {
+        'disponible': disponible,
+        'version': resultado.get('version'),
+        'latencia_ms': int(round((time.perf_counter() - inicio) * 1000)) if disponible else None,
+        'error': str(resultado['error'])[:300] if resultado.get('error') else None,
+    }
+
+
+def _ejecutores(config):
+    global _executor, _executor_pruebas
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=len(CANDIDATOS), thread_name_prefix='catalogo-modelos')
+            _executor_pruebas = ThreadPoolExecutor(max_workers=config.get('IA_MODELOS_HILOS', HILOS),
+                                                   thread_name_prefix='catalogo-modelos-prueba')
+    return _executor, _executor_pruebas
+
+
+def descubrir(proveedor, anteriores=None):
+    """
+    Probar los candidatos del proveedor en paralelo con un plazo total (requiere app context).
+
+    Args:
+        proveedor: 'claude' o 'gemini'
+        anteriores: {modelo: datos} del descubrimiento anterior, para lo que no termine a tiempo
+
+    Returns:
+        ({modelo: datos}, cantidad de pruebas y listados que terminaron)
+    """
+    cliente = _cliente(proveedor)
+    _, ejecutor = _ejecutores(current_app.config)
+    anteriores = anteriores or {}
+
+    candidatos = list(CANDIDATOS[proveedor])
+    if cliente.model not in candidatos:
+        candidatos.insert(0, cliente.model)
+    pruebas = {ejecutor.submit(_probar, cliente, modelo): modelo for modelo in candidatos}
+    listados = {}
+    if proveedor == 'gemini':
+        listados = {ejecutor.submit(cliente.listar_modelos_api, version): version for version in VERSIONES_GEMINI}
+
+    terminados, sin_terminar = wait(list(pruebas) + list(listados), timeout=config_app('IA_MODELOS_PLAZO', PLAZO))
+    for futuro in sin_terminar:
+        futuro.cancel()
+    if sin_terminar:
+        logger.warning(f"⏱️ Descubrimiento de modelos {proveedor}: {len(sin_terminar)} prueba(s) sin terminar en el plazo")
+
+    ahora = datetime.utcnow()
+    modelos = {}
+    # Listado: v1beta primero; un modelo listado en las dos versiones queda con v1beta
+    listado_completo = False
+    for futuro, version in sorted(listados.items(), key=lambda item: VERSIONES_GEMINI.index(item[1])):
+        if futuro not in terminados:
+            continue
+        try:
+            listado = futuro.result()
+        except Exception as e:
+            logger.warning(f"Error listando modelos de Gemini con {version}: {e}")
+            continue
+        listado_completo = True
+        for modelo in listado:
+            if modelo['nombre'] in modelos:
+                continue
+            datos = _vacio(proveedor, modelo['nombre'])
+            datos.update(version=modelo['version'], nombre_visible=modelo['display_name'][:200],
+                         descripcion=modelo['description'], metodos=list(modelo['supported_generation_methods']),
+                         listado=True, soporta_vision=modelo['soporta_vision'], fecha_verificacion=ahora)
+            modelos[modelo['nombre']] = datos
+    if listados and not listado_completo:
+        # Sin listado nuevo: se conservan los modelos listados la vez anterior
+        for nombre, datos in anteriores.items():
+            if datos['listado']:
+                modelos[nombre] = dict(datos)
+
+    for futuro, modelo in pruebas.items():
+        if futuro not in terminados:
+            if modelo in anteriores and modelo not in modelos:
+                modelos[modelo] = dict(anteriores[modelo])
+            continue
+        prueba = futuro.result()
+        datos = modelos.setdefault(modelo, _vacio(proveedor, modelo))
+        datos.update(disponible=prueba['disponible'], latencia_ms=prueba['latencia_ms'],
+                     error=prueba['error'], fecha_verificacion=ahora)
+        if prueba['version']:
+            datos['version'] = prueba['version']
+
+    return modelos, len(terminados)
+
+
+# ---------------------------------------------------------------------------
+# Persistencia
+# ---------------------------------------------------------------------------
+
+def _cargar(proveedor):
+    """Resultado guardado en la base ({'modelos', 'verificado'})"""
+    try:
+        filas = CapacidadModelo.query.filter_by(proveedor=proveedor).all()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"⚠️ No se pudo leer ia_modelos (¿falta la migración?): {e}")
+        return {'modelos': {}, 'verificado': None}
+    modelos = {}
+    for fila in filas:
+        datos = {campo: getattr(fila, campo) for campo in CAMPOS}
+        datos['modelo'] = fila.modelo
+        datos['metodos'] = [m for m in (fila.metodos or '').split(',') if m]
+        modelos[fila.modelo] = datos
+    verificado = max((d['fecha_verificacion'] for d in modelos.values()), default=None)
+    return {'modelos': modelos, 'verificado': verificado}
+
+
+def _guardar(proveedor, modelos):
+    try:
+        existentes = {fila.modelo: fila for fila in CapacidadModelo.query.filter_by(proveedor=proveedor)}
+        for nombre, datos in modelos.items():
+            fila = existentes.pop(nombre, None)
+            if fila is None:
+                fila = CapacidadModelo(proveedor=proveedor, modelo=nombre)
+                db.session.add(fila)
+            for campo in CAMPOS:
+                setattr(fila, campo, datos[campo])
+            fila.metodos = ','.join(datos['metodos'])[:300]
+        # Modelos que ya no se listan ni son candidatos
+        for fila in existentes.values():
+            db.session.delete(fila)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"⚠️ No se pudo guardar el descubrimiento de modelos {proveedor}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Renovación en segundo plano
+# ---------------------------------------------------------------------------
+
+def _renovar(app, proveedor):
+    with app.app_context():
+        try:
+            with _lock:
+                anteriores = dict(_estado.get(proveedor, {}).get('modelos', {}))
+            inicio = time.perf_counter()
+            modelos, terminados = descubrir(proveedor, anteriores)
+            duracion = time.perf_counter() - inicio
+            metricas.observar('ldh_ia_modelos_descubrimiento_segundos', duracion, proveedor=proveedor)
+            if not terminados:
+                logger.warning(f"⚠️ Descubrimiento de modelos {proveedor} sin resultados; se reintenta en {REINTENTO} s")
+                return
+            _guardar(proveedor, modelos)
+            verificado = max((d['fecha_verificacion'] for d in modelos.values() if d['fecha_verificacion']), default=None)
+            with _lock:
+                _estado[proveedor] = {'modelos': modelos, 'verificado': verificado, 'reintentar_desde': 0}
+            disponibles = sum(1 for d in modelos.values() if d['disponible'])
+            logger.info(f"🔎 Modelos {proveedor} verificados en {duracion:.1f} s: {disponibles} disponible(s) de {len(modelos)}")
+        except Exception as e:
+            logger.error(f"Error en el descubrimiento de modelos {proveedor}: {e}", exc_info=True)
+        finally:
+            # No volver a intentar enseguida, aunque la renovación haya fallado
+            with _lock:
+                entrada = _estado.setdefault(proveedor, {'modelos': {}, 'verificado': None, 'reintentar_desde': 0})
+                entrada['reintentar_desde'] = time.monotonic() + REINTENTO
+            db.session.remove()
+
+
+def _en_curso(proveedor):
+    futuro = _renovaciones.get(proveedor)
+    return futuro is not None and not futuro.done()
+
+
+def refrescar(proveedor):
+    """
+    Renovar el descubrimiento en segundo plano (requiere app context).
+    Si ya hay una renovación en curso para el proveedor, devuelve esa.
+
+    Returns:
+        Future de la renovación, o None si el proveedor no está configurado
+    """
+    app = current_app._get_current_object()
+    if not _cliente(proveedor).is_configured():
+        return None
+    ejecutor, _ = _ejecutores(app.config)
+    with _lock:
+        if _en_curso(proveedor):
+            return _renovaciones[proveedor]
+        futuro = _renovaciones[proveedor] = ejecutor.submit(_renovar, app, proveedor)
+    return futuro
+
+
+# ---------------------------------------------------------------------------
+# Lectura (lo que usan los requests)
+# ---------------------------------------------------------------------------
+
+def _vencido(verificado):
+    return verificado is None or datetime.utcnow() - verificado > timedelta(seconds=config_app('IA_MODELOS_TTL', TTL))
+
+
+def _entrada(proveedor):
+    """Copia del proceso; se relee de la base al vencer y, si sigue vencida, se renueva en segundo plano"""
+    with _lock:
+        entrada = _estado.get(proveedor)
+        en_curso = _en_curso(proveedor)
+    if not has_app_context():
+        return entrada or {'modelos': {}, 'verificado': None, 'reintentar_desde': 0}
+
+    if entrada is None or (_vencido(entrada['verificado']) and not en_curso
+                           and time.monotonic() >= entrada['reintentar_desde']):
+        guardado = _cargar(proveedor)
+        metricas.registrar_cache('modelos_ia', not _vencido(guardado['verificado']))
+        with _lock:
+            reintentar_desde = entrada['reintentar_desde'] if entrada else 0
+            entrada = _estado[proveedor] = {**guardado, 'reintentar_desde': reintentar_desde}
+    if _vencido(entrada['verificado']) and not en_curso and time.monotonic() >= entrada['reintentar_desde']:
+        refrescar(proveedor)
+    return entrada
+
+
+def estado(proveedor):
+    """
+    Resultado del último descubrimiento (no consulta al proveedor).
+
+    Returns:
+        {'modelos': [datos] en orden de preferencia (disponibles primero),
+         'verificado': datetime o None, 'actualizando': bool}
+        donde datos = {'modelo', 'version', 'nombre_visible', 'descripcion', 'metodos',
+        'listado', 'disponible' (None: no probado), 'soporta_vision', 'latencia_ms',
+        'error', 'fecha_verificacion'}
+    """
+    entrada = _entrada(proveedor)
+    modelos = sorted(entrada['modelos'].values(),
+                     key=lambda d: (not d['disponible'], d['disponible'] is None, _orden(proveedor, d)))
+    with _lock:
+        actualizando = _en_curso(proveedor)
+    return {'modelos': modelos, 'verificado': entrada['verificado'], 'actualizando': actualizando}
+
+
+def modelo_funcional(proveedor, vision=False, excluir=None):
+    """
+    Mejor modelo disponible según el último descubrimiento (no consulta al proveedor)
+
+    Args:
+        vision: Solo modelos que aceptan imágenes
+        excluir: Modelo a descartar (p. ej. el que acaba de fallar)
+
+    Returns:
+        Nombre del modelo o None
+    """
+    aptos = [d for d in _entrada(proveedor)['modelos'].values()
+             if d['modelo'] != excluir and (d['soporta_vision'] or not vision)]
+    disponibles = [d for d in aptos if d['disponible']]
+    if disponibles:
+        return min(disponibles, key=lambda d: _orden(proveedor, d))['modelo']
+    # Sin pruebas exitosas: el primer modelo listado que acepta generateContent
+    for datos in aptos:
+        if datos['listado'] and datos['disponible'] is None and 'generateContent' in datos['metodos']:
+            return datos['modelo']
+    return None
+
+
+def limpiar():
+    """Olvidar la copia del proceso (se vuelve a leer de la base)"""
+    with _lock:
+        _estado.clear()
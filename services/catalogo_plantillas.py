@@ -0,0 +1,243 @@
+"""
+Catálogo de plantillas por tipo de estudio
+
+Reúne en un único JSON todo lo que los editores piden por partes: secciones con
+sus líneas, configuración de botones, líneas reutilizables por categoría/sección
+y plantillas estándar con sus líneas. El resultado se cachea en memoria por
+(tipo de estudio, versión) y se sirve con un ETag del contenido, así abrir un
+editor cuesta un único request condicional.
+
+La versión es un token guardado en `configuracion` (clave
+`catalogo_plantillas_version`) que se renueva en la misma transacción en que se
+crea, modifica o elimina cualquier fila de las tablas de plantillas (por el ORM
+o con sentencias masivas de la sesión); todos los
+procesos la consultan con una sola lectura indexada. Los contadores de uso
+(`veces_usado`, `ultima_vez_usado`) no forman parte del catálogo y no lo
+invalidan (services/contadores_uso los vuelca fuera de la sesión).
+"""
+import hashlib
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from sqlalchemy import inspect
+
+from extensions import db
+from models.informe import (PlantillaPap, LineaPap, PlantillaLinea,
+                            PlantillaBiopsia, LineaBiopsia, PlantillaLineaBiopsia)
+from models.plantilla_dinamica import SeccionPlantilla, LineaPlantilla, ConfiguracionBotones
+from models.plantilla_multilinea import PlantillaMultilinea
+from services import metricas
+from services.version_tokens import TokenVersion
+
+logger = logging.getLogger(__name__)
+
+CLAVE_VERSION = 'catalogo_plantillas_version'
+
+MODELOS_CATALOGO = (SeccionPlantilla, LineaPlantilla, ConfiguracionBotones,
+                    PlantillaPap, LineaPap, PlantillaLinea,
+                    PlantillaBiopsia, LineaBiopsia, PlantillaLineaBiopsia,
+                    # No forma parte del catálogo, pero su versión también invalida
+                    # el índice de autocompletado (services/autocompletado_lineas)
+                    PlantillaMultilinea)
+TABLAS_CATALOGO = {modelo.__tablename__ for modelo in MODELOS_CATALOGO}
+COLUMNAS_DE_USO = {'veces_usado', 'ultima_vez_usado'}
+
+# tipo_estudio -> (versión, cuerpo JSON en bytes, etag)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def normalizar_tipo(tipo_estudio):
+    tipo = (tipo_estudio or '').strip().upper()
+    if tipo == 'BIOPSIAS':
+        return 'BIOPSIA'
+    if tipo in ('CITOLOGIA', 'CITOLOGÍAS', 'CITOLOGIAS'):
+        return 'CITOLOGÍA'
+    return tipo
+
+
+def _cambio_relevante(instancia):
+    """Si una instancia modificada cambió algo más que los contadores de uso"""
+    estado = inspect(instancia)
+    for atributo in estado.attrs:
+        if atributo.key not in COLUMNAS_DE_USO and atributo.history.has_changes():
+            return True
+    return False
+
+
+def _cambia_en_flush(session):
+    """Si el flush toca tablas de plantillas (más allá de los contadores de uso)"""
+    if any(isinstance(obj, MODELOS_CATALOGO) for obj in list(session.new) + list(session.deleted)):
+        return True
+    return any(isinstance(obj, MODELOS_CATALOGO) and _cambio_relevante(obj) for obj in session.dirty)
+
+
+def _sentencia_relevante(tablas, columnas):
+    """Sentencias masivas sobre tablas de plantillas que no sean solo de contadores de uso"""
+    return bool(tablas & TABLAS_CATALOGO) and (columnas is None or bool(columnas - COLUMNAS_DE_USO))
+
+
+VERSION = TokenVersion(CLAVE_VERSION, 'Versión del catálogo de plantillas (se renueva al modificarlas)',
+                       _cambia_en_flush, _sentencia_relevante)
+
+
+def init_app(app):
+    """Registrar la detección de cambios en las tablas de plantillas"""
+    VERSION.registrar()
+
+
+def invalidar():
+    """
+    Renovar la versión a mano (hace commit), p. ej. tras cargar plantillas con SQL
+    directo fuera de la sesión de la aplicación.
+    """
+    VERSION.renovar(db.session)
+    db.session.commit()
+    with _cache_lock:
+        _cache.clear()
+
+
+def version_actual():
+    """Token de versión vigente (una consulta indexada)"""
+    return VERSION.actual()
+
+
+# ---------------------------------------------------------------------------
+# Construcción
+# ---------------------------------------------------------------------------
+
+def _secciones_y_botones(tipo):
+    secciones = SeccionPlantilla.query.filter_by(tipo_estudio=tipo, activo=True).order_by(
+        SeccionPlantilla.orden, SeccionPlantilla.seccion_id
+    ).all()
+    lineas_por_seccion = defaultdict(list)
+    if secciones:
+        lineas = LineaPlantilla.query.filter(
+            LineaPlantilla.seccion_id.in_([s.seccion_id for s in secciones]),
+            LineaPlantilla.activo.is_(True)
+        ).order_by(LineaPlantilla.seccion_id, LineaPlantilla.orden, LineaPlantilla.linea_id).all()
+        for linea in lineas:
+            lineas_por_seccion[linea.seccion_id].append({
+                'id': linea.linea_id,
+                'texto': linea.texto or '',
+                'orden': int(linea.orden or 0)
+            })
+    botones = ConfiguracionBotones.query.filter_by(tipo_estudio=tipo, activo=True).order_by(
+        ConfiguracionBotones.numero_boton
+    ).all()
+    return (
+        [{
+            'id': s.seccion_id,
+            'codigo': s.codigo or '',
+            'nombre': s.nombre or '',
+            'descripcion': s.descripcion or '',
+            'orden': s.orden,
+            'lineas': lineas_por_seccion.get(s.seccion_id, [])
+        } for s in secciones],
+        [{
+            'codigo_boton': b.codigo_boton,
+            'numero_boton': b.numero_boton,
+            'seccion_id': b.seccion_id,
+            'descripcion': b.descripcion
+        } for b in botones]
+    )
+
+
+def _catalogo_pap():
+    lineas = defaultdict(list)
+    for linea in LineaPap.query.filter_by(activo=True).order_by(LineaPap.categoria, LineaPap.orden).all():
+        lineas[linea.categoria].append({'lineas_pap_id': linea.linea_id, 'texto': linea.texto, 'orden': linea.orden})
+
+    plantillas = PlantillaPap.query.filter_by(activo=True).order_by(PlantillaPap.orden).all()
+    lineas_plantilla = defaultdict(list)
+    if plantillas:
+        filas = db.session.query(PlantillaLinea.plantilla_id, PlantillaLinea.orden, LineaPap).join(
+            LineaPap, LineaPap.linea_id == PlantillaLinea.linea_plantilla_id
+        ).filter(
+            PlantillaLinea.plantilla_id.in_([p.plantilla_pap_id for p in plantillas])
+        ).order_by(PlantillaLinea.plantilla_id, PlantillaLinea.orden).all()
+        for plantilla_id, orden, linea in filas:
+            lineas_plantilla[plantilla_id].append({
+                'lineas_pap_id': linea.linea_id,
+                'categoria': linea.categoria,
+                'texto': linea.texto,
+                'orden': orden
+            })
+
+    return {
+        'lineas': lineas,
+        'plantillas': [{
+            'codigo': p.codigo,
+            'descripcion': p.descripcion,
+            'categoria': p.categoria,
+            'lineas': lineas_plantilla.get(p.plantilla_pap_id, [])
+        } for p in plantillas]
+    }
+
+
+def _catalogo_biopsia():
+    lineas = defaultdict(list)
+    for linea in LineaBiopsia.query.filter_by(activo=True).order_by(LineaBiopsia.seccion, LineaBiopsia.orden).all():
+        lineas[linea.seccion].append({'linea_id': linea.linea_id, 'texto': linea.texto, 'orden': linea.orden})
+
+    plantillas = PlantillaBiopsia.query.filter_by(activo=True).order_by(
+        PlantillaBiopsia.nombre, PlantillaBiopsia.seccion
+    ).all()
+    lineas_plantilla = defaultdict(list)
+    if plantillas:
+        filas = db.session.query(PlantillaLineaBiopsia.plantilla_id, PlantillaLineaBiopsia.orden, LineaBiopsia).join(
+            LineaBiopsia, LineaBiopsia.linea_id == PlantillaLineaBiopsia.linea_plantilla_id
+        ).filter(
+            PlantillaLineaBiopsia.plantilla_id.in_([p.plantilla_biopsia_id for p in plantillas])
+        ).order_by(PlantillaLineaBiopsia.plantilla_id, PlantillaLineaBiopsia.orden).all()
+        for plantilla_id, orden, linea in filas:
+            lineas_plantilla[plantilla_id].append({'linea_id': linea.linea_id, 'texto': linea.texto, 'orden': orden})
+
+    por_nombre = {}
+    for p in plantillas:
+        por_nombre.setdefault(p.nombre, {})[p.seccion] = lineas_plantilla.get(p.plantilla_biopsia_id, [])
+
+    return {
+        'lineas': lineas,
+        'plantillas': [{'nombre': nombre, 'secciones': secciones} for nombre, secciones in por_nombre.items()]
+    }
+
+
+def construir_catalogo(tipo_estudio):
+    """Catálogo completo de un tipo de estudio (dict serializable)"""
+    tipo = normalizar_tipo(tipo_estudio)
+    secciones, botones = _secciones_y_botones(tipo)
+    catalogo = {'tipo_estudio': tipo, 'secciones': secciones, 'botones': botones,
+                'lineas': {}, 'plantillas': []}
+    if tipo == 'PAP':
+        catalogo.update(_catalogo_pap())
+    elif tipo == 'BIOPSIA':
+        catalogo.update(_catalogo_biopsia())
+    return catalogo
+
+
+def obtener_catalogo(tipo_estudio):
+    """
+    Catálogo serializado de un tipo de estudio, desde cache si la versión no cambió.
+
+    Returns:
+        (versión, cuerpo JSON en bytes, etag)
+    """
+    tipo = normalizar_tipo(tipo_estudio)
+    version = version_actual()
+    with _cache_lock:
+        cacheado = _cache.get(tipo)
+    if cacheado and cacheado[0] == version:
+        metricas.registrar_cache('catalogo_plantillas', True)
+        return cacheado
+
+    metricas.registrar_cache('catalogo_plantillas', False)
+    cuerpo = json.dumps(construir_catalogo(tipo), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    etag = hashlib.sha256(cuerpo).hexdigest()[:32]
+    resultado = (version, cuerpo, etag)
+    with _cache_lock:
+        _cache[tipo] = resultado
+    logger.info(f"📚 Catálogo de plantillas {tipo} reconstruido ({len(cuerpo)} bytes)")
+    return resultado
@@ -11,18 +11,230 @@ import requests
 import base64
 from typing import Dict, List, Optional, Any
 import logging
+from services.metricas import medir_llm, funcion_llm
+from services.presupuesto_tokens import estimar_pedido, estimar_tokens, recortar_historial
+from services.contexto_chat import sin_imagenes
 
 logger = logging.getLogger(__name__)
 
 # Importar herramientas de base de datos
 try:
-    from services.asistente_db_tools import TOOLS, ejecutar_funcion
+    from services.asistente_db_tools import TOOLS, ejecutar_herramientas
     TOOLS_DISPONIBLES = True
 except ImportError as e:
     logger.warning(f"⚠️ No se pudieron importar las herramientas de base de datos: {e}")
     TOOLS_DISPONIBLES = False
     TOOLS = []
-    ejecutar_funcion = None
+    ejecutar_herramientas = None
+
+# Punto de cache de prompts del proveedor (vigencia de 5 minutos, renovada en cada acierto)
+CACHE_EFIMERO = {"type": "ephemeral"}
+
+
+def _marcar_ultimo_mensaje(messages: List[Dict]) -> List[Dict]:
+    """Copia de los mensajes con cache_control en el último bloque del último mensaje"""
+    if not messages:
+        return messages
+    ultimo = dict(messages[-1])
+    contenido = ultimo.get('content')
+    if isinstance(contenido, str):
+        contenido = [{"type": "text", "text": contenido}]
+    elif isinstance(contenido, list) and contenido:
+        contenido = list(contenido)
+    else:
+        return messages
+    contenido[-1] = {**contenido[-1], "cache_control": CACHE_EFIMERO}
+    ultimo['content'] = contenido
+    return messages[:-1] + [ultimo]
+
+
+# Prompts de sistema: constantes del módulo para que el prefijo que se cachea en
+# el proveedor (tools + system) sea idéntico byte a byte entre llamadas
+PROMPT_SUGERIR_PAP = """Eres un asistente especializado en citología cervicovaginal (PAP). 
+Tu trabajo es sugerir plantillas apropiadas basadas en el contexto del caso.
+
+Las categorías de plantillas son:
+- T (Trófoco): Para extendidos normales y bien representativos
+- H (Hipotrófoco): Para conformación celular y células adicionales
+- A (Atrófico): Para componente inflamatorio y flora
+- I (Inflamatorio): Para diagnósticos
+
+Responde en formato JSON con:
+{
+    "sugerencias": [
+        {
+            "categoria": "T",
+            "codigo": "T1",
+            "razon": "Explicación de por qué esta plantilla es apropiada"
+        }
+    ],
+    "confianza": 0.85,
+    "observaciones": "Notas adicionales sobre el caso"
+}"""
+
+PROMPT_ANALIZAR_CASO = """Eres un patólogo experto en citología. Analiza casos de PAP y proporciona 
+recomendaciones profesionales basadas en los datos clínicos y hallazgos.
+
+Responde en formato JSON con:
+{
+    "diagnostico_sugerido": "Diagnóstico más probable",
+    "plantillas_recomendadas": ["T1", "A2", "I3"],
+    "nivel_complejidad": "simple|moderado|complejo",
+    "observaciones": "Análisis detallado del caso",
+    "recomendaciones": ["Recomendación 1", "Recomendación 2"]
+}"""
+
+PROMPT_GENERAR_INFORME = """Eres un patólogo experto. Genera informes de PAP profesionales 
+basados en las plantillas seleccionadas y el contexto del caso.
+
+El informe debe ser:
+- Profesional y técnicamente correcto
+- Bien estructurado por secciones
+- Coherente y fluido
+- Apropiado para el contexto clínico"""
+
+PROMPT_CASOS_SIMILARES = """Eres un asistente que ayuda a encontrar casos similares en citología.
+Basándote en los criterios proporcionados, sugiere plantillas que podrían ser apropiadas
+para casos similares."""
+
+PROMPT_RESUMEN_CHAT = """Resumes conversaciones entre un usuario del sistema LDH (laboratorio de anatomía patológica) y su asistente.
+Recibes el resumen anterior (si hay) y los turnos nuevos. Devuelve un único resumen actualizado, en español, de no más de 250 palabras, que conserve:
+- protocolos, pacientes, diagnósticos, cifras y fechas mencionados
+- hallazgos de las imágenes analizadas
+- decisiones tomadas y preguntas pendientes
+Responde solo con el resumen, sin introducción."""
+
+PROMPT_CHAT_MEDICO = """Eres un asistente inteligente especializado en anatomía patológica y citología. 
+Ayudas a médicos patólogos en su trabajo diario con el sistema LDH.
+
+TUS CAPACIDADES:
+- Responder preguntas sobre protocolos, diagnósticos y casos
+- Buscar casos similares en el histórico
+- Sugerir plantillas y diagnósticos apropiados
+- Analizar datos y generar reportes
+- Analizar imágenes médicas (fotomicrografías, imágenes macroscópicas, citologías, etc.)
+- Ayudar con navegación en el sistema
+
+ANÁLISIS DE IMÁGENES MÉDICAS:
+IMPORTANTE: Tienes capacidad completa para analizar imágenes médicas. Puedes ver y procesar imágenes adjuntas.
+Cuando el usuario adjunta imágenes médicas, DEBES analizarlas y proporcionar:
+- Descripción detallada de hallazgos macroscópicos o microscópicos
+- Identificación de estructuras celulares o tisulares
+- Sugerencias de diagnósticos basadas en los hallazgos visuales
+- Correlación con datos clínicos cuando estén disponibles
+- Observaciones relevantes para el caso
+- Descripción de características histológicas o citológicas observadas
+
+NO digas que no puedes analizar imágenes. Si el usuario adjunta una imagen, es porque espera que la analices.
+
+TUS RESPUESTAS DEBEN SER:
+- Profesionales y técnicamente precisas
+- Concisas pero completas
+- En español argentino (vos/tu)
+- Útiles y prácticas
+- BASADAS ÚNICAMENTE EN LA INFORMACIÓN REAL DEL SISTEMA LDH
+
+CONSULTAS A LA BASE DE DATOS:
+Tienes acceso a herramientas que te permiten consultar datos reales del sistema. Cuando el usuario pregunte sobre:
+- Prestadores con más pacientes
+- Pacientes con múltiples protocolos
+- Estadísticas de protocolos
+- Cualquier dato estadístico o de consulta
+
+DEBES usar las herramientas disponibles en lugar de decir que no tienes acceso a los datos.
+Siempre usa las herramientas cuando el usuario pregunte por información estadística o datos específicos del sistema.
+
+INFORMACIÓN IMPORTANTE DEL SISTEMA LDH:
+
+ESTADOS DE PROTOCOLOS (solo estos existen realmente):
+- PENDIENTE: Protocolo creado pero aún no iniciado su procesamiento
+- EN_PROCESO: Protocolo que está siendo trabajado actualmente
+- COMPLETADO: Protocolo finalizado con informe completado
+
+Los protocolos pueden editarse solo si están en estado PENDIENTE o EN_PROCESO.
+Cuando un protocolo se completa, pasa a estado COMPLETADO y ya no puede editarse.
+
+TIPOS DE ESTUDIOS:
+- BIOPSIA
+- CITOLOGIA
+- PAP (Citología cérvico vaginal)
+
+IMPORTANTE: Si no estás seguro de algo sobre el sistema, di que no estás seguro en lugar de inventar información. 
+Nunca inventes estados, funcionalidades o características que no se mencionen explícitamente.
+
+DETECCIÓN DE INTENCIONES:
+Cuando el usuario pide buscar, analizar o navegar, identifica la intención y estructura tu respuesta.
+
+Responde de forma natural y conversacional, como un colega experto."""
+
+PROMPT_CHAT_ADMINISTRADOR = """Eres un asistente inteligente para administradores del sistema LDH.
+
+TUS CAPACIDADES:
+- Analizar estadísticas y reportes
+- Gestionar usuarios y permisos
+- Generar reportes administrativos
+- Ayudar con configuración del sistema
+
+TUS RESPUESTAS DEBEN SER:
+- Profesionales y enfocadas en gestión
+- BASADAS ÚNICAMENTE EN LA INFORMACIÓN REAL DEL SISTEMA LDH
+
+CONSULTAS A LA BASE DE DATOS:
+Tienes acceso a herramientas que te permiten consultar datos reales del sistema. Cuando el usuario pregunte sobre:
+- Prestadores con más pacientes
+- Pacientes con múltiples protocolos
+- Estadísticas de protocolos
+- Cualquier dato estadístico o de consulta
+
+DEBES usar las herramientas disponibles en lugar de decir que no tienes acceso a los datos.
+Siempre usa las herramientas cuando el usuario pregunte por información estadística o datos específicos del sistema.
+
+INFORMACIÓN IMPORTANTE DEL SISTEMA LDH:
+
+ESTADOS DE PROTOCOLOS (solo estos existen realmente):
+- PENDIENTE: Protocolo creado pero aún no iniciado su procesamiento
+- EN_PROCESO: Protocolo que está siendo trabajado actualmente
+- COMPLETADO: Protocolo finalizado con informe completado
+
+IMPORTANTE: Si no estás seguro de algo sobre el sistema, di que no estás seguro en lugar de inventar información. 
+Nunca inventes estados, funcionalidades o características que no se mencionen explícitamente.
+
+Responde de forma profesional y enfocada en gestión."""
+
+PROMPT_CHAT_PERSONAL = """Eres un asistente inteligente para el personal técnico y administrativo del sistema LDH.
+
+TUS CAPACIDADES:
+- Buscar protocolos y casos
+- Generar reportes
+- Resolver dudas sobre el sistema
+- Ayudar con tareas administrativas
+
+TUS RESPUESTAS DEBEN SER:
+- Claras y prácticas
+- BASADAS ÚNICAMENTE EN LA INFORMACIÓN REAL DEL SISTEMA LDH
+
+CONSULTAS A LA BASE DE DATOS:
+Tienes acceso a herramientas que te permiten consultar datos reales del sistema. Cuando el usuario pregunte sobre:
+- Prestadores con más pacientes
+- Pacientes con múltiples protocolos
+- Estadísticas de protocolos
+- Cualquier dato estadístico o de consulta
+
+DEBES usar las herramientas disponibles en lugar de decir que no tienes acceso a los datos.
+Siempre usa las herramientas cuando el usuario pregunte por información estadística o datos específicos del sistema.
+
+INFORMACIÓN IMPORTANTE DEL SISTEMA LDH:
+
+ESTADOS DE PROTOCOLOS (solo estos existen realmente):
+- PENDIENTE: Protocolo creado pero aún no iniciado su procesamiento
+- EN_PROCESO: Protocolo que está siendo trabajado actualmente
+- COMPLETADO: Protocolo finalizado con informe completado
+
+IMPORTANTE: Si no estás seguro de algo sobre el sistema, di que no estás seguro en lugar de inventar información. 
+Nunca inventes estados, funcionalidades o características que no se mencionen explícitamente.
+
+Responde de forma clara y práctica."""
+
 
 class ClaudeClient:
     """Cliente para interactuar con Claude API"""
@@ -42,8 +254,12 @@ class ClaudeClient:
         try:
             from flask import current_app
             modelo_config = current_app.config.get('CLAUDE_MODEL')
+            self.prompt_cache = current_app.config.get('CLAUDE_PROMPT_CACHE', True)
+            self.presupuesto_entrada = current_app.config.get('CLAUDE_PRESUPUESTO_ENTRADA', 30000)
         except:
             modelo_config = None
+            self.prompt_cache = True
+            self.presupuesto_entrada = 30000
         
         if modelo:
             self.model = modelo
@@ -128,23 +344,40 @@ class ClaudeClient:
                 'modelo': modelo_a_probar
             }
     
-    def _make_request(self, messages: List[Dict], max_tokens: int = 1000, system: str = None, timeout: int = 60, tools: List[Dict] = None) -> Dict:
-        """Hacer petición a Claude API"""
+    @medir_llm('claude')
+    def _make_request(self, messages: List[Dict], max_tokens: int = 1000, system: str = None, timeout: int = 60, tools: List[Dict] = None, tool_choice: Dict = None, cachear_mensajes: bool = False, system_extra: str = None) -> Dict:
+        """
+        Hacer petición a Claude API
+        
+        Con el cache de prompts activo (CLAUDE_PROMPT_CACHE) marca el system
+        prompt como punto de cache: el proveedor reutiliza tools + system entre
+        llamadas. Con cachear_mensajes también marca el último mensaje, para que
+        las iteraciones siguientes de una misma conversación reutilicen todo lo
+        anterior. system_extra (p. ej. el resumen de la conversación) va en un
+        bloque aparte, después del punto de cache, para no invalidarlo.
+        """
         if not self.is_configured():
             raise ValueError("Claude API key no está configurada")
         
+        cachear = self.prompt_cache
         payload = {
             "model": self.model,
             "max_tokens": max_tokens,
-            "messages": messages
+            "messages": _marcar_ultimo_mensaje(messages) if cachear and cachear_mensajes else messages
         }
         
-        if system:
-            payload["system"] = system
+        if system and cachear:
+            payload["system"] = [{"type": "text", "text": system, "cache_control": CACHE_EFIMERO}]
+            if system_extra:
+                payload["system"].append({"type": "text", "text": system_extra})
+        elif system:
+            payload["system"] = f"{system}\n\n{system_extra}" if system_extra else system
         
         # Agregar tools si están disponibles
         if tools and len(tools) > 0:
             payload["tools"] = tools
+            if tool_choice:
+                payload["tool_choice"] = tool_choice
         
         try:
             response = requests.post(
@@ -187,30 +420,11 @@ class ClaudeClient:
             logger.error(f"Error en petición a Claude: {e}")
             raise Exception(f"Error comunicándose con Claude: {str(e)}")
     
+    @funcion_llm('sugerir_plantillas_pap')
     def sugerir_plantillas_pap(self, contexto: Dict) -> Dict:
         """Sugerir plantillas PAP basadas en contexto"""
         
-        system_prompt = """Eres un asistente especializado en citología cervicovaginal (PAP). 
-        Tu trabajo es sugerir plantillas apropiadas basadas en el contexto del caso.
-        
-        Las categorías de plantillas son:
-        - T (Trófoco): Para extendidos normales y bien representativos
-        - H (Hipotrófoco): Para conformación celular y células adicionales
-        - A (Atrófico): Para componente inflamatorio y flora
-        - I (Inflamatorio): Para diagnósticos
-        
-        Responde en formato JSON con:
-        {
-            "sugerencias": [
-                {
-                    "categoria": "T",
-                    "codigo": "T1",
-                    "razon": "Explicación de por qué esta plantilla es apropiada"
-                }
-            ],
-            "confianza": 0.85,
-            "observaciones": "Notas adicionales sobre el caso"
-        }"""
+        system_prompt = PROMPT_SUGERIR_PAP
         
         user_prompt = f"""Analiza este contexto de PAP y sugiere plantillas apropiadas:
         
@@ -250,20 +464,11 @@ class ClaudeClient:
                 "error": str(e)
             }
     
+    @funcion_llm('analizar_caso_completo')
     def analizar_caso_completo(self, datos_caso: Dict) -> Dict:
         """Analizar un caso completo y sugerir enfoque"""
         
-        system_prompt = """Eres un patólogo experto en citología. Analiza casos de PAP y proporciona 
-        recomendaciones profesionales basadas en los datos clínicos y hallazgos.
-        
-        Responde en formato JSON con:
-        {
-            "diagnostico_sugerido": "Diagnóstico más probable",
-            "plantillas_recomendadas": ["T1", "A2", "I3"],
-            "nivel_complejidad": "simple|moderado|complejo",
-            "observaciones": "Análisis detallado del caso",
-            "recomendaciones": ["Recomendación 1", "Recomendación 2"]
-        }"""
+        system_prompt = PROMPT_ANALIZAR_CASO
         
         user_prompt = f"""Analiza este caso completo de PAP:
         
@@ -304,17 +509,11 @@ class ClaudeClient:
                 "error": str(e)
             }
     
+    @funcion_llm('generar_informe')
     def generar_informe(self, plantillas_seleccionadas: List[Dict], contexto: Dict) -> str:
         """Generar informe basado en plantillas seleccionadas"""
         
-        system_prompt = """Eres un patólogo experto. Genera informes de PAP profesionales 
-        basados en las plantillas seleccionadas y el contexto del caso.
-        
-        El informe debe ser:
-        - Profesional y técnicamente correcto
-        - Bien estructurado por secciones
-        - Coherente y fluido
-        - Apropiado para el contexto clínico"""
+        system_prompt = PROMPT_GENERAR_INFORME
         
         plantillas_texto = "\n".join([
             f"- {p.get('codigo', 'N/A')}: {p.get('texto', '')}"
@@ -344,12 +543,11 @@ class ClaudeClient:
             logger.error(f"Error en generar_informe: {e}")
             return f"Error generando informe: {str(e)}"
     
+    @funcion_llm('buscar_casos_similares')
     def buscar_casos_similares(self, criterios: Dict) -> Dict:
         """Buscar casos similares basados en criterios"""
         
-        system_prompt = """Eres un asistente que ayuda a encontrar casos similares en citología.
-        Basándote en los criterios proporcionados, sugiere plantillas que podrían ser apropiadas
-        para casos similares."""
+        system_prompt = PROMPT_CASOS_SIMILARES
         
         user_prompt = f"""Busca casos similares basados en estos criterios:
         
@@ -380,7 +578,26 @@ class ClaudeClient:
                 "confianza": 0.0
             }
     
-    def chat_conversacional(self, mensaje: str, historial: List[Dict] = None, contexto_usuario: Dict = None, imagenes: List[Dict] = None) -> Dict:
+    @funcion_llm('resumir_conversacion')
+    def resumir_conversacion(self, resumen_anterior: Optional[str], turnos: List) -> str:
+        """
+        Resumen acumulado de una conversación del chat
+        
+        Args:
+            resumen_anterior: Resumen de los turnos previos (o None)
+            turnos: Lista de (mensaje del usuario, respuesta del asistente)
+        
+        Returns:
+            Texto del resumen actualizado
+        """
+        dialogo = "\n\n".join(f"Usuario: {mensaje}\nAsistente: {respuesta}" for mensaje, respuesta in turnos)
+        user_prompt = (f"RESUMEN ANTERIOR:\n{resumen_anterior}\n\n" if resumen_anterior else "") + f"TURNOS NUEVOS:\n{dialogo}"
+        response = self._make_request([{"role": "user", "content": user_prompt}], max_tokens=500,
+                                      system=PROMPT_RESUMEN_CHAT, timeout=30)
+        return "".join(item.get('text', '') for item in response.get('content', []) if item.get('type') == 'text').strip()
+    
+    @funcion_llm('chat_conversacional')
+    def chat_conversacional(self, mensaje: str, historial: List[Dict] = None, contexto_usuario: Dict = None, imagenes: List[Dict] = None, resumen: str = None) -> Dict:
         """
         Chat conversacional con Claude API para usuarios internos
         
@@ -389,6 +606,7 @@ class ClaudeClient:
             historial: Lista de mensajes anteriores en formato [{"role": "user|assistant", "content": "..."}]
             contexto_usuario: Información del usuario (rol, permisos, etc.)
             imagenes: Lista de imágenes en formato [{"data": "base64", "media_type": "image/png", "nombre": "..."}]
+            resumen: Resumen de los turnos anteriores al historial (services/contexto_chat)
         
         Returns:
             Dict con respuesta y acciones opcionales
@@ -401,146 +619,22 @@ class ClaudeClient:
         es_medico = contexto_usuario.get('es_medico', False) if contexto_usuario else False
         
         if es_medico or 'medico' in rol or 'patologo' in rol:
-            system_prompt = """Eres un asistente inteligente especializado en anatomía patológica y citología. 
-            Ayudas a médicos patólogos en su trabajo diario con el sistema LDH.
-            
-            TUS CAPACIDADES:
-            - Responder preguntas sobre protocolos, diagnósticos y casos
-            - Buscar casos similares en el histórico
-            - Sugerir plantillas y diagnósticos apropiados
-            - Analizar datos y generar reportes
-            - Analizar imágenes médicas (fotomicrografías, imágenes macroscópicas, citologías, etc.)
-            - Ayudar con navegación en el sistema
-            
-            ANÁLISIS DE IMÁGENES MÉDICAS:
-            IMPORTANTE: Tienes capacidad completa para analizar imágenes médicas. Puedes ver y procesar imágenes adjuntas.
-            Cuando el usuario adjunta imágenes médicas, DEBES analizarlas y proporcionar:
-            - Descripción detallada de hallazgos macroscópicos o microscópicos
-            - Identificación de estructuras celulares o tisulares
-            - Sugerencias de diagnósticos basadas en los hallazgos visuales
-            - Correlación con datos clínicos cuando estén disponibles
-            - Observaciones relevantes para el caso
-            - Descripción de características histológicas o citológicas observadas
-            
-            NO digas que no puedes analizar imágenes. Si el usuario adjunta una imagen, es porque espera que la analices.
-            
-            TUS RESPUESTAS DEBEN SER:
-            - Profesionales y técnicamente precisas
-            - Concisas pero completas
-            - En español argentino (vos/tu)
-            - Útiles y prácticas
-            - BASADAS ÚNICAMENTE EN LA INFORMACIÓN REAL DEL SISTEMA LDH
-            
-            CONSULTAS A LA BASE DE DATOS:
-            Tienes acceso a herramientas que te permiten consultar datos reales del sistema. Cuando el usuario pregunte sobre:
-            - Prestadores con más pacientes
-            - Pacientes con múltiples protocolos
-            - Estadísticas de protocolos
-            - Cualquier dato estadístico o de consulta
-            
-            DEBES usar las herramientas disponibles en lugar de decir que no tienes acceso a los datos.
-            Siempre usa las herramientas cuando el usuario pregunte por información estadística o datos específicos del sistema.
-            
-            INFORMACIÓN IMPORTANTE DEL SISTEMA LDH:
-            
-            ESTADOS DE PROTOCOLOS (solo estos existen realmente):
-            - PENDIENTE: Protocolo creado pero aún no iniciado su procesamiento
-            - EN_PROCESO: Protocolo que está siendo trabajado actualmente
-            - COMPLETADO: Protocolo finalizado con informe completado
-            
-            Los protocolos pueden editarse solo si están en estado PENDIENTE o EN_PROCESO.
-            Cuando un protocolo se completa, pasa a estado COMPLETADO y ya no puede editarse.
-            
-            TIPOS DE ESTUDIOS:
-            - BIOPSIA
-            - CITOLOGIA
-            - PAP (Citología cérvico vaginal)
-            
-            IMPORTANTE: Si no estás seguro de algo sobre el sistema, di que no estás seguro en lugar de inventar información. 
-            Nunca inventes estados, funcionalidades o características que no se mencionen explícitamente.
-            
-            DETECCIÓN DE INTENCIONES:
-            Cuando el usuario pide buscar, analizar o navegar, identifica la intención y estructura tu respuesta.
-            
-            Responde de forma natural y conversacional, como un colega experto."""
+            system_prompt = PROMPT_CHAT_MEDICO
         
         elif 'administrador' in rol or 'admin' in rol:
-            system_prompt = """Eres un asistente inteligente para administradores del sistema LDH.
-            
-            TUS CAPACIDADES:
-            - Analizar estadísticas y reportes
-            - Gestionar usuarios y permisos
-            - Generar reportes administrativos
-            - Ayudar con configuración del sistema
-            
-            TUS RESPUESTAS DEBEN SER:
-            - Profesionales y enfocadas en gestión
-            - BASADAS ÚNICAMENTE EN LA INFORMACIÓN REAL DEL SISTEMA LDH
-            
-            CONSULTAS A LA BASE DE DATOS:
-            Tienes acceso a herramientas que te permiten consultar datos reales del sistema. Cuando el usuario pregunte sobre:
-            - Prestadores con más pacientes
-            - Pacientes con múltiples protocolos
-            - Estadísticas de protocolos
-            - Cualquier dato estadístico o de consulta
-            
-            DEBES usar las herramientas disponibles en lugar de decir que no tienes acceso a los datos.
-            Siempre usa las herramientas cuando el usuario pregunte por información estadística o datos específicos del sistema.
-            
-            INFORMACIÓN IMPORTANTE DEL SISTEMA LDH:
-            
-            ESTADOS DE PROTOCOLOS (solo estos existen realmente):
-            - PENDIENTE: Protocolo creado pero aún no iniciado su procesamiento
-            - EN_PROCESO: Protocolo que está siendo trabajado actualmente
-            - COMPLETADO: Protocolo finalizado con informe completado
-            
-            IMPORTANTE: Si no estás seguro de algo sobre el sistema, di que no estás seguro en lugar de inventar información. 
-            Nunca inventes estados, funcionalidades o características que no se mencionen explícitamente.
-            
-            Responde de forma profesional y enfocada en gestión."""
+            system_prompt = PROMPT_CHAT_ADMINISTRADOR
         
         else:
             # Para técnicos, secretarias, etc.
-            system_prompt = """Eres un asistente inteligente para el personal técnico y administrativo del sistema LDH.
-            
-            TUS CAPACIDADES:
-            - Buscar protocolos y casos
-            - Generar reportes
-            - Resolver dudas sobre el sistema
-            - Ayudar con tareas administrativas
-            
-            TUS RESPUESTAS DEBEN SER:
-            - Claras y prácticas
-            - BASADAS ÚNICAMENTE EN LA INFORMACIÓN REAL DEL SISTEMA LDH
-            
-            CONSULTAS A LA BASE DE DATOS:
-            Tienes acceso a herramientas que te permiten consultar datos reales del sistema. Cuando el usuario pregunte sobre:
-            - Prestadores con más pacientes
-            - Pacientes con múltiples protocolos
-            - Estadísticas de protocolos
-            - Cualquier dato estadístico o de consulta
-            
-            DEBES usar las herramientas disponibles en lugar de decir que no tienes acceso a los datos.
-            Siempre usa las herramientas cuando el usuario pregunte por información estadística o datos específicos del sistema.
-            
-            INFORMACIÓN IMPORTANTE DEL SISTEMA LDH:
-            
-            ESTADOS DE PROTOCOLOS (solo estos existen realmente):
-            - PENDIENTE: Protocolo creado pero aún no iniciado su procesamiento
-            - EN_PROCESO: Protocolo que está siendo trabajado actualmente
-            - COMPLETADO: Protocolo finalizado con informe completado
-            
-            IMPORTANTE: Si no estás seguro de algo sobre el sistema, di que no estás seguro en lugar de inventar información. 
-            Nunca inventes estados, funcionalidades o características que no se mencionen explícitamente.
-            
-            Responde de forma clara y práctica."""
+            system_prompt = PROMPT_CHAT_PERSONAL
         
         # Construir historial de mensajes
         messages = []
         
-        # Agregar historial si existe
+        # Agregar historial si existe (las imágenes de turnos anteriores no se reenvían)
         if historial:
-            messages.extend(historial)
+            messages.extend(sin_imagenes(historial))
+        system_extra = f"RESUMEN DE LA CONVERSACIÓN ANTERIOR:\n{resumen}" if resumen else None
         
         # Agregar mensaje actual con imágenes si existen
         mensaje_contexto = f"{mensaje}"
@@ -638,74 +732,80 @@ class ClaudeClient:
             if TOOLS_DISPONIBLES and TOOLS:
                 tools_a_usar = TOOLS
             
+            # Recortar el historial más viejo si el pedido supera el presupuesto de entrada
+            fijos = estimar_pedido([], system=system_prompt, tools=tools_a_usar) + estimar_tokens(system_extra)
+            messages, descartados = recortar_historial(messages, self.presupuesto_entrada, fijos)
+            if descartados:
+                logger.info(f"✂️ Historial recortado: {descartados} mensaje(s) descartados para entrar en "
+                            f"{self.presupuesto_entrada} tokens (≈{estimar_pedido(messages, system_prompt, tools_a_usar)})")
+            
             # Iterar hasta obtener respuesta final (manejando tool calls)
             max_iteraciones = 5  # Máximo de iteraciones para evitar loops infinitos
             iteracion = 0
             contenido_final = ""
             
             while iteracion < max_iteraciones:
+                # Las tools van en todas las iteraciones (la API las exige si el historial
+                # tiene tool_use); en la última se pide la respuesta sin más herramientas
+                ultima = iteracion == max_iteraciones - 1
                 response = self._make_request(
                     messages=messages,
                     max_tokens=max_tokens,
                     system=system_prompt,
                     timeout=timeout,
-                    tools=tools_a_usar if iteracion == 0 else None  # Solo enviar tools en primera iteración
+                    tools=tools_a_usar,
+                    tool_choice={"type": "none"} if ultima else None,
+                    cachear_mensajes=True,
+                    system_extra=system_extra
                 )
                 
-                # Verificar si Claude quiere usar una herramienta
+                # Verificar si Claude quiere usar herramientas
                 content_items = response.get('content', [])
                 stop_reason = response.get('stop_reason', '')
+                tool_use_items = [item for item in content_items if item.get('type') == 'tool_use']
                 
-                if stop_reason == 'tool_use' and content_items:
-                    # Claude quiere usar una herramienta
-                    tool_use_item = None
-                    text_content = ""
-                    
-                    for item in content_items:
-                        if item.get('type') == 'tool_use':
-                            tool_use_item = item
-                        elif item.get('type') == 'text':
-                            text_content += item.get('text', '')
-                    
-                    if tool_use_item:
-                        tool_name = tool_use_item.get('name')
-                        tool_input = tool_use_item.get('input', {})
-                        tool_id = tool_use_item.get('id')
+                if stop_reason == 'tool_use' and tool_use_items:
+                    if ejecutar_herramientas:
+                        logger.info(f"🔧 Claude quiere usar {len(tool_use_items)} herramienta(s): " +
+                                    ", ".join(f"{item.get('name')}({item.get('input', {})})" for item in tool_use_items))
                         
-                        logger.info(f"🔧 Claude quiere usar herramienta: {tool_name} con input: {tool_input}")
+                        # Ejecutar todas las herramientas de la respuesta en paralelo
+                        resultados = ejecutar_herramientas(
+                            [(item.get('name'), item.get('input', {})) for item in tool_use_items]
+                        )
                         
-                        # Ejecutar la función
-                        if ejecutar_funcion:
-                            resultado = ejecutar_funcion(tool_name, tool_input)
-                            
-                            # Agregar mensaje del asistente con tool_use
-                            messages.append({
-                                "role": "assistant",
-                                "content": content_items
-                            })
-                            
-                            # Convertir resultado a JSON string para que Claude pueda procesarlo
-                            import json
+                        # Agregar mensaje del asistente con los tool_use
+                        messages.append({
+                            "role": "assistant",
+                            "content": content_items
+                        })
+                        
+                        # Todos los resultados en un único mensaje, uno por tool_use
+                        tool_results = []
+                        for item, resultado in zip(tool_use_items, resultados):
                             try:
                                 resultado_json = json.dumps(resultado, ensure_ascii=False, indent=2, default=str)
                             except Exception as e:
                                 logger.warning(f"⚠️ Error serializando resultado a JSON: {e}, usando str()")
                                 resultado_json = str(resultado)
-                            
-                            # Agregar resultado de la herramienta
-                            messages.append({
-                                "role": "user",
-                                "content": [{
-                                    "type": "tool_result",
-                                    "tool_use_id": tool_id,
-                                    "content": resultado_json
-                                }]
-                            })
-                            
-                            iteracion += 1
-                            continue  # Continuar loop para obtener respuesta final de Claude
-                        else:
-                            logger.error("⚠️ ejecutar_funcion no está disponible")
+                            tool_result = {
+                                "type": "tool_result",
+                                "tool_use_id": item.get('id'),
+                                "content": resultado_json
+                            }
+                            if isinstance(resultado, dict) and resultado.get('success') is False:
+                                tool_result["is_error"] = True
+                            tool_results.append(tool_result)
+                        
+                        messages.append({
+                            "role": "user",
+                            "content": tool_results
+                        })
+                        
+                        iteracion += 1
+                        continue  # Continuar loop para obtener respuesta final de Claude
+                    else:
+                        logger.error("⚠️ ejecutar_herramientas no está disponible")
                     
                 # Si llegamos aquí, Claude no quiere usar herramientas o ya terminó
                 # Extraer texto de la respuesta
@@ -0,0 +1,93 @@
+"""
+Contadores de uso de plantillas con escritura diferida
+
+Cada clic en una línea o plantilla solo suma en memoria; los incrementos
+acumulados se vuelcan en lote (un UPDATE por fila con su total) cada
+USO_CONTADORES_INTERVALO segundos o al juntar USO_CONTADORES_MAX_PENDIENTES
+filas distintas. El volcado corre al terminar un request, sobre una conexión
+propia (no toca la sesión del request), y también al cerrar el proceso
+(services/escritura_diferida).
+
+Las estadísticas (`veces_usado`, `ultima_vez_usado`) quedan eventualmente
+consistentes: pueden ir hasta un intervalo atrasadas respecto de los clics.
+"""
+from collections import defaultdict
+
+from sqlalchemy import update, bindparam, func
+
+from services import metricas
+from services.escritura_diferida import EscritorEnLote
+
+
+def _nuevo():
+    # modelo -> {id de fila: incremento}
+    return defaultdict(lambda: defaultdict(int))
+
+
+def _tamanio(pendientes):
+    return sum(len(por_id) for por_id in pendientes.values())
+
+
+def _tabla_y_clave(modelo):
+    tabla = modelo.__table__
+    return tabla, list(tabla.primary_key.columns)[0]
+
+
+def _escribir(conexion, lote):
+    """Un UPDATE por fila con su incremento total"""
+    for modelo, por_id in lote.items():
+        tabla, clave = _tabla_y_clave(modelo)
+        conexion.execute(
+            update(tabla).where(clave == bindparam('b_id')).values(
+                veces_usado=func.coalesce(tabla.c.veces_usado, 0) + bindparam('b_incremento'),
+                ultima_vez_usado=func.now()
+            ),
+            [{'b_id': id_fila, 'b_incremento': incremento} for id_fila, incremento in por_id.items()]
+        )
+    return _tamanio(lote)
+
+
+def _reencolar(pendientes, lote):
+    for modelo, por_id in lote.items():
+        for id_fila, incremento in por_id.items():
+            pendientes[modelo][id_fila] += incremento
+
+
+_escritor = EscritorEnLote(
+    'contadores de uso', _nuevo, _tamanio, _escribir, _reencolar,
+    'USO_CONTADORES_INTERVALO', 30, 'USO_CONTADORES_MAX_PENDIENTES', 500,
+    al_volcar=lambda filas: metricas.incrementar('ldh_contadores_uso_total', filas, evento='volcado')
+)
+
+
+def registrar_uso(modelo, id_fila):
+    """Sumar un uso a la fila `id_fila` del modelo (LineaPlantilla, PlantillaTexto, ...)"""
+    def sumar(pendientes):
+        pendientes[modelo][id_fila] += 1
+    _escritor.agregar(sumar)
+    metricas.incrementar('ldh_contadores_uso_total', evento='registrado')
+
+
+def pendientes():
+    """Cantidad de filas con incrementos sin volcar"""
+    return _escritor.pendientes()
+
+
+def volcar():
+    """
+    Escribir los incrementos acumulados (requiere app context).
+
+    Returns:
+        Cantidad de filas actualizadas
+    """
+    return _escritor.volcar()
+
+
+def volcar_si_corresponde(config):
+    """Volcar si pasó el intervalo o se acumularon demasiadas filas"""
+    return _escritor.volcar_si_corresponde(config)
+
+
+def init_app(app):
+    """Volcar al final de los requests y al cerrar el proceso"""
+    _escritor.init_app(app)
@@ -0,0 +1,194 @@
+"""
+Ventana de contexto del chat del asistente
+
+Los turnos del chat se guardan en chat_turnos (las imágenes no: el turno queda
+con el análisis textual que devolvió el modelo). Para cada mensaje nuevo se
+arma el contexto de la conversación así:
+
+- los últimos CHAT_TURNOS_TEXTUALES turnos, tal cual (cada uno recortado a
+  MAX_CARACTERES_TURNO)
+- los anteriores, reemplazados por un resumen acumulado guardado en
+  chat_resumenes
+
+El resumen avanza de a CHAT_BLOQUE_RESUMEN turnos: la ventana textual tiene
+entre CHAT_TURNOS_TEXTUALES y CHAT_TURNOS_TEXTUALES + CHAT_BLOQUE_RESUMEN - 1
+turnos, y el resumen solo se regenera (resumen anterior + el bloque que sale
+de la ventana) cuando se completa un bloque. Así el tamaño del pedido queda
+acotado por más largo que sea el trabajo sobre un caso.
+
+Una conversación es la serie de turnos del usuario en el mismo protocolo (o
+en el chat general) a partir del primer turno que el navegador tiene a la
+vista; "Limpiar conversación" empieza una nueva.
+"""
+import logging
+
+from sqlalchemy import select
+
+from extensions import db
+from models.asistente import TurnoChat, ResumenChat
+from services import metricas
+from utils import config_app
+
+logger = logging.getLogger(__name__)
+
+TURNOS_TEXTUALES = 6
+BLOQUE_RESUMEN = 4
+MAX_CARACTERES_TURNO = 4000
+MAX_CARACTERES_RESUMEN = 2500
+# Recorte de cada turno al pasárselo al resumidor
+CARACTERES_TURNO_A_RESUMIR = 1200
+# Turnos por llamada al resumidor (al resumir de una vez una conversación larga)
+TURNOS_POR_RESUMEN = 12
+
+NOTA_IMAGENES = '[{n} imagen(es) adjunta(s); el análisis está en la respuesta]'
+
+
+
+def _recortar(texto, maximo):
+    texto = texto or ''
+    return texto if len(texto) <= maximo else texto[:maximo].rstrip() + ' […]'
+
+
+def texto_usuario(turno):
+    """Mensaje del usuario de un turno, con la nota de imágenes si las tenía"""
+    mensaje = turno.mensaje or ''
+    if turno.imagenes:
+        nota = NOTA_IMAGENES.format(n=turno.imagenes)
+        mensaje = f'{mensaje}\n\n{nota}' if mensaje else nota
+    return mensaje
+
+
+def sin_imagenes(messages):
+    """
+    Mensajes sin bloques de imagen: cada imagen de un turno anterior se
+    reemplaza por una nota (su análisis ya está en la respuesta del asistente).
+    """
+    resultado = []
+    for mensaje in messages:
+        contenido = mensaje.get('content')
+        if isinstance(contenido, list) and any(isinstance(b, dict) and b.get('type') == 'image' for b in contenido):
+            imagenes = sum(1 for b in contenido if isinstance(b, dict) and b.get('type') == 'image')
+            contenido = [b for b in contenido if not (isinstance(b, dict) and b.get('type') == 'image')]
+            contenido.append({'type': 'text', 'text': NOTA_IMAGENES.format(n=imagenes)})
+            mensaje = {**mensaje, 'content': contenido}
+        resultado.append(mensaje)
+    return resultado
+
+
+def registrar_turno(usuario_id, protocolo_id, mensaje, respuesta, imagenes=0, modelo=None):
+    """Guardar un turno del chat (hace falta commit del llamador)"""
+    turno = TurnoChat(usuario_id=usuario_id, protocolo_id=protocolo_id, mensaje=mensaje or '',
+                      respuesta=respuesta or '', imagenes=imagenes or 0, modelo=modelo)
+    db.session.add(turno)
+    db.session.flush()
+    return turno
+
+
+def _filtro_conversacion(usuario_id, protocolo_id, desde_turno_id):
+    t = TurnoChat.__table__
+    filtros = [t.c.usuario_id == usuario_id, t.c.turno_id >= desde_turno_id]
+    filtros.append(t.c.protocolo_id == protocolo_id if protocolo_id else t.c.protocolo_id.is_(None))
+    return filtros
+
+
+def _turnos(usuario_id, protocolo_id, desde, hasta=None, despues_de=None):
+    """Turnos de la conversación con turno_id en (despues_de, hasta]"""
+    consulta = TurnoChat.query.filter(*_filtro_conversacion(usuario_id, protocolo_id, desde))
+    if despues_de is not None:
+        consulta = consulta.filter(TurnoChat.turno_id > despues_de)
+    if hasta is not None:
+        consulta = consulta.filter(TurnoChat.turno_id <= hasta)
+    return consulta.order_by(TurnoChat.turno_id).all()
+
+
+def resumir_extractivo(resumen_anterior, turnos):
+    """Resumen sin modelo: el anterior más una línea por turno (respaldo si el modelo falla)"""
+    lineas = [resumen_anterior] if resumen_anterior else []
+    for turno in turnos:
+        lineas.append(f'- Usuario: {_recortar(texto_usuario(turno), 200)} → Asistente: '
+                      f'{_recortar(turno.respuesta, 300)}')
+    texto = '\n'.join(lineas)
+    # Si no entra, se conserva lo más reciente
+    return texto if len(texto) <= MAX_CARACTERES_RESUMEN else '[…] ' + texto[-MAX_CARACTERES_RESUMEN:]
+
+
+def _resumir_con_modelo(resumen_anterior, turnos):
+    from services.claude_client import get_claude_client
+
+    cliente = get_claude_client()
+    if not cliente.is_configured():
+        return resumir_extractivo(resumen_anterior, turnos)
+    dialogo = [(_recortar(texto_usuario(t), CARACTERES_TURNO_A_RESUMIR),
+                _recortar(t.respuesta, CARACTERES_TURNO_A_RESUMIR)) for t in turnos]
+    try:
+        resumen = cliente.resumir_conversacion(resumen_anterior, dialogo)
+    except Exception as e:
+        logger.warning(f"⚠️ No se pudo resumir la conversación con el modelo: {e}")
+        resumen = None
+    return _recortar(resumen, MAX_CARACTERES_RESUMEN) if resumen else resumir_extractivo(resumen_anterior, turnos)
+
+
+def _resumen_hasta(usuario_id, protocolo_id, desde, hasta, resumidor):
+    """Resumen de los turnos desde..hasta, reutilizando el guardado y resumiendo solo lo que falta"""
+    fila = ResumenChat.query.filter_by(usuario_id=usuario_id, desde_turno_id=desde).first()
+    if fila is not None and fila.hasta_turno_id == hasta:
+        metricas.registrar_cache('resumen_chat', True)
+        return fila.resumen
+    metricas.registrar_cache('resumen_chat', False)
+
+    if fila is not None and fila.hasta_turno_id < hasta:
+        resumen, resumidos, despues_de = fila.resumen, fila.turnos_resumidos, fila.hasta_turno_id
+    else:
+        resumen, resumidos, despues_de = None, 0, None
+    pendientes = _turnos(usuario_id, protocolo_id, desde, hasta=hasta, despues_de=despues_de)
+    for i in range(0, len(pendientes), TURNOS_POR_RESUMEN):
+        resumen = resumidor(resumen, pendientes[i:i + TURNOS_POR_RESUMEN])
+    resumidos += len(pendientes)
+
+    if fila is None:
+        fila = ResumenChat(usuario_id=usuario_id, desde_turno_id=desde)
+        db.session.add(fila)
+    fila.hasta_turno_id, fila.turnos_resumidos, fila.resumen = hasta, resumidos, resumen
+    db.session.commit()
+    logger.info(f"🧾 Resumen de conversación actualizado: {resumidos} turno(s), {len(resumen)} caracteres")
+    return resumen
+
+
+def armar_contexto(usuario_id, protocolo_id, desde_turno_id, resumidor=None):
+    """
+    Historial para el modelo: resumen de los turnos viejos y los últimos turnos textuales.
+
+    Args:
+        usuario_id: Usuario de la conversación
+        protocolo_id: Protocolo de la conversación (None = chat general)
+        desde_turno_id: Primer turno de la conversación (None = conversación nueva)
+        resumidor: Función (resumen_anterior, turnos) -> texto; por defecto el modelo
+
+    Returns:
+        (mensajes [{'role', 'content'}], resumen o None)
+    """
+    if not desde_turno_id:
+        return [], None
+    textuales = config_app('CHAT_TURNOS_TEXTUALES', TURNOS_TEXTUALES)
+    bloque = max(config_app('CHAT_BLOQUE_RESUMEN', BLOQUE_RESUMEN), 1)
+
+    t = TurnoChat.__table__
+    ids = db.session.execute(
+        select(t.c.turno_id).where(*_filtro_conversacion(usuario_id, protocolo_id, desde_turno_id))
+        .order_by(t.c.turno_id)
+    ).scalars().all()
+    if not ids:
+        return [], None
+
+    # Resumir de a bloques enteros: el resumen cambia solo cuando la ventana avanza un bloque
+    a_resumir = max(len(ids) - textuales, 0) // bloque * bloque
+    resumen = None
+    if a_resumir:
+        resumen = _resumen_hasta(usuario_id, protocolo_id, ids[0], ids[a_resumir - 1],
+                                 resumidor or _resumir_con_modelo)
+
+    mensajes = []
+    for turno in _turnos(usuario_id, protocolo_id, desde_turno_id, despues_de=ids[a_resumir - 1] if a_resumir else None):
+        mensajes.append({'role': 'user', 'content': _recortar(texto_usuario(turno), MAX_CARACTERES_TURNO)})
+        mensajes.append({'role': 'assistant', 'content': _recortar(turno.respuesta, MAX_CARACTERES_TURNO)})
+    return mensajes, resumen
@@ -0,0 +1,265 @@
+"""
+Despachador de la bandeja de salida de notificaciones
+
+Toma lotes de notificaciones pendientes y las envía reutilizando una única
+conexión SMTP autenticada por lote. Los errores transitorios se reintentan con
+backoff exponencial; los permanentes (o al agotar los reintentos) pasan a
+FALLIDA (dead letter) y quedan para revisión.
+
+Puede correr en un hilo dentro de la aplicación (NOTIFICACIONES_DESPACHADOR_EN_PROCESO)
+o como proceso aparte con `flask despachar-notificaciones`.
+"""
+import logging
+import random
+import smtplib
+import threading
+import uuid
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+from extensions import db
+from models.notificacion import NotificacionSalida
+from services import metricas
+
+logger = logging.getLogger(__name__)
+
+# Tiempo máximo que un lote tomado queda reservado; si el proceso muere a mitad
+# del envío, al vencer vuelve a estar disponible para otro despachador
+DURACION_RESERVA = timedelta(minutes=5)
+
+_hilo = None
+_hilo_lock = threading.Lock()
+_despertar = threading.Event()
+
+
+class _ConexionSMTP:
+    """Conexión SMTP perezosa, reutilizada para todos los mensajes de un lote"""
+
+    def __init__(self, config):
+        self.host = config.get('SMTP_HOST')
+        self.port = config.get('SMTP_PORT', 587)
+        self.usuario = config.get('SMTP_USER')
+        self.password = config.get('SMTP_PASSWORD')
+        self.usar_tls = config.get('SMTP_USE_TLS', True)
+        self.timeout = config.get('NOTIFICACIONES_SMTP_TIMEOUT', 30)
+        self.servidor = None
+
+    def _conectar(self):
+        servidor = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.usar_tls:
+            servidor.starttls()
+        if self.usuario and self.password:
+            servidor.login(self.usuario, self.password)
+        self.servidor = servidor
+
+    def enviar(self, msg):
+        if self.servidor is None:
+            self._conectar()
+        try:
+            self.servidor.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # El servidor cerró la conexión (timeout de inactividad, límite por sesión):
+            # reconectar una vez y reintentar
+            self.servidor = None
+            self._conectar()
+            self.servidor.send_message(msg)
+
+    def cerrar(self):
+        if self.servidor is not None:
+            try:
+                self.servidor.quit()
+            except Exception:
+                pass
+            self.servidor = None
+
+
+def _es_error_permanente(error):
+    """Errores 5xx del servidor (destinatario inválido, rechazo) no se reintentan"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(codigo >= 500 for codigo, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500 and not isinstance(error, smtplib.SMTPAuthenticationError)
+    return False
+
+
+def _espera_reintento(intentos, config):
+    """Backoff exponencial con jitter: base * 2^(intentos-1), con tope"""
+    base = config.get('NOTIFICACIONES_BACKOFF_BASE', 60)
+    tope = config.get('NOTIFICACIONES_BACKOFF_MAXIMO', 3600)
+    segundos = min(tope, base * (2 ** (intentos - 1)))
+    return timedelta(seconds=segundos * random.uniform(0.8, 1.2))
+
+
+def _construir_mensaje(notificacion, remitente):
+    msg = MIMEMultipart()
+    msg['From'] = remitente
+    msg['To'] = notificacion.destinatario
+    msg['Subject'] = notificacion.asunto or ''
+    msg.attach(MIMEText(notificacion.mensaje, 'plain', 'utf-8'))
+    return msg
+
+
+def _tomar_lote(tamanio):
+    """
+    Reservar un lote de notificaciones listas para enviar.
+
+    La reserva es un UPDATE condicionado al estado, por lo que dos despachadores
+    concurrentes nunca toman la misma notificación.
+    """
+    ahora = datetime.utcnow()
+    candidatas = [fila[0] for fila in db.session.query(NotificacionSalida.notificacion_id).filter(
+        NotificacionSalida.estado.in_([NotificacionSalida.PENDIENTE, NotificacionSalida.ENVIANDO]),
+        NotificacionSalida.proximo_intento <= ahora
+    ).order_by(NotificacionSalida.proximo_intento).limit(tamanio).all()]
+    if not candidatas:
+        return []
+
+    lote = uuid.uuid4().hex
+    NotificacionSalida.query.filter(
+        NotificacionSalida.notificacion_id.in_(candidatas),
+        NotificacionSalida.estado.in_([NotificacionSalida.PENDIENTE, NotificacionSalida.ENVIANDO]),
+        NotificacionSalida.proximo_intento <= ahora
+    ).update({
+        'estado': NotificacionSalida.ENVIANDO,
+        'lote': lote,
+        'proximo_intento': ahora + DURACION_RESERVA,
+    }, synchronize_session=False)
+    db.session.commit()
+
+    return NotificacionSalida.query.filter_by(lote=lote).order_by(NotificacionSalida.notificacion_id).all()
+
+
+def _liberar(ids, proximo_intento):
+    """Devolver a PENDIENTE notificaciones reservadas que no llegaron a intentarse"""
+    if not ids:
+        return
+    NotificacionSalida.query.filter(NotificacionSalida.notificacion_id.in_(ids)).update({
+        'estado': NotificacionSalida.PENDIENTE,
+        'lote': None,
+        'proximo_intento': proximo_intento,
+    }, synchronize_session=False)
+    db.session.commit()
+
+
+def procesar_pendientes(config, tamanio_lote=None):
+    """
+    Enviar un lote de notificaciones pendientes (requiere app context).
+
+    Args:
+        config: Configuración de la aplicación (current_app.config)
+        tamanio_lote: Máximo de notificaciones a tomar
+
+    Returns:
+        Dict con la cantidad de enviadas, reintentos programados y fallidas
+    """
+    resumen = {'enviadas': 0, 'reintentos': 0, 'fallidas': 0}
+    if not config.get('SMTP_HOST'):
+        logger.warning("SMTP_HOST no configurado, las notificaciones quedan en la bandeja de salida")
+        return resumen
+
+    lote = _tomar_lote(tamanio_lote or config.get('NOTIFICACIONES_LOTE', 50))
+    if not lote:
+        return resumen
+
+    remitente = config.get('LABORATORIO_EMAIL') or config.get('SMTP_USER') or 'noreply@laboratorio.com'
+    max_intentos = config.get('NOTIFICACIONES_MAX_INTENTOS', 6)
+    conexion = _ConexionSMTP(config)
+    try:
+        for posicion, notificacion in enumerate(lote):
+            notificacion.intentos += 1
+            try:
+                conexion.enviar(_construir_mensaje(notificacion, remitente))
+            except Exception as e:
+                permanente = _es_error_permanente(e)
+                notificacion.ultimo_error = f'{type(e).__name__}: {e}'[:2000]
+                notificacion.lote = None
+                if permanente or notificacion.intentos >= max_intentos:
+                    notificacion.estado = NotificacionSalida.FALLIDA
+                    resumen['fallidas'] += 1
+                    metricas.incrementar('ldh_smtp_envios_total', resultado='fallida')
+                    logger.error(f"❌ Notificación {notificacion.notificacion_id} a {notificacion.destinatario} "
+                                 f"descartada tras {notificacion.intentos} intento(s): {e}")
+                else:
+                    notificacion.estado = NotificacionSalida.PENDIENTE
+                    notificacion.proximo_intento = datetime.utcnow() + _espera_reintento(notificacion.intentos, config)
+                    resumen['reintentos'] += 1
+                    metricas.incrementar('ldh_smtp_envios_total', resultado='reintento')
+                    logger.warning(f"⚠️ Error enviando notificación {notificacion.notificacion_id} "
+                                   f"(intento {notificacion.intentos}): {e}")
+                db.session.commit()
+                if not permanente:
+                    # Falla de conexión o de sesión: liberar el resto del lote sin
+                    # consumir intentos y esperar a la próxima vuelta
+                    _liberar([n.notificacion_id for n in lote[posicion + 1:]],
+                             datetime.utcnow() + _espera_reintento(1, config))
+                    break
+                continue
+
+            notificacion.estado = NotificacionSalida.ENVIADA
+            notificacion.fecha_envio = datetime.utcnow()
+            notificacion.ultimo_error = None
+            notificacion.lote = None
+            resumen['enviadas'] += 1
+            metricas.incrementar('ldh_smtp_envios_total', resultado='ok')
+            # Confirmar cada envío: un corte a mitad del lote no debe reenviar lo ya entregado
+            db.session.commit()
+    finally:
+        conexion.cerrar()
+
+    logger.info(f"📬 Notificaciones: {resumen['enviadas']} enviadas, {resumen['reintentos']} a reintentar, "
+                f"{resumen['fallidas']} fallidas")
+    return resumen
+
+
+def despachar_todo(config, tamanio_lote=None):
+    """Procesar lotes hasta vaciar la bandeja de lo que está listo para enviar"""
+    total = {'enviadas': 0, 'reintentos': 0, 'fallidas': 0}
+    while True:
+        resumen = procesar_pendientes(config, tamanio_lote)
+        for clave, valor in resumen.items():
+            total[clave] += valor
+        if not any(resumen.values()):
+            return total
+
+
+def reencolar_fallidas():
+    """Volver a PENDIENTE las notificaciones FALLIDAS (tras corregir la causa)"""
+    cantidad = NotificacionSalida.query.filter_by(estado=NotificacionSalida.FALLIDA).update({
+        'estado': NotificacionSalida.PENDIENTE,
+        'intentos': 0,
+        'proximo_intento': datetime.utcnow(),
+    }, synchronize_session=False)
+    db.session.commit()
+    return cantidad
+
+
+def despertar():
+    """Pedir al hilo despachador que revise la bandeja sin esperar el intervalo"""
+    _despertar.set()
+
+
+def _bucle(app):
+    intervalo = app.config.get('NOTIFICACIONES_INTERVALO', 15)
+    while True:
+        _despertar.wait(intervalo)
+        _despertar.clear()
+        try:
+            with app.app_context():
+                despachar_todo(app.config)
+        except Exception as e:
+            logger.error(f"Error en el despachador de notificaciones: {e}")
+        finally:
+            with app.app_context():
+                db.session.remove()
+
+
+def iniciar_en_proceso(app):
+    """Iniciar (una sola vez por proceso) el hilo despachador en segundo plano"""
+    global _hilo
+    with _hilo_lock:
+        if _hilo is not None and _hilo.is_alive():
+            return
+        _hilo = threading.Thread(target=_bucle, args=(app,), name='despachador-notificaciones', daemon=True)
+        _hilo.start()
+    _despertar.set()
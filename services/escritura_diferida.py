@@ -0,0 +1,121 @@
+"""
+Escritura diferida en lote
+
+Un EscritorEnLote junta en memoria lo que hay que escribir y lo vuelca sobre una
+conexión propia (no toca la sesión del request): al terminar un request si pasó
+el intervalo configurado o se juntaron demasiados pendientes, y al cerrar el
+proceso. Si el volcado falla, el lote vuelve a la cola para el siguiente. Lo
+usan los contadores de uso de plantillas y el registro de uso de los modelos de IA.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from extensions import db
+
+logger = logging.getLogger(__name__)
+
+
+class EscritorEnLote:
+    """
+    Cola en memoria con volcado en lote.
+
+    Args:
+        descripcion: Qué se escribe, para los mensajes de log
+        nuevo: f() -> cola vacía
+        tamanio: f(cola) -> cantidad de pendientes
+        escribir: f(conexion, lote) -> cantidad escrita, dentro de una transacción
+        reencolar: f(cola, lote) para devolver un lote que no se pudo escribir
+        clave_intervalo, intervalo: Clave de config y segundos por defecto entre volcados
+        clave_maximo, maximo: Clave de config y pendientes por defecto que fuerzan el volcado
+        al_volcar: f(cantidad) opcional, después de cada volcado exitoso
+    """
+
+    def __init__(self, descripcion, nuevo, tamanio, escribir, reencolar,
+                 clave_intervalo, intervalo, clave_maximo, maximo, al_volcar=None):
+        self.descripcion = descripcion
+        self._nuevo = nuevo
+        self._tamanio = tamanio
+        self._escribir = escribir
+        self._reencolar = reencolar
+        self._clave_intervalo, self._intervalo = clave_intervalo, intervalo
+        self._clave_maximo, self._maximo = clave_maximo, maximo
+        self._al_volcar = al_volcar
+        self._pendientes = nuevo()
+        self._lock = threading.Lock()
+        self._ultimo_volcado = time.monotonic()
+        self._app = None
+        self._atexit_registrado = False
+
+    def agregar(self, funcion):
+        """Modificar la cola con el lock tomado: funcion(cola)"""
+        with self._lock:
+            funcion(self._pendientes)
+
+    def pendientes(self):
+        with self._lock:
+            return self._tamanio(self._pendientes)
+
+    def volcar(self):
+        """
+        Escribir lo acumulado (requiere app context).
+
+        Returns:
+            Cantidad escrita
+        """
+        with self._lock:
+            lote, self._pendientes = self._pendientes, self._nuevo()
+            self._ultimo_volcado = time.monotonic()
+        if not self._tamanio(lote):
+            return 0
+        try:
+            with db.engine.begin() as conexion:
+                cantidad = self._escribir(conexion, lote)
+        except Exception as e:
+            # Devolver el lote para el próximo volcado
+            with self._lock:
+                self._reencolar(self._pendientes, lote)
+            logger.error(f"Error volcando {self.descripcion}: {e}")
+            return 0
+        if self._al_volcar:
+            self._al_volcar(cantidad)
+        return cantidad
+
+    def volcar_si_corresponde(self, config):
+        """Volcar si pasó el intervalo o se acumularon demasiados pendientes"""
+        with self._lock:
+            cantidad = self._tamanio(self._pendientes)
+            if not cantidad:
+                return 0
+            vencido = time.monotonic() - self._ultimo_volcado >= config.get(self._clave_intervalo, self._intervalo)
+            lleno = cantidad >= config.get(self._clave_maximo, self._maximo)
+        if vencido or lleno:
+            return self.volcar()
+        return 0
+
+    def _volcar_al_salir(self):
+        if self._app is None:
+            return
+        try:
+            with self._app.app_context():
+                cantidad = self.volcar()
+            if cantidad:
+                logger.info(f"💾 {self.descripcion.capitalize()} volcado al cerrar: {cantidad}")
+        except Exception as e:
+            logger.error(f"No se pudo volcar {self.descripcion} al cerrar: {e}")
+
+    def init_app(self, app):
+        """Volcar al final de los requests y al cerrar el proceso"""
+        self._app = app
+
+        def volcar_al_terminar_request(exc):
+            try:
+                self.volcar_si_corresponde(app.config)
+            except Exception as e:
+                logger.error(f"Error volcando {self.descripcion}: {e}")
+
+        app.teardown_request(volcar_al_terminar_request)
+        if not self._atexit_registrado:
+            atexit.register(self._volcar_al_salir)
+            self._atexit_registrado = True
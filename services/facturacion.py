@@ -0,0 +1,361 @@
+"""
+Motor de cálculo de facturación por obra social, plan y categoría
+
+Los meses cerrados se cachean en memoria por (mes, valores base, versión). La
+versión es un token guardado en `configuracion` (clave `facturacion_version`)
+que se renueva en la misma transacción en que se modifica algo que cambia la
+valorización de un mes cerrado: obras sociales, planes y sus categorías,
+tipos de análisis, o protocolos con fecha de ingreso (anterior o nueva) en un
+mes ya cerrado (ver services/version_tokens). Así todos los procesos ven la
+invalidación con una lectura indexada, como el catálogo de plantillas. Las
+sentencias masivas sobre protocolos solo cuentan si asignan columnas
+facturables: el incremento de `revision_lineas` de cada guardado no invalida.
+"""
+import logging
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Any, Optional, Tuple
+
+from sqlalchemy import func, case, literal, and_, or_, extract, inspect
+
+from extensions import db
+from services import metricas
+from services.version_tokens import TokenVersion
+from models.protocolo import Protocolo, TipoAnalisis
+from models.obra_social import ObraSocial, PlanFacturacion, PlanCategoria
+
+logger = logging.getLogger(__name__)
+
+CLAVE_VERSION = 'facturacion_version'
+
+# Cualquier cambio en estas tablas revaloriza los meses cerrados
+MODELOS_TARIFAS = (ObraSocial, PlanFacturacion, PlanCategoria, TipoAnalisis)
+TABLAS_TARIFAS = {modelo.__tablename__ for modelo in MODELOS_TARIFAS}
+# Atributos de un protocolo que entran en la facturación
+ATRIBUTOS_FACTURABLES = ('fecha_ingreso', 'estado', 'es_prueba', 'tipo_estudio', 'tipo_analisis_id',
+                         'obra_social_id', 'obra_social_codigo', 'obra_social_nombre')
+
+# Claves de configuración con el valor base (100%) de cada tipo de estudio
+CLAVES_VALOR_BASE = {
+    'BIOPSIA': 'facturacion_valor_biopsia',
+    'CITOLOGIA': 'facturacion_valor_citologia',
+    'PAP': 'facturacion_valor_pap',
+}
+
+# Cache de meses cerrados: (anio, mes, tarifas) -> filas agregadas del mes,
+# válido mientras no cambie la versión
+_cache_periodos_cerrados: Dict[Tuple, List[Dict[str, Any]]] = {}
+_cache_version = None
+_cache_lock = threading.Lock()
+
+
+def obtener_valores_base() -> Dict[str, float]:
+    """Obtener el valor base configurado para cada tipo de estudio"""
+    from models.configuracion import Configuracion
+
+    filas = Configuracion.query.filter(
+        Configuracion.clave.in_(list(CLAVES_VALOR_BASE.values()))
+    ).all()
+    por_clave = {c.clave: c.valor for c in filas}
+
+    valores = {}
+    for tipo, clave in CLAVES_VALOR_BASE.items():
+        try:
+            valores[tipo] = float(por_clave.get(clave) or 0)
+        except (TypeError, ValueError):
+            valores[tipo] = 0.0
+    return valores
+
+
+def _en_mes_cerrado(fecha) -> bool:
+    if isinstance(fecha, datetime):
+        fecha = fecha.date()
+    return isinstance(fecha, date) and fecha < _inicio_mes(date.today())
+
+
+def _afecta_mes_cerrado(protocolo, nuevo_o_borrado=False) -> bool:
+    """Si el alta, baja o modificación de un protocolo cambia un mes ya cerrado"""
+    estado = inspect(protocolo)
+    historia = estado.attrs.fecha_ingreso.history
+    fechas = list(historia.added) + list(historia.deleted) + list(historia.unchanged)
+    if not any(_en_mes_cerrado(f) for f in fechas):
+        return False
+    return nuevo_o_borrado or any(estado.attrs[a].history.has_changes() for a in ATRIBUTOS_FACTURABLES)
+
+
+def _cambia_en_flush(session) -> bool:
+    """Si el flush cambia la valorización de un mes cerrado"""
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, MODELOS_TARIFAS) or (isinstance(obj, Protocolo) and _afecta_mes_cerrado(obj, True)):
+            return True
+    for obj in session.dirty:
+        if isinstance(obj, MODELOS_TARIFAS) and session.is_modified(obj):
+            return True
+        if isinstance(obj, Protocolo) and _afecta_mes_cerrado(obj):
+            return True
+    return False
+
+
+def _sentencia_relevante(tablas, columnas) -> bool:
+    """Sentencias masivas sobre tarifas, o sobre protocolos que asignan columnas facturables"""
+    if tablas & TABLAS_TARIFAS:
+        return True
+    if Protocolo.__tablename__ not in tablas:
+        return False
+    # p. ej. el incremento de revision_lineas en cada guardado de líneas no cuenta
+    return columnas is None or bool(columnas & set(ATRIBUTOS_FACTURABLES))
+
+
+VERSION = TokenVersion(CLAVE_VERSION, 'Versión de la facturación de meses cerrados (se renueva al modificarlos)',
+                       _cambia_en_flush, _sentencia_relevante)
+
+
+def init_app(app):
+    """Registrar la detección de cambios que invalidan los meses cerrados"""
+    VERSION.registrar()
+
+
+def version_actual() -> str:
+    """Token de versión vigente (una consulta indexada)"""
+    return VERSION.actual()
+
+
+def invalidar_cache():
+    """
+    Renovar la versión a mano (hace commit), p. ej. tras modificar protocolos o
+    planes con SQL directo fuera de la sesión de la aplicación.
+    """
+    VERSION.renovar(db.session)
+    db.session.commit()
+    with _cache_lock:
+        _cache_periodos_cerrados.clear()
+
+
+def _inicio_mes(fecha: date) -> date:
+    return fecha.replace(day=1)
+
+
+def _fin_mes(fecha: date) -> date:
+    siguiente = (fecha.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return siguiente - timedelta(days=1)
+
+
+def _meses_en_rango(fecha_desde: date, fecha_hasta: date):
+    """Iterar (anio, mes, desde, hasta) recortando el primer y último mes al rango"""
+    actual = _inicio_mes(fecha_desde)
+    while actual <= fecha_hasta:
+        fin = _fin_mes(actual)
+        yield actual.year, actual.month, max(actual, fecha_desde), min(fin, fecha_hasta)
+        actual = fin + timedelta(days=1)
+
+
+def _query_facturacion(rangos: List[Tuple[date, date]], valores_base: Dict[str, float]):
+    """
+    Construir la consulta agregada de facturación para uno o más rangos de fechas.
+
+    El precio de cada protocolo es valor_base(tipo) * porcentaje / 100, donde el
+    porcentaje es el de la categoría del plan (código del tipo de análisis o tipo
+    de estudio) y, si el plan no la define, el porcentaje base del plan.
+    """
+    tipo_normalizado = case(
+        (Protocolo.tipo_estudio.in_(['CITOLOGÍA', 'CITOLOGIA']), literal('CITOLOGIA')),
+        else_=Protocolo.tipo_estudio
+    )
+    categoria = func.coalesce(TipoAnalisis.codigo, tipo_normalizado)
+    porcentaje = func.coalesce(PlanCategoria.porcentaje, PlanFacturacion.porcentaje_base, 100)
+    valor_base = case(
+        *[(tipo_normalizado == tipo, literal(valor)) for tipo, valor in valores_base.items()],
+        else_=literal(0.0)
+    )
+
+    anio = extract('year', Protocolo.fecha_ingreso).label('anio')
+    mes = extract('month', Protocolo.fecha_ingreso).label('mes')
+    os_codigo = func.coalesce(Protocolo.obra_social_codigo, ObraSocial.codigo, '').label('obra_social_codigo')
+    os_nombre = func.coalesce(Protocolo.obra_social_nombre, ObraSocial.nombre, 'Sin obra social').label('obra_social_nombre')
+    plan_nombre = func.coalesce(PlanFacturacion.nombre, 'Sin plan').label('plan_nombre')
+
+    return db.session.query(
+        anio,
+        mes,
+        os_codigo,
+        os_nombre,
+        plan_nombre,
+        tipo_normalizado.label('tipo_estudio'),
+        func.count(Protocolo.protocolo_id).label('cantidad'),
+        func.sum(valor_base * porcentaje / 100).label('importe'),
+        func.sum(case((PlanFacturacion.plan_facturacion_id.is_(None), 1), else_=0)).label('sin_plan'),
+    ).outerjoin(
+        ObraSocial, ObraSocial.obra_social_id == Protocolo.obra_social_id
+    ).outerjoin(
+        PlanFacturacion, PlanFacturacion.plan_facturacion_id == ObraSocial.plan_id
+    ).outerjoin(
+        TipoAnalisis, TipoAnalisis.tipo_analisis_id == Protocolo.tipo_analisis_id
+    ).outerjoin(
+        PlanCategoria, and_(
+            PlanCategoria.plan_id == PlanFacturacion.plan_facturacion_id,
+            PlanCategoria.categoria_codigo == categoria
+        )
+    ).filter(
+        Protocolo.es_prueba == False,
+        Protocolo.estado != 'CANCELADO',
+        or_(*[Protocolo.fecha_ingreso.between(desde, hasta) for desde, hasta in rangos])
+    ).group_by(
+        anio, mes, os_codigo, os_nombre, plan_nombre, tipo_normalizado
+    )
+
+
+def calcular_facturacion(fecha_desde: date, fecha_hasta: date) -> List[Dict[str, Any]]:
+    """
+    Calcular la facturación agregada entre dos fechas (inclusive).
+
+    Los meses completos ya cerrados se sirven desde cache; el resto se resuelve
+    con una única consulta agregada.
+
+    Returns:
+        Lista de filas con anio, mes, obra social, plan, tipo de estudio,
+        cantidad de protocolos e importe
+    """
+    if fecha_desde > fecha_hasta:
+        return []
+
+    global _cache_version
+    valores_base = obtener_valores_base()
+    firma = tuple(sorted(valores_base.items()))
+    inicio_mes_actual = _inicio_mes(date.today())
+    version = version_actual()
+    with _cache_lock:
+        if version != _cache_version:
+            # Otro proceso (o este) modificó un mes cerrado: lo cacheado ya no vale
+            _cache_periodos_cerrados.clear()
+            _cache_version = version
+
+    filas = []
+    pendientes = []
+    cacheables = set()
+    for anio, mes, desde, hasta in _meses_en_rango(fecha_desde, fecha_hasta):
+        mes_completo = desde.day == 1 and hasta == _fin_mes(desde)
+        if mes_completo and hasta < inicio_mes_actual:
+            with _cache_lock:
+                cacheado = _cache_periodos_cerrados.get((anio, mes, firma))
+            metricas.registrar_cache('facturacion', cacheado is not None)
+            if cacheado is not None:
+                filas.extend(cacheado)
+                continue
+            cacheables.add((anio, mes))
+        # Unir meses contiguos para mantener la consulta simple
+        if pendientes and pendientes[-1][1] + timedelta(days=1) == desde:
+            pendientes[-1] = (pendientes[-1][0], hasta)
+        else:
+            pendientes.append((desde, hasta))
+
+    if pendientes:
+        nuevas = {}
+        for r in _query_facturacion(pendientes, valores_base).all():
+            fila = {
+                'anio': int(r.anio),
+                'mes': int(r.mes),
+                'obra_social_codigo': r.obra_social_codigo,
+                'obra_social_nombre': r.obra_social_nombre,
+                'plan_nombre': r.plan_nombre,
+                'tipo_estudio': r.tipo_estudio,
+                'cantidad': int(r.cantidad or 0),
+                'importe': round(float(r.importe or 0), 2),
+                'sin_plan': int(r.sin_plan or 0),
+            }
+            nuevas.setdefault((fila['anio'], fila['mes']), []).append(fila)
+            filas.append(fila)
+
+        with _cache_lock:
+            if version == _cache_version:
+                for anio, mes in cacheables:
+                    _cache_periodos_cerrados[(anio, mes, firma)] = nuevas.get((anio, mes), [])
+
+        logger.info(f"💰 Facturación calculada: {len(pendientes)} período(s) consultados, {len(cacheables)} cacheados")
+
+    return filas
+
+
+def resumen_por_obra_social(filas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Agrupar las filas de facturación por obra social"""
+    por_os = {}
+    for f in filas:
+        clave = (f['obra_social_codigo'], f['obra_social_nombre'])
+        item = por_os.setdefault(clave, {
+            'obra_social_codigo': f['obra_social_codigo'],
+            'obra_social_nombre': f['obra_social_nombre'],
+            'plan_nombre': f['plan_nombre'],
+            'cantidad': 0,
+            'importe': 0.0,
+            'por_tipo': {},
+        })
+        item['cantidad'] += f['cantidad']
+        item['importe'] += f['importe']
+        item['por_tipo'][f['tipo_estudio']] = item['por_tipo'].get(f['tipo_estudio'], 0) + f['cantidad']
+
+    resultado = sorted(por_os.values(), key=lambda x: x['importe'], reverse=True)
+    for item in resultado:
+        item['importe'] = round(item['importe'], 2)
+    return resultado
+
+
+def resumen_por_periodo(filas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Agrupar las filas de facturación por mes"""
+    por_mes = {}
+    for f in filas:
+        item = por_mes.setdefault((f['anio'], f['mes']), {
+            'anio': f['anio'],
+            'mes': f['mes'],
+            'cantidad': 0,
+            'importe': 0.0,
+            'por_tipo': {},
+        })
+        item['cantidad'] += f['cantidad']
+        item['importe'] += f['importe']
+        item['por_tipo'][f['tipo_estudio']] = round(item['por_tipo'].get(f['tipo_estudio'], 0) + f['importe'], 2)
+
+    resultado = [por_mes[k] for k in sorted(por_mes)]
+    for item in resultado:
+        item['importe'] = round(item['importe'], 2)
+    return resultado
+
+
+def estadisticas_contables(filas: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Calcular totales, distribución por tipo y ticket promedio"""
+    total_cantidad = sum(f['cantidad'] for f in filas)
+    total_importe = round(sum(f['importe'] for f in filas), 2)
+
+    por_tipo = {}
+    for f in filas:
+        item = por_tipo.setdefault(f['tipo_estudio'], {'tipo_estudio': f['tipo_estudio'], 'cantidad': 0, 'importe': 0.0})
+        item['cantidad'] += f['cantidad']
+        item['importe'] += f['importe']
+    for item in por_tipo.values():
+        item['importe'] = round(item['importe'], 2)
+        item['porcentaje'] = round(item['importe'] * 100 / total_importe, 1) if total_importe else 0
+
+    return {
+        'total_cantidad': total_cantidad,
+        'total_importe': total_importe,
+        'ticket_promedio': round(total_importe / total_cantidad, 2) if total_cantidad else 0,
+        'sin_plan': sum(f['sin_plan'] for f in filas),
+        'por_tipo': sorted(por_tipo.values(), key=lambda x: x['importe'], reverse=True),
+        'top_obras_sociales': resumen_por_obra_social(filas)[:10],
+    }
+
+
+def parsear_rango(fecha_desde: Optional[str], fecha_hasta: Optional[str]) -> Tuple[date, date]:
+    """Interpretar el rango de fechas del request (por defecto, el año en curso)"""
+    hoy = date.today()
+    desde = date(hoy.year, 1, 1)
+    hasta = hoy
+    if fecha_desde:
+        try:
+            desde = datetime.strptime(fecha_desde, '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    if fecha_hasta:
+        try:
+            hasta = datetime.strptime(fecha_hasta, '%Y-%m-%d').date()
+        except ValueError:
+            pass
+    return desde, hasta
@@ -0,0 +1,318 @@
+"""
+Frecuencias de diagnósticos y categorías de casos históricos
+
+`top_diagnosticos` y `obtener_categorias` agrupaban casos_historicos por el
+texto completo del diagnóstico en cada llamada, y separaban en grupos
+distintos variantes como "Carcinoma ductal infiltrante." y "CARCINOMA DUCTAL
+INFILTRANTE". Ahora:
+
+- diagnosticos_normalizados: SHA-1 del texto canónico (palabras plegadas,
+  services/analisis_texto) -> texto a mostrar
+- frecuencias_diagnostico: casos activos por (tipo, categoría, diagnóstico),
+  con categoría '*' para el total del tipo
+- frecuencias_categoria: casos activos por (tipo, categoría)
+
+Las tablas se mantienen en la misma transacción en que la sesión crea,
+modifica, da de baja o borra casos (los valores anteriores se leen de la base
+en before_flush y las diferencias se aplican en after_flush), así que las dos
+consultas son lecturas por índice. Los contadores se suman con un INSERT ... ON
+CONFLICT del dialecto, así dos sesiones que cuentan el primer caso de un mismo
+diagnóstico no chocan por la clave primaria.
+
+`flask recalcular-diagnosticos` construye las tablas (paso del despliegue) y
+hace falta de nuevo tras cargas por SQL directo. Mientras no se haya corrido,
+las consultas devuelven listas vacías: ningún request las reconstruye.
+"""
+import hashlib
+import logging
+from collections import Counter, defaultdict
+
+from sqlalchemy import event, inspect, select, insert, update, delete, bindparam
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.asistente import CasoHistorico, DiagnosticoNormalizado, FrecuenciaDiagnostico, FrecuenciaCategoria
+from models.configuracion import Configuracion
+from services.analisis_texto import palabras
+
+logger = logging.getLogger(__name__)
+
+CLAVE_INICIALIZADAS = 'frecuencias_diagnostico_inicializadas'
+TODAS = '*'
+CAMPOS = ('tipo_estudio', 'categoria', 'diagnostico', 'activo')
+
+_inicializadas = False
+
+
+def canonico(texto):
+    """Texto canónico de un diagnóstico (sin acentos, mayúsculas ni puntuación)"""
+    return ' '.join(palabras(texto))
+
+
+def hash_diagnostico(texto):
+    return hashlib.sha1(canonico(texto).encode('utf-8')).hexdigest()
+
+
+def _clave_tipo(tipo_estudio):
+    return (tipo_estudio or '').strip().upper()
+
+
+def _insert_con_conflicto(session, tabla, claves, sumar=None):
+    """
+    INSERT del dialecto de la sesión que resuelve el choque con una fila existente
+    por `claves`: le suma la columna `sumar`, o si es None la deja como estaba.
+    """
+    dialecto = session.get_bind().dialect.name
+    if dialecto in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert as insert_dialecto
+        sentencia = insert_dialecto(tabla)
+        columna = sumar or claves[0]
+        valor = tabla.c[columna] + sentencia.inserted[columna] if sumar else tabla.c[columna]
+        return sentencia.on_duplicate_key_update({columna: valor})
+    if dialecto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as insert_dialecto
+    else:
+        from sqlalchemy.dialects.sqlite import insert as insert_dialecto
+    sentencia = insert_dialecto(tabla)
+    if sumar is None:
+        return sentencia.on_conflict_do_nothing(index_elements=list(claves))
+    return sentencia.on_conflict_do_update(index_elements=list(claves),
+                                           set_={sumar: tabla.c[sumar] + sentencia.excluded[sumar]})
+
+
+def resolver_diagnosticos(session, textos):
+    """
+    IDs de diagnóstico normalizado de los textos, creando los que falten.
+
+    Returns:
+        Dict texto -> diagnostico_id (los textos sin palabras quedan afuera)
+    """
+    tabla = DiagnosticoNormalizado.__table__
+    por_hash = {}
+    for texto in textos:
+        if canonico(texto):
+            por_hash.setdefault(hash_diagnostico(texto), texto)
+    if not por_hash:
+        return {}
+
+    ids = {}
+    hashes = list(por_hash)
+    for i in range(0, len(hashes), 500):
+        lote = hashes[i:i + 500]
+        ids.update(session.execute(select(tabla.c.hash, tabla.c.diagnostico_id).where(tabla.c.hash.in_(lote))).all())
+    faltantes = [h for h in hashes if h not in ids]
+    if faltantes:
+        # Otra sesión puede haber creado el mismo hash mientras tanto: se conserva el suyo
+        session.execute(_insert_con_conflicto(session, tabla, ('hash',)),
+                        [{'hash': h, 'texto_mostrar': por_hash[h].strip()} for h in faltantes])
+        for i in range(0, len(faltantes), 500):
+            lote = faltantes[i:i + 500]
+            ids.update(session.execute(select(tabla.c.hash, tabla.c.diagnostico_id).where(tabla.c.hash.in_(lote))).all())
+    return {texto: ids[hash_diagnostico(texto)] for texto in textos if canonico(texto)}
+
+
+def _sumar(session, tabla, columna, claves, deltas):
+    """columna += delta por clave; las sumas crean la fila si no existía (upsert)"""
+    altas = []
+    for valores, delta in deltas.items():
+        filtro = dict(zip(claves, valores))
+        if delta > 0:
+            altas.append({**filtro, columna: delta})
+        elif delta < 0:
+            session.execute(
+                update(tabla).where(*(tabla.c[c] == v for c, v in filtro.items())).values(
+                    {columna: tabla.c[columna] + delta}
+                )
+            )
+    if altas:
+        session.execute(_insert_con_conflicto(session, tabla, claves, sumar=columna), altas)
+
+
+def aplicar_cambios(session, cambios):
+    """
+    Aplicar a las tablas de frecuencias una lista de (tipo, categoría, diagnóstico, +1/-1).
+    """
+    cambios = [c for c in cambios if c[3]]
+    if not cambios:
+        return
+    ids = resolver_diagnosticos(session, {c[2] for c in cambios})
+    por_diagnostico, por_categoria = Counter(), Counter()
+    for tipo, categoria, diagnostico, delta in cambios:
+        tipo, categoria = _clave_tipo(tipo), categoria or ''
+        por_categoria[(tipo, categoria)] += delta
+        diagnostico_id = ids.get(diagnostico)
+        if diagnostico_id is not None:
+            por_diagnostico[(tipo, categoria, diagnostico_id)] += delta
+            por_diagnostico[(tipo, TODAS, diagnostico_id)] += delta
+    _sumar(session, FrecuenciaDiagnostico.__table__, 'frecuencia',
+           ('tipo_estudio', 'categoria', 'diagnostico_id'), por_diagnostico)
+    _sumar(session, FrecuenciaCategoria.__table__, 'total', ('tipo_estudio', 'categoria'), por_categoria)
+
+
+def _valores(caso):
+    """(tipo, categoría, diagnóstico, activo) actuales de un caso"""
+    return tuple(getattr(caso, campo) for campo in CAMPOS)
+
+
+def _modificado(caso):
+    estado = inspect(caso)
+    return any(estado.attrs[campo].history.has_changes() for campo in CAMPOS)
+
+
+def _leer_anteriores(session, flush_context, instances):
+    """before_flush: valores guardados de los casos que se van a modificar o borrar
+    (después de un commit los atributos están expirados y la historia no tiene el
+    valor anterior)"""
+    ids = [
+        caso.caso_id for caso in list(session.dirty) + list(session.deleted)
+        if isinstance(caso, CasoHistorico) and caso.caso_id is not None
+        and (caso in session.deleted or _modificado(caso))
+    ]
+    if not ids:
+        return
+    c = CasoHistorico.__table__
+    anteriores = session.info.setdefault('frecuencias_anteriores', {})
+    with session.no_autoflush:
+        for i in range(0, len(ids), 500):
+            for fila in session.execute(
+                select(c.c.caso_id, *(c.c[campo] for campo in CAMPOS)).where(c.c.caso_id.in_(ids[i:i + 500]))
+            ):
+                anteriores[fila[0]] = tuple(fila[1:])
+
+
+def _registrar_cambios(session, flush_context):
+    """after_flush: llevar las frecuencias al estado de los casos recién escritos"""
+    anteriores = session.info.pop('frecuencias_anteriores', {})
+    cambios = []
+    for caso in session.new:
+        if isinstance(caso, CasoHistorico):
+            tipo, categoria, diagnostico, activo = _valores(caso)
+            if activo is not False:
+                cambios.append((tipo, categoria, diagnostico, 1))
+    for caso in list(session.dirty) + list(session.deleted):
+        if not isinstance(caso, CasoHistorico) or caso.caso_id not in anteriores:
+            continue
+        tipo, categoria, diagnostico, activo = anteriores[caso.caso_id]
+        if activo is not False:
+            cambios.append((tipo, categoria, diagnostico, -1))
+        if caso not in session.deleted:
+            tipo, categoria, diagnostico, activo = _valores(caso)
+            if activo is not False:
+                cambios.append((tipo, categoria, diagnostico, 1))
+    if cambios:
+        aplicar_cambios(session, cambios)
+
+
+def _descartar(session):
+    session.info.pop('frecuencias_anteriores', None)
+
+
+def recalcular():
+    """
+    Reconstruir las tablas de frecuencias desde casos_historicos (hace commit).
+
+    También actualiza el texto a mostrar de cada diagnóstico a su variante más
+    frecuente.
+
+    Returns:
+        Cantidad de casos activos contados
+    """
+    global _inicializadas
+    c = CasoHistorico.__table__
+    conteo = Counter()
+    variantes = defaultdict(Counter)  # hash -> variante -> casos
+    for fila in db.session.execute(
+        select(c.c.tipo_estudio, c.c.categoria, c.c.diagnostico).where(c.c.activo.isnot(False))
+    ):
+        conteo[(_clave_tipo(fila.tipo_estudio), fila.categoria or '', fila.diagnostico)] += 1
+        if canonico(fila.diagnostico):
+            variantes[hash_diagnostico(fila.diagnostico)][fila.diagnostico.strip()] += 1
+
+    ids = resolver_diagnosticos(db.session, {diagnostico for _, _, diagnostico in conteo})
+    por_diagnostico, por_categoria = Counter(), Counter()
+    for (tipo, categoria, diagnostico), casos in conteo.items():
+        por_categoria[(tipo, categoria)] += casos
+        diagnostico_id = ids.get(diagnostico)
+        if diagnostico_id is not None:
+            por_diagnostico[(tipo, categoria, diagnostico_id)] += casos
+            por_diagnostico[(tipo, TODAS, diagnostico_id)] += casos
+
+    if variantes:
+        tabla = DiagnosticoNormalizado.__table__
+        db.session.execute(
+            update(tabla).where(tabla.c.hash == bindparam('b_hash')).values(texto_mostrar=bindparam('b_texto')),
+            [{'b_hash': h, 'b_texto': cuenta.most_common(1)[0][0]} for h, cuenta in variantes.items()]
+        )
+    db.session.execute(delete(FrecuenciaDiagnostico.__table__))
+    db.session.execute(delete(FrecuenciaCategoria.__table__))
+    if por_diagnostico:
+        db.session.execute(insert(FrecuenciaDiagnostico.__table__), [
+            {'tipo_estudio': t, 'categoria': cat, 'diagnostico_id': d, 'frecuencia': n}
+            for (t, cat, d), n in por_diagnostico.items()
+        ])
+    if por_categoria:
+        db.session.execute(insert(FrecuenciaCategoria.__table__), [
+            {'tipo_estudio': t, 'categoria': cat, 'total': n} for (t, cat), n in por_categoria.items()
+        ])
+    marca = Configuracion.query.filter_by(clave=CLAVE_INICIALIZADAS).first()
+    if marca is None:
+        db.session.add(Configuracion(clave=CLAVE_INICIALIZADAS, valor='true', tipo='BOOLEAN', categoria='sistema',
+                                     descripcion='Tablas de frecuencias de diagnósticos construidas'))
+    db.session.commit()
+    _inicializadas = True
+    total = sum(por_categoria.values())
+    logger.info(f"📊 Frecuencias de diagnósticos: {total} casos, {len(ids)} variantes en "
+                f"{len(set(ids.values()))} diagnósticos normalizados")
+    return total
+
+
+def inicializadas(conexion=None):
+    """Si ya se corrió `flask recalcular-diagnosticos` (una lectura indexada hasta que sí)"""
+    global _inicializadas
+    if not _inicializadas:
+        c = Configuracion.__table__
+        _inicializadas = (conexion or db.session).execute(
+            select(c.c.valor).where(c.c.clave == CLAVE_INICIALIZADAS)
+        ).scalar() is not None
+    return _inicializadas
+
+
+def top_diagnosticos(tipo_estudio, categoria=None, limite=20, conexion=None):
+    """
+    [(texto a mostrar, frecuencia)] de mayor a menor ([] si las tablas no se
+    construyeron). `conexion` permite leer fuera de la sesión, p. ej. con la
+    conexión de solo lectura de las herramientas del asistente.
+    """
+    conexion = conexion or db.session
+    if not inicializadas(conexion):
+        return []
+    f, d = FrecuenciaDiagnostico.__table__, DiagnosticoNormalizado.__table__
+    return conexion.execute(
+        select(d.c.texto_mostrar, f.c.frecuencia)
+        .join(d, d.c.diagnostico_id == f.c.diagnostico_id)
+        .where(f.c.tipo_estudio == _clave_tipo(tipo_estudio), f.c.categoria == (categoria or TODAS),
+               f.c.frecuencia > 0)
+        .order_by(f.c.frecuencia.desc(), f.c.diagnostico_id)
+        .limit(limite)
+    ).all()
+
+
+def categorias(tipo_estudio):
+    """[(categoría o None, total de casos)] de mayor a menor ([] si las tablas no se construyeron)"""
+    if not inicializadas():
+        return []
+    t = FrecuenciaCategoria.__table__
+    filas = db.session.execute(
+        select(t.c.categoria, t.c.total)
+        .where(t.c.tipo_estudio == _clave_tipo(tipo_estudio), t.c.total > 0)
+        .order_by(t.c.total.desc(), t.c.categoria)
+    ).all()
+    return [(categoria or None, total) for categoria, total in filas]
+
+
+def init_app(app):
+    """Mantener las frecuencias al día con los commits de la sesión"""
+    if not event.contains(Session, 'after_flush', _registrar_cambios):
+        event.listen(Session, 'before_flush', _leer_anteriores)
+        event.listen(Session, 'after_flush', _registrar_cambios)
+        event.listen(Session, 'after_rollback', _descartar)
@@ -12,6 +12,9 @@ import requests
 import base64
 from typing import Dict, List, Optional, Any
 import logging
+from services.metricas import medir_llm, funcion_llm
+from services import uso_llm
+from services import catalogo_modelos
 
 logger = logging.getLogger(__name__)
 
@@ -73,126 +76,117 @@ class GeminiClient:
         """Verificar si la API key está configurada"""
         return bool(self.api_key)
     
-    def listar_modelos_disponibles(self) -> List[Dict]:
+    @staticmethod
+    def soporta_vision(nombre: str, descripcion: str = '') -> bool:
         """
-        Listar modelos disponibles en Gemini API
+        Si el modelo acepta imágenes: los Gemini 2.0+ son multimodales por defecto,
+        y también los que tienen "vision" en el nombre
         """
-        if not self.api_key:
-            return []
+        nombre = (nombre or '').lower()
+        return (
+            'vision' in nombre or
+            nombre.startswith('gemini-2.') or  # Gemini 2.0+ son multimodales
+            nombre.startswith('gemini-3.') or  # Gemini 3.0+ son multimodales
+            'multimodal' in (descripcion or '').lower()
+        )
+    
+    def listar_modelos_api(self, version: str = 'v1beta') -> List[Dict]:
+        """
+        Listar los modelos de una versión de la API (consulta a Gemini; lanza excepción si falla).
+        Los requests usan listar_modelos_disponibles, que lee el catálogo guardado.
+        """
+        url = f"https://generativelanguage.googleapis.com/{version}/models"
+        response = requests.get(url, params={"key": self.api_key}, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        
+        modelos = []
+        for modelo in data.get('models', []):
+            nombre = modelo.get('name', '')
+            # Extraer solo el nombre del modelo (sin el prefijo "models/")
+            if 'models/' in nombre:
+                nombre = nombre.split('models/')[1]
+            metodos = modelo.get('supportedGenerationMethods', [])
+            modelos.append({
+                'nombre': nombre,
+                'display_name': modelo.get('displayName', ''),
+                'description': modelo.get('description', ''),
+                'supported_generation_methods': metodos,
+                'version': version,
+                'soporta_vision': self.soporta_vision(nombre, modelo.get('description', '')),
+                'soporta_generateContent': 'generateContent' in metodos
+            })
+        return modelos
+    
+    def probar_modelo(self, modelo: str = None, timeout: int = 5) -> Dict[str, Any]:
+        """
+        Probar si un modelo responde con una petición mínima (v1beta y, si falla, v1)
         
-        modelos_disponibles = []
+        Returns:
+            Dict con 'disponible' (bool), 'error' (str o None), 'modelo' y 'version'
+        """
+        modelo_a_probar = modelo or self.model
+        if not self.is_configured():
+            return {'disponible': False, 'error': 'API key no configurada', 'modelo': modelo_a_probar, 'version': None}
         
-        # Intentar con v1beta primero
+        test_payload = {
+            "contents": [{
+                "parts": [{"text": "test"}]
+            }],
+            "generationConfig": {
+                "maxOutputTokens": 10
+            }
+        }
+        error = None
         for version in ['v1beta', 'v1']:
+            url = f"https://generativelanguage.googleapis.com/{version}/models/{modelo_a_probar}:generateContent"
             try:
-                url = f"https://generativelanguage.googleapis.com/{version}/models"
-                params = {"key": self.api_key}
-                
-                response = requests.get(url, params=params, timeout=10)
-                response.raise_for_status()
-                data = response.json()
-                
-                if 'models' in data:
-                    for modelo in data['models']:
-                        nombre = modelo.get('name', '')
-                        # Extraer solo el nombre del modelo (sin el prefijo "models/")
-                        if 'models/' in nombre:
-                            nombre = nombre.split('models/')[1]
-                        
-                        metodos = modelo.get('supportedGenerationMethods', [])
-                        
-                        # Los modelos Gemini 2.0+ son multimodales por defecto (soportan visión)
-                        # También modelos con "vision" en el nombre
-                        es_multimodal = (
-                            'vision' in nombre.lower() or 
-                            'pro-vision' in nombre.lower() or
-                            nombre.startswith('gemini-2.') or  # Gemini 2.0+ son multimodales
-                            nombre.startswith('gemini-3.') or  # Gemini 3.0+ son multimodales
-                            'multimodal' in modelo.get('description', '').lower()
-                        )
-                        
-                        modelos_disponibles.append({
-                            'nombre': nombre,
-                            'display_name': modelo.get('displayName', ''),
-                            'description': modelo.get('description', ''),
-                            'supported_generation_methods': metodos,
-                            'version': version,
-                            'soporta_vision': es_multimodal,
-                            'soporta_generateContent': 'generateContent' in metodos
-                        })
-                
-                # Si encontramos modelos, no intentar con la siguiente versión
-                if modelos_disponibles:
-                    break
-                    
+                response = requests.post(url, json=test_payload, params={"key": self.api_key}, timeout=timeout)
+                if response.status_code == 200:
+                    return {'disponible': True, 'error': None, 'modelo': modelo_a_probar, 'version': version}
+                try:
+                    error = response.json().get('error', {}).get('message') or f'HTTP {response.status_code}'
+                except Exception:
+                    error = f'HTTP {response.status_code}'
             except Exception as e:
-                logger.warning(f"Error listando modelos de Gemini con {version}: {e}")
-                continue
+                error = str(e)
+        return {'disponible': False, 'error': error, 'modelo': modelo_a_probar, 'version': None}
+    
+    def listar_modelos_disponibles(self) -> List[Dict]:
+        """
+        Modelos que lista la API de Gemini, con el resultado de las pruebas
+        (catálogo guardado por services/catalogo_modelos; no consulta a Gemini)
+        """
+        if not self.api_key:
+            return []
         
-        return modelos_disponibles
+        modelos = []
+        for datos in catalogo_modelos.estado('gemini')['modelos']:
+            if not datos['listado']:
+                continue
+            modelos.append({
+                'nombre': datos['modelo'],
+                'display_name': datos['nombre_visible'] or '',
+                'description': datos['descripcion'] or '',
+                'supported_generation_methods': datos['metodos'],
+                'version': datos['version'],
+                'soporta_vision': datos['soporta_vision'],
+                'soporta_generateContent': 'generateContent' in datos['metodos'],
+                'disponible': datos['disponible'],
+                'latencia_ms': datos['latencia_ms']
+            })
+        return modelos
     
     def encontrar_modelo_funcional(self) -> Optional[str]:
         """
-        Encontrar automáticamente un modelo que funcione con visión
+        Modelo con visión que respondió en el último descubrimiento (distinto del actual)
         
         Returns:
             Nombre del modelo que funciona, o None si no se encuentra ninguno
         """
-        modelos_a_probar = [
-            'gemini-2.5-flash',  # Estable, multimodal
-            'gemini-2.0-flash',  # Estable, multimodal
-            'gemini-2.5-pro',    # Estable, multimodal, más potente
-            'gemini-2.0-flash-001',  # Versión específica estable
-            'gemini-flash-latest',  # Latest
-            'gemini-pro-latest',    # Latest
-            'gemini-pro-vision',    # Legacy
-            'gemini-1.5-flash-latest',
-            'gemini-1.5-pro-latest'
-        ]
-        
-        # Primero intentar listar modelos disponibles
-        modelos_disponibles = self.listar_modelos_disponibles()
-        if modelos_disponibles:
-            # Buscar el primer modelo con visión que soporte generateContent
-            for modelo in modelos_disponibles:
-                if modelo.get('soporta_vision') and modelo.get('soporta_generateContent'):
-                    logger.info(f"✅ Modelo encontrado automáticamente: {modelo['nombre']}")
-                    return modelo['nombre']
-        
-        # Si no encontramos en la lista, probar modelos comunes manualmente
-        for modelo_nombre in modelos_a_probar:
-            try:
-                # Probar con una petición simple
-                test_payload = {
-                    "contents": [{
-                        "parts": [{"text": "test"}]
-                    }],
-                    "generationConfig": {
-                        "maxOutputTokens": 10
-                    }
-                }
-                
-                for version in ['v1beta', 'v1']:
-                    url = f"https://generativelanguage.googleapis.com/{version}/models/{modelo_nombre}:generateContent"
-                    params = {"key": self.api_key}
-                    
-                    try:
-                        response = requests.post(
-                            url,
-                            json=test_payload,
-                            params=params,
-                            timeout=5
-                        )
-                        if response.status_code == 200:
-                            logger.info(f"✅ Modelo funcional encontrado: {modelo_nombre} (versión {version})")
-                            return modelo_nombre
-                    except:
-                        continue
-            except:
-                continue
-        
-        return None
+        return catalogo_modelos.modelo_funcional('gemini', vision=True, excluir=self.model)
     
+    @medir_llm('gemini')
     def _make_request(self, prompt: str, images: List[Dict] = None, timeout: int = 120) -> Dict:
         """
         Hacer petición a Gemini API
@@ -248,7 +242,9 @@ class GeminiClient:
             urls_a_probar.append(self.base_url_v1)
         
         ultimo_error = None
-        for url in urls_a_probar:
+        for indice_url, url in enumerate(urls_a_probar):
+            if indice_url:
+                uso_llm.nuevo_intento()
             try:
                 logger.info(f"🔍 Intentando con URL: {url}")
                 response = requests.post(
@@ -304,6 +300,7 @@ class GeminiClient:
             # Intentar nuevamente con el nuevo modelo
             urls_a_probar = [self.base_url, self.base_url_v1]
             for url in urls_a_probar:
+                uso_llm.nuevo_intento()
                 try:
                     logger.info(f"🔍 Reintentando con URL: {url}")
                     response = requests.post(
@@ -324,6 +321,7 @@ class GeminiClient:
             mensaje_error += f"\n\n💡 Sugerencia: Prueba cambiar a '{modelo_funcional}' en config.py"
         raise Exception(f"Error de API: {mensaje_error}")
     
+    @funcion_llm('analizar_imagen_medica')
     def analizar_imagen_medica(self, imagen_data: Dict, contexto: Dict = None) -> Dict:
         """
         Analizar una imagen médica usando Gemini
@@ -436,6 +434,7 @@ Sé preciso y profesional en tu análisis."""
             logger.error(f"Error en analizar_imagen_medica: {e}", exc_info=True)
             raise
     
+    @funcion_llm('chat_conversacional')
     def chat_conversacional(self, mensaje: str, imagenes: List[Dict] = None, contexto_usuario: Dict = None) -> Dict:
         """
         Chat conversacional con Gemini, especializado en análisis de imágenes médicas
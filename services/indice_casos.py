@@ -0,0 +1,463 @@
+"""
+Índice invertido BM25 de casos históricos
+
+Reemplaza el `ilike('%palabra%')` sobre casos_historicos (recorrido completo y
+orden por id) por un índice invertido con plegado de acentos y stemming
+(services/analisis_texto) sobre CasoHistorico y CasoHistoricoCompleto,
+puntuado con BM25.
+
+Persistencia en INDICE_CASOS_FOLDER:
+    actual.json                 generación vigente
+    gen-<n>/meta.json           documentos, largo promedio, códigos de tipo/origen
+    gen-<n>/terminos.json       termino -> [desde, cantidad] en las listas de postings
+    gen-<n>/*.bin               arreglos binarios (ids, largos, tipos, postings)
+    gen-<n>/delta.jsonl         altas, cambios y bajas posteriores a la construcción
+
+Los .bin se abren con mmap (numpy.frombuffer si numpy está instalado, si no
+memoryview.cast): cada proceso comparte las páginas del sistema operativo y el
+arranque no lee el índice entero. Los cambios de casos hechos por la sesión se
+agregan a delta.jsonl al hacer commit (un documento en delta reemplaza al de la
+base) y cada proceso relee solo lo nuevo del delta antes de buscar. Las cargas
+masivas por SQL directo requieren `flask indexar-casos`, que construye una
+generación nueva.
+"""
+import json
+import logging
+import math
+import mmap
+import os
+import shutil
+import threading
+import time
+from array import array
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.asistente import CasoHistorico
+from models.plantilla_multilinea import CasoHistoricoCompleto
+from services import metricas
+from services.analisis_texto import terminos
+
+try:
+    import numpy as np
+except ImportError:  # el índice funciona igual, con el cálculo en Python
+    np = None
+
+logger = logging.getLogger(__name__)
+
+K1 = 1.2
+B = 0.75
+
+# origen -> (modelo, campos indexados con su peso)
+ORIGENES = {
+    'h': (CasoHistorico, (
+        ('descripcion_microscopica', 1), ('descripcion', 1), ('diagnostico', 2), ('categoria', 2),
+    )),
+    'c': (CasoHistoricoCompleto, (
+        ('seccion_extendido', 1), ('seccion_celulas', 1), ('seccion_inflamatorio', 1),
+        ('seccion_flora', 1), ('seccion_diagnostico', 2), ('categoria', 2), ('subcategoria', 1),
+    )),
+}
+ORIGEN_POR_MODELO = {modelo: origen for origen, (modelo, _) in ORIGENES.items()}
+
+# archivo -> código de array
+ARREGLOS = {
+    'docs_id': 'i', 'docs_largo': 'f', 'docs_tipo': 'b', 'docs_origen': 'b',
+    'postings_doc': 'i', 'postings_tf': 'f',
+}
+
+
+def normalizar_tipo(tipo_estudio):
+    tipo = (tipo_estudio or '').strip().upper()
+    return {'CITOLOGÍA': 'CITOLOGIA', 'BIOPSIAS': 'BIOPSIA'}.get(tipo, tipo)
+
+
+def documento(origen, fila):
+    """(tipo, frecuencias ponderadas de términos, largo) de un caso"""
+    _, campos = ORIGENES[origen]
+    frecuencias = Counter()
+    for campo, peso in campos:
+        for termino in terminos(getattr(fila, campo, None)):
+            frecuencias[termino] += peso
+    return normalizar_tipo(fila.tipo_estudio), frecuencias, float(sum(frecuencias.values()))
+
+
+# ---------------------------------------------------------------------------
+# Construcción
+# ---------------------------------------------------------------------------
+
+def _carpeta():
+    carpeta = current_app.config['INDICE_CASOS_FOLDER']
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+def _leer_actual(carpeta):
+    try:
+        with open(os.path.join(carpeta, 'actual.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _filas(origen, lote=2000):
+    modelo, campos = ORIGENES[origen]
+    columnas = [modelo.caso_id, modelo.tipo_estudio] + [getattr(modelo, campo) for campo, _ in campos]
+    consulta = db.session.query(*columnas).filter(modelo.activo.is_(True)).order_by(modelo.caso_id)
+    return consulta.yield_per(lote)
+
+
+def construir():
+    """
+    Construir una generación nueva del índice desde la base y activarla.
+
+    Returns:
+        Dict con documentos, términos y segundos
+    """
+    inicio = time.monotonic()
+    carpeta = _carpeta()
+    anterior = _leer_actual(carpeta)
+    delta_anterior = os.path.join(carpeta, anterior['gen'], 'delta.jsonl') if anterior else None
+    # Lo que se agregue al delta viejo desde ahora se copia a la generación nueva
+    desde_delta = os.path.getsize(delta_anterior) if delta_anterior and os.path.exists(delta_anterior) else 0
+
+    tipos, origenes = [], list(ORIGENES)
+    arreglos = {nombre: array(codigo) for nombre, codigo in ARREGLOS.items() if nombre.startswith('docs_')}
+    postings = {}  # termino -> (array de docs, array de tf)
+    for codigo_origen, origen in enumerate(origenes):
+        for fila in _filas(origen):
+            tipo, frecuencias, largo = documento(origen, fila)
+            if tipo not in tipos:
+                tipos.append(tipo)
+            indice_doc = len(arreglos['docs_id'])
+            arreglos['docs_id'].append(fila.caso_id)
+            arreglos['docs_largo'].append(largo)
+            arreglos['docs_tipo'].append(tipos.index(tipo))
+            arreglos['docs_origen'].append(codigo_origen)
+            for termino, tf in frecuencias.items():
+                lista = postings.get(termino)
+                if lista is None:
+                    lista = postings[termino] = (array('i'), array('f'))
+                lista[0].append(indice_doc)
+                lista[1].append(tf)
+
+    postings_doc, postings_tf, terminos_indice = array('i'), array('f'), {}
+    for termino in sorted(postings):
+        docs, tfs = postings[termino]
+        terminos_indice[termino] = [len(postings_doc), len(docs)]
+        postings_doc.extend(docs)
+        postings_tf.extend(tfs)
+    arreglos.update(postings_doc=postings_doc, postings_tf=postings_tf)
+
+    n_docs = len(arreglos['docs_id'])
+    generacion = f'gen-{int(time.time() * 1000)}'
+    destino = os.path.join(carpeta, generacion)
+    os.makedirs(destino)
+    for nombre, datos in arreglos.items():
+        with open(os.path.join(destino, f'{nombre}.bin'), 'wb') as f:
+            datos.tofile(f)
+    with open(os.path.join(destino, 'terminos.json'), 'w', encoding='utf-8') as f:
+        json.dump(terminos_indice, f, separators=(',', ':'))
+    with open(os.path.join(destino, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'documentos': n_docs,
+            'largo_promedio': (sum(arreglos['docs_largo']) / n_docs) if n_docs else 0.0,
+            'tipos': tipos,
+            'origenes': origenes,
+            'creado': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }, f)
+
+    def copiar_delta_nuevo(desde):
+        if not delta_anterior or not os.path.exists(delta_anterior):
+            return desde
+        with open(delta_anterior, 'rb') as origen_f, open(os.path.join(destino, 'delta.jsonl'), 'ab') as destino_f:
+            origen_f.seek(desde)
+            destino_f.write(origen_f.read())
+            return origen_f.tell()
+
+    desde_delta = copiar_delta_nuevo(desde_delta)
+    temporal = os.path.join(carpeta, 'actual.json.tmp')
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump({'gen': generacion}, f)
+    os.replace(temporal, os.path.join(carpeta, 'actual.json'))
+    # Escrituras que leyeron actual.json justo antes del cambio
+    copiar_delta_nuevo(desde_delta)
+
+    # Conservar la generación anterior (otros procesos pueden tenerla abierta)
+    for nombre in os.listdir(carpeta):
+        if nombre.startswith('gen-') and nombre not in (generacion, anterior and anterior['gen']):
+            shutil.rmtree(os.path.join(carpeta, nombre), ignore_errors=True)
+
+    segundos = round(time.monotonic() - inicio, 2)
+    logger.info(f"🔎 Índice de casos construido: {n_docs} documentos, {len(terminos_indice)} términos en {segundos}s")
+    return {'documentos': n_docs, 'terminos': len(terminos_indice), 'segundos': segundos}
+
+
+def entrada_delta(origen, caso_id, fila):
+    """Renglón del delta para un caso (fila None: dado de baja)"""
+    entrada = {'k': f'{origen}:{caso_id}'}
+    if fila is not None:
+        tipo, frecuencias, largo = documento(origen, fila)
+        entrada.update(t=tipo, f=dict(frecuencias), l=largo)
+    return entrada
+
+
+def registrar_cambios(entradas):
+    """Agregar entradas al delta de la generación vigente (sin efecto si no hay índice)"""
+    if not entradas:
+        return
+    carpeta = _carpeta()
+    actual = _leer_actual(carpeta)
+    if not actual:
+        return
+    renglones = [json.dumps(e, ensure_ascii=False, separators=(',', ':')) for e in entradas]
+    with open(os.path.join(carpeta, actual['gen'], 'delta.jsonl'), 'a', encoding='utf-8') as f:
+        f.write('\n'.join(renglones) + '\n')
+
+
+# ---------------------------------------------------------------------------
+# Lectura y búsqueda
+# ---------------------------------------------------------------------------
+
+class _Generacion:
+    """Una generación del índice abierta con mmap, más su delta en memoria"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        with open(os.path.join(ruta, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(ruta, 'terminos.json'), encoding='utf-8') as f:
+            self.terminos = json.load(f)
+        self._mapas = []
+        self.arreglos = {nombre: self._mapear(nombre, codigo) for nombre, codigo in ARREGLOS.items()}
+        self._clave_doc = None
+        # Delta: clave -> (tipo, frecuencias, largo) o None si se dio de baja
+        self.delta = {}
+        self.delta_offset = 0
+        self.sincronizar_delta()
+
+    def _mapear(self, nombre, codigo):
+        with open(os.path.join(self.ruta, f'{nombre}.bin'), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return np.zeros(0, dtype=np.dtype(codigo)) if np is not None else array(codigo)
+            mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._mapas.append(mapa)
+        if np is not None:
+            return np.frombuffer(mapa, dtype=np.dtype(codigo))
+        return memoryview(mapa).cast(codigo)
+
+    def sincronizar_delta(self):
+        ruta = os.path.join(self.ruta, 'delta.jsonl')
+        try:
+            if os.path.getsize(ruta) == self.delta_offset:
+                return
+        except OSError:
+            return
+        with open(ruta, 'rb') as f:
+            f.seek(self.delta_offset)
+            for renglon in f:
+                if not renglon.endswith(b'\n'):
+                    break  # línea a medio escribir: se relee la próxima vez
+                self.delta_offset += len(renglon)
+                try:
+                    entrada = json.loads(renglon)
+                except ValueError:
+                    continue
+                self.delta[entrada['k']] = (entrada['t'], entrada['f'], entrada['l']) if 'f' in entrada else None
+
+    def excluidos_base(self):
+        """Índices de documentos de la base reemplazados o dados de baja por el delta"""
+        if not self.delta:
+            return []
+        if self._clave_doc is None:
+            origenes = self.meta['origenes']
+            self._clave_doc = {
+                f'{origenes[codigo_origen]}:{caso_id}': indice
+                for indice, (codigo_origen, caso_id) in enumerate(zip(self.arreglos['docs_origen'], self.arreglos['docs_id']))
+            }
+        return [self._clave_doc[k] for k in self.delta if k in self._clave_doc]
+
+    def buscar(self, consulta, tipo=None, limite=10):
+        terminos_consulta = list(dict.fromkeys(terminos(consulta)))
+        if not terminos_consulta:
+            return []
+
+        # Estadísticas de la colección vigente: la base sin los documentos que el
+        # delta reemplazó o dio de baja, más los documentos del delta
+        delta_vigente = {k: v for k, v in self.delta.items() if v is not None}
+        excluidos = self.excluidos_base()
+        n_total = self.meta['documentos'] - len(excluidos) + len(delta_vigente)
+        if not n_total:
+            return []
+        largo_total = (self.meta['largo_promedio'] * self.meta['documentos']
+                       - sum(self.arreglos['docs_largo'][i] for i in excluidos)
+                       + sum(v[2] for v in delta_vigente.values()))
+        largo_promedio = (largo_total / n_total) or 1.0
+
+        pesos = {}
+        for termino in terminos_consulta:
+            df = (self._df_base(termino, excluidos)
+                  + sum(1 for v in delta_vigente.values() if termino in v[1]))
+            if df:
+                pesos[termino] = math.log(1 + (n_total - df + 0.5) / (df + 0.5))
+        if not pesos:
+            return []
+
+        codigo_tipo = self.meta['tipos'].index(tipo) if tipo in self.meta['tipos'] else None
+        if np is not None:
+            candidatos = self._puntuar_numpy(pesos, largo_promedio, tipo, codigo_tipo, excluidos, limite)
+        else:
+            candidatos = self._puntuar_python(pesos, largo_promedio, tipo, codigo_tipo, excluidos)
+
+        for clave, (tipo_doc, frecuencias, largo) in delta_vigente.items():
+            if tipo and tipo_doc != tipo:
+                continue
+            puntaje = sum(
+                idf * frecuencias[t] * (K1 + 1) / (frecuencias[t] + K1 * (1 - B + B * largo / largo_promedio))
+                for t, idf in pesos.items() if t in frecuencias
+            )
+            if puntaje > 0:
+                origen, caso_id = clave.split(':')
+                candidatos.append((puntaje, origen, int(caso_id)))
+
+        candidatos.sort(key=lambda c: (-c[0], c[1], -c[2]))
+        return candidatos[:limite]
+
+    def _df_base(self, termino, excluidos):
+        """Documentos de la base vigentes que contienen el término"""
+        desde, cantidad = self.terminos.get(termino, (0, 0))
+        if not cantidad or not excluidos:
+            return cantidad
+        docs = self.arreglos['postings_doc'][desde:desde + cantidad]
+        if np is not None:
+            return cantidad - int(np.isin(docs, excluidos).sum())
+        excluidos = set(excluidos)
+        return cantidad - sum(1 for doc in docs if doc in excluidos)
+
+    def _puntuar_numpy(self, pesos, largo_promedio, tipo, codigo_tipo, excluidos, limite):
+        if tipo and codigo_tipo is None:
+            return []
+        a = self.arreglos
+        puntajes = np.zeros(self.meta['documentos'], dtype=np.float32)
+        for termino, idf in pesos.items():
+            desde, cantidad = self.terminos.get(termino, (0, 0))
+            if not cantidad:
+                continue
+            docs = a['postings_doc'][desde:desde + cantidad]
+            tf = a['postings_tf'][desde:desde + cantidad]
+            normalizacion = K1 * (1 - B + B * a['docs_largo'][docs] / largo_promedio)
+            puntajes[docs] += idf * tf * (K1 + 1) / (tf + normalizacion)
+        if codigo_tipo is not None and tipo:
+            puntajes[a['docs_tipo'] != codigo_tipo] = 0
+        if excluidos:
+            puntajes[excluidos] = 0
+        con_puntaje = np.flatnonzero(puntajes)
+        if len(con_puntaje) > limite:
+            con_puntaje = con_puntaje[np.argpartition(puntajes[con_puntaje], -limite)[-limite:]]
+        origenes = self.meta['origenes']
+        return [(float(puntajes[i]), origenes[a['docs_origen'][i]], int(a['docs_id'][i])) for i in con_puntaje]
+
+    def _puntuar_python(self, pesos, largo_promedio, tipo, codigo_tipo, excluidos):
+        if tipo and codigo_tipo is None:
+            return []
+        a = self.arreglos
+        puntajes = {}
+        for termino, idf in pesos.items():
+            desde, cantidad = self.terminos.get(termino, (0, 0))
+            for i in range(desde, desde + cantidad):
+                doc, tf = a['postings_doc'][i], a['postings_tf'][i]
+                normalizacion = K1 * (1 - B + B * a['docs_largo'][doc] / largo_promedio)
+                puntajes[doc] = puntajes.get(doc, 0.0) + idf * tf * (K1 + 1) / (tf + normalizacion)
+        for doc in excluidos:
+            puntajes.pop(doc, None)
+        origenes = self.meta['origenes']
+        return [
+            (puntaje, origenes[a['docs_origen'][doc]], a['docs_id'][doc])
+            for doc, puntaje in puntajes.items()
+            if codigo_tipo is None or a['docs_tipo'][doc] == codigo_tipo
+        ]
+
+
+# carpeta -> _Generacion abierta
+_abiertas = {}
+_lock = threading.Lock()
+
+
+def _generacion():
+    """Generación vigente abierta (None si nunca se construyó el índice)"""
+    carpeta = _carpeta()
+    actual = _leer_actual(carpeta)
+    if not actual:
+        return None
+    ruta = os.path.join(carpeta, actual['gen'])
+    with _lock:
+        abierta = _abiertas.get(carpeta)
+        if abierta is None or abierta.ruta != ruta:
+            abierta = _abiertas[carpeta] = _Generacion(ruta)
+            logger.info(f"🔎 Índice de casos abierto: {abierta.meta['documentos']} documentos ({actual['gen']})")
+        abierta.sincronizar_delta()
+    return abierta
+
+
+def disponible():
+    return _leer_actual(_carpeta()) is not None
+
+
+def buscar(consulta, tipo_estudio=None, limite=10):
+    """
+    Casos más relevantes para la consulta.
+
+    Returns:
+        Lista de (puntaje, origen 'h'|'c', caso_id) ordenada por relevancia, o
+        None si el índice no está construido
+    """
+    generacion = _generacion()
+    if generacion is None:
+        return None
+    inicio = time.monotonic()
+    with _lock:
+        resultado = generacion.buscar(consulta, normalizar_tipo(tipo_estudio) or None, limite)
+    metricas.observar('ldh_indice_casos_busqueda_segundos', time.monotonic() - inicio)
+    return resultado
+
+
+# ---------------------------------------------------------------------------
+# Actualización incremental desde la sesión
+# ---------------------------------------------------------------------------
+
+def _registrar_pendientes(session, flush_context):
+    """after_flush: tokenizar los casos creados, modificados o borrados (después del
+    commit los atributos están expirados y no se puede consultar)"""
+    pendientes = session.info.setdefault('indice_casos_pendientes', {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        origen = ORIGEN_POR_MODELO.get(type(obj))
+        if not origen or obj.caso_id is None:
+            continue
+        vigente = obj not in session.deleted and obj.activo is not False
+        pendientes[(origen, obj.caso_id)] = entrada_delta(origen, obj.caso_id, obj if vigente else None)
+
+
+def _aplicar_pendientes(session):
+    pendientes = session.info.pop('indice_casos_pendientes', None)
+    if not pendientes:
+        return
+    try:
+        registrar_cambios(list(pendientes.values()))
+    except Exception as e:
+        logger.error(f"No se pudo actualizar el índice de casos: {e}")
+
+
+def _descartar_pendientes(session):
+    session.info.pop('indice_casos_pendientes', None)
+
+
+def init_app(app):
+    """Mantener el delta del índice al día con los commits de la sesión"""
+    if not event.contains(Session, 'after_flush', _registrar_pendientes):
+        event.listen(Session, 'after_flush', _registrar_pendientes)
+        event.listen(Session, 'after_commit', _aplicar_pendientes)
+        event.listen(Session, 'after_rollback', _descartar_pendientes)
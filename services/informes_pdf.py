@@ -0,0 +1,137 @@
+"""
+Almacén de PDFs de informes pre-renderizados
+
+Al completar un protocolo se encola el render de su PDF final en segundo plano;
+el portal del prestador luego lo sirve desde disco sin esperar a WeasyPrint.
+
+Cada archivo se identifica por el hash del HTML del informe, así que cualquier
+cambio que altere el resultado (líneas, diseño, configuración, firma del médico)
+produce otra clave y el PDF anterior simplemente deja de usarse. Renderizar dos
+veces el mismo HTML es idempotente: si el archivo ya existe no se vuelve a generar.
+"""
+import glob
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, render_template
+
+from services import metricas
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_INFORME = 'plantillas_dinamicas/reporte_unificado.html'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _carpeta():
+    carpeta = current_app.config['INFORMES_FOLDER']
+    os.makedirs(carpeta, exist_ok=True)
+    return carpeta
+
+
+def _ruta(protocolo_id, html):
+    clave = hashlib.sha256(html.encode('utf-8')).hexdigest()[:20]
+    return os.path.join(_carpeta(), f'{protocolo_id}_{clave}.pdf')
+
+
+def _guardar(ruta, protocolo_id, pdf_bytes):
+    """Escritura atómica y limpieza de versiones anteriores del mismo protocolo"""
+    descriptor, temporal = tempfile.mkstemp(dir=os.path.dirname(ruta), suffix='.tmp')
+    with os.fdopen(descriptor, 'wb') as f:
+        f.write(pdf_bytes)
+    os.replace(temporal, ruta)
+    for anterior in glob.glob(os.path.join(os.path.dirname(ruta), f'{protocolo_id}_*.pdf')):
+        if anterior != ruta:
+            try:
+                os.remove(anterior)
+            except OSError:
+                pass
+
+
+def obtener_pdf(protocolo_id, html, base_url, origen='portal'):
+    """
+    PDF del informe: desde el almacén si existe para este HTML, o renderizado y guardado.
+
+    Args:
+        protocolo_id: ID del protocolo
+        html: HTML del informe ya renderizado
+        base_url: Base para resolver URLs relativas
+        origen: Etiqueta de la métrica de render
+
+    Returns:
+        bytes del PDF
+    """
+    from utils.pdf import renderizar_pdf
+
+    ruta = _ruta(protocolo_id, html)
+    if os.path.exists(ruta):
+        metricas.registrar_cache('informes_pdf', True)
+        with open(ruta, 'rb') as f:
+            return f.read()
+
+    metricas.registrar_cache('informes_pdf', False)
+    pdf_bytes = renderizar_pdf(html, base_url, origen=origen)
+    try:
+        _guardar(ruta, protocolo_id, pdf_bytes)
+    except OSError as e:
+        logger.warning(f"No se pudo guardar el PDF del protocolo {protocolo_id}: {e}")
+    return pdf_bytes
+
+
+def _base_url(app):
+    return app.config.get('APPLICATION_URL') or 'http://localhost/'
+
+
+def _prerenderizar(app, protocolo_ids):
+    """Renderizar y guardar los PDFs de los protocolos indicados (en segundo plano)"""
+    from extensions import db
+    from routes.plantillas_dinamicas import construir_contextos_reporte
+
+    base_url = _base_url(app)
+    with app.test_request_context(base_url=base_url):
+        try:
+            contextos = construir_contextos_reporte(protocolo_ids)
+            for protocolo_id, contexto in contextos.items():
+                if contexto['protocolo'].estado != 'COMPLETADO':
+                    continue
+                try:
+                    html = render_template(TEMPLATE_INFORME, **contexto)
+                    obtener_pdf(protocolo_id, html, base_url, origen='prerender')
+                except Exception as e:
+                    logger.error(f"Error pre-renderizando el PDF del protocolo {protocolo_id}: {e}")
+            logger.info(f"📄 PDFs pre-renderizados: {len(contextos)}")
+        finally:
+            db.session.remove()
+
+
+def encolar_prerender(protocolo_ids):
+    """
+    Encolar el render en segundo plano de los PDFs (llamar después del commit).
+
+    Sin efecto si INFORMES_PRERENDER está desactivado o WeasyPrint no está instalado.
+    """
+    global _executor
+    app = current_app._get_current_object()
+    if not app.config.get('INFORMES_PRERENDER'):
+        return
+    try:
+        import weasyprint  # noqa: F401
+    except Exception:
+        return
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prerender-pdf')
+    _executor.submit(_prerenderizar, app, list(protocolo_ids))
+
+
+def encolar_si_completado(protocolo):
+    """Volver a pre-renderizar un protocolo ya completado (p. ej. tras editar sus líneas)"""
+    if protocolo is not None and protocolo.estado == 'COMPLETADO' and not protocolo.es_prueba:
+        encolar_prerender([protocolo.protocolo_id])
@@ -0,0 +1,168 @@
+"""
+Guardado de líneas de protocolo por diferencias
+
+En lugar de borrar y reinsertar todas las líneas en cada guardado, compara las
+líneas recibidas con las guardadas y aplica solo los INSERT, UPDATE y DELETE
+necesarios, en sentencias masivas de Core.
+
+Cada guardado con cambios incrementa `Protocolo.revision_lineas`; el cliente puede
+enviar la revisión que tiene para detectar escrituras sobre una versión vieja.
+"""
+from collections import defaultdict
+
+from sqlalchemy import select, insert, update, delete, bindparam
+
+from extensions import db
+from models.informe import ProtocoloLinea
+from models.protocolo import Protocolo
+
+
+class RevisionObsoleta(Exception):
+    """Las líneas del protocolo cambiaron desde la revisión que tiene el cliente"""
+
+    def __init__(self, revision_actual):
+        super().__init__(f'Las líneas fueron modificadas por otro guardado (revisión actual {revision_actual})')
+        self.revision_actual = revision_actual
+
+
+def agrupar_lineas(lineas):
+    """
+    Agrupar líneas [{'seccion', 'texto', 'orden'}] por sección, ordenadas por `orden`.
+
+    Returns:
+        Dict seccion -> [(texto, orden), ...]
+    """
+    por_seccion = defaultdict(list)
+    for posicion, linea in enumerate(lineas):
+        seccion = (linea.get('seccion') or '').strip()
+        if not seccion:
+            continue
+        orden = linea.get('orden')
+        por_seccion[seccion].append((linea.get('texto') or '', orden if orden is not None else posicion, posicion))
+    return {
+        seccion: [(texto, orden) for texto, orden, _ in sorted(items, key=lambda x: (x[1], x[2]))]
+        for seccion, items in por_seccion.items()
+    }
+
+
+def _diferencias_seccion(existentes, nuevas):
+    """
+    Calcular operaciones para llevar una sección de `existentes` a `nuevas`.
+
+    Las líneas con el mismo texto conservan su fila (a lo sumo cambia el orden);
+    las filas sobrantes se reutilizan para textos nuevos antes de insertar o borrar.
+
+    Args:
+        existentes: [(id, texto, orden)]
+        nuevas: [(texto, orden)]
+
+    Returns:
+        (actualizaciones [(id, texto, orden)], inserciones [(texto, orden)], ids a borrar)
+    """
+    libres_por_texto = defaultdict(list)
+    for fila in existentes:
+        libres_por_texto[fila[1]].append(fila)
+
+    asignadas = {}
+    sin_asignar = []
+    for indice, (texto, orden) in enumerate(nuevas):
+        candidatas = libres_por_texto.get(texto)
+        if candidatas:
+            asignadas[indice] = candidatas.pop(0)
+        else:
+            sin_asignar.append(indice)
+
+    usadas = {fila[0] for fila in asignadas.values()}
+    sobrantes = [fila for fila in existentes if fila[0] not in usadas]
+
+    actualizaciones, inserciones = [], []
+    for indice in sin_asignar:
+        if sobrantes:
+            asignadas[indice] = sobrantes.pop(0)
+        else:
+            inserciones.append(nuevas[indice])
+
+    for indice, (id_fila, texto_actual, orden_actual) in asignadas.items():
+        texto, orden = nuevas[indice]
+        if texto != texto_actual or orden != orden_actual:
+            actualizaciones.append((id_fila, texto, orden))
+
+    return actualizaciones, inserciones, [fila[0] for fila in sobrantes]
+
+
+def guardar_lineas(protocolo_id, lineas_por_seccion, secciones=None, revision_esperada=None):
+    """
+    Guardar las líneas de un protocolo aplicando solo las diferencias (sin commit).
+
+    Args:
+        protocolo_id: ID del protocolo
+        lineas_por_seccion: Dict seccion -> [(texto, orden)] (ver agrupar_lineas)
+        secciones: Secciones a reemplazar; None reemplaza el protocolo completo
+            (las secciones ausentes se eliminan)
+        revision_esperada: Revisión que tiene el cliente, o None para no verificar
+
+    Returns:
+        Dict con la revisión resultante y la cantidad de filas insertadas,
+        actualizadas y eliminadas
+
+    Raises:
+        RevisionObsoleta: Si revision_esperada no coincide con la guardada
+    """
+    tabla = ProtocoloLinea.__table__
+    revision_actual = db.session.execute(
+        select(Protocolo.revision_lineas).where(Protocolo.protocolo_id == protocolo_id)
+    ).scalar_one()
+    if revision_esperada is not None and revision_esperada != revision_actual:
+        raise RevisionObsoleta(revision_actual)
+
+    consulta = select(tabla.c.protocolo_linea_id, tabla.c.seccion, tabla.c.texto, tabla.c.orden).where(
+        tabla.c.protocolo_id == protocolo_id
+    ).order_by(tabla.c.seccion, tabla.c.orden, tabla.c.protocolo_linea_id)
+    if secciones is not None:
+        consulta = consulta.where(tabla.c.seccion.in_(list(secciones)))
+
+    existentes = defaultdict(list)
+    for fila in db.session.execute(consulta):
+        existentes[fila.seccion].append((fila.protocolo_linea_id, fila.texto, fila.orden))
+
+    afectadas = set(secciones) if secciones is not None else set(existentes) | set(lineas_por_seccion)
+    actualizaciones, inserciones, borrados = [], [], []
+    for seccion in afectadas:
+        cambios, nuevas, sobrantes = _diferencias_seccion(existentes.get(seccion, []),
+                                                          lineas_por_seccion.get(seccion, []))
+        actualizaciones.extend(cambios)
+        inserciones.extend((seccion, texto, orden) for texto, orden in nuevas)
+        borrados.extend(sobrantes)
+
+    resumen = {'revision': revision_actual, 'insertadas': len(inserciones),
+               'actualizadas': len(actualizaciones), 'eliminadas': len(borrados)}
+    if not (actualizaciones or inserciones or borrados):
+        return resumen
+
+    # Incremento condicionado: si otro guardado se adelantó, no se pisa
+    resultado = db.session.execute(
+        update(Protocolo.__table__).where(
+            Protocolo.__table__.c.protocolo_id == protocolo_id,
+            Protocolo.__table__.c.revision_lineas == revision_actual
+        ).values(revision_lineas=Protocolo.__table__.c.revision_lineas + 1)
+    )
+    if resultado.rowcount != 1:
+        raise RevisionObsoleta(revision_actual + 1)
+
+    if borrados:
+        db.session.execute(delete(tabla).where(tabla.c.protocolo_linea_id.in_(borrados)))
+    if actualizaciones:
+        db.session.execute(
+            update(tabla).where(tabla.c.protocolo_linea_id == bindparam('b_id')).values(
+                texto=bindparam('b_texto'), orden=bindparam('b_orden')
+            ),
+            [{'b_id': i, 'b_texto': t, 'b_orden': o} for i, t, o in actualizaciones]
+        )
+    if inserciones:
+        db.session.execute(insert(tabla), [
+            {'protocolo_id': protocolo_id, 'seccion': s, 'texto': t, 'orden': o}
+            for s, t, o in inserciones
+        ])
+
+    resumen['revision'] = revision_actual + 1
+    return resumen
@@ -0,0 +1,126 @@
+"""
+Materialización masiva de plantillas
+
+Guardar una plantilla personalizada PAP asociada a un botón o exportar una
+plantilla generada requería una consulta (y un flush) por línea. Estas funciones
+resuelven todas las líneas de una vez: una búsqueda por conjunto, un único INSERT
+de varias filas para las que faltan y una relectura, de modo que la cantidad de
+sentencias no depende del tamaño de la plantilla.
+"""
+from sqlalchemy import select, insert, delete
+
+from extensions import db
+from models.informe import LineaPap, PlantillaLinea
+from models.plantilla_dinamica import SeccionPlantilla, LineaPlantilla
+
+
+def _buscar_lineas_pap(pares):
+    """{(categoria, texto): linea_id} de las líneas activas que ya existen"""
+    tabla = LineaPap.__table__
+    categorias = {categoria for categoria, _ in pares}
+    textos = {texto for _, texto in pares}
+    filas = db.session.execute(
+        select(tabla.c.linea_id, tabla.c.categoria, tabla.c.texto).where(
+            tabla.c.activo.is_(True),
+            tabla.c.categoria.in_(categorias),
+            tabla.c.texto.in_(textos)
+        ).order_by(tabla.c.linea_id)
+    ).all()
+    encontradas = {}
+    for linea_id, categoria, texto in filas:
+        # Con duplicados históricos se usa la más antigua, como el .first() anterior
+        encontradas.setdefault((categoria, texto), linea_id)
+    return {par: linea_id for par, linea_id in encontradas.items() if par in pares}
+
+
+def resolver_o_crear_lineas_pap(lineas):
+    """
+    Obtener el id de LineaPap de cada (categoria, texto), creando las que falten.
+
+    Args:
+        lineas: Lista ordenada de (categoria, texto); la posición se usa como
+            `orden` de las líneas nuevas
+
+    Returns:
+        Dict (categoria, texto) -> linea_id
+    """
+    pares = {}
+    for orden, (categoria, texto) in enumerate(lineas):
+        pares.setdefault((categoria, texto), orden)
+    if not pares:
+        return {}
+
+    ids = _buscar_lineas_pap(pares)
+    faltantes = [par for par in pares if par not in ids]
+    if faltantes:
+        db.session.execute(insert(LineaPap.__table__), [
+            {'categoria': categoria, 'texto': texto, 'orden': pares[(categoria, texto)],
+             'activo': True, 'veces_usado': 0}
+            for categoria, texto in faltantes
+        ])
+        ids = _buscar_lineas_pap(pares)
+    return ids
+
+
+def reemplazar_lineas_plantilla_pap(plantilla_pap_id, lineas_por_categoria):
+    """
+    Reemplazar las líneas asociadas a una PlantillaPap (sin commit).
+
+    Args:
+        plantilla_pap_id: Id de la plantilla estándar
+        lineas_por_categoria: Dict categoria -> [textos], en el orden del informe
+
+    Returns:
+        Cantidad de líneas asociadas
+    """
+    lineas = [(categoria, texto)
+              for categoria, textos in lineas_por_categoria.items()
+              for texto in textos]
+    ids = resolver_o_crear_lineas_pap(lineas)
+
+    tabla = PlantillaLinea.__table__
+    db.session.execute(delete(tabla).where(tabla.c.plantilla_id == plantilla_pap_id))
+
+    asociaciones = []
+    vistas = set()
+    for orden, par in enumerate(lineas):
+        linea_id = ids[par]
+        # uq_plantilla_linea: una misma línea se asocia una sola vez
+        if linea_id in vistas:
+            continue
+        vistas.add(linea_id)
+        asociaciones.append({'plantilla_id': plantilla_pap_id, 'linea_plantilla_id': linea_id, 'orden': orden})
+    if asociaciones:
+        db.session.execute(insert(tabla), asociaciones)
+    return len(asociaciones)
+
+
+def resolver_contenido_generado(contenido):
+    """
+    Resolver el contenido de una PlantillaGenerada ({seccion_id: linea_id}) con
+    dos consultas IN.
+
+    Returns:
+        Lista de (nombre de sección, texto de línea) en el orden del contenido,
+        omitiendo las referencias que ya no existen
+    """
+    referencias = []
+    for seccion_id, linea_id in (contenido or {}).items():
+        try:
+            referencias.append((int(seccion_id), int(linea_id)))
+        except (TypeError, ValueError):
+            continue
+    if not referencias:
+        return []
+
+    secciones = dict(db.session.execute(
+        select(SeccionPlantilla.seccion_id, SeccionPlantilla.nombre).where(
+            SeccionPlantilla.seccion_id.in_({s for s, _ in referencias})
+        )
+    ).all())
+    lineas = dict(db.session.execute(
+        select(LineaPlantilla.linea_id, LineaPlantilla.texto).where(
+            LineaPlantilla.linea_id.in_({l for _, l in referencias})
+        )
+    ).all())
+    return [(secciones[s], lineas[l]) for s, l in referencias if s in secciones and l in lineas]
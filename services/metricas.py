@@ -0,0 +1,303 @@
+"""
+Métricas de la aplicación en formato Prometheus (en proceso, sin agentes externos)
+
+Registra contadores e histogramas en memoria y los expone en /metrics:
+latencia y cantidad de requests por endpoint, tiempo de base de datos por request,
+latencia y tokens de las llamadas a Claude/Gemini, duración de render de PDFs,
+resultado de los envíos SMTP y aciertos de los caches.
+
+Las métricas son por proceso: con varios workers, Prometheus debe consultar cada uno.
+"""
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Buckets (segundos) para latencias de requests y base de datos
+BUCKETS_REQUEST = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Buckets (segundos) para operaciones lentas: LLM y render de PDF
+BUCKETS_LENTOS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# nombre -> (tipo, ayuda, buckets)
+DEFINICIONES = {
+    'ldh_http_requests_total': ('counter', 'Requests atendidos por endpoint, método y estado', None),
+    'ldh_http_request_duration_seconds': ('histogram', 'Duración de los requests por endpoint', BUCKETS_REQUEST),
+    'ldh_db_duration_seconds': ('histogram', 'Tiempo de base de datos por request', BUCKETS_REQUEST),
+    'ldh_db_queries_total': ('counter', 'Consultas SQL ejecutadas por endpoint', None),
+    'ldh_llm_request_duration_seconds': ('histogram', 'Duración de las llamadas a modelos de IA', BUCKETS_LENTOS),
+    'ldh_llm_tokens_total': ('counter', 'Tokens consumidos en llamadas a modelos de IA', None),
+    'ldh_pdf_render_duration_seconds': ('histogram', 'Duración del render de PDFs', BUCKETS_LENTOS),
+    'ldh_smtp_envios_total': ('counter', 'Envíos de email por resultado', None),
+    'ldh_cache_total': ('counter', 'Consultas a caches internos por resultado (hit/miss)', None),
+    'ldh_contadores_uso_total': ('counter', 'Usos de plantillas registrados en memoria y filas volcadas a la base', None),
+    'ldh_indice_casos_busqueda_segundos': ('histogram', 'Duración de las búsquedas en el índice de casos', BUCKETS_REQUEST),
+    'ldh_autocompletado_segundos': ('histogram', 'Duración de las consultas de autocompletado de líneas', BUCKETS_REQUEST),
+    'ldh_prediccion_lineas_segundos': ('histogram', 'Duración de las predicciones de la próxima línea', BUCKETS_REQUEST),
+    'ldh_asistente_tools_segundos': ('histogram', 'Duración de las herramientas de base de datos del asistente', BUCKETS_REQUEST),
+    'ldh_asistente_tools_total': ('counter', 'Ejecuciones de herramientas del asistente por resultado', None),
+    'ldh_ia_modelos_descubrimiento_segundos': ('histogram', 'Duración del descubrimiento de modelos de IA por proveedor', BUCKETS_LENTOS),
+}
+
+_lock = threading.Lock()
+# nombre -> {etiquetas (tupla ordenada): valor}  para contadores
+# nombre -> {etiquetas: [conteos por bucket..., suma, cantidad]}  para histogramas
+_valores = {nombre: {} for nombre in DEFINICIONES}
+
+# Método público del cliente de IA en curso (lo fija el decorador funcion_llm)
+_funcion_llm = ContextVar('funcion_llm', default=None)
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    """Sumar `valor` a un contador"""
+    clave = tuple(sorted(etiquetas.items()))
+    with _lock:
+        serie = _valores[nombre]
+        serie[clave] = serie.get(clave, 0) + valor
+
+
+def observar(nombre, valor, **etiquetas):
+    """Registrar una observación en un histograma"""
+    buckets = DEFINICIONES[nombre][2]
+    clave = tuple(sorted(etiquetas.items()))
+    indice = bisect_left(buckets, valor)
+    with _lock:
+        serie = _valores[nombre]
+        datos = serie.get(clave)
+        if datos is None:
+            datos = serie[clave] = [0] * (len(buckets) + 1) + [0.0, 0]
+        datos[indice] += 1
+        datos[-2] += valor
+        datos[-1] += 1
+
+
+@contextmanager
+def medir(nombre, **etiquetas):
+    """Context manager que observa la duración del bloque en un histograma"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+
+def percentil(ordenados, fraccion):
+    """Valor del percentil `fraccion` (0 a 1) de una lista ordenada, o None si está vacía"""
+    if not ordenados:
+        return None
+    return ordenados[min(int(round(fraccion * (len(ordenados) - 1))), len(ordenados) - 1)]
+
+
+def registrar_cache(cache, acierto):
+    """Registrar un acierto (hit) o fallo (miss) de un cache interno"""
+    incrementar('ldh_cache_total', cache=cache, resultado='hit' if acierto else 'miss')
+
+
+def registrar_llm(proveedor, modelo, duracion, tokens_entrada=0, tokens_salida=0, exito=True,
+                  tokens_cache_lectura=0, tokens_cache_escritura=0):
+    """Registrar una llamada a un modelo de IA"""
+    observar('ldh_llm_request_duration_seconds', duracion, proveedor=proveedor, modelo=modelo,
+             resultado='ok' if exito else 'error')
+    if tokens_entrada:
+        incrementar('ldh_llm_tokens_total', tokens_entrada, proveedor=proveedor, modelo=modelo, tipo='entrada')
+    if tokens_salida:
+        incrementar('ldh_llm_tokens_total', tokens_salida, proveedor=proveedor, modelo=modelo, tipo='salida')
+    if tokens_cache_lectura:
+        incrementar('ldh_llm_tokens_total', tokens_cache_lectura, proveedor=proveedor, modelo=modelo,
+                    tipo='cache_lectura')
+    if tokens_cache_escritura:
+        incrementar('ldh_llm_tokens_total', tokens_cache_escritura, proveedor=proveedor, modelo=modelo,
+                    tipo='cache_escritura')
+
+
+def _tokens_respuesta(respuesta):
+    """Tokens de una respuesta: `usage` (Claude) o `usageMetadata` (Gemini, que incluye los cacheados en la entrada)"""
+    uso = respuesta.get('usage') or {}
+    meta = respuesta.get('usageMetadata') or {}
+    cache_lectura = uso.get('cache_read_input_tokens') or meta.get('cachedContentTokenCount') or 0
+    entrada = uso.get('input_tokens')
+    if entrada is None:
+        entrada = max((meta.get('promptTokenCount') or 0) - cache_lectura, 0)
+    return {
+        'tokens_entrada': entrada or 0,
+        'tokens_salida': uso.get('output_tokens') or meta.get('candidatesTokenCount') or 0,
+        'tokens_cache_lectura': cache_lectura,
+        'tokens_cache_escritura': uso.get('cache_creation_input_tokens') or 0,
+    }
+
+
+def funcion_llm(nombre):
+    """
+    Decorador para los métodos públicos de los clientes de IA: las llamadas que
+    hagan a `_make_request` se registran con `nombre` como función.
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def envoltura(*args, **kwargs):
+            token = _funcion_llm.set(nombre)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _funcion_llm.reset(token)
+        return envoltura
+    return decorador
+
+
+def medir_llm(proveedor):
+    """
+    Decorador para el `_make_request` de los clientes de IA.
+
+    Mide la duración y toma los tokens de la respuesta, incluidos los leídos
+    y escritos en el cache de prompts del proveedor. Además deja el registro
+    de la llamada en services/uso_llm, con la función que fijó funcion_llm.
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def envoltura(self, *args, **kwargs):
+            from services import uso_llm
+            funcion = _funcion_llm.get() or 'sin_funcion'
+            uso_llm.iniciar_llamada()
+            inicio = time.perf_counter()
+            try:
+                respuesta = func(self, *args, **kwargs)
+            except Exception:
+                duracion = time.perf_counter() - inicio
+                registrar_llm(proveedor, getattr(self, 'model', ''), duracion, exito=False)
+                uso_llm.registrar_llamada(proveedor, getattr(self, 'model', ''), funcion, duracion, exito=False)
+                raise
+            duracion = time.perf_counter() - inicio
+            tokens = _tokens_respuesta(respuesta)
+            registrar_llm(proveedor, getattr(self, 'model', ''), duracion, **tokens)
+            uso_llm.registrar_llamada(proveedor, getattr(self, 'model', ''), funcion, duracion, **tokens)
+            return respuesta
+        return envoltura
+    return decorador
+
+
+# ---------------------------------------------------------------------------
+# Instrumentación de requests y base de datos
+# ---------------------------------------------------------------------------
+
+def _antes_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_metricas_inicio', []).append(time.perf_counter())
+
+
+def _cerrar_consulta(conn):
+    pila = conn.info.get('_metricas_inicio')
+    if not pila:
+        return
+    duracion = time.perf_counter() - pila.pop()
+    if has_request_context():
+        g._metricas_db = getattr(g, '_metricas_db', 0.0) + duracion
+        g._metricas_consultas = getattr(g, '_metricas_consultas', 0) + 1
+
+
+def _despues_de_consulta(conn, cursor, statement, parameters, context, executemany):
+    _cerrar_consulta(conn)
+
+
+def _error_de_consulta(contexto):
+    # Sin esto, cada sentencia fallida deja su inicio en la conexión del pool
+    # y las duraciones siguientes se miden contra el inicio equivocado
+    if contexto.connection is not None:
+        _cerrar_consulta(contexto.connection)
+
+
+def _inicio_request():
+    g._metricas_inicio = time.perf_counter()
+    g._metricas_db = 0.0
+    g._metricas_consultas = 0
+
+
+def _fin_request(response):
+    inicio = getattr(g, '_metricas_inicio', None)
+    if inicio is None:
+        return response
+    endpoint = request.url_rule.endpoint if request.url_rule else 'sin_ruta'
+    incrementar('ldh_http_requests_total', endpoint=endpoint, metodo=request.method, estado=str(response.status_code))
+    observar('ldh_http_request_duration_seconds', time.perf_counter() - inicio, endpoint=endpoint)
+    if g._metricas_consultas:
+        observar('ldh_db_duration_seconds', g._metricas_db, endpoint=endpoint)
+        incrementar('ldh_db_queries_total', g._metricas_consultas, endpoint=endpoint)
+    return response
+
+
+def init_app(app):
+    """Instalar la instrumentación de requests y de SQLAlchemy"""
+    app.before_request(_inicio_request)
+    app.after_request(_fin_request)
+    if not event.contains(Engine, 'before_cursor_execute', _antes_de_consulta):
+        event.listen(Engine, 'before_cursor_execute', _antes_de_consulta)
+        event.listen(Engine, 'after_cursor_execute', _despues_de_consulta)
+        event.listen(Engine, 'handle_error', _error_de_consulta)
+
+
+# ---------------------------------------------------------------------------
+# Exportación
+# ---------------------------------------------------------------------------
+
+def _formatear_etiquetas(clave, extra=None):
+    pares = list(clave) + (extra or [])
+    if not pares:
+        return ''
+    contenido = ','.join(
+        '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in pares
+    )
+    return '{' + contenido + '}'
+
+
+def _formatear_numero(valor):
+    if isinstance(valor, float):
+        return repr(round(valor, 6))
+    return str(valor)
+
+
+def exportar():
+    """Texto en formato de exposición de Prometheus (text/plain; version=0.0.4)"""
+    with _lock:
+        copia = {nombre: {k: (list(v) if isinstance(v, list) else v) for k, v in serie.items()}
+                 for nombre, serie in _valores.items()}
+
+    lineas = []
+    for nombre, (tipo, ayuda, buckets) in DEFINICIONES.items():
+        lineas.append(f'# HELP {nombre} {ayuda}')
+        lineas.append(f'# TYPE {nombre} {tipo}')
+        for clave, valor in sorted(copia[nombre].items()):
+            if tipo == 'histogram':
+                acumulado = 0
+                for limite, conteo in zip(buckets, valor):
+                    acumulado += conteo
+                    lineas.append(f'{nombre}_bucket{_formatear_etiquetas(clave, [("le", limite)])} {acumulado}')
+                acumulado += valor[len(buckets)]
+                lineas.append(f'{nombre}_bucket{_formatear_etiquetas(clave, [("le", "+Inf")])} {acumulado}')
+                lineas.append(f'{nombre}_sum{_formatear_etiquetas(clave)} {_formatear_numero(valor[-2])}')
+                lineas.append(f'{nombre}_count{_formatear_etiquetas(clave)} {valor[-1]}')
+            else:
+                lineas.append(f'{nombre}{_formatear_etiquetas(clave)} {_formatear_numero(valor)}')
+
+    # Proporción de aciertos de cada cache (derivada de ldh_cache_total)
+    por_cache = {}
+    for clave, valor in copia['ldh_cache_total'].items():
+        etiquetas = dict(clave)
+        totales = por_cache.setdefault(etiquetas.get('cache', ''), [0, 0])
+        totales[0 if etiquetas.get('resultado') == 'hit' else 1] += valor
+    lineas.append('# HELP ldh_cache_hit_ratio Proporción de aciertos de cada cache interno')
+    lineas.append('# TYPE ldh_cache_hit_ratio gauge')
+    for cache, (aciertos, fallos) in sorted(por_cache.items()):
+        total = aciertos + fallos
+        lineas.append(f'ldh_cache_hit_ratio{{cache="{cache}"}} {_formatear_numero(aciertos / total if total else 0.0)}')
+
+    return '\n'.join(lineas) + '\n'
+
+
+def reiniciar():
+    """Vaciar todas las series (uso en pruebas y benchmarks)"""
+    with _lock:
+        for serie in _valores.values():
+            serie.clear()
@@ -1,19 +1,25 @@
 """
 Servicio de notificaciones (Email y WhatsApp)
 """
-import smtplib
 import logging
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from flask import current_app, url_for
+from sqlalchemy import event
 from models.prestador import Prestador
 from models.usuario import Usuario
 from models.entidad import usuario_prestador
+from models.notificacion import NotificacionSalida
 from extensions import db
 
 logger = logging.getLogger(__name__)
 
 
+def _despertar_despachador(session):
+    """after_commit: avisar al despachador si la transacción encoló notificaciones"""
+    if session.info.pop('notificaciones_encoladas', False):
+        from services.despachador_notificaciones import despertar
+        despertar()
+
+
 class NotificacionesService:
     """Servicio para enviar notificaciones a prestadores y entidades"""
     
@@ -22,6 +28,9 @@ class NotificacionesService:
         """
         Enviar notificación cuando se completa un protocolo
         
+        Los emails se encolan en la bandeja de salida sin hacer commit: llamar
+        antes del commit que marca el protocolo como COMPLETADO.
+        
         Args:
             protocolo: Instancia del modelo Protocolo
         """
@@ -56,7 +65,8 @@ class NotificacionesService:
         
         # Enviar por email si está configurado
         if prestador.notificar_email and prestador.email:
-            resultado = NotificacionesService._enviar_email(
+            NotificacionesService._encolar_email(
+                protocolo=protocolo,
                 destinatario=prestador.email,
                 asunto=f"Protocolo {protocolo.numero_protocolo} completado",
                 mensaje=NotificacionesService._generar_mensaje_email(
@@ -67,10 +77,7 @@ class NotificacionesService:
                     mensaje_acceso=mensaje_acceso
                 )
             )
-            if resultado:
-                logger.info(f"✅ Email enviado a {prestador.email} para protocolo {protocolo.numero_protocolo}")
-            else:
-                logger.warning(f"⚠️ No se pudo enviar email a {prestador.email} (SMTP no configurado o error)")
+            logger.info(f"📨 Email encolado para {prestador.email} (protocolo {protocolo.numero_protocolo})")
         
         # Enviar por WhatsApp si está configurado
         if prestador.notificar_whatsapp and prestador.whatsapp:
@@ -148,7 +155,8 @@ class NotificacionesService:
             
             # Enviar email si está configurado
             if prestador_entidad.notificar_email and prestador_entidad.email:
-                resultado = NotificacionesService._enviar_email(
+                NotificacionesService._encolar_email(
+                    protocolo=protocolo,
                     destinatario=prestador_entidad.email,
                     asunto=f"Protocolo {protocolo.numero_protocolo} completado - {protocolo.prestador.nombre_completo}",
                     mensaje=NotificacionesService._generar_mensaje_email_entidad(
@@ -160,10 +168,7 @@ class NotificacionesService:
                         mensaje_acceso=mensaje_acceso
                     )
                 )
-                if resultado:
-                    logger.info(f"✅ Email enviado a entidad {prestador_entidad.email} para protocolo {protocolo.numero_protocolo}")
-                else:
-                    logger.warning(f"⚠️ No se pudo enviar email a entidad {prestador_entidad.email} (SMTP no configurado o error)")
+                logger.info(f"📨 Email encolado para entidad {prestador_entidad.email} (protocolo {protocolo.numero_protocolo})")
             
             # Enviar WhatsApp si está configurado
             if prestador_entidad.notificar_whatsapp and prestador_entidad.whatsapp:
@@ -314,41 +319,27 @@ Se completó un protocolo del prestador asociado {prestador_original.nombre_comp
         return mensaje
     
     @staticmethod
-    def _enviar_email(destinatario, asunto, mensaje):
-        """Enviar email usando SMTP"""
-        try:
-            smtp_host = current_app.config.get('SMTP_HOST')
-            smtp_port = current_app.config.get('SMTP_PORT', 587)
-            smtp_user = current_app.config.get('SMTP_USER')
-            smtp_password = current_app.config.get('SMTP_PASSWORD')
-            smtp_use_tls = current_app.config.get('SMTP_USE_TLS', True)
-            remitente = current_app.config.get('LABORATORIO_EMAIL', smtp_user or 'noreply@laboratorio.com')
-            
-            if not smtp_host:
-                logger.warning("SMTP_HOST no configurado, no se puede enviar email")
-                return False
-            
-            msg = MIMEMultipart()
-            msg['From'] = remitente
-            msg['To'] = destinatario
-            msg['Subject'] = asunto
-            msg.attach(MIMEText(mensaje, 'plain', 'utf-8'))
-            
-            server = smtplib.SMTP(smtp_host, smtp_port)
-            if smtp_use_tls:
-                server.starttls()
-            
-            if smtp_user and smtp_password:
-                server.login(smtp_user, smtp_password)
-            
-            server.send_message(msg)
-            server.quit()
-            
-            return True
-        except Exception as e:
-            logger.error(f"Error enviando email: {e}")
-            # No lanzar excepción, solo registrar el error para no interrumpir el flujo principal
-            return False
+    def _encolar_email(protocolo, destinatario, asunto, mensaje):
+        """
+        Agregar un email a la bandeja de salida.
+
+        No hace commit: la notificación se guarda en la misma transacción que el
+        cambio de estado del protocolo y la envía el despachador en segundo plano.
+        """
+        db.session.add(NotificacionSalida(
+            canal='EMAIL',
+            destinatario=destinatario,
+            asunto=asunto,
+            mensaje=mensaje,
+            protocolo_id=protocolo.protocolo_id
+        ))
+        
+        # Avisar al despachador en cuanto la transacción se confirme (el listener
+        # queda en la sesión; la marca se consume en cada commit que encoló algo)
+        sesion = db.session()
+        sesion.info['notificaciones_encoladas'] = True
+        if not event.contains(sesion, 'after_commit', _despertar_despachador):
+            event.listen(sesion, 'after_commit', _despertar_despachador)
     
     @staticmethod
     def _enviar_whatsapp(numero, mensaje):
@@ -0,0 +1,490 @@
+"""
+Predicción de la próxima línea de una sección a partir de protocolos completados
+
+Modelo de n-gramas de líneas entrenado con las `ProtocoloLinea` de los protocolos
+COMPLETADO (sin los de prueba). Cada línea se identifica por su texto plegado
+(services/analisis_texto) y cada sección es una secuencia
+
+    [última línea de la sección anterior del protocolo, ^, línea 1, ..., línea n, $]
+
+de la que se cuentan, por tipo de estudio y sección, los sucesores de cuatro
+contextos, del más específico al más general:
+
+    1. las dos líneas anteriores (en la primera línea: ^ y la sección anterior)
+    2. la línea anterior
+    3. la última línea de la sección anterior (co-ocurrencia entre secciones)
+    4. la sección sola (frecuencia de cada línea)
+
+La probabilidad se interpola entre niveles con Witten-Bell, así que la
+confianza es una probabilidad real y el soporte es la cantidad de veces que se
+vio el contexto más específico con datos. La sección anterior es la escrita
+justo antes en el protocolo (orden de la primera línea guardada).
+
+Los sucesores de cada contexto se guardan en arreglos `array('I')` (ids y
+conteos) ordenados por conteo, de modo que el top-k de un nivel es un prefijo
+y una predicción cuesta unas decenas de búsquedas en diccionarios.
+
+El modelo vive en memoria de cada proceso: se carga completo en la primera
+predicción y después se sincroniza por diferencias cada
+PREDICCION_LINEAS_INTERVALO segundos (protocolos con `ultima_modificacion`
+reciente: los que se completan, se reabren o cambian de líneas se reentrenan).
+Los commits del propio proceso que completan protocolos fuerzan la
+sincronización en la próxima predicción.
+"""
+import logging
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.informe import ProtocoloLinea
+from models.protocolo import Protocolo
+from services import metricas
+from services.analisis_texto import palabras
+
+logger = logging.getLogger(__name__)
+
+INICIO = 0  # ^ : antes de la primera línea de la sección
+FIN = 1     # $ : la sección termina
+SIN_PREVIA = 2  # el protocolo no tiene sección anterior
+
+ESTADO_ENTRENABLE = 'COMPLETADO'
+# Margen sobre la marca de agua: ultima_modificacion se toma en la aplicación y
+# un commit lento puede hacerse visible con una marca anterior a la ya leída
+SOLAPE_SINCRONIZACION = timedelta(minutes=2)
+CANDIDATOS_POR_NIVEL = 20
+MAX_LINEAS_PREDICCION = 15
+
+
+def clave_linea(texto):
+    """Identidad de una línea: palabras plegadas ("Negativo." == "NEGATIVO")"""
+    return ' '.join(palabras(texto))
+
+
+class _Sucesores:
+    """Conteos de las líneas que siguieron a un contexto, ordenados de mayor a menor"""
+    __slots__ = ('ids', 'cuentas', 'posicion', 'total', 'distintos')
+
+    def __init__(self):
+        self.ids = array('I')
+        self.cuentas = array('I')
+        self.posicion = {}
+        self.total = 0
+        self.distintos = 0
+
+    def sumar(self, linea_id, delta):
+        ids, cuentas, posicion = self.ids, self.cuentas, self.posicion
+        i = posicion.get(linea_id)
+        if i is None:
+            if delta < 0:
+                return
+            i = posicion[linea_id] = len(ids)
+            ids.append(linea_id)
+            cuentas.append(0)
+        delta = max(delta, -cuentas[i])
+        if not delta:
+            return
+        if cuentas[i] == 0:
+            self.distintos += 1
+        cuentas[i] += delta
+        self.total += delta
+        if cuentas[i] == 0 and delta < 0:
+            self.distintos -= 1
+        # Mantener el orden por conteo moviendo solo la entrada tocada
+        paso = -1 if delta > 0 else 1
+        j = i + paso
+        while 0 <= j < len(ids) and (cuentas[j] < cuentas[i] if delta > 0 else cuentas[j] > cuentas[i]):
+            ids[i], ids[j] = ids[j], ids[i]
+            cuentas[i], cuentas[j] = cuentas[j], cuentas[i]
+            posicion[ids[i]] = i
+            posicion[ids[j]] = j
+            i, j = j, j + paso
+
+    def cuenta(self, linea_id):
+        i = self.posicion.get(linea_id)
+        return 0 if i is None else self.cuentas[i]
+
+    def primeros(self, cantidad):
+        return [self.ids[i] for i in range(min(cantidad, len(self.ids))) if self.cuentas[i]]
+
+
+class ModeloLineas:
+    """Modelo de n-gramas de líneas por (tipo de estudio, sección)"""
+
+    def __init__(self):
+        self.textos = ['^', '$', '']   # id -> texto mostrado (el primero visto)
+        self.ids = {}                  # clave de línea -> id
+        self.secciones = {}            # (tipo, sección) -> id
+        # Un diccionario por nivel: contexto -> _Sucesores
+        self.niveles = ({}, {}, {}, {})
+        self.entrenados = {}           # protocolo_id -> (revisión, secuencias)
+        self.marca = None              # ultima_modificacion hasta la que se sincronizó
+
+    # -- vocabulario ---------------------------------------------------------
+
+    def _id_linea(self, texto):
+        clave = clave_linea(texto)
+        if not clave:
+            return None
+        linea_id = self.ids.get(clave)
+        if linea_id is None:
+            linea_id = self.ids[clave] = len(self.textos)
+            self.textos.append(texto.strip())
+        return linea_id
+
+    def id_seccion(self, tipo_estudio, seccion, crear=False):
+        clave = ((tipo_estudio or '').upper(), (seccion or '').strip().upper())
+        seccion_id = self.secciones.get(clave)
+        if seccion_id is None and crear:
+            seccion_id = self.secciones[clave] = len(self.secciones)
+        return seccion_id
+
+    def secuencias(self, tipo_estudio, lineas_por_seccion):
+        """
+        Secuencias codificadas de un protocolo.
+
+        Args:
+            lineas_por_seccion: [(sección, [texto, ...])] en el orden en que se escribieron
+
+        Returns:
+            Tupla de (id de sección, id de la línea previa, array de ids de línea)
+        """
+        resultado = []
+        previa = SIN_PREVIA
+        for seccion, textos in lineas_por_seccion:
+            ids = array('I', (i for i in map(self._id_linea, textos) if i is not None))
+            if not ids:
+                continue
+            resultado.append((self.id_seccion(tipo_estudio, seccion, crear=True), previa, ids))
+            previa = ids[-1]
+        return tuple(resultado)
+
+    # -- entrenamiento ---------------------------------------------------------
+
+    def _contar(self, secuencias, delta):
+        nivel2, nivel1, nivel_previa, nivel0 = self.niveles
+        for seccion_id, previa, ids in secuencias:
+            anterior2, anterior = -1 - previa, INICIO
+            for linea_id in list(ids) + [FIN]:
+                for nivel, contexto in (
+                    (nivel2, (seccion_id, anterior2, anterior)),
+                    (nivel1, (seccion_id, anterior)),
+                    (nivel_previa, (seccion_id, previa)),
+                    (nivel0, seccion_id),
+                ):
+                    sucesores = nivel.get(contexto)
+                    if sucesores is None:
+                        if delta < 0:
+                            continue
+                        sucesores = nivel[contexto] = _Sucesores()
+                    sucesores.sumar(linea_id, delta)
+                anterior2, anterior = anterior, linea_id
+
+    def entrenar(self, protocolo_id, revision, tipo_estudio, lineas_por_seccion):
+        """(Re)entrenar un protocolo, descontando lo aprendido de una revisión anterior"""
+        self.olvidar(protocolo_id)
+        secuencias = self.secuencias(tipo_estudio, lineas_por_seccion)
+        self._contar(secuencias, 1)
+        self.entrenados[protocolo_id] = (revision, secuencias)
+
+    def olvidar(self, protocolo_id):
+        anterior = self.entrenados.pop(protocolo_id, None)
+        if anterior:
+            self._contar(anterior[1], -1)
+
+    # -- predicción ----------------------------------------------------------
+
+    def _contextos(self, seccion_id, previa, ids):
+        anterior = ids[-1] if ids else INICIO
+        if len(ids) >= 2:
+            anterior2 = ids[-2]
+        elif ids:
+            anterior2 = INICIO
+        else:
+            anterior2 = -1 - previa
+        nivel2, nivel1, nivel_previa, nivel0 = self.niveles
+        return [
+            nivel2.get((seccion_id, anterior2, anterior)),
+            nivel1.get((seccion_id, anterior)),
+            nivel_previa.get((seccion_id, previa)),
+            nivel0.get(seccion_id),
+        ]
+
+    @staticmethod
+    def _probabilidad(contextos, linea_id, base):
+        """Witten-Bell: P = (c(ctx, w) + T(ctx)·P_inferior) / (N(ctx) + T(ctx))"""
+        p = base
+        for sucesores in reversed(contextos):
+            if sucesores is None or not sucesores.total:
+                continue
+            p = (sucesores.cuenta(linea_id) + sucesores.distintos * p) / (sucesores.total + sucesores.distintos)
+        return p
+
+    def siguientes(self, seccion_id, previa, ids, limite, excluir=()):
+        """
+        Próximas líneas más probables.
+
+        Returns:
+            (soporte del contexto más específico con datos,
+             [(id de línea, probabilidad, veces vista en ese contexto)])
+        """
+        contextos = self._contextos(seccion_id, previa, ids)
+        con_datos = [s for s in contextos if s is not None and s.total]
+        if not con_datos:
+            return 0, []
+        especifico = con_datos[0]
+        base = 1.0 / (con_datos[-1].distintos + 1)
+        candidatos = set()
+        for sucesores in con_datos:
+            candidatos.update(sucesores.primeros(max(limite, CANDIDATOS_POR_NIVEL)))
+        candidatos.difference_update(excluir)
+        puntuados = sorted(
+            ((linea_id, self._probabilidad(contextos, linea_id, base), especifico.cuenta(linea_id))
+             for linea_id in candidatos),
+            key=lambda x: (-x[1], x[0])
+        )
+        return especifico.total, puntuados[:limite]
+
+
+# ---------------------------------------------------------------------------
+# Carga y sincronización desde la base
+# ---------------------------------------------------------------------------
+
+_modelo = None
+_lock = threading.Lock()
+_ultima_sincronizacion = 0.0
+_forzar_sincronizacion = False
+
+
+def _agrupar(filas):
+    """[(sección, texto)] ordenadas por sección/orden y con el id de la primera
+    línea -> [(sección, [textos])] en el orden en que se escribieron"""
+    por_seccion = {}
+    primera = {}
+    for seccion, texto, linea_id in filas:
+        por_seccion.setdefault(seccion, []).append(texto)
+        primera[seccion] = min(primera.get(seccion, linea_id), linea_id)
+    return [(seccion, por_seccion[seccion]) for seccion in sorted(por_seccion, key=primera.get)]
+
+
+def _consulta_lineas():
+    tabla = ProtocoloLinea.__table__
+    return select(tabla.c.protocolo_id, tabla.c.seccion, tabla.c.texto, tabla.c.protocolo_linea_id).order_by(
+        tabla.c.protocolo_id, tabla.c.seccion, tabla.c.orden, tabla.c.protocolo_linea_id
+    )
+
+
+def _entrenar_filas(modelo, protocolos, filas):
+    """Entrenar protocolos {id: (revisión, tipo)} con filas ordenadas por protocolo"""
+    actual, grupo = None, []
+    for fila in filas:
+        if fila.protocolo_id != actual:
+            if grupo:
+                modelo.entrenar(actual, *protocolos[actual], _agrupar(grupo))
+            actual, grupo = fila.protocolo_id, []
+        grupo.append((fila.seccion, fila.texto, fila.protocolo_linea_id))
+    if grupo:
+        modelo.entrenar(actual, *protocolos[actual], _agrupar(grupo))
+
+
+def _cargar():
+    inicio = time.monotonic()
+    modelo = ModeloLineas()
+    modelo.marca = datetime.utcnow() - SOLAPE_SINCRONIZACION
+    p = Protocolo.__table__
+    protocolos = {
+        fila.protocolo_id: (fila.revision_lineas, fila.tipo_estudio)
+        for fila in db.session.execute(
+            select(p.c.protocolo_id, p.c.revision_lineas, p.c.tipo_estudio).where(
+                p.c.estado == ESTADO_ENTRENABLE, p.c.es_prueba.is_(False)
+            )
+        )
+    }
+    consulta = _consulta_lineas().join(p, p.c.protocolo_id == ProtocoloLinea.__table__.c.protocolo_id).where(
+        p.c.estado == ESTADO_ENTRENABLE, p.c.es_prueba.is_(False)
+    )
+    _entrenar_filas(modelo, protocolos, db.session.execute(consulta))
+    logger.info(f"🧠 Modelo de líneas cargado: {len(modelo.entrenados)} protocolos, "
+                f"{len(modelo.textos) - 3} líneas distintas en {time.monotonic() - inicio:.2f}s")
+    return modelo
+
+
+def _sincronizar(modelo):
+    """Reentrenar los protocolos modificados desde la última marca"""
+    desde = modelo.marca
+    modelo.marca = datetime.utcnow() - SOLAPE_SINCRONIZACION
+    p = Protocolo.__table__
+    a_entrenar = {}
+    for fila in db.session.execute(
+        select(p.c.protocolo_id, p.c.revision_lineas, p.c.tipo_estudio, p.c.estado, p.c.es_prueba).where(
+            p.c.ultima_modificacion >= desde
+        )
+    ):
+        entrenado = modelo.entrenados.get(fila.protocolo_id)
+        if fila.estado != ESTADO_ENTRENABLE or fila.es_prueba:
+            if entrenado:
+                modelo.olvidar(fila.protocolo_id)
+        elif not entrenado or entrenado[0] != fila.revision_lineas:
+            a_entrenar[fila.protocolo_id] = (fila.revision_lineas, fila.tipo_estudio)
+    if a_entrenar:
+        ids = list(a_entrenar)
+        for i in range(0, len(ids), 500):
+            lote = ids[i:i + 500]
+            for protocolo_id in lote:
+                modelo.olvidar(protocolo_id)  # también los que quedaron sin líneas
+            _entrenar_filas(modelo, a_entrenar, db.session.execute(
+                _consulta_lineas().where(ProtocoloLinea.__table__.c.protocolo_id.in_(lote))
+            ))
+        logger.info(f"🧠 Modelo de líneas: {len(a_entrenar)} protocolos reentrenados")
+
+
+def _modelo_al_dia():
+    global _modelo, _ultima_sincronizacion, _forzar_sincronizacion
+    intervalo = current_app.config.get('PREDICCION_LINEAS_INTERVALO', 30)
+    with _lock:
+        if _modelo is None:
+            _modelo = _cargar()
+            _ultima_sincronizacion = time.monotonic()
+            _forzar_sincronizacion = False
+        elif _forzar_sincronizacion or time.monotonic() - _ultima_sincronizacion >= intervalo:
+            _forzar_sincronizacion = False
+            _ultima_sincronizacion = time.monotonic()
+            _sincronizar(_modelo)
+        return _modelo
+
+
+def descartar():
+    """Olvidar el modelo en memoria (se recarga en la próxima predicción)"""
+    global _modelo
+    with _lock:
+        _modelo = None
+
+
+def lineas_protocolo(protocolo_id):
+    """Líneas guardadas de un protocolo agrupadas como en el entrenamiento"""
+    filas = db.session.execute(_consulta_lineas().where(ProtocoloLinea.__table__.c.protocolo_id == protocolo_id))
+    return _agrupar((f.seccion, f.texto, f.protocolo_linea_id) for f in filas)
+
+
+def predecir(tipo_estudio, seccion, lineas_protocolo, lineas_seccion=None, limite=5):
+    """
+    Próximas líneas de una sección.
+
+    Args:
+        tipo_estudio: PAP, BIOPSIA, ...
+        seccion: Sección a continuar
+        lineas_protocolo: [(sección, [textos])] del protocolo en orden de escritura
+            (ver lineas_protocolo); da la sección anterior y las líneas ya escritas
+        lineas_seccion: Líneas actuales de la sección si difieren de las guardadas
+        limite: Cantidad de predicciones
+
+    Returns:
+        Dict con 'soporte' (veces que se vio el contexto), 'predicciones'
+        [{'texto', 'confianza', 'soporte'}] y 'probabilidad_fin' (de que la
+        sección termine después de las líneas previas)
+    """
+    inicio = time.monotonic()
+    modelo = _modelo_al_dia()
+    resultado = {'soporte': 0, 'predicciones': [], 'probabilidad_fin': 0.0}
+    with _lock:
+        seccion_id, previa, ids = _contexto(modelo, tipo_estudio, seccion, lineas_protocolo, lineas_seccion)
+        if seccion_id is not None:
+            soporte, siguientes = modelo.siguientes(seccion_id, previa, ids, limite + 1, excluir=set(ids))
+            resultado['soporte'] = soporte
+            for linea_id, p, vista in siguientes:
+                if linea_id == FIN:
+                    resultado['probabilidad_fin'] = round(p, 4)
+                elif len(resultado['predicciones']) < limite:
+                    resultado['predicciones'].append(
+                        {'texto': modelo.textos[linea_id], 'confianza': round(p, 4), 'soporte': vista}
+                    )
+    metricas.observar('ldh_prediccion_lineas_segundos', time.monotonic() - inicio)
+    return resultado
+
+
+def completar(tipo_estudio, seccion, lineas_protocolo, lineas_seccion=None, confianza_minima=0.0,
+              max_lineas=MAX_LINEAS_PREDICCION):
+    """
+    Secuencia más probable para continuar la sección (búsqueda voraz).
+
+    Se detiene al predecir el cierre de la sección, al llegar a max_lineas o
+    cuando la mejor línea no alcanza confianza_minima.
+
+    Returns:
+        Dict con 'lineas', 'confianza' (probabilidad conjunta) y 'soporte' (del
+        primer paso)
+    """
+    inicio = time.monotonic()
+    modelo = _modelo_al_dia()
+    lineas, confianza, soporte = [], 1.0, 0
+    with _lock:
+        seccion_id, previa, ids = _contexto(modelo, tipo_estudio, seccion, lineas_protocolo, lineas_seccion)
+        if seccion_id is not None:
+            ids = array('I', ids)
+            for paso in range(max_lineas):
+                vistos, siguientes = modelo.siguientes(seccion_id, previa, ids, 1, excluir=set(ids))
+                if paso == 0:
+                    soporte = vistos
+                if not siguientes:
+                    break
+                linea_id, p, _ = siguientes[0]
+                if linea_id == FIN or p < confianza_minima:
+                    break
+                lineas.append(modelo.textos[linea_id])
+                confianza *= p
+                ids.append(linea_id)
+    metricas.observar('ldh_prediccion_lineas_segundos', time.monotonic() - inicio)
+    return {'lineas': lineas, 'confianza': round(confianza, 4) if lineas else 0.0, 'soporte': soporte}
+
+
+def _contexto(modelo, tipo_estudio, seccion, lineas_protocolo, lineas_seccion):
+    """(id de sección, línea previa, ids ya escritos en la sección) sin agregar vocabulario"""
+    seccion_id = modelo.id_seccion(tipo_estudio, seccion)
+    if seccion_id is None:
+        return None, SIN_PREVIA, ()
+    clave_seccion = (seccion or '').strip().upper()
+    previa, propias = SIN_PREVIA, None
+    for nombre, textos in lineas_protocolo:
+        conocidos = [i for i in (modelo.ids.get(clave_linea(t)) for t in textos) if i is not None]
+        if nombre.strip().upper() == clave_seccion:
+            propias = conocidos
+            break
+        if conocidos:
+            previa = conocidos[-1]
+    if lineas_seccion is not None:
+        propias = [i for i in (modelo.ids.get(clave_linea(t)) for t in lineas_seccion) if i is not None]
+    return seccion_id, previa, propias or ()
+
+
+# ---------------------------------------------------------------------------
+# Sincronización inmediata con los commits del proceso
+# ---------------------------------------------------------------------------
+
+def _registrar_completados(session, flush_context):
+    for obj in session.dirty:
+        if isinstance(obj, Protocolo) and inspect(obj).attrs.estado.history.has_changes():
+            session.info['prediccion_lineas_sincronizar'] = True
+            return
+
+
+def _aplicar(session):
+    global _forzar_sincronizacion
+    if session.info.pop('prediccion_lineas_sincronizar', None):
+        _forzar_sincronizacion = True
+
+
+def _descartar(session):
+    session.info.pop('prediccion_lineas_sincronizar', None)
+
+
+def init_app(app):
+    """Sincronizar el modelo en la próxima predicción cuando un commit cambia el estado de un protocolo"""
+    if not event.contains(Session, 'after_flush', _registrar_completados):
+        event.listen(Session, 'after_flush', _registrar_completados)
+        event.listen(Session, 'after_commit', _aplicar)
+        event.listen(Session, 'after_rollback', _descartar)
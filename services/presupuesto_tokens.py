@@ -0,0 +1,89 @@
+"""
+Estimación de tokens y recorte del historial antes de llamar a un modelo de IA
+
+La estimación es local (sin tokenizer): caracteres / CARACTERES_POR_TOKEN para
+texto, un valor fijo por imagen y el JSON serializado para tool_use,
+tool_result y definiciones de herramientas. Alcanza para decidir cuánto
+historial entra en el presupuesto sin pagar una llamada de conteo.
+"""
+import json
+import math
+
+# Texto en español con términos médicos: algo más de tokens por carácter que en inglés
+CARACTERES_POR_TOKEN = 3.5
+# Tope de Claude por imagen (las más chicas cuestan menos: ancho * alto / 750)
+TOKENS_IMAGEN = 1600
+# Sobrecosto de cada mensaje (rol y separadores)
+TOKENS_POR_MENSAJE = 4
+
+
+def estimar_tokens(contenido):
+    """Tokens aproximados de un texto, un bloque de contenido o una lista de bloques"""
+    if not contenido:
+        return 0
+    if isinstance(contenido, str):
+        return math.ceil(len(contenido) / CARACTERES_POR_TOKEN)
+    if isinstance(contenido, (list, tuple)):
+        return sum(estimar_tokens(bloque) for bloque in contenido)
+    if isinstance(contenido, dict):
+        tipo = contenido.get('type')
+        if tipo == 'text':
+            return estimar_tokens(contenido.get('text'))
+        if tipo == 'image':
+            return TOKENS_IMAGEN
+        if tipo == 'tool_result':
+            return estimar_tokens(contenido.get('content'))
+        if tipo == 'tool_use':
+            return estimar_tokens(json.dumps(contenido.get('input', {}), ensure_ascii=False)) + 10
+        return estimar_tokens(json.dumps(contenido, ensure_ascii=False, default=str))
+    return estimar_tokens(str(contenido))
+
+
+def estimar_mensajes(messages):
+    return sum(estimar_tokens(m.get('content')) + TOKENS_POR_MENSAJE for m in messages)
+
+
+def estimar_pedido(messages, system=None, tools=None):
+    """Tokens de entrada aproximados de un pedido completo"""
+    total = estimar_mensajes(messages) + estimar_tokens(system)
+    if tools:
+        total += estimar_tokens(json.dumps(tools, ensure_ascii=False))
+    return total
+
+
+def _es_resultado_de_herramienta(mensaje):
+    contenido = mensaje.get('content')
+    return isinstance(contenido, list) and any(
+        isinstance(b, dict) and b.get('type') == 'tool_result' for b in contenido
+    )
+
+
+def recortar_historial(messages, presupuesto, fijos=0):
+    """
+    Descartar los mensajes más viejos hasta que el pedido entre en el presupuesto.
+
+    El último mensaje siempre se conserva. El historial recortado empieza con
+    un mensaje del usuario que no es un tool_result (la API no acepta
+    resultados sin su tool_use).
+
+    Args:
+        messages: Mensajes en el formato de la API
+        presupuesto: Tokens de entrada máximos
+        fijos: Tokens que no se pueden recortar (system prompt y herramientas)
+
+    Returns:
+        (mensajes, cantidad descartada)
+    """
+    costos = [estimar_tokens(m.get('content')) + TOKENS_POR_MENSAJE for m in messages]
+    total = fijos + sum(costos)
+    inicio = 0
+    while total > presupuesto and inicio < len(messages) - 1:
+        total -= costos[inicio]
+        inicio += 1
+        # Avanzar hasta un punto de corte válido
+        while inicio < len(messages) - 1 and (
+            messages[inicio].get('role') != 'user' or _es_resultado_de_herramienta(messages[inicio])
+        ):
+            total -= costos[inicio]
+            inicio += 1
+    return messages[inicio:], inicio
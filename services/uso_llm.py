@@ -0,0 +1,245 @@
+"""
+Registro de uso de los modelos de IA (latencia, tokens y costo por llamada)
+
+Cada `_make_request` de ClaudeClient y GeminiClient (decorador
+metricas.medir_llm) deja un registro con el endpoint, usuario y protocolo del
+request, el modelo, la función del cliente que lo pidió (metricas.funcion_llm),
+la duración, los tokens (incluidos los del cache de prompts), los intentos y el
+resultado. Los registros se juntan en memoria y se escriben en lote en
+llm_usos (services/escritura_diferida): al terminar un request cada
+LLM_USO_INTERVALO segundos o al juntar LLM_USO_MAX_PENDIENTES, sobre una
+conexión propia, y al cerrar el proceso.
+
+`resumen()` arma el reporte de administración: llamadas, errores,
+reintentos, latencia p50/p95, tokens y costo estimado por modelo y por
+función.
+"""
+import logging
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime
+
+from flask import has_request_context, request
+from sqlalchemy import insert, select
+
+from extensions import db
+from models.asistente import UsoLLM
+from services.escritura_diferida import EscritorEnLote
+from services.metricas import percentil
+
+logger = logging.getLogger(__name__)
+
+# Tope de registros en memoria si la base no acepta escrituras (se descartan los más viejos)
+MAX_EN_MEMORIA = 5000
+
+# Precios de lista en USD por millón de tokens (entrada, salida), por prefijo de
+# modelo; el más largo que coincida gana. El cache de Claude cobra la lectura a
+# 0,1x y la escritura a 1,25x de la entrada.
+PRECIOS_POR_MILLON = {
+    'claude-3-haiku': (0.25, 1.25),
+    'claude-3-5-haiku': (0.80, 4.00),
+    'claude-haiku-4': (1.00, 5.00),
+    'claude-3-sonnet': (3.00, 15.00),
+    'claude-3-5-sonnet': (3.00, 15.00),
+    'claude-3-7-sonnet': (3.00, 15.00),
+    'claude-sonnet-4': (3.00, 15.00),
+    'claude-3-opus': (15.00, 75.00),
+    'claude-3-5-opus': (15.00, 75.00),
+    'claude-opus-4': (15.00, 75.00),
+    'gemini-2.5-pro': (1.25, 10.00),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-flash-lite': (0.10, 0.40),
+    'gemini-2.0-flash': (0.10, 0.40),
+    'gemini-2.0-flash-lite': (0.075, 0.30),
+    'gemini-flash-latest': (0.30, 2.50),
+    'gemini-pro': (0.50, 1.50),
+}
+FACTOR_CACHE_LECTURA = 0.1
+FACTOR_CACHE_ESCRITURA = 1.25
+
+# Intentos HTTP de la llamada en curso (los clientes suman uno por cada reintento)
+_intentos = ContextVar('intentos_llm', default=None)
+
+
+def iniciar_llamada():
+    _intentos.set([1])
+
+
+def nuevo_intento():
+    """Marcar un reintento de la llamada en curso (otra URL u otro modelo)"""
+    intentos = _intentos.get()
+    if intentos is not None:
+        intentos[0] += 1
+
+
+def _intentos_llamada():
+    intentos = _intentos.get()
+    _intentos.set(None)
+    return intentos[0] if intentos else 1
+
+
+def precio(modelo):
+    """(USD entrada, USD salida) por millón de tokens, o None si el modelo no está en la tabla"""
+    modelo = (modelo or '').lower()
+    mejor = None
+    for prefijo in PRECIOS_POR_MILLON:
+        if modelo.startswith(prefijo) and (mejor is None or len(prefijo) > len(mejor)):
+            mejor = prefijo
+    return PRECIOS_POR_MILLON[mejor] if mejor else None
+
+
+def costo(modelo, tokens_entrada=0, tokens_salida=0, tokens_cache_lectura=0, tokens_cache_escritura=0):
+    """Costo estimado en USD de una llamada (None si no hay precio para el modelo)"""
+    precios = precio(modelo)
+    if precios is None:
+        return None
+    entrada, salida = precios
+    return ((tokens_entrada or 0) * entrada + (tokens_salida or 0) * salida
+            + (tokens_cache_lectura or 0) * entrada * FACTOR_CACHE_LECTURA
+            + (tokens_cache_escritura or 0) * entrada * FACTOR_CACHE_ESCRITURA) / 1_000_000
+
+
+def _contexto_request():
+    """(endpoint, usuario_id, protocolo_id) del request en curso"""
+    if not has_request_context():
+        return None, None, None
+    usuario_id = None
+    try:
+        from flask_login import current_user
+        if current_user.is_authenticated:
+            usuario_id = current_user.get_id()
+            usuario_id = int(usuario_id) if usuario_id is not None else None
+    except Exception:
+        pass
+    protocolo_id = (request.view_args or {}).get('protocolo_id')
+    if protocolo_id is None and request.is_json:
+        datos = request.get_json(silent=True)
+        if isinstance(datos, dict):
+            protocolo_id = datos.get('protocolo_id')
+    if protocolo_id is None:
+        protocolo_id = request.args.get('protocolo_id')
+    try:
+        protocolo_id = int(protocolo_id) if protocolo_id not in (None, '') else None
+    except (TypeError, ValueError):
+        protocolo_id = None
+    return request.endpoint, usuario_id, protocolo_id
+
+
+def registrar_llamada(proveedor, modelo, funcion, duracion, tokens_entrada=0, tokens_salida=0,
+                      tokens_cache_lectura=0, tokens_cache_escritura=0, exito=True):
+    """Encolar el registro de una llamada (se escribe en el próximo volcado)"""
+    endpoint, usuario_id, protocolo_id = _contexto_request()
+    registro = {
+        'fecha': datetime.utcnow(),
+        'proveedor': proveedor,
+        'modelo': (modelo or '')[:100],
+        'funcion': (funcion or '')[:50],
+        'endpoint': endpoint,
+        'usuario_id': usuario_id,
+        'protocolo_id': protocolo_id,
+        'duracion_ms': int(round(duracion * 1000)),
+        'tokens_entrada': tokens_entrada or 0,
+        'tokens_salida': tokens_salida or 0,
+        'tokens_cache_lectura': tokens_cache_lectura or 0,
+        'tokens_cache_escritura': tokens_cache_escritura or 0,
+        'intentos': _intentos_llamada(),
+        'exito': bool(exito),
+    }
+
+    def encolar(pendientes):
+        pendientes.append(registro)
+        _recortar(pendientes)
+    _escritor.agregar(encolar)
+
+
+def _recortar(pendientes):
+    """Descartar los más viejos si la base no acepta escrituras hace rato"""
+    if len(pendientes) > MAX_EN_MEMORIA:
+        del pendientes[:len(pendientes) - MAX_EN_MEMORIA]
+
+
+def _escribir(conexion, lote):
+    conexion.execute(insert(UsoLLM.__table__), lote)
+    return len(lote)
+
+
+def _reencolar(pendientes, lote):
+    # Los del lote fallido son los más viejos: van adelante
+    pendientes[:0] = lote
+    _recortar(pendientes)
+
+
+_escritor = EscritorEnLote('registro de uso de IA', list, len, _escribir, _reencolar,
+                           'LLM_USO_INTERVALO', 30, 'LLM_USO_MAX_PENDIENTES', 200)
+
+
+def pendientes():
+    return _escritor.pendientes()
+
+
+def volcar():
+    """
+    Escribir los registros acumulados (requiere app context).
+
+    Returns:
+        Cantidad de registros escritos
+    """
+    return _escritor.volcar()
+
+
+def volcar_si_corresponde(config):
+    """Volcar si pasó el intervalo o se acumularon demasiados registros"""
+    return _escritor.volcar_si_corresponde(config)
+
+
+def resumen(desde, hasta, agrupar_por='modelo'):
+    """
+    Reporte de uso entre dos fechas (datetime), agrupado por modelo o por función.
+
+    Returns:
+        [{'proveedor', 'modelo' o 'funcion', 'llamadas', 'errores', 'reintentos',
+          'p50_ms', 'p95_ms', 'tokens_entrada', 'tokens_salida',
+          'tokens_cache_lectura', 'tokens_cache_escritura', 'costo_usd'}]
+        ordenado por costo y cantidad de llamadas
+    """
+    volcar()  # que el reporte incluya lo que todavía está en memoria
+    t = UsoLLM.__table__
+    clave = t.c.funcion if agrupar_por == 'funcion' else t.c.modelo
+    filas = db.session.execute(
+        select(t.c.proveedor, clave, t.c.modelo, t.c.duracion_ms, t.c.tokens_entrada, t.c.tokens_salida,
+               t.c.tokens_cache_lectura, t.c.tokens_cache_escritura, t.c.intentos, t.c.exito)
+        .where(t.c.fecha >= desde, t.c.fecha < hasta)
+    ).all()
+
+    grupos = defaultdict(lambda: {'duraciones': [], 'llamadas': 0, 'errores': 0, 'reintentos': 0,
+                                  'tokens_entrada': 0, 'tokens_salida': 0, 'tokens_cache_lectura': 0,
+                                  'tokens_cache_escritura': 0, 'costo_usd': 0.0, 'sin_precio': False})
+    for proveedor, grupo, modelo, duracion, entrada, salida, cache_lectura, cache_escritura, intentos, exito in filas:
+        datos = grupos[(proveedor, grupo)]
+        datos['llamadas'] += 1
+        datos['duraciones'].append(duracion)
+        datos['errores'] += 0 if exito else 1
+        datos['reintentos'] += 1 if intentos and intentos > 1 else 0
+        datos['tokens_entrada'] += entrada or 0
+        datos['tokens_salida'] += salida or 0
+        datos['tokens_cache_lectura'] += cache_lectura or 0
+        datos['tokens_cache_escritura'] += cache_escritura or 0
+        monto = costo(modelo, entrada, salida, cache_lectura, cache_escritura)
+        if monto is None:
+            datos['sin_precio'] = True
+        else:
+            datos['costo_usd'] += monto
+
+    resultado = []
+    nombre = 'funcion' if agrupar_por == 'funcion' else 'modelo'
+    for (proveedor, grupo), datos in grupos.items():
+        duraciones = sorted(datos.pop('duraciones'))
+        resultado.append({'proveedor': proveedor, nombre: grupo, 'p50_ms': percentil(duraciones, 0.5),
+                          'p95_ms': percentil(duraciones, 0.95), **datos})
+    resultado.sort(key=lambda d: (-d['costo_usd'], -d['llamadas']))
+    return resultado
+
+
+def init_app(app):
+    """Volcar al final de los requests y al cerrar el proceso"""
+    _escritor.init_app(app)
@@ -0,0 +1,115 @@
+"""
+Tokens de versión guardados en `configuracion`
+
+Un token se renueva (uuid nuevo) en la misma transacción en que la sesión
+modifica lo que versiona, ya sea en un flush del ORM o con una sentencia
+INSERT/UPDATE/DELETE ejecutada por la sesión. Cada proceso lo compara con una
+lectura indexada para saber si su cache sigue vigente. Lo usan el catálogo de
+plantillas y la facturación de meses cerrados.
+"""
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db
+from models.configuracion import Configuracion
+
+
+def _nombre_columna(clave):
+    if isinstance(clave, str):
+        return clave
+    return getattr(clave, 'key', None)
+
+
+def tablas_de_sentencia(estado):
+    """Nombres de las tablas que escribe una sentencia de la sesión"""
+    tablas = {mapper.local_table.name for mapper in estado.all_mappers}
+    tabla = getattr(estado.statement, 'table', None)
+    if tabla is not None:
+        tablas.add(getattr(tabla, 'name', None))
+    return tablas
+
+
+def columnas_asignadas(estado):
+    """
+    Columnas que asigna un INSERT/UPDATE de la sesión, o None si no se pueden
+    determinar (DELETE, INSERT ... SELECT, o una versión de SQLAlchemy que guarde
+    los valores de otra forma): None cuenta como "cualquier columna".
+    """
+    if estado.is_delete:
+        return None
+    sentencia = estado.statement
+    claves = list(getattr(sentencia, '_values', None) or ())
+    claves += [clave for clave, _ in getattr(sentencia, '_ordered_values', None) or ()]
+    for filas in getattr(sentencia, '_multi_values', None) or ():
+        for fila in filas:
+            claves += list(fila)
+    parametros = estado.parameters
+    if isinstance(parametros, dict):
+        parametros = [parametros]
+    for fila in parametros or ():
+        claves += list(fila)
+
+    columnas = {_nombre_columna(clave) for clave in claves}
+    if not columnas or None in columnas:
+        return None
+    return columnas
+
+
+class TokenVersion:
+    """
+    Token de versión de una clave de `configuracion`.
+
+    Args:
+        clave: Clave en `configuracion`
+        descripcion: Descripción de la fila al crearla
+        cambia_en_flush: f(session) -> bool, si el flush en curso modifica lo versionado
+        sentencia_relevante: f(tablas, columnas) -> bool para las sentencias
+            masivas; `columnas` es None si no se pudieron determinar
+    """
+
+    def __init__(self, clave, descripcion, cambia_en_flush, sentencia_relevante):
+        self.clave = clave
+        self.descripcion = descripcion
+        self._cambia_en_flush = cambia_en_flush
+        self._sentencia_relevante = sentencia_relevante
+        self._marca = f'{clave}_renovada'
+
+    def _antes_del_flush(self, session, flush_context, instances):
+        if not session.info.get(self._marca) and self._cambia_en_flush(session):
+            self.renovar(session)
+
+    def _sentencia_masiva(self, estado):
+        if not (estado.is_insert or estado.is_update or estado.is_delete):
+            return
+        if estado.session.info.get(self._marca):
+            return
+        if self._sentencia_relevante(tablas_de_sentencia(estado), columnas_asignadas(estado)):
+            self.renovar(estado.session)
+
+    def _fin_transaccion(self, session, transaccion):
+        if transaccion.parent is None:
+            session.info.pop(self._marca, None)
+
+    def registrar(self):
+        """Escuchar los flush y las sentencias de todas las sesiones (idempotente)"""
+        if not event.contains(Session, 'before_flush', self._antes_del_flush):
+            event.listen(Session, 'before_flush', self._antes_del_flush)
+            event.listen(Session, 'do_orm_execute', self._sentencia_masiva)
+            event.listen(Session, 'after_transaction_end', self._fin_transaccion)
+
+    def renovar(self, session):
+        """Asignar un token nuevo en la transacción de `session` (una vez por transacción)"""
+        with session.no_autoflush:
+            fila = session.query(Configuracion).filter_by(clave=self.clave).first()
+            if fila is None:
+                fila = Configuracion(clave=self.clave, tipo='STRING', categoria='sistema',
+                                     descripcion=self.descripcion)
+                session.add(fila)
+            fila.valor = uuid.uuid4().hex
+        session.info[self._marca] = True
+
+    def actual(self):
+        """Token vigente (una consulta indexada)"""
+        return db.session.query(Configuracion.valor).filter_by(clave=self.clave).scalar() or '0'
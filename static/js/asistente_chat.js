@@ -92,13 +92,15 @@ let ultimoEventoAbrirPanel = 0;
 const ABRIR_PANEL_EVENT_COOLDOWN_MS = 1500;
 
 // Función para obtener la ruta correcta del archivo RIVE según el contexto
+// (base.html publica en window.ASISTENTE_RIVE las rutas con huella, cacheables)
 function obtenerRutaRIVE() {
+    const rutas = window.ASISTENTE_RIVE || {};
     // Si el usuario está autenticado, usar el avatar femenino
     if (window.ASISTENTE_AUTH === true) {
-        return RIVE_FILE_PATH_AUTH;
+        return rutas.auth || RIVE_FILE_PATH_AUTH;
     }
     // Si no está autenticado (login), usar el avatar masculino
-    return RIVE_FILE_PATH_LOGIN;
+    return rutas.login || RIVE_FILE_PATH_LOGIN;
 }
 
 /**
@@ -3266,7 +3268,12 @@ window.enviarMensajeChat = async function enviarMensajeChat() {
             }
             
             agregarMensajeChat('asistente', data.respuesta);
-            
+
+            // El turno queda en la conversación: el servidor lo usa como contexto del próximo mensaje
+            if (data.historial_id) {
+                historialChatIds.push(data.historial_id);
+            }
+
             // Procesar acciones si existen
             if (data.acciones && Array.isArray(data.acciones) && data.acciones.length > 0) {
                 procesarAccionesChat(data.acciones, data.intencion);
@@ -0,0 +1,162 @@
+/**
+ * Autocompletado de líneas en los editores de informes
+ *
+ * Mientras se escribe en un textarea de sección, consulta
+ * /selector_plantillas/autocompletar con la línea actual (del último salto de
+ * línea al cursor) y muestra debajo las frases del corpus de plantillas que la
+ * completan. Flechas para elegir, Tab o Enter para aceptar, Esc para cerrar.
+ * Al aceptar reemplaza la línea y dispara `input` para que el editor sincronice.
+ *
+ * Uso:
+ *   AutocompletarLineas.adjuntar('textarea.editor-seccion', { tipo: 'PAP' });
+ */
+(function (window, document) {
+    'use strict';
+
+    if (window.AutocompletarLineas) {
+        return;
+    }
+
+    const URL_AUTOCOMPLETAR = '/selector_plantillas/autocompletar';
+    const ESPERA_MS = 120;
+    const MINIMO_CARACTERES = 2;
+
+    let lista = null;
+    let activo = null;       // { textarea, opciones }
+    let seleccionada = -1;
+    let temporizador = null;
+    let pedido = null;       // AbortController del request en curso
+
+    function obtenerLista() {
+        if (!lista) {
+            lista = document.createElement('ul');
+            lista.className = 'autocompletar-lineas';
+            lista.setAttribute('role', 'listbox');
+            lista.addEventListener('mousedown', evento => {
+                const item = evento.target.closest('li[data-indice]');
+                if (item) {
+                    evento.preventDefault();  // no perder el foco del textarea
+                    aceptar(Number(item.dataset.indice));
+                }
+            });
+            document.body.appendChild(lista);
+        }
+        return lista;
+    }
+
+    function cerrar() {
+        activo = null;
+        seleccionada = -1;
+        if (lista) lista.style.display = 'none';
+    }
+
+    function lineaActual(textarea) {
+        const cursor = textarea.selectionStart;
+        const inicio = textarea.value.lastIndexOf('\n', cursor - 1) + 1;
+        let fin = textarea.value.indexOf('\n', cursor);
+        if (fin === -1) fin = textarea.value.length;
+        return { texto: textarea.value.slice(inicio, cursor), inicio, fin };
+    }
+
+    function mostrar(textarea, opciones) {
+        if (!opciones.length) {
+            cerrar();
+            return;
+        }
+        const ul = obtenerLista();
+        ul.innerHTML = '';
+        opciones.forEach((opcion, indice) => {
+            const li = document.createElement('li');
+            li.dataset.indice = indice;
+            li.setAttribute('role', 'option');
+            li.textContent = opcion.texto;
+            if (opcion.seccion) li.title = opcion.seccion;
+            ul.appendChild(li);
+        });
+        const rect = textarea.getBoundingClientRect();
+        ul.style.left = `${rect.left + window.scrollX}px`;
+        ul.style.top = `${rect.bottom + window.scrollY}px`;
+        ul.style.minWidth = `${rect.width}px`;
+        ul.style.display = 'block';
+        activo = { textarea, opciones };
+        marcar(0);
+    }
+
+    function marcar(indice) {
+        if (!activo) return;
+        seleccionada = (indice + activo.opciones.length) % activo.opciones.length;
+        Array.from(lista.children).forEach((li, i) => {
+            li.classList.toggle('activa', i === seleccionada);
+            li.setAttribute('aria-selected', i === seleccionada ? 'true' : 'false');
+        });
+    }
+
+    function aceptar(indice) {
+        if (!activo) return;
+        const { textarea, opciones } = activo;
+        // La línea se mide ahora: lo escrito mientras llegaba la respuesta también se reemplaza
+        const { inicio, fin } = lineaActual(textarea);
+        const texto = opciones[indice].texto;
+        textarea.value = textarea.value.slice(0, inicio) + texto + textarea.value.slice(fin);
+        const cursor = inicio + texto.length;
+        textarea.setSelectionRange(cursor, cursor);
+        cerrar();
+        textarea.dispatchEvent(new Event('input', { bubbles: true }));
+    }
+
+    function consultar(textarea, opciones) {
+        const { texto, inicio } = lineaActual(textarea);
+        if (texto.trim().length < MINIMO_CARACTERES) {
+            cerrar();
+            return;
+        }
+        if (pedido) pedido.abort();
+        pedido = new AbortController();
+        const params = new URLSearchParams({ q: texto, limite: opciones.limite || 8 });
+        if (opciones.tipo) params.set('tipo', opciones.tipo);
+        fetch(`${URL_AUTOCOMPLETAR}?${params}`, { credentials: 'same-origin', signal: pedido.signal })
+            .then(response => response.ok ? response.json() : { resultados: [] })
+            .then(data => {
+                // Descartar si el usuario ya cambió de línea o de editor
+                if (document.activeElement !== textarea || lineaActual(textarea).inicio !== inicio) return;
+                const escrito = texto.trim().toLowerCase();
+                const resultados = (data.resultados || []).filter(r => r.texto.toLowerCase() !== escrito);
+                mostrar(textarea, resultados);
+            })
+            .catch(error => {
+                if (error.name !== 'AbortError') console.warn('⚠️ Autocompletado no disponible:', error);
+            });
+    }
+
+    function adjuntar(selector, opciones = {}) {
+        document.addEventListener('input', evento => {
+            const textarea = evento.target;
+            if (!textarea.matches || !textarea.matches(selector)) return;
+            if (evento.isTrusted === false && activo === null) return;  // input sintético de aceptar()
+            clearTimeout(temporizador);
+            temporizador = setTimeout(() => consultar(textarea, opciones), ESPERA_MS);
+        });
+
+        // En captura: se adelanta a los atajos de teclado del editor (Esc, Enter)
+        document.addEventListener('keydown', evento => {
+            if (!activo || evento.target !== activo.textarea) return;
+            if (evento.key === 'ArrowDown' || evento.key === 'ArrowUp') {
+                evento.preventDefault();
+                marcar(seleccionada + (evento.key === 'ArrowDown' ? 1 : -1));
+            } else if (evento.key === 'Enter' || evento.key === 'Tab') {
+                evento.preventDefault();
+                evento.stopPropagation();
+                aceptar(seleccionada);
+            } else if (evento.key === 'Escape') {
+                evento.stopPropagation();
+                cerrar();
+            }
+        }, true);
+
+        document.addEventListener('focusout', evento => {
+            if (activo && evento.target === activo.textarea) cerrar();
+        });
+    }
+
+    window.AutocompletarLineas = { adjuntar, cerrar };
+})(window, document);
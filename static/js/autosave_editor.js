@@ -0,0 +1,164 @@
+/**
+ * Autoguardado de los editores de informes
+ *
+ * Cada `intervalo` ms compara el contenido actual de cada sección con la última
+ * versión enviada y manda solo las operaciones de línea que cambiaron
+ * (insert/edit/delete, o replace para una sección nueva) a
+ * /plantillas-dinamicas/api/protocolo/<id>/autosave. Al salir de la página envía
+ * lo pendiente con sendBeacon pidiendo compactar el borrador.
+ *
+ * Uso:
+ *   const autosave = AutosaveEditor.iniciar({
+ *       protocoloId: 123,
+ *       obtenerSecciones: () => ({ DIAGNOSTICO: ['línea 1', 'línea 2'] })
+ *   });
+ *   autosave.marcarGuardado(['DIAGNOSTICO']);   // después de un guardado explícito
+ */
+(function (window) {
+    'use strict';
+
+    if (window.AutosaveEditor) {
+        return;
+    }
+
+    function normalizar(lineas) {
+        const resultado = [];
+        (lineas || []).forEach(texto => {
+            String(texto || '').split(/\r?\n/).forEach(renglon => {
+                const limpio = renglon.trim();
+                if (limpio) resultado.push(limpio);
+            });
+        });
+        return resultado;
+    }
+
+    function tomarInstantanea(obtenerSecciones) {
+        const secciones = obtenerSecciones() || {};
+        const instantanea = {};
+        Object.keys(secciones).forEach(seccion => {
+            if (seccion) instantanea[seccion] = normalizar(secciones[seccion]);
+        });
+        return instantanea;
+    }
+
+    /**
+     * Operaciones para llevar `anteriores` a `nuevas`: se recorta el prefijo y el
+     * sufijo comunes y el tramo del medio se edita, inserta o borra.
+     */
+    function diferenciasSeccion(seccion, anteriores, nuevas) {
+        const ops = [];
+        let inicio = 0;
+        while (inicio < anteriores.length && inicio < nuevas.length && anteriores[inicio] === nuevas[inicio]) {
+            inicio++;
+        }
+        let finAnt = anteriores.length;
+        let finNue = nuevas.length;
+        while (finAnt > inicio && finNue > inicio && anteriores[finAnt - 1] === nuevas[finNue - 1]) {
+            finAnt--;
+            finNue--;
+        }
+
+        const cantAnt = finAnt - inicio;
+        const cantNue = finNue - inicio;
+        const comunes = Math.min(cantAnt, cantNue);
+        for (let i = 0; i < comunes; i++) {
+            ops.push({ op: 'edit', seccion, pos: inicio + i, texto: nuevas[inicio + i] });
+        }
+        for (let i = comunes; i < cantNue; i++) {
+            ops.push({ op: 'insert', seccion, pos: inicio + i, texto: nuevas[inicio + i] });
+        }
+        for (let i = comunes; i < cantAnt; i++) {
+            ops.push({ op: 'delete', seccion, pos: inicio + comunes });
+        }
+
+        // Reescrituras grandes: una sola operación con la sección completa
+        if (ops.length > nuevas.length + 1) {
+            return [{ op: 'replace', seccion, lineas: nuevas }];
+        }
+        return ops;
+    }
+
+    function calcularOperaciones(base, actual) {
+        let ops = [];
+        Object.keys(actual).forEach(seccion => {
+            if (!(seccion in base)) {
+                ops.push({ op: 'replace', seccion, lineas: actual[seccion] });
+            } else {
+                ops = ops.concat(diferenciasSeccion(seccion, base[seccion], actual[seccion]));
+            }
+        });
+        return ops;
+    }
+
+    function iniciar(opciones) {
+        const protocoloId = opciones.protocoloId;
+        const obtenerSecciones = opciones.obtenerSecciones;
+        const intervalo = opciones.intervalo || 5000;
+        const url = `/plantillas-dinamicas/api/protocolo/${protocoloId}/autosave`;
+
+        let base = tomarInstantanea(obtenerSecciones);
+        let enviando = false;
+        let detenido = false;
+
+        function enviar() {
+            if (enviando || detenido) return;
+            const actual = tomarInstantanea(obtenerSecciones);
+            const ops = calcularOperaciones(base, actual);
+            if (!ops.length) return;
+
+            enviando = true;
+            fetch(url, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ops })
+            })
+            .then(response => {
+                if (response.ok) {
+                    base = actual;
+                } else if (response.status === 400 || response.status === 404) {
+                    // Protocolo de prueba u operación rechazada: no insistir
+                    detenido = true;
+                }
+            })
+            .catch(error => {
+                console.warn('Autoguardado pendiente, se reintentará:', error);
+            })
+            .finally(() => {
+                enviando = false;
+            });
+        }
+
+        const temporizador = setInterval(enviar, intervalo);
+
+        window.addEventListener('pagehide', () => {
+            if (detenido || !navigator.sendBeacon) return;
+            const actual = tomarInstantanea(obtenerSecciones);
+            const cuerpo = JSON.stringify({ ops: calcularOperaciones(base, actual), compactar: true });
+            if (navigator.sendBeacon(url, new Blob([cuerpo], { type: 'application/json' }))) {
+                base = actual;
+            }
+        });
+
+        return {
+            enviar,
+            /** Tomar el contenido actual como ya guardado (todas las secciones o solo las indicadas) */
+            marcarGuardado(secciones) {
+                const actual = tomarInstantanea(obtenerSecciones);
+                if (!secciones) {
+                    base = actual;
+                    return;
+                }
+                base = Object.assign({}, base);
+                secciones.forEach(seccion => {
+                    if (seccion in actual) base[seccion] = actual[seccion];
+                });
+            },
+            detener() {
+                detenido = true;
+                clearInterval(temporizador);
+            }
+        };
+    }
+
+    window.AutosaveEditor = { iniciar, calcularOperaciones };
+})(window);
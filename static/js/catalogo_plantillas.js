@@ -0,0 +1,96 @@
+/**
+ * Catálogo de plantillas de los editores
+ *
+ * Descarga una sola vez por página /plantillas-dinamicas/api/catalogo/<tipo>
+ * (el navegador lo revalida con ETag) y responde localmente las consultas que
+ * antes eran un request cada una. Las funciones devuelven promesas con la misma
+ * forma que los endpoints individuales que reemplazan.
+ */
+(function (window) {
+    'use strict';
+
+    if (window.CatalogoPlantillas) {
+        return;
+    }
+
+    const catalogos = {};
+
+    function obtener(tipo) {
+        const clave = String(tipo || '').toUpperCase();
+        if (!catalogos[clave]) {
+            catalogos[clave] = fetch(`/plantillas-dinamicas/api/catalogo/${encodeURIComponent(clave)}`)
+                .then(response => {
+                    if (!response.ok) throw new Error(`Catálogo ${clave}: HTTP ${response.status}`);
+                    return response.json();
+                })
+                .catch(error => {
+                    delete catalogos[clave];  // permitir reintentar
+                    throw error;
+                });
+        }
+        return catalogos[clave];
+    }
+
+    /** Descartar el catálogo ya descargado (tras guardar o borrar plantillas) */
+    function invalidar(tipo) {
+        delete catalogos[String(tipo || '').toUpperCase()];
+    }
+
+    // ===== PAP =====
+
+    function lineasPap(categoria) {
+        return obtener('PAP').then(c => ({ lineas: c.lineas[categoria] || [] }));
+    }
+
+    function plantillasPap() {
+        return obtener('PAP').then(c => ({
+            plantillas: c.plantillas.map(p => ({ codigo: p.codigo, descripcion: p.descripcion, categoria: p.categoria }))
+        }));
+    }
+
+    function plantillaPap(codigo) {
+        return obtener('PAP').then(c => c.plantillas.find(p => p.codigo === codigo) || { error: 'Plantilla no encontrada' });
+    }
+
+    // ===== Secciones dinámicas (SeccionPlantilla / LineaPlantilla) =====
+
+    function lineasSeccion(seccionId, tipo) {
+        return obtener(tipo || 'PAP').then(c => {
+            const seccion = c.secciones.find(s => s.id === Number(seccionId));
+            if (!seccion) return { success: false, error: 'Sección no encontrada' };
+            return {
+                success: true,
+                seccion: { id: seccion.id, nombre: seccion.nombre, codigo: seccion.codigo, descripcion: seccion.descripcion },
+                lineas: seccion.lineas
+            };
+        });
+    }
+
+    // ===== Biopsias =====
+
+    function lineasBiopsia(seccion) {
+        return obtener('BIOPSIA').then(c => ({ lineas: c.lineas[String(seccion).toUpperCase()] || [] }));
+    }
+
+    function plantillasBiopsias() {
+        return obtener('BIOPSIA').then(c => ({
+            plantillas: c.plantillas.map(p => ({ nombre: p.nombre, secciones: Object.keys(p.secciones) }))
+        }));
+    }
+
+    function plantillaBiopsia(nombre) {
+        return obtener('BIOPSIA').then(c => c.plantillas.find(p => p.nombre === nombre) || { error: 'Plantilla no encontrada' });
+    }
+
+    window.CatalogoPlantillas = {
+        obtener,
+        invalidar,
+        lineasPap,
+        plantillasPap,
+        plantillaPap,
+        lineasSeccion,
+        lineasBiopsia,
+        plantillasBiopsias,
+        plantillaBiopsia
+    };
+})(window);
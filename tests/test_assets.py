@@ -0,0 +1,32 @@
+"""
+Librerías vendorizadas y URLs de assets en las páginas
+"""
+import os
+import re
+
+import pytest
+
+from services.assets import VENDOR
+
+
+@pytest.mark.xfail(strict=True, reason='static/vendor/ todavía no se versionó: correr `flask vendorizar-assets`, '
+                                       'agregarlo al repositorio y quitar esta marca')
+def test_todas_las_librerias_vendorizadas_existen(app):
+    faltantes = [ruta for ruta in VENDOR if not os.path.isfile(os.path.join(app.static_folder, ruta))]
+    assert faltantes == []
+
+
+def test_login_no_pide_librerias_inexistentes(app):
+    cliente = app.test_client()
+    html = cliente.get('/auth/login').get_data(as_text=True)
+
+    urls = re.findall(r'(?:href|src)="([^"]+)"', html)
+    assert any('bootstrap' in url for url in urls)
+    for url in urls:
+        if url.startswith(app.static_url_path + '/'):
+            respuesta = cliente.get(url)
+            assert respuesta.status_code == 200, url
+            respuesta.close()
+        elif url.startswith('http'):
+            # Solo el CDN de respaldo de una librería que falta en static/vendor/
+            assert url in VENDOR.values(), url
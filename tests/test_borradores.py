@@ -0,0 +1,101 @@
+"""
+Compactación del diario de borradores frente a autoguardados concurrentes
+"""
+import json
+import os
+import threading
+from datetime import date
+
+import pytest
+
+from extensions import db
+from models.informe import ProtocoloLinea
+from models.protocolo import Protocolo
+from services import borradores
+from services import lineas_protocolo
+
+
+@pytest.fixture
+def protocolo_id(app, tmp_path):
+    app.config['AUTOSAVE_FOLDER'] = str(tmp_path)
+    protocolo = Protocolo(numero_protocolo='B-0001', tipo_estudio='BIOPSIA', afiliado_id=1,
+                          fecha_ingreso=date.today())
+    db.session.add(protocolo)
+    db.session.flush()
+    db.session.add(ProtocoloLinea(protocolo_id=protocolo.protocolo_id, seccion='MACRO', texto='a', orden=1))
+    db.session.commit()
+    return protocolo.protocolo_id
+
+
+def _lineas(protocolo_id):
+    return [texto for (texto,) in db.session.query(ProtocoloLinea.texto).filter_by(
+        protocolo_id=protocolo_id, seccion='MACRO').order_by(ProtocoloLinea.orden)]
+
+
+def test_autoguardado_durante_la_compactacion_no_pierde_cambios(app, protocolo_id, monkeypatch):
+    borradores.agregar_operaciones(protocolo_id, [{'op': 'insert', 'seccion': 'MACRO', 'pos': 1, 'texto': 'b'}])
+
+    guardar_original = lineas_protocolo.guardar_lineas
+    autoguardado = {}
+
+    def autoguardar():
+        with app.app_context():
+            borradores.agregar_operaciones(protocolo_id,
+                                           [{'op': 'insert', 'seccion': 'MACRO', 'pos': 2, 'texto': 'c'}])
+
+    def guardar_con_autoguardado(*args, **kwargs):
+        hilo = autoguardado['hilo'] = threading.Thread(target=autoguardar)
+        hilo.start()
+        hilo.join(0.2)
+        # El autoguardado espera al commit de la compactación
+        autoguardado['bloqueado'] = hilo.is_alive()
+        return guardar_original(*args, **kwargs)
+
+    monkeypatch.setattr(lineas_protocolo, 'guardar_lineas', guardar_con_autoguardado)
+    assert borradores.compactar(protocolo_id)['aplicadas'] == ['MACRO']
+    autoguardado['hilo'].join(5)
+    monkeypatch.setattr(lineas_protocolo, 'guardar_lineas', guardar_original)
+
+    assert autoguardado['bloqueado']
+    assert _lineas(protocolo_id) == ['a', 'b']
+    resultado = borradores.compactar(protocolo_id)
+    assert resultado['descartadas'] == []
+    assert _lineas(protocolo_id) == ['a', 'b', 'c']
+
+
+def test_compactacion_fallida_deja_el_diario_intacto(app, protocolo_id, monkeypatch):
+    borradores.agregar_operaciones(protocolo_id, [{'op': 'insert', 'seccion': 'MACRO', 'pos': 1, 'texto': 'b'}])
+
+    def fallar(*args, **kwargs):
+        raise RuntimeError('base de datos caída')
+
+    monkeypatch.setattr(lineas_protocolo, 'guardar_lineas', fallar)
+    with pytest.raises(RuntimeError):
+        borradores.compactar(protocolo_id)
+    monkeypatch.undo()
+
+    assert os.listdir(app.config['AUTOSAVE_FOLDER']) == [f'{protocolo_id}.jsonl']
+    borradores.agregar_operaciones(protocolo_id, [{'op': 'insert', 'seccion': 'MACRO', 'pos': 2, 'texto': 'c'}])
+    assert borradores.borrador(protocolo_id) == {'MACRO': ['a', 'b', 'c']}
+    assert borradores.compactar(protocolo_id)['aplicadas'] == ['MACRO']
+    assert _lineas(protocolo_id) == ['a', 'b', 'c']
+    assert os.listdir(app.config['AUTOSAVE_FOLDER']) == []
+
+
+def test_descartar_borra_el_diario_sin_operaciones(app, protocolo_id):
+    db.session.add(ProtocoloLinea(protocolo_id=protocolo_id, seccion='MICRO', texto='o', orden=1))
+    db.session.commit()
+    borradores.agregar_operaciones(protocolo_id, [
+        {'op': 'edit', 'seccion': 'MICRO', 'pos': 0, 'texto': 'o'},
+        {'op': 'insert', 'seccion': 'MACRO', 'pos': 1, 'texto': 'b'},
+    ])
+    ruta = os.path.join(app.config['AUTOSAVE_FOLDER'], f'{protocolo_id}.jsonl')
+
+    borradores.descartar(protocolo_id, ['MACRO'])
+    assert borradores.borrador(protocolo_id) == {'MICRO': ['o']}
+
+    # Queda la base de MICRO (cuya línea es "o") pero ninguna operación
+    with open(ruta, 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'b': 'OTRA', 'l': ['o']}) + '\n')
+    borradores.descartar(protocolo_id, ['MICRO'])
+    assert not os.path.exists(ruta)
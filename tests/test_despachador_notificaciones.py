@@ -0,0 +1,205 @@
+"""
+Bandeja de salida de notificaciones contra un servidor SMTP local de prueba
+
+El servidor es un stub al estilo de aiosmtpd sobre socketserver (sin
+dependencias): guarda los mensajes recibidos, cuenta conexiones y logins, y
+puede rechazar destinatarios con un código fijo (550 permanente, 451 transitorio).
+"""
+import base64
+import socketserver
+import threading
+from datetime import datetime
+from email import message_from_bytes
+from types import SimpleNamespace
+
+import pytest
+
+from extensions import db
+from models.notificacion import NotificacionSalida
+from services import despachador_notificaciones as despachador
+from services.notificaciones import NotificacionesService
+
+
+class _SesionSMTP(socketserver.StreamRequestHandler):
+    """Una sesión SMTP: EHLO, AUTH PLAIN/LOGIN, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def _responder(self, linea):
+        self.wfile.write(linea.encode() + b'\r\n')
+
+    def handle(self):
+        servidor = self.server.stub
+        servidor.conexiones += 1
+        self._responder('220 stub ESMTP')
+        remitente, destinatarios = None, []
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            comando = linea.decode().strip()
+            verbo = comando.split(' ', 1)[0].upper()
+            if verbo in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-stub\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n')
+            elif verbo == 'AUTH':
+                partes = comando.split()
+                if partes[1].upper() == 'PLAIN' and len(partes) > 2:
+                    usuario = base64.b64decode(partes[2]).split(b'\0')[1].decode()
+                elif partes[1].upper() == 'PLAIN':
+                    self._responder('334 ')
+                    usuario = base64.b64decode(self.rfile.readline().strip()).split(b'\0')[1].decode()
+                else:
+                    self._responder('334 VXNlcm5hbWU6')
+                    usuario = base64.b64decode(self.rfile.readline().strip()).decode()
+                    self._responder('334 UGFzc3dvcmQ6')
+                    self.rfile.readline()
+                servidor.logins.append(usuario)
+                self._responder('235 Authentication successful')
+            elif verbo == 'MAIL':
+                remitente, destinatarios = comando.split(':', 1)[1].strip(' <>'), []
+                self._responder('250 OK')
+            elif verbo == 'RCPT':
+                destinatario = comando.split(':', 1)[1].strip(' <>')
+                codigo = servidor.rechazos.get(destinatario)
+                if codigo:
+                    self._responder(f'{codigo} rechazado por el stub')
+                else:
+                    destinatarios.append(destinatario)
+                    self._responder('250 OK')
+            elif verbo == 'DATA':
+                self._responder('354 End data with <CR><LF>.<CR><LF>')
+                datos = []
+                while True:
+                    linea = self.rfile.readline()
+                    if linea in (b'.\r\n', b'.\n', b''):
+                        break
+                    datos.append(linea[1:] if linea.startswith(b'..') else linea)
+                servidor.mensajes.append((remitente, destinatarios, message_from_bytes(b''.join(datos))))
+                self._responder('250 OK: queued')
+            elif verbo in ('RSET', 'NOOP'):
+                self._responder('250 OK')
+            elif verbo == 'QUIT':
+                self._responder('221 Bye')
+                return
+            else:
+                self._responder('502 Command not implemented')
+
+
+class _ServidorSMTP(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class StubSMTP:
+    def __init__(self):
+        self.mensajes = []
+        self.conexiones = 0
+        self.logins = []
+        self.rechazos = {}
+        self._servidor = _ServidorSMTP(('127.0.0.1', 0), _SesionSMTP)
+        self._servidor.stub = self
+        self.puerto = self._servidor.server_address[1]
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+
+    def cerrar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+@pytest.fixture
+def smtp(app):
+    stub = StubSMTP()
+    app.config.update(SMTP_HOST='127.0.0.1', SMTP_PORT=stub.puerto, SMTP_USE_TLS=False,
+                      SMTP_USER='laboratorio', SMTP_PASSWORD='secreto',
+                      LABORATORIO_EMAIL='laboratorio@example.com')
+    yield stub
+    stub.cerrar()
+
+
+def _encolar(*destinatarios):
+    for destinatario in destinatarios:
+        NotificacionesService._encolar_email(SimpleNamespace(protocolo_id=None), destinatario,
+                                             f'Protocolo para {destinatario}', 'Informe disponible')
+    db.session.commit()
+
+
+def _estado(destinatario):
+    return NotificacionSalida.query.filter_by(destinatario=destinatario).one()
+
+
+def test_lote_reutiliza_una_conexion_autenticada(app, smtp):
+    _encolar('a@example.com', 'b@example.com', 'c@example.com')
+
+    resumen = despachador.procesar_pendientes(app.config)
+
+    assert resumen == {'enviadas': 3, 'reintentos': 0, 'fallidas': 0}
+    assert smtp.conexiones == 1
+    assert smtp.logins == ['laboratorio']
+    assert [d for _, destinatarios, _ in smtp.mensajes for d in destinatarios] == \
+        ['a@example.com', 'b@example.com', 'c@example.com']
+    assert smtp.mensajes[0][2]['Subject'] == 'Protocolo para a@example.com'
+    assert all(_estado(d).estado == NotificacionSalida.ENVIADA for d in ('a@example.com', 'b@example.com', 'c@example.com'))
+
+
+def test_rechazo_permanente_pasa_a_fallida_y_sigue_el_lote(app, smtp):
+    smtp.rechazos['malo@example.com'] = 550
+    _encolar('malo@example.com', 'bueno@example.com')
+
+    resumen = despachador.procesar_pendientes(app.config)
+
+    assert resumen == {'enviadas': 1, 'reintentos': 0, 'fallidas': 1}
+    fallida = _estado('malo@example.com')
+    assert fallida.estado == NotificacionSalida.FALLIDA
+    assert '550' in fallida.ultimo_error
+    assert _estado('bueno@example.com').estado == NotificacionSalida.ENVIADA
+    assert smtp.conexiones == 1
+
+
+def test_error_transitorio_reintenta_con_backoff(app, smtp):
+    smtp.rechazos['ocupado@example.com'] = 451
+    _encolar('ocupado@example.com', 'despues@example.com')
+
+    antes = datetime.utcnow()
+    resumen = despachador.procesar_pendientes(app.config)
+
+    assert resumen == {'enviadas': 0, 'reintentos': 1, 'fallidas': 0}
+    reintento = _estado('ocupado@example.com')
+    assert reintento.estado == NotificacionSalida.PENDIENTE
+    assert reintento.intentos == 1
+    # Backoff base de 60 s con jitter de ±20 %
+    assert (reintento.proximo_intento - antes).total_seconds() >= 60 * 0.8 - 1
+    # El resto del lote se libera sin consumir intentos
+    liberada = _estado('despues@example.com')
+    assert liberada.estado == NotificacionSalida.PENDIENTE
+    assert liberada.intentos == 0
+    assert liberada.proximo_intento > antes
+
+
+def test_agotar_los_intentos_pasa_a_fallida(app, smtp):
+    app.config['NOTIFICACIONES_MAX_INTENTOS'] = 2
+    smtp.rechazos['ocupado@example.com'] = 451
+    _encolar('ocupado@example.com')
+
+    despachador.procesar_pendientes(app.config)
+    _estado('ocupado@example.com').proximo_intento = datetime.utcnow()
+    db.session.commit()
+    resumen = despachador.procesar_pendientes(app.config)
+
+    assert resumen['fallidas'] == 1
+    fallida = _estado('ocupado@example.com')
+    assert fallida.estado == NotificacionSalida.FALLIDA
+    assert fallida.intentos == 2
+
+    assert despachador.reencolar_fallidas() == 1
+    smtp.rechazos.clear()
+    assert despachador.despachar_todo(app.config)['enviadas'] == 1
+
+
+def test_cada_commit_que_encola_despierta_al_despachador(app, monkeypatch):
+    llamadas = []
+    monkeypatch.setattr(despachador, 'despertar', lambda: llamadas.append(1))
+
+    for numero in range(3):
+        _encolar(f'destino{numero}@example.com')
+    # Un commit sin notificaciones nuevas no lo despierta
+    db.session.commit()
+
+    assert len(llamadas) == 3
@@ -0,0 +1,65 @@
+"""
+Escritura diferida de contadores de uso y del registro de uso de los modelos de IA
+"""
+from datetime import datetime, timedelta
+
+from extensions import db
+from models.asistente import UsoLLM
+from models.informe import LineaPap
+from services import contadores_uso, uso_llm
+from services.metricas import medir_llm, funcion_llm
+
+
+class _ClienteFalso:
+    model = 'claude-sonnet-4-20250514'
+
+    @medir_llm('claude')
+    def _make_request(self):
+        return {'usage': {'input_tokens': 10, 'output_tokens': 5}}
+
+    @funcion_llm('resumir_conversacion')
+    def resumir(self):
+        return self._make_request()
+
+
+def test_contadores_se_suman_y_vuelcan_en_lote(app):
+    linea = LineaPap(categoria='GENERAL', texto='Extendido adecuado', orden=1)
+    db.session.add(linea)
+    db.session.commit()
+
+    for _ in range(3):
+        contadores_uso.registrar_uso(LineaPap, linea.linea_id)
+    assert contadores_uso.pendientes() == 1
+    assert contadores_uso.volcar() == 1
+
+    db.session.expire_all()
+    assert db.session.get(LineaPap, linea.linea_id).veces_usado == 3
+    assert contadores_uso.pendientes() == 0
+
+
+def test_registro_de_llm_con_la_funcion_declarada(app):
+    uso_llm.volcar()
+    cliente = _ClienteFalso()
+    cliente.resumir()
+    cliente._make_request()
+
+    assert uso_llm.volcar() == 2
+    assert sorted(f for (f,) in db.session.query(UsoLLM.funcion)) == ['resumir_conversacion', 'sin_funcion']
+
+
+def test_volcado_fallido_vuelve_a_la_cola(app, monkeypatch):
+    uso_llm.volcar()
+    _ClienteFalso().resumir()
+
+    def fallar(conexion, lote):
+        raise RuntimeError('base de datos bloqueada')
+
+    monkeypatch.setattr(uso_llm._escritor, '_escribir', fallar)
+    assert uso_llm.volcar() == 0
+    assert uso_llm.pendientes() == 1
+
+    monkeypatch.undo()
+    assert uso_llm.volcar() == 1
+    resumen = uso_llm.resumen(datetime.utcnow() - timedelta(hours=1), datetime.utcnow() + timedelta(hours=1),
+                              agrupar_por='funcion')
+    assert [(r['funcion'], r['llamadas'], r['tokens_entrada']) for r in resumen] == [('resumir_conversacion', 1, 10)]
@@ -0,0 +1,32 @@
+"""
+Exportación en streaming: cargas anticipadas declaradas y XML válido en el XLSX
+"""
+import io
+import zipfile
+from xml.etree import ElementTree
+
+import pytest
+from sqlalchemy.orm import selectinload
+
+from models.prestador import Prestador
+from utils.exportacion import generar_xlsx, iterar_query
+
+
+def test_cargas_anticipadas_declaradas_se_rechazan_antes_de_iterar(app):
+    query = Prestador.query.options(selectinload(Prestador.especialidad))
+    with pytest.raises(ValueError, match='Prestador.especialidad'):
+        iterar_query(query, cargas_anticipadas=[Prestador.especialidad])
+
+
+def test_query_sin_cargas_anticipadas_se_recorre_por_lotes(app):
+    assert list(iterar_query(Prestador.query, lote=10)) == []
+
+
+def test_xlsx_sin_caracteres_de_control_invalidos_en_xml():
+    filas = [('Pérez\x00, Ana\x0b', 'línea 1\nlínea 2\tcon tab', 3, None)]
+    contenido = b''.join(generar_xlsx(['Paciente\x1f', 'Texto', 'N', 'Vacío'], filas))
+
+    with zipfile.ZipFile(io.BytesIO(contenido)) as zf:
+        hoja = ElementTree.fromstring(zf.read('xl/worksheets/sheet1.xml'))
+    textos = [t.text for t in hoja.iter('{http://schemas.openxmlformats.org/spreadsheetml/2006/main}t')]
+    assert textos == ['Paciente', 'Texto', 'N', 'Vacío', 'Pérez, Ana', 'línea 1\nlínea 2\tcon tab', None]
@@ -0,0 +1,93 @@
+"""
+Tablas de frecuencias de diagnósticos: sumas concurrentes y tablas sin construir
+"""
+import pytest
+from sqlalchemy import event
+
+from extensions import db
+from models.asistente import CasoHistorico
+from services import frecuencias_diagnostico
+from services.frecuencias_diagnostico import hash_diagnostico
+
+
+@pytest.fixture
+def casos(app, tmp_path, monkeypatch):
+    app.config['INDICE_CASOS_FOLDER'] = str(tmp_path)
+    monkeypatch.setattr(frecuencias_diagnostico, '_inicializadas', False)
+    frecuencias_diagnostico.recalcular()
+
+
+def _caso(diagnostico, categoria='MAMA'):
+    db.session.add(CasoHistorico(tipo_estudio='BIOPSIA', categoria=categoria, diagnostico=diagnostico))
+    db.session.commit()
+
+
+def test_sin_construir_devuelve_vacio_sin_escribir(app, monkeypatch):
+    monkeypatch.setattr(frecuencias_diagnostico, '_inicializadas', False)
+    db.session.add(CasoHistorico(tipo_estudio='BIOPSIA', categoria='MAMA', diagnostico='Carcinoma ductal'))
+    db.session.commit()
+
+    assert frecuencias_diagnostico.top_diagnosticos('BIOPSIA') == []
+    assert frecuencias_diagnostico.categorias('BIOPSIA') == []
+    assert not frecuencias_diagnostico.inicializadas()
+
+
+def test_primer_caso_concurrente_suma_en_lugar_de_chocar(app, casos):
+    """Otra sesión crea el diagnóstico y su frecuencia justo antes de nuestros INSERT"""
+    diagnostico = 'Carcinoma ductal infiltrante'
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def adelantarse(conn, cursor, statement, parameters, context, executemany):
+        crudo = cursor.connection
+        if statement.startswith('INSERT INTO diagnosticos_normalizados'):
+            crudo.execute('INSERT OR IGNORE INTO diagnosticos_normalizados (hash, texto_mostrar) VALUES (?, ?)',
+                          (hash_diagnostico(diagnostico), diagnostico))
+        elif statement.startswith('INSERT INTO frecuencias_diagnostico'):
+            diagnostico_id = crudo.execute('SELECT diagnostico_id FROM diagnosticos_normalizados WHERE hash = ?',
+                                           (hash_diagnostico(diagnostico),)).fetchone()[0]
+            crudo.execute("INSERT OR IGNORE INTO frecuencias_diagnostico VALUES ('BIOPSIA', '*', ?, 1)",
+                          (diagnostico_id,))
+
+    try:
+        _caso(diagnostico)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', adelantarse)
+
+    assert frecuencias_diagnostico.top_diagnosticos('BIOPSIA') == [(diagnostico, 2)]
+    assert frecuencias_diagnostico.top_diagnosticos('BIOPSIA', 'MAMA') == [(diagnostico, 1)]
+
+
+def test_variantes_se_agrupan_y_las_bajas_restan(app, casos):
+    _caso('Carcinoma ductal infiltrante.')
+    _caso('CARCINOMA DUCTAL INFILTRANTE')
+    _caso('Fibroadenoma', categoria='MAMA')
+
+    assert frecuencias_diagnostico.top_diagnosticos('BIOPSIA')[0][1] == 2
+    caso = CasoHistorico.query.filter_by(diagnostico='Fibroadenoma').one()
+    caso.activo = False
+    db.session.commit()
+
+    assert [n for _, n in frecuencias_diagnostico.top_diagnosticos('BIOPSIA')] == [2]
+    assert frecuencias_diagnostico.categorias('BIOPSIA') == [('MAMA', 2)]
+
+
+def test_herramienta_del_asistente_lee_sin_la_sesion(app, tmp_path, monkeypatch):
+    from services import asistente_db_tools
+
+    app.config['INDICE_CASOS_FOLDER'] = str(tmp_path)
+    monkeypatch.setattr(frecuencias_diagnostico, '_inicializadas', False)
+    asistente_db_tools.limpiar_cache()
+    sin_construir = asistente_db_tools.ejecutar_funcion('obtener_top_diagnosticos', {'tipo_estudio': 'BIOPSIA'})
+    assert sin_construir['success'] is False
+    assert 'recalcular-diagnosticos' in sin_construir['error']
+
+    frecuencias_diagnostico.recalcular()
+    _caso('Carcinoma ductal infiltrante')
+
+    def sin_sesion(*args, **kwargs):
+        raise AssertionError('la herramienta no debe usar la sesión del ORM')
+
+    monkeypatch.setattr(db.session, 'execute', sin_sesion)
+    resultado = asistente_db_tools.ejecutar_funcion('obtener_top_diagnosticos', {'tipo_estudio': 'BIOPSIA'})
+    assert resultado['success'] is True
+    assert resultado['diagnosticos'] == [{'diagnostico': 'Carcinoma ductal infiltrante', 'frecuencia': 1}]
@@ -0,0 +1,78 @@
+"""
+Índice BM25 de casos: con el delta aplicado, los puntajes coinciden con BM25
+calculado desde cero sobre los casos vigentes
+"""
+import math
+
+import pytest
+
+from extensions import db
+from models.asistente import CasoHistorico
+from services import indice_casos
+from services.analisis_texto import terminos
+
+
+@pytest.fixture
+def indice(app, tmp_path):
+    app.config['INDICE_CASOS_FOLDER'] = str(tmp_path)
+    indice_casos._abiertas.clear()
+    for diagnostico, microscopia in [
+        ('Carcinoma ductal infiltrante', 'Proliferación de células atípicas en cordones'),
+        ('Fibroadenoma', 'Proliferación estromal y ductal sin atipía'),
+        ('Carcinoma lobulillar', 'Células discohesivas en fila india'),
+        ('Mastopatía fibroquística', 'Quistes y metaplasia apocrina'),
+    ]:
+        db.session.add(CasoHistorico(tipo_estudio='BIOPSIA', categoria='MAMA', diagnostico=diagnostico,
+                                     descripcion_microscopica=microscopia))
+    db.session.commit()
+    indice_casos.construir()
+    yield
+    indice_casos._abiertas.clear()
+
+
+def _bm25_desde_cero(consulta):
+    documentos = {}
+    for caso in CasoHistorico.query.filter(CasoHistorico.activo.is_(True)):
+        _, frecuencias, largo = indice_casos.documento('h', caso)
+        documentos[caso.caso_id] = (frecuencias, largo)
+    n = len(documentos)
+    largo_promedio = sum(largo for _, largo in documentos.values()) / n
+    puntajes = {}
+    for termino in dict.fromkeys(terminos(consulta)):
+        df = sum(1 for frecuencias, _ in documentos.values() if termino in frecuencias)
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for caso_id, (frecuencias, largo) in documentos.items():
+            tf = frecuencias.get(termino)
+            if tf:
+                normalizacion = indice_casos.K1 * (1 - indice_casos.B + indice_casos.B * largo / largo_promedio)
+                puntajes[caso_id] = puntajes.get(caso_id, 0.0) + idf * tf * (indice_casos.K1 + 1) / (tf + normalizacion)
+    return puntajes
+
+
+def _comparar(consulta):
+    resultado = indice_casos.buscar(consulta, limite=50)
+    esperado = _bm25_desde_cero(consulta)
+    assert {caso_id for _, _, caso_id in resultado} == set(esperado)
+    for puntaje, origen, caso_id in resultado:
+        assert origen == 'h'
+        assert puntaje == pytest.approx(esperado[caso_id], rel=1e-5)
+
+
+def test_puntajes_sin_delta(app, indice):
+    _comparar('carcinoma ductal')
+
+
+def test_puntajes_con_reemplazos_bajas_y_altas(app, indice):
+    fibroadenoma = CasoHistorico.query.filter_by(diagnostico='Fibroadenoma').one()
+    fibroadenoma.diagnostico = 'Carcinoma ductal in situ'
+    fibroadenoma.descripcion_microscopica = 'Células atípicas intraductales con necrosis central'
+    CasoHistorico.query.filter_by(diagnostico='Carcinoma lobulillar').one().activo = False
+    db.session.add(CasoHistorico(tipo_estudio='BIOPSIA', categoria='MAMA', diagnostico='Carcinoma ductal',
+                                 descripcion_microscopica='Células atípicas'))
+    db.session.commit()
+
+    _comparar('carcinoma ductal')
+    _comparar('células atípicas necrosis')
+    _comparar('proliferación estromal')
@@ -0,0 +1,17 @@
+"""
+Instrumentación de consultas: las sentencias fallidas no dejan inicios colgados
+"""
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from extensions import db
+
+
+def test_sentencia_fallida_no_deja_inicio_en_la_conexion(app):
+    with db.engine.connect() as conexion:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conexion.execute(text('SELECT * FROM tabla_inexistente'))
+        conexion.execute(text('SELECT 1'))
+        assert conexion.info.get('_metricas_inicio') == []
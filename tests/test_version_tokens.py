@@ -0,0 +1,66 @@
+"""
+Renovación de los tokens de versión de facturación y del catálogo de plantillas
+"""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from extensions import db
+from models.informe import LineaPap
+from models.protocolo import Protocolo
+from services import catalogo_plantillas, facturacion
+from services.lineas_protocolo import guardar_lineas
+
+
+def _protocolo(numero, fecha_ingreso):
+    protocolo = Protocolo(numero_protocolo=numero, tipo_estudio='BIOPSIA', afiliado_id=1, fecha_ingreso=fecha_ingreso)
+    db.session.add(protocolo)
+    db.session.commit()
+    return protocolo.protocolo_id
+
+
+@pytest.mark.parametrize('fecha_ingreso', [date.today(), date.today().replace(day=1) - timedelta(days=40)])
+def test_guardar_lineas_no_renueva_la_facturacion(app, fecha_ingreso):
+    protocolo_id = _protocolo('F-0001', fecha_ingreso)
+    version = facturacion.version_actual()
+
+    for texto in ('uno', 'dos', 'tres'):
+        guardar_lineas(protocolo_id, {'MACRO': [(texto, 1)]})
+        db.session.commit()
+
+    assert facturacion.version_actual() == version
+
+
+def test_update_masivo_de_columna_facturable_renueva(app):
+    protocolo_id = _protocolo('F-0002', date.today())
+    version = facturacion.version_actual()
+
+    db.session.execute(update(Protocolo).where(Protocolo.protocolo_id == protocolo_id).values(estado='CANCELADO'))
+    db.session.commit()
+
+    assert facturacion.version_actual() != version
+
+
+def test_catalogo_ignora_sentencias_de_contadores_de_uso(app):
+    db.session.add(LineaPap(categoria='GENERAL', texto='Extendido adecuado', orden=1))
+    db.session.commit()
+    version = catalogo_plantillas.version_actual()
+
+    db.session.execute(update(LineaPap).values(veces_usado=LineaPap.veces_usado + 1))
+    db.session.commit()
+    assert catalogo_plantillas.version_actual() == version
+
+    db.session.execute(update(LineaPap).values(texto='Extendido satisfactorio'))
+    db.session.commit()
+    assert catalogo_plantillas.version_actual() != version
+
+
+def test_cancelar_protocolo_de_mes_cerrado_renueva(app):
+    protocolo_id = _protocolo('F-0003', date.today().replace(day=1) - timedelta(days=40))
+    version = facturacion.version_actual()
+
+    db.session.get(Protocolo, protocolo_id).estado = 'CANCELADO'
+    db.session.commit()
+
+    assert facturacion.version_actual() != version
@@ -2,3 +2,12 @@
 Utilidades del sistema
 """
 
+from flask import current_app
+
+
+def config_app(clave, por_defecto):
+    """Valor de la configuración de la app, o `por_defecto` fuera de un app context"""
+    try:
+        return current_app.config.get(clave, por_defecto)
+    except RuntimeError:
+        return por_defecto
@@ -0,0 +1,248 @@
+"""
+Benchmark de los circuitos principales de la aplicación
+
+Recorre con el cliente de pruebas de Flask los circuitos más usados (login,
+dashboard, búsqueda de protocolos, guardado del editor, reportes y descarga
+masiva del portal) y mide latencia (p50/p90/p99) y consultas SQL por request.
+Los resultados se agregan a un archivo JSONL junto con el commit actual para
+poder compararlos entre versiones.
+"""
+import json
+import os
+import statistics
+import subprocess
+import threading
+import time
+from datetime import datetime
+
+from flask import url_for
+from sqlalchemy import event
+
+from extensions import db
+from utils.datos_sinteticos import USUARIO_BENCH, USUARIO_BENCH_PRESTADOR, PASSWORD_BENCH
+
+ARCHIVO_RESULTADOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                  'benchmarks', 'resultados.jsonl')
+
+
+class _ContadorConsultas:
+    """Cuenta las sentencias SQL ejecutadas sobre el engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.total = 0
+
+    def _contar(self, *args, **kwargs):
+        self.total += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._contar)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._contar)
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(ordenados) - 1)
+    return ordenados[f] + (ordenados[c] - ordenados[f]) * (k - f)
+
+
+def _commit_actual():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def _login(cliente, url_login, username):
+    respuesta = cliente.post(url_login, data={'username': username, 'password': PASSWORD_BENCH})
+    return respuesta.status_code == 302
+
+
+def _datos_circuitos():
+    """Ids de ejemplo para los circuitos (tomados de la base sembrada)"""
+    from models.protocolo import Protocolo
+    from models.usuario import Usuario
+    from models.informe import ProtocoloLinea
+
+    protocolo_abierto = Protocolo.query.filter(
+        Protocolo.es_prueba == False, Protocolo.estado != 'COMPLETADO'
+    ).order_by(Protocolo.protocolo_id.desc()).first()
+    protocolo_completo = Protocolo.query.filter_by(es_prueba=False, estado='COMPLETADO').order_by(
+        Protocolo.protocolo_id.desc()).first()
+
+    lineas = []
+    if protocolo_abierto:
+        lineas = [{'seccion': l.seccion, 'texto': l.texto, 'orden': l.orden}
+                  for l in ProtocoloLinea.query.filter_by(protocolo_id=protocolo_abierto.protocolo_id).all()]
+
+    usuario_portal = Usuario.query.filter_by(username=USUARIO_BENCH_PRESTADOR).first()
+    ids_portal = []
+    if usuario_portal and usuario_portal.prestador_id:
+        ids_portal = [p.protocolo_id for p in Protocolo.query.filter_by(
+            prestador_id=usuario_portal.prestador_id, estado='COMPLETADO'
+        ).order_by(Protocolo.fecha_informe.desc()).limit(10).all()]
+
+    return {
+        'protocolo_abierto': protocolo_abierto.protocolo_id if protocolo_abierto else None,
+        'protocolo_completo': protocolo_completo.protocolo_id if protocolo_completo else None,
+        'lineas': lineas,
+        'ids_portal': ids_portal,
+    }
+
+
+def _circuitos(datos):
+    """
+    Lista de (nombre, usuario, método, url, kwargs del request).
+
+    Las URLs se resuelven de antemano: los requests deben ejecutarse fuera de un
+    contexto de aplicación para que cada uno tenga su propio `g` (y su usuario).
+    """
+    login = {'data': {'username': USUARIO_BENCH, 'password': PASSWORD_BENCH}}
+    circuitos = [
+        ('login', None, 'post', url_for('auth.login'), login),
+        ('dashboard', USUARIO_BENCH, 'get', url_for('dashboard.index'), {}),
+        ('protocolos_buscar', USUARIO_BENCH, 'get', url_for('protocolos.index', buscar='GONZALEZ'), {}),
+        ('protocolos_filtrar', USUARIO_BENCH, 'get',
+         url_for('protocolos.index', tipo='PAP', estado='COMPLETADO', page=3), {}),
+        ('reporte_periodo', USUARIO_BENCH, 'get', url_for('reportes.protocolos_por_periodo'), {}),
+        ('reporte_facturacion', USUARIO_BENCH, 'get', url_for('reportes.facturacion_obra_social'), {}),
+    ]
+    if datos['protocolo_abierto']:
+        circuitos.append(('editor_guardar', USUARIO_BENCH, 'post',
+                          url_for('plantillas_dinamicas.api_guardar_lineas_protocolo',
+                                  protocolo_id=datos['protocolo_abierto']),
+                          {'json': {'lineas': datos['lineas']}}))
+    if datos['protocolo_completo']:
+        circuitos.append(('informe_preview', USUARIO_BENCH, 'get',
+                          url_for('plantillas_dinamicas.preview_plantilla', protocolo_id=datos['protocolo_completo']),
+                          {}))
+    if datos['ids_portal']:
+        circuitos.append(('portal_descarga_multiple', USUARIO_BENCH_PRESTADOR, 'post',
+                          url_for('portal_prestador.descargar_multiples'),
+                          {'json': {'protocolos': datos['ids_portal']}}))
+    return circuitos
+
+
+def _medir_circuitos(app, iteraciones, calentamiento, log):
+    """Ejecutar los circuitos y calcular percentiles y consultas por request"""
+    resultados = {}
+    with app.test_request_context():
+        from models.protocolo import Protocolo
+        datos = _datos_circuitos()
+        total_protocolos = Protocolo.query.count()
+        circuitos = _circuitos(datos)
+        url_login = url_for('auth.login')
+        engine = db.engine
+        db.session.remove()
+
+    for nombre, usuario, metodo, url, kwargs in circuitos:
+        cliente = app.test_client()
+        if usuario and not _login(cliente, url_login, usuario):
+            log(f'⚠️ {nombre}: no se pudo iniciar sesión como {usuario}')
+            continue
+
+        def ejecutar():
+            # Sin usuario (circuito de login) cada request usa un cliente nuevo
+            c = cliente if usuario else app.test_client()
+            return getattr(c, metodo)(url, **kwargs)
+
+        for _ in range(calentamiento):
+            ejecutar()
+
+        tiempos, consultas, estados = [], [], {}
+        for _ in range(iteraciones):
+            with _ContadorConsultas(engine) as contador:
+                inicio = time.perf_counter()
+                respuesta = ejecutar()
+                respuesta.get_data()
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            consultas.append(contador.total)
+            estados[respuesta.status_code] = estados.get(respuesta.status_code, 0) + 1
+
+        resultados[nombre] = {
+            'p50_ms': round(_percentil(tiempos, 50), 2),
+            'p90_ms': round(_percentil(tiempos, 90), 2),
+            'p99_ms': round(_percentil(tiempos, 99), 2),
+            'media_ms': round(statistics.mean(tiempos), 2),
+            'consultas': round(statistics.mean(consultas), 1),
+            'estados': {str(k): v for k, v in estados.items()},
+        }
+
+    return {'resultados': resultados, 'protocolos': total_protocolos}
+
+
+def ejecutar_benchmark(app, iteraciones=20, calentamiento=2, etiqueta=None, guardar=True, log=print):
+    """
+    Ejecutar todos los circuitos y devolver las métricas por circuito.
+
+    Args:
+        app: Aplicación Flask
+        iteraciones: Requests medidos por circuito
+        calentamiento: Requests previos no medidos (caches, compilación de templates)
+        etiqueta: Texto libre para identificar la corrida
+        guardar: Si se agrega el resultado a benchmarks/resultados.jsonl
+    """
+    # El CLI de Flask deja un app context activo en el hilo principal; si los
+    # requests lo compartieran, `g` (y el usuario logueado) se reutilizaría entre
+    # ellos. Por eso los circuitos se ejecutan en un hilo propio.
+    resultado_hilo = {}
+    hilo = threading.Thread(
+        target=lambda: resultado_hilo.update(_medir_circuitos(app, iteraciones, calentamiento, log))
+    )
+    hilo.start()
+    hilo.join()
+    resultados = resultado_hilo['resultados']
+    total_protocolos = resultado_hilo['protocolos']
+
+    corrida = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': _commit_actual(),
+        'etiqueta': etiqueta,
+        'iteraciones': iteraciones,
+        'protocolos': total_protocolos,
+        'resultados': resultados,
+    }
+    anterior = ultima_corrida()
+    if guardar:
+        os.makedirs(os.path.dirname(ARCHIVO_RESULTADOS), exist_ok=True)
+        with open(ARCHIVO_RESULTADOS, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(corrida, ensure_ascii=False) + '\n')
+
+    imprimir_resultados(corrida, anterior, log=log)
+    return corrida
+
+
+def ultima_corrida():
+    """Última corrida guardada (para comparar), o None"""
+    if not os.path.exists(ARCHIVO_RESULTADOS):
+        return None
+    ultima = None
+    with open(ARCHIVO_RESULTADOS, encoding='utf-8') as f:
+        for linea in f:
+            if linea.strip():
+                ultima = json.loads(linea)
+    return ultima
+
+
+def imprimir_resultados(corrida, anterior=None, log=print):
+    """Tabla de resultados, con la variación de p50 respecto de la corrida anterior"""
+    log(f"\nBenchmark {corrida['fecha']} (commit {corrida['commit'] or '-'}, "
+        f"{corrida['protocolos']} protocolos, {corrida['iteraciones']} iteraciones)")
+    if anterior:
+        log(f"Comparando con {anterior['fecha']} (commit {anterior.get('commit') or '-'})")
+    log(f"{'Circuito':<28}{'p50':>10}{'p90':>10}{'p99':>10}{'SQL/req':>10}{'Δ p50':>10}  Estados")
+    for nombre, r in corrida['resultados'].items():
+        delta = ''
+        previo = (anterior or {}).get('resultados', {}).get(nombre)
+        if previo and previo.get('p50_ms'):
+            delta = f"{(r['p50_ms'] - previo['p50_ms']) * 100 / previo['p50_ms']:+.0f}%"
+        log(f"{nombre:<28}{r['p50_ms']:>10.1f}{r['p90_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+            f"{r['consultas']:>10.1f}{delta:>10}  {r['estados']}")
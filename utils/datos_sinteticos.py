@@ -0,0 +1,322 @@
+"""
+Generador de datos sintéticos para pruebas de carga y benchmarks
+
+Crea un conjunto de datos reproducible (semilla fija) con pacientes, prestadores,
+entidades, obras sociales, protocolos con sus líneas e historial de auditoría.
+Solo debe usarse sobre una base vacía (desarrollo o benchmarks).
+"""
+import random
+from datetime import date, datetime, timedelta
+
+from extensions import db
+from models.usuario import Usuario, Rol
+from models.paciente import Afiliado
+from models.prestador import Prestador, Especialidad, prestador_entidad
+from models.entidad import usuario_prestador
+from models.obra_social import ObraSocial, PlanFacturacion, PlanCategoria
+from models.protocolo import Protocolo
+from models.informe import ProtocoloLinea
+from models.auditoria import Auditoria
+
+# Tamaño de los lotes de inserción masiva
+LOTE = 5000
+
+# Usuarios creados para recorrer los circuitos del benchmark
+USUARIO_BENCH = 'bench'
+USUARIO_BENCH_PRESTADOR = 'bench_prestador'
+USUARIO_BENCH_ENTIDAD = 'bench_entidad'
+PASSWORD_BENCH = 'bench123'
+
+APELLIDOS = ['GONZALEZ', 'RODRIGUEZ', 'GOMEZ', 'FERNANDEZ', 'LOPEZ', 'DIAZ', 'MARTINEZ', 'PEREZ',
+             'GARCIA', 'SANCHEZ', 'ROMERO', 'SOSA', 'TORRES', 'ALVAREZ', 'RUIZ', 'RAMIREZ',
+             'FLORES', 'BENITEZ', 'ACOSTA', 'MEDINA', 'HERRERA', 'SUAREZ', 'AGUIRRE', 'GIMENEZ']
+NOMBRES = ['MARIA', 'JUAN', 'ANA', 'CARLOS', 'LAURA', 'JOSE', 'SILVIA', 'JORGE', 'MONICA',
+           'LUIS', 'GRACIELA', 'MIGUEL', 'PATRICIA', 'RICARDO', 'NORMA', 'DANIEL', 'SUSANA']
+ESPECIALIDADES = ['GINECOLOGIA', 'CIRUGIA GENERAL', 'DERMATOLOGIA', 'GASTROENTEROLOGIA',
+                  'UROLOGIA', 'CLINICA MEDICA', 'OTORRINOLARINGOLOGIA']
+ENTIDADES = ['SANATORIO', 'HOSPITAL', 'CLINICA', 'INSTITUTO MEDICO']
+
+# Líneas típicas por sección y tipo de estudio (mismo vocabulario que las plantillas)
+LINEAS_POR_TIPO = {
+    'PAP': {
+        'DATOS_CLINICOS': ['Control anual.', 'FUM: hace 15 días.', 'Portadora de DIU.', 'Posmenopausia.'],
+        'EXTENDIDO': ['Extendido adecuado para evaluación.', 'Extendido con escasa celularidad.'],
+        'CELULAS_CONFORMACION': ['Células pavimentosas superficiales e intermedias.',
+                                 'Células pavimentosas intermedias y parabasales.'],
+        'COMP_INFLAMATORIO': ['Escaso componente inflamatorio.', 'Moderado componente inflamatorio.'],
+        'FLORA': ['Flora bacilar.', 'Flora cocoide.', 'Flora mixta.'],
+        'DIAGNOSTICO': ['Negativo para lesión intraepitelial o malignidad.',
+                        'Cambios celulares reactivos asociados a inflamación.',
+                        'Lesión intraepitelial escamosa de bajo grado (LSIL).'],
+    },
+    'BIOPSIA': {
+        'MATERIAL_REMITIDO': ['Biopsia de cuello uterino.', 'Pólipo de colon.', 'Biopsia de piel.',
+                              'Vesícula biliar.', 'Biopsia gástrica.'],
+        'DESCRIPCION_MACROSCOPICA': ['Se reciben múltiples fragmentos de tejido blanquecino.',
+                                     'Pieza de 3 x 2 x 1 cm, superficie lisa.',
+                                     'Fragmento irregular de 0,5 cm.'],
+        'DESCRIPCION_MICROSCOPICA': ['Los cortes muestran mucosa con inflamación crónica.',
+                                     'Epitelio sin atipías.', 'Estroma con congestión vascular.'],
+        'DIAGNOSTICO': ['Cervicitis crónica.', 'Pólipo hiperplásico.', 'Colecistitis crónica litiásica.',
+                        'Gastritis crónica moderada.', 'Queratosis seborreica.'],
+    },
+    'CITOLOGÍA': {
+        'MATERIAL_REMITIDO': ['Líquido pleural.', 'Punción de tiroides.', 'Orina.'],
+        'DESCRIPCION_MICROSCOPICA': ['Extendidos con células mesoteliales reactivas.',
+                                     'Células foliculares en grupos cohesivos.'],
+        'DIAGNOSTICO': ['Negativo para células neoplásicas.', 'Lesión folicular benigna.'],
+    },
+}
+PREFIJOS = {'PAP': 'P', 'BIOPSIA': 'B', 'CITOLOGÍA': 'C'}
+
+
+def _insertar_en_lotes(tabla, filas):
+    """Inserción masiva (executemany) en lotes de LOTE filas"""
+    for inicio in range(0, len(filas), LOTE):
+        db.session.execute(db.insert(tabla), filas[inicio:inicio + LOTE])
+
+
+def _ids(columna, inicio_id):
+    """Ids insertados a partir de inicio_id (las inserciones masivas no devuelven PK)"""
+    return [fila[0] for fila in db.session.query(columna).filter(columna > inicio_id).order_by(columna).all()]
+
+
+def _max_id(columna):
+    return db.session.query(db.func.coalesce(db.func.max(columna), 0)).scalar()
+
+
+def generar_datos_sinteticos(pacientes=5000, prestadores=200, entidades=10, obras_sociales=40,
+                             anios=2, protocolos_por_anio=15000, auditorias=50000, semilla=42,
+                             log=print):
+    """
+    Generar el conjunto de datos sintético completo.
+
+    Args:
+        pacientes: Cantidad de afiliados
+        prestadores: Cantidad de prestadores médicos
+        entidades: Cantidad de entidades (prestadores con es_entidad=True)
+        obras_sociales: Cantidad de obras sociales
+        anios: Años de historia de protocolos (hasta hoy)
+        protocolos_por_anio: Protocolos generados por año
+        auditorias: Registros de auditoría
+        semilla: Semilla del generador aleatorio (datos reproducibles)
+        log: Función para informar el progreso
+
+    Returns:
+        Dict con la cantidad de registros creados por tabla
+    """
+    rnd = random.Random(semilla)
+    hoy = date.today()
+    resumen = {}
+
+    # Planes y obras sociales
+    planes = []
+    for i, porcentaje in enumerate([100, 90, 80, 70, 60], 1):
+        plan = PlanFacturacion(codigo=f'SIN-PL{i}', nombre=f'Plan {i} ({porcentaje}%)', porcentaje_base=porcentaje)
+        db.session.add(plan)
+        planes.append(plan)
+    db.session.flush()
+    for plan in planes:
+        for categoria in ('PAP', 'BIOPSIA', 'CITOLOGIA'):
+            db.session.add(PlanCategoria(plan_id=plan.plan_facturacion_id, categoria_codigo=categoria,
+                                         porcentaje=rnd.choice([50, 75, 100])))
+
+    inicio = _max_id(ObraSocial.obra_social_id)
+    _insertar_en_lotes(ObraSocial, [{
+        'codigo': f'SIN-OS{i:04d}',
+        'nombre': f'OBRA SOCIAL SINTETICA {i}',
+        'plan_id': rnd.choice(planes).plan_facturacion_id,
+        'activo': True,
+        'fecha_registro': datetime.utcnow(),
+    } for i in range(1, obras_sociales + 1)])
+    os_ids = _ids(ObraSocial.obra_social_id, inicio)
+    os_datos = {oid: (f'SIN-OS{i:04d}', f'OBRA SOCIAL SINTETICA {i}') for i, oid in enumerate(os_ids, 1)}
+    resumen['obras_sociales'] = len(os_ids)
+    log(f'✓ {len(os_ids)} obras sociales')
+
+    # Especialidades, prestadores y entidades
+    especialidad_ids = []
+    for nombre in ESPECIALIDADES:
+        especialidad = Especialidad.query.filter_by(nombre=nombre).first() or Especialidad(nombre=nombre)
+        db.session.add(especialidad)
+        db.session.flush()
+        especialidad_ids.append(especialidad.especialidad_id)
+
+    inicio = _max_id(Prestador.prestador_id)
+    _insertar_en_lotes(Prestador, [{
+        'apellido': rnd.choice(APELLIDOS),
+        'nombre': rnd.choice(NOMBRES),
+        'codigo': f'SIN-M{i:05d}',
+        'tipo_matricula': 'MP',
+        'numero_matricula': str(10000 + i),
+        'especialidad_id': rnd.choice(especialidad_ids),
+        'activo': True,
+        'es_entidad': False,
+        'puede_ver_ambulatorio': True,
+        'puede_ver_internacion': True,
+        'notificar_email': False,
+        'notificar_whatsapp': False,
+        'notificar_ambulatorio': False,
+        'notificar_internacion': False,
+        'fecha_registro': datetime.utcnow(),
+    } for i in range(1, prestadores + 1)])
+    prestador_ids = _ids(Prestador.prestador_id, inicio)
+
+    inicio = _max_id(Prestador.prestador_id)
+    _insertar_en_lotes(Prestador, [{
+        'apellido': f'{rnd.choice(ENTIDADES)} SINTETICO',
+        'nombre': str(i),
+        'codigo': f'SIN-E{i:04d}',
+        'activo': True,
+        'es_entidad': True,
+        'puede_ver_ambulatorio': True,
+        'puede_ver_internacion': True,
+        'notificar_email': False,
+        'notificar_whatsapp': False,
+        'notificar_ambulatorio': False,
+        'notificar_internacion': False,
+        'fecha_registro': datetime.utcnow(),
+    } for i in range(1, entidades + 1)])
+    entidad_ids = _ids(Prestador.prestador_id, inicio)
+
+    vinculos = set()
+    for entidad_id in entidad_ids:
+        for prestador_id in rnd.sample(prestador_ids, min(len(prestador_ids), rnd.randint(5, 25))):
+            vinculos.add((entidad_id, prestador_id))
+    _insertar_en_lotes(prestador_entidad, [
+        {'entidad_id': e, 'prestador_id': p, 'fecha_asociacion': datetime.utcnow()} for e, p in sorted(vinculos)
+    ])
+    resumen['prestadores'] = len(prestador_ids)
+    resumen['entidades'] = len(entidad_ids)
+    resumen['prestador_entidad'] = len(vinculos)
+    log(f'✓ {len(prestador_ids)} prestadores, {len(entidad_ids)} entidades, {len(vinculos)} vínculos')
+
+    # Pacientes
+    inicio = _max_id(Afiliado.afiliado_id)
+    _insertar_en_lotes(Afiliado, [{
+        'apellido': rnd.choice(APELLIDOS),
+        'nombre': rnd.choice(NOMBRES),
+        'obra_social_id': rnd.choice(os_ids),
+        'numero_afiliado': f'{rnd.randint(10**9, 10**10 - 1)}',
+        'tipo_documento': 'DNI',
+        'numero_documento': str(10_000_000 + i),
+        'fecha_nacimiento': hoy - timedelta(days=rnd.randint(18 * 365, 85 * 365)),
+        'activo': True,
+        'fecha_registro': datetime.utcnow(),
+    } for i in range(1, pacientes + 1)])
+    afiliado_ids = _ids(Afiliado.afiliado_id, inicio)
+    resumen['pacientes'] = len(afiliado_ids)
+    log(f'✓ {len(afiliado_ids)} pacientes')
+
+    # Usuarios para el benchmark (administrador, prestador del portal y entidad)
+    rol_admin = Rol.query.filter_by(nombre='Administrador').first()
+    rol_prestador = Rol.query.filter_by(nombre='Prestador').first()
+    rol_entidad = Rol.query.filter_by(nombre='Entidades').first()
+    prestador_portal_id = prestador_ids[0]
+    usuarios = {}
+    for username, rol, prestador_id in [(USUARIO_BENCH, rol_admin, None),
+                                        (USUARIO_BENCH_PRESTADOR, rol_prestador, prestador_portal_id),
+                                        (USUARIO_BENCH_ENTIDAD, rol_entidad, entidad_ids[0] if entidad_ids else None)]:
+        if not rol:
+            continue
+        usuario = Usuario.query.filter_by(username=username).first()
+        if not usuario:
+            usuario = Usuario(username=username, email=f'{username}@ldh.local',
+                              nombre_completo=f'Usuario {username}', rol_id=rol.rol_id,
+                              prestador_id=prestador_id, activo=True)
+            usuario.set_password(PASSWORD_BENCH)
+            db.session.add(usuario)
+            db.session.flush()
+        usuarios[username] = usuario.usuario_id
+    usuario_admin_id = usuarios.get(USUARIO_BENCH)
+
+    if USUARIO_BENCH_ENTIDAD in usuarios:
+        # Las entidades ven a sus prestadores a través de usuario_prestador
+        _insertar_en_lotes(usuario_prestador, [{
+            'usuario_id': usuarios[USUARIO_BENCH_ENTIDAD],
+            'prestador_id': p,
+            'fecha_asociacion': datetime.utcnow(),
+            'puede_ver_ambulatorio': True,
+            'puede_ver_internacion': True,
+        } for e, p in sorted(vinculos) if e == entidad_ids[0]])
+
+    # Protocolos (más recientes en estado abierto, el resto completados)
+    tipos = ['PAP'] * 6 + ['BIOPSIA'] * 3 + ['CITOLOGÍA']
+    contadores = {}
+    filas_protocolos = []
+    total_protocolos = anios * protocolos_por_anio
+    for i in range(total_protocolos):
+        dias_atras = int(i * anios * 365 / max(total_protocolos, 1))
+        fecha_ingreso = hoy - timedelta(days=dias_atras)
+        tipo = rnd.choice(tipos)
+        clave = (PREFIJOS[tipo], fecha_ingreso.year % 100)
+        contadores[clave] = contadores.get(clave, 0) + 1
+        # Los más viejos quedan completados; los últimos 10 días, mezcla de estados
+        if dias_atras > 10:
+            estado = 'COMPLETADO' if rnd.random() > 0.01 else 'CANCELADO'
+        else:
+            estado = rnd.choice(['PENDIENTE', 'EN_PROCESO', 'URGENTE', 'COMPLETADO'])
+        os_id = rnd.choice(os_ids)
+        prestador_id = prestador_portal_id if rnd.random() < 0.05 else rnd.choice(prestador_ids)
+        filas_protocolos.append({
+            'numero_protocolo': f'{clave[0]}-{clave[1]:02d}-{contadores[clave]:05d}',
+            'tipo_estudio': tipo,
+            'afiliado_id': rnd.choice(afiliado_ids),
+            'prestador_id': prestador_id,
+            'obra_social_id': os_id,
+            'obra_social_codigo': os_datos[os_id][0],
+            'obra_social_nombre': os_datos[os_id][1],
+            'obra_social_activa': True,
+            'fecha_ingreso': fecha_ingreso,
+            'fecha_informe': fecha_ingreso + timedelta(days=rnd.randint(2, 10)) if estado == 'COMPLETADO' else None,
+            'estado': estado,
+            'es_prueba': False,
+            'tipo_protocolo': 'INTERNACION' if rnd.random() < 0.15 else 'AMBULATORIO',
+            'usuario_ingreso_id': usuario_admin_id,
+            'usuario_informe_id': usuario_admin_id if estado == 'COMPLETADO' else None,
+            'fecha_creacion': datetime.combine(fecha_ingreso, datetime.min.time()),
+        })
+    inicio = _max_id(Protocolo.protocolo_id)
+    _insertar_en_lotes(Protocolo, filas_protocolos)
+    protocolo_ids = _ids(Protocolo.protocolo_id, inicio)
+    resumen['protocolos'] = len(protocolo_ids)
+    log(f'✓ {len(protocolo_ids)} protocolos')
+
+    # Líneas de cada protocolo
+    filas_lineas = []
+    total_lineas = 0
+    for protocolo_id, fila in zip(protocolo_ids, filas_protocolos):
+        for seccion, opciones in LINEAS_POR_TIPO[fila['tipo_estudio']].items():
+            for orden in range(rnd.randint(1, 2)):
+                filas_lineas.append({
+                    'protocolo_id': protocolo_id,
+                    'seccion': seccion,
+                    'texto': rnd.choice(opciones),
+                    'orden': orden,
+                    'creado_en': fila['fecha_creacion'],
+                })
+        if len(filas_lineas) >= LOTE:
+            _insertar_en_lotes(ProtocoloLinea, filas_lineas)
+            total_lineas += len(filas_lineas)
+            filas_lineas = []
+    _insertar_en_lotes(ProtocoloLinea, filas_lineas)
+    total_lineas += len(filas_lineas)
+    resumen['protocolo_lineas'] = total_lineas
+    log(f'✓ {total_lineas} líneas de protocolo')
+
+    # Historial de auditoría
+    acciones = ['CREAR', 'MODIFICAR', 'CAMBIAR_ESTADO', 'LOGIN', 'VER']
+    _insertar_en_lotes(Auditoria, [{
+        'usuario_id': usuario_admin_id,
+        'accion': rnd.choice(acciones),
+        'tabla': 'protocolos',
+        'registro_id': rnd.choice(protocolo_ids) if protocolo_ids else None,
+        'descripcion': f'Registro sintético {i}',
+        'ip_address': '127.0.0.1',
+        'fecha_hora': datetime.utcnow() - timedelta(minutes=i * 7),
+    } for i in range(auditorias)])
+    resumen['auditoria'] = auditorias
+    log(f'✓ {auditorias} registros de auditoría')
+
+    db.session.commit()
+    return resumen
@@ -0,0 +1,190 @@
+"""
+Exportación de reportes y listados en CSV/XLSX con streaming
+"""
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime, date
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from flask import Response, stream_with_context
+
+# Cantidad de filas que se traen de la base por lote (server-side cursor)
+FILAS_POR_LOTE = 1000
+
+FORMATOS_EXPORTACION = ('csv', 'xlsx')
+
+# Caracteres que XML 1.0 no admite ni escapados: uno solo en el texto de un
+# paciente deja un XLSX que Excel no abre
+_XML_INVALIDOS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def formato_solicitado(request):
+    """Devuelve 'csv' o 'xlsx' si el request pide exportar, o None"""
+    formato = (request.args.get('formato') or '').strip().lower()
+    return formato if formato in FORMATOS_EXPORTACION else None
+
+
+def iterar_query(query, lote=FILAS_POR_LOTE, cargas_anticipadas=()):
+    """
+    Iterar una query por lotes sin materializar la lista de resultados.
+
+    Usa stream_results (cursor del lado del servidor donde el motor lo soporta)
+    y yield_per para que el ORM no acumule las filas en memoria. Las relaciones
+    se traen con joins explícitos (add_columns/with_entities), no con
+    selectinload/joinedload.
+
+    Args:
+        query: Query a recorrer
+        lote: Filas por lote
+        cargas_anticipadas: Relaciones que la query carga de forma anticipada
+            (opciones selectinload/joinedload o lazy= del modelo), declaradas por
+            quien llama. El ORM no las admite con yield_per y falla recién al
+            iterar, con la respuesta ya empezada: se rechazan acá.
+    """
+    if cargas_anticipadas:
+        raise ValueError(f"iterar_query no admite cargas anticipadas de relaciones "
+                         f"({', '.join(str(c) for c in cargas_anticipadas)}); "
+                         f"seleccionar las columnas relacionadas con joins explícitos")
+    return query.execution_options(stream_results=True).yield_per(lote)
+
+
+def _valor_texto(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, datetime):
+        return valor.strftime('%d/%m/%Y %H:%M')
+    if isinstance(valor, date):
+        return valor.strftime('%d/%m/%Y')
+    return str(valor)
+
+
+class _Pipe(io.RawIOBase):
+    """Buffer de escritura que se vacía en cada yield (stream no posicionable)"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._chunks.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self):
+        datos = b''.join(self._chunks)
+        self._chunks = []
+        return datos
+
+
+def generar_csv(columnas, filas):
+    """Generador de CSV (separador ';' y BOM para que Excel respete los acentos)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+
+    buffer.write('﻿')
+    writer.writerow(columnas)
+    for i, fila in enumerate(filas, 1):
+        writer.writerow([_valor_texto(v) for v in fila])
+        if i % 200 == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue().encode('utf-8')
+
+
+_XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_XLSX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{hoja}" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+_XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+
+
+def _texto_xml(valor):
+    return escape(_XML_INVALIDOS.sub('', _valor_texto(valor)))
+
+
+def _celda_xlsx(valor):
+    if isinstance(valor, bool) or valor is None:
+        return f'<c t="inlineStr"><is><t>{_texto_xml(valor)}</t></is></c>'
+    if isinstance(valor, (int, float, Decimal)):
+        return f'<c><v>{valor}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{_texto_xml(valor)}</t></is></c>'
+
+
+def generar_xlsx(columnas, filas, hoja='Reporte'):
+    """
+    Generador de XLSX en memoria constante.
+
+    Escribe la hoja como XML fila por fila dentro de un ZIP sobre un stream no
+    posicionable, de modo que cada fragmento se envía al cliente apenas se genera.
+    """
+    salida = _Pipe()
+    with zipfile.ZipFile(salida, mode='w', compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', _XLSX_CONTENT_TYPES)
+        zf.writestr('_rels/.rels', _XLSX_RELS)
+        zf.writestr('xl/workbook.xml', _XLSX_WORKBOOK.format(hoja=_texto_xml(hoja[:31])))
+        zf.writestr('xl/_rels/workbook.xml.rels', _XLSX_WORKBOOK_RELS)
+        yield salida.vaciar()
+
+        with zf.open('xl/worksheets/sheet1.xml', mode='w', force_zip64=True) as hoja_xml:
+            hoja_xml.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            hoja_xml.write(('<row>' + ''.join(_celda_xlsx(c) for c in columnas) + '</row>').encode('utf-8'))
+            for i, fila in enumerate(filas, 1):
+                hoja_xml.write(('<row>' + ''.join(_celda_xlsx(v) for v in fila) + '</row>').encode('utf-8'))
+                if i % 200 == 0:
+                    yield salida.vaciar()
+            hoja_xml.write(b'</sheetData></worksheet>')
+    yield salida.vaciar()
+
+
+def respuesta_exportacion(nombre, columnas, filas, formato='csv'):
+    """
+    Construir la respuesta HTTP de exportación en streaming.
+
+    Args:
+        nombre: Nombre base del archivo (sin extensión)
+        columnas: Títulos de las columnas
+        filas: Iterable de tuplas (idealmente un generador sobre iterar_query)
+        formato: 'csv' o 'xlsx'
+    """
+    fecha = datetime.now().strftime('%Y-%m-%d')
+    if formato == 'xlsx':
+        generador = generar_xlsx(columnas, filas, hoja=nombre)
+        mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    else:
+        generador = generar_csv(columnas, filas)
+        mimetype = 'text/csv'  # Werkzeug agrega charset=utf-8 a los text/*
+
+    respuesta = Response(stream_with_context(generador), mimetype=mimetype)
+    respuesta.headers['Content-Disposition'] = f'attachment; filename="{nombre}_{fecha}.{formato}"'
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
@@ -0,0 +1,120 @@
+"""
+Render de PDFs con WeasyPrint sin requests de vuelta al propio servidor
+
+Las imágenes y hojas de estilo bajo /static (logo, firmas, logos subidos) se
+leen directo del disco a través de un cache en memoria validado por mtime, en
+lugar de pedirse por HTTP al mismo worker durante el request (un round-trip por
+recurso y, con un único worker, un posible bloqueo).
+
+La configuración de fuentes y el cache de imágenes decodificadas de WeasyPrint
+se reutilizan entre renders del mismo hilo.
+"""
+import mimetypes
+import os
+import threading
+from urllib.parse import urlsplit, unquote
+
+from flask import current_app
+from werkzeug.security import safe_join
+
+from services import metricas
+
+# ruta absoluta -> (mtime_ns, tamaño, contenido, mime_type)
+_cache_assets = {}
+_cache_lock = threading.Lock()
+# Se incrementa cuando un archivo cambia en disco, para descartar las imágenes
+# ya decodificadas por WeasyPrint (su cache es por URL)
+_generacion = 0
+
+_local = threading.local()
+
+
+def _leer_asset(ruta):
+    """Contenido de un archivo estático, desde memoria si no cambió en disco"""
+    global _generacion
+    estado = os.stat(ruta)
+    with _cache_lock:
+        cacheado = _cache_assets.get(ruta)
+    if cacheado and cacheado[0] == estado.st_mtime_ns and cacheado[1] == estado.st_size:
+        metricas.registrar_cache('pdf_assets', True)
+        return cacheado[2], cacheado[3]
+
+    metricas.registrar_cache('pdf_assets', False)
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    mime_type = mimetypes.guess_type(ruta)[0] or 'application/octet-stream'
+    with _cache_lock:
+        if cacheado:
+            _generacion += 1
+        _cache_assets[ruta] = (estado.st_mtime_ns, estado.st_size, contenido, mime_type)
+    return contenido, mime_type
+
+
+def crear_url_fetcher(url_root):
+    """
+    url_fetcher para WeasyPrint que resuelve /static/... desde el disco.
+
+    Args:
+        url_root: Raíz de la aplicación usada como base_url (request.url_root)
+    """
+    from weasyprint import default_url_fetcher
+
+    static_folder = current_app.static_folder
+    static_prefijo = (current_app.static_url_path or '/static').rstrip('/') + '/'
+    host_propio = urlsplit(url_root).netloc
+
+    def url_fetcher(url, *args, **kwargs):
+        partes = urlsplit(url)
+        propio = partes.scheme in ('http', 'https') and partes.netloc == host_propio
+        if propio and partes.path.startswith(static_prefijo):
+            ruta = safe_join(static_folder, unquote(partes.path[len(static_prefijo):]))
+            if ruta is None or not os.path.isfile(ruta):
+                raise ValueError(f'Recurso estático inexistente: {partes.path}')
+            contenido, mime_type = _leer_asset(ruta)
+            return {'string': contenido, 'mime_type': mime_type, 'redirected_url': url}
+        if propio:
+            # Nunca pedir al propio servidor durante el render
+            raise ValueError(f'Recurso no estático omitido en el PDF: {partes.path}')
+        return default_url_fetcher(url, *args, **kwargs)
+
+    return url_fetcher
+
+
+def _recursos_hilo():
+    """FontConfiguration y cache de imágenes de WeasyPrint del hilo actual"""
+    from weasyprint.text.fonts import FontConfiguration
+
+    if getattr(_local, 'font_config', None) is None:
+        _local.font_config = FontConfiguration()
+    if getattr(_local, 'generacion', None) != _generacion:
+        _local.cache_imagenes = {}
+        _local.generacion = _generacion
+    return _local.font_config, _local.cache_imagenes
+
+
+def renderizar_pdf(html, base_url, origen='otro'):
+    """
+    Generar un PDF a partir de HTML.
+
+    Args:
+        html: HTML ya renderizado
+        base_url: Base para resolver URLs relativas (request.url_root)
+        origen: Etiqueta para la métrica de duración de render
+
+    Returns:
+        bytes del PDF
+    """
+    from weasyprint import HTML
+
+    font_config, cache_imagenes = _recursos_hilo()
+    with metricas.medir('ldh_pdf_render_duration_seconds', origen=origen):
+        documento = HTML(string=html, base_url=base_url, url_fetcher=crear_url_fetcher(base_url))
+        return documento.write_pdf(font_config=font_config, cache=cache_imagenes)
+
+
+def invalidar_cache():
+    """Descartar los archivos cacheados (por ejemplo, tras subir una firma nueva)"""
+    global _generacion
+    with _cache_lock:
+        _cache_assets.clear()
+        _generacion += 1